@@ -1,10 +1,33 @@
+import time
+
+# Startup clock for the time-to-first-served-byte measurement
+STARTED_AT = time.time()
+
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from werkzeug.utils import secure_filename
-import uuid
-from models.image_captioning import ImageCaptioningModel
-from models.object_detection import ObjectDetectionModel
-from models.recipe_generation import RecipeGenerationModel
+import json
+import atexit
+import contextlib
+import click
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort, g, Response, stream_with_context
+from models.fallbacks import CAPTION_FAILURE_MESSAGE, DEFAULT_INGREDIENTS, FALLBACK_RECIPES
+from models.registry import ModelRegistry, ModelNotReady, model_config_from_env
+from models.inference_cache import InferenceCache, hash_bytes
+from models.near_duplicates import NearDuplicateIndex
+from models.preprocessing import SharedImage
+from models.recipe_cache import RecipeCache
+from models.parallel import VisionExecutor, threads_per_call, set_torch_threads, set_interop_threads
+from models.batching import BatchScheduler
+from models.jobs import JobQueue, QueueFull
+from models.retrieval import RecipeIndex
+from models.upload_store import UploadStore
+from models.weight_sharing import process_memory
+from models.model_server import ModelServerClient, model_factories, model_server_sockets
+from models.quality import QualityBudget, CAPTION_STAGES, DETECTION_STAGES, current_budget, set_budget, stage_estimate
+from models.cancellation import (
+    RequestCancelled, cancellation_stats, current_cancellation, deadline_probe, disconnect_probe, request_token,
+    set_cancellation, wait_for
+)
+from models.metrics import REGISTRY, FALLBACKS, stage, start_request_timing, request_timings, server_timing_header
 from dotenv import load_dotenv
 
 # Load environment variables from .env file if it exists
@@ -14,20 +37,587 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-for-dev-only')
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+# "background" loads models in a warm-up thread after startup, "lazy" on first
+# use, "eager" before serving anything (the old behaviour)
+app.config['MODEL_LOADING'] = os.environ.get('MODEL_LOADING', 'background')
+app.config['MODEL_RETRY_AFTER'] = int(os.environ.get('MODEL_RETRY_AFTER', 5))
+# Models, precision, artifacts, prefix cache, draft model and output format
+app.config.update(model_config_from_env())
+# Unix socket of a model server (serve_models.py) hosting the models instead of this
+# process; "path,recipe=other_path" puts single models on other servers
+app.config['MODEL_SERVER'] = os.environ.get('MODEL_SERVER', '')  # empty = models in this process
+app.config['MODEL_SERVER_POOL_SIZE'] = int(os.environ.get('MODEL_SERVER_POOL_SIZE', 8))
+app.config['INFERENCE_CACHE_SIZE'] = int(os.environ.get('INFERENCE_CACHE_SIZE', 512))
+app.config['INFERENCE_CACHE_DIR'] = os.environ.get('INFERENCE_CACHE_DIR')  # unset = memory only
+# Reuse caption/detection results of perceptually near-identical images
+app.config['NEAR_DUPLICATES'] = os.environ.get('NEAR_DUPLICATES', '0') == '1'
+app.config['NEAR_DUPLICATE_THRESHOLD'] = int(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 6))  # bits of 64
+app.config['NEAR_DUPLICATE_MAX_ENTRIES'] = int(os.environ.get('NEAR_DUPLICATE_MAX_ENTRIES', 10000))
+# Generated recipes keyed by the canonical ingredient set
+app.config['RECIPE_CACHE_SIZE'] = int(os.environ.get('RECIPE_CACHE_SIZE', 1024))
+app.config['RECIPE_CACHE_VARIANTS'] = int(os.environ.get('RECIPE_CACHE_VARIANTS', 3))
+app.config['RECIPE_CACHE_TTL'] = float(os.environ.get('RECIPE_CACHE_TTL', 7 * 24 * 3600))
+app.config['RECIPE_CACHE_FILE'] = os.environ.get('RECIPE_CACHE_FILE')  # unset = memory only
+# Multi-candidate and batched recipe generation limits
+app.config['RECIPE_MAX_CANDIDATES'] = int(os.environ.get('RECIPE_MAX_CANDIDATES', 4))
+app.config['RECIPE_BATCH_SIZE'] = int(os.environ.get('RECIPE_BATCH_SIZE', 8))
+app.config['RECIPE_BATCH_MAX_LISTS'] = int(os.environ.get('RECIPE_BATCH_MAX_LISTS', 256))
+# "generate" runs the LLM, "retrieve" returns the best matches from the recipe
+# corpus without it; retrieval also replaces the fixed fallback recipe
+app.config['RECIPE_MODE'] = os.environ.get('RECIPE_MODE', 'generate')
+app.config['RECIPE_CORPUS'] = os.environ.get('RECIPE_CORPUS')  # JSON/JSONL; unset = built-in recipes only
+# Micro-batch concurrent caption/detection requests into one forward pass
+app.config['BATCHING_ENABLED'] = os.environ.get('BATCHING_ENABLED', '0') == '1'
+app.config['BATCH_MAX_SIZE'] = int(os.environ.get('BATCH_MAX_SIZE', 8))
+app.config['BATCH_MAX_WAIT_MS'] = float(os.environ.get('BATCH_MAX_WAIT_MS', 10))
+# "parallel" runs captioning and detection side by side, splitting the cores evenly
+app.config['VISION_EXECUTION'] = os.environ.get('VISION_EXECUTION', 'sequential')
+app.config['VISION_THREADS'] = int(os.environ.get('VISION_THREADS', os.cpu_count() or 1))
+# Asynchronous /api/jobs pipeline: worker pool size, queue bound and result retention
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_QUEUE_SIZE'] = int(os.environ.get('JOB_QUEUE_SIZE', 32))
+app.config['JOB_RESULT_TTL'] = float(os.environ.get('JOB_RESULT_TTL', 600))
+app.config['JOB_MAX_WAIT'] = float(os.environ.get('JOB_MAX_WAIT', 30))  # longest long-poll
+# Add a Server-Timing header with per-stage durations to every response
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '0') == '1'
+# Quality tier for requests that don't ask for one: fast, balanced or quality
+app.config['QUALITY_TIER'] = os.environ.get('QUALITY_TIER', 'quality')
+# Stop model work for requests whose client disconnected or whose deadline passed
+app.config['REQUEST_CANCELLATION'] = os.environ.get('REQUEST_CANCELLATION', '1') == '1'
+# Uploads are stored by content hash; least recently used ones are evicted past
+# the size cap, unused ones after the max age (0 = never)
+app.config['UPLOAD_MAX_MB'] = float(os.environ.get('UPLOAD_MAX_MB', 2048))
+app.config['UPLOAD_MAX_AGE'] = float(os.environ.get('UPLOAD_MAX_AGE', 7 * 24 * 3600))
+app.config['UPLOAD_SWEEP_INTERVAL'] = float(os.environ.get('UPLOAD_SWEEP_INTERVAL', 300))
+app.config['UPLOAD_DISPLAY_EDGE'] = int(os.environ.get('UPLOAD_DISPLAY_EDGE', 1024))
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Initialize models
-image_captioning_model = ImageCaptioningModel()
-object_detection_model = ObjectDetectionModel()
-recipe_model = RecipeGenerationModel()
+upload_store = UploadStore(
+    app.config['UPLOAD_FOLDER'],
+    max_bytes=int(app.config['UPLOAD_MAX_MB'] * 1024 * 1024),
+    max_age=app.config['UPLOAD_MAX_AGE'] or None,
+    sweep_interval=app.config['UPLOAD_SWEEP_INTERVAL'],
+    display_edge=app.config['UPLOAD_DISPLAY_EDGE']
+)
+
+# Both torch thread pools are process-wide; the inter-op one must be sized
+# before any model runs. Captioning and detection running side by side each
+# get an intra-op pool of this size, so together they use VISION_THREADS
+if app.config['VISION_EXECUTION'] == 'parallel':
+    set_interop_threads(2)
+    set_torch_threads(threads_per_call(2, total=app.config['VISION_THREADS']))
+
+# Models are imported and built lazily so the server answers immediately;
+# smallest first so image analysis becomes available as early as possible.
+# Models hosted by a model server are loaded there; here they wait for it
+model_factories_by_name = model_factories(app.config)
+model_servers = {}
+for name, socket_path in model_server_sockets(app.config['MODEL_SERVER']).items():
+    if socket_path not in model_servers:
+        model_servers[socket_path] = ModelServerClient(socket_path, pool_size=app.config['MODEL_SERVER_POOL_SIZE'])
+    model_factories_by_name[name] = model_servers[socket_path].factory(name)
+for client in model_servers.values():
+    atexit.register(client.close)
+
+def _load_recipe_index():
+    return RecipeIndex.from_file(app.config['RECIPE_CORPUS'])
+
+model_registry = ModelRegistry()
+if app.config['RECIPE_CORPUS']:
+    model_registry.register('retrieval', _load_recipe_index)
+for name, factory in model_factories_by_name.items():
+    model_registry.register(name, factory)
+
+if app.config['MODEL_LOADING'] == 'eager':
+    model_registry.load_all()
+elif app.config['MODEL_LOADING'] == 'background':
+    model_registry.warm_up()
+
+startup_timings = {'first_response_seconds': None}
+
+# Caption/detection results keyed by image content, so /upload -> /results
+# and page refreshes don't run the vision models again
+inference_cache = InferenceCache(
+    max_entries=app.config['INFERENCE_CACHE_SIZE'],
+    cache_dir=app.config['INFERENCE_CACHE_DIR']
+)
+
+# Perceptual hashes of processed images, so resized or recompressed copies
+# (which never match a byte-level key) reuse the original's results
+near_duplicate_index = None
+if app.config['NEAR_DUPLICATES']:
+    near_duplicate_index = NearDuplicateIndex(
+        max_entries=app.config['NEAR_DUPLICATE_MAX_ENTRIES'],
+        threshold=app.config['NEAR_DUPLICATE_THRESHOLD']
+    )
+
+caption_scheduler = None
+detection_scheduler = None
+if app.config['BATCHING_ENABLED']:
+    caption_scheduler = BatchScheduler(
+        lambda images: model_registry.get('captioning').generate_captions(images),
+        max_batch_size=app.config['BATCH_MAX_SIZE'],
+        max_wait_ms=app.config['BATCH_MAX_WAIT_MS'],
+        name='caption'
+    )
+    detection_scheduler = BatchScheduler(
+        lambda images: model_registry.get('detection').detect_ingredients_batch(images),
+        max_batch_size=app.config['BATCH_MAX_SIZE'],
+        max_wait_ms=app.config['BATCH_MAX_WAIT_MS'],
+        name='detection'
+    )
+
+# With batching on, branch workers only wait on the schedulers, so allow as
+# many of them as can share a batch
+vision_executor = VisionExecutor(
+    mode=app.config['VISION_EXECUTION'],
+    workers_per_branch=app.config['BATCH_MAX_SIZE'] if app.config['BATCHING_ENABLED'] else 1
+)
+
+recipe_cache = RecipeCache(
+    max_entries=app.config['RECIPE_CACHE_SIZE'],
+    variants_per_key=app.config['RECIPE_CACHE_VARIANTS'],
+    ttl_seconds=app.config['RECIPE_CACHE_TTL'],
+    path=app.config['RECIPE_CACHE_FILE']
+)
+atexit.register(recipe_cache.save)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_upload(file):
+    """Read an uploaded file into memory and store it; returns (filename, image bytes)"""
+    file_extension = file.filename.rsplit('.', 1)[1].lower()
+    data = file.read()
+    
+    # Named by content, so an image uploaded before is not written again
+    with stage('upload_save'):
+        filename = upload_store.save(data, file_extension)
+    
+    return filename, data
+
+def upload_url(filename):
+    return url_for('static', filename=f"uploads/{upload_store.relative_path(filename)}")
+
+def caption_image(image, num_beams=None):
+    """
+    Caption one image, going through the batch scheduler when batching is enabled
+    
+    Captions with fewer beams than the model's own run on their own, since
+    a batch shares one generate call. Once the request is cancelled,
+    generation stops or the image leaves the batch queue, and
+    RequestCancelled is raised.
+    """
+    cancellation = current_cancellation()
+    if caption_scheduler is None or num_beams is not None:
+        return model_registry.get('captioning').generate_caption(image, num_beams, cancellation)
+    try:
+        return wait_for(caption_scheduler.submit(image), cancellation, 'caption_queue', CAPTION_STAGES)
+    except RequestCancelled:
+        raise
+    except Exception:
+        FALLBACKS.inc(kind='caption_failure')
+        return CAPTION_FAILURE_MESSAGE
+
+def detect_image_ingredients(image, shortest_edge=None):
+    """
+    Detect ingredients in one image, going through the batch scheduler when batching is enabled
+    
+    Raises RequestCancelled instead of starting (or leaving the batch queue)
+    once the client has disconnected. A passed deadline does not stop
+    detection: it cannot be cut short, and recipes need its ingredients.
+    """
+    cancellation = current_cancellation()
+    if detection_scheduler is None or shortest_edge is not None:
+        if cancellation is not None:
+            cancellation.raise_if_cancelled('detection', estimate_stages=DETECTION_STAGES, reasons=('disconnect',))
+        return model_registry.get('detection').detect_ingredients(image, shortest_edge)
+    try:
+        return wait_for(detection_scheduler.submit(image), cancellation, 'detection_queue', DETECTION_STAGES,
+                        reasons=('disconnect',))
+    except RequestCancelled:
+        raise
+    except Exception:
+        FALLBACKS.inc(kind='default_ingredients')
+        return list(DEFAULT_INGREDIENTS)
+
+def skip_on_deadline(error, degradation):
+    """Re-raise a cancellation unless the deadline caused it, in which case record the degradation"""
+    if error.reason != 'deadline':
+        raise error
+    current_budget().degrade(degradation, 'deadline')
+
+def no_progress(name, cached=False):
+    return contextlib.nullcontext()
+
+def analyze_image(image_bytes, progress=no_progress):
+    """
+    Caption an image and detect its ingredients, serving repeats from the inference cache
+    
+    The image is decoded at most once, at the smallest resolution both
+    vision processors accept, and the same decoded image feeds both models.
+    Cache misses are made cheaper as the request's quality budget asks
+    (greedy or no captioning, a smaller detection input); the caption is
+    None when it was skipped, also when the deadline passed while it was
+    being generated. Raises ModelNotReady while either vision model is
+    still loading, and RequestCancelled once the client has disconnected.
+    
+    Args:
+        image_bytes: Encoded image
+        progress: Progress hook, e.g. Job.stage; called as progress(name, cached)
+            and used as a context manager around the "caption" and "detect" steps
+    """
+    image_captioning_model, object_detection_model = model_registry.get_all(['captioning', 'detection'])
+    budget = current_budget()
+    
+    image_hash = hash_bytes(image_bytes)
+    caption_settings = dict(image_captioning_model.gen_kwargs, precision=image_captioning_model.precision)
+    detection_settings = {'threshold': object_detection_model.threshold, 'precision': object_detection_model.precision}
+    caption_key = inference_cache.make_key(image_hash, image_captioning_model.model_name, caption_settings)
+    ingredients_key = inference_cache.make_key(image_hash, object_detection_model.model_name, detection_settings)
+    caption = inference_cache.get(caption_key)
+    ingredients = inference_cache.get(ingredients_key)
+    shared_image = SharedImage(
+        image_bytes,
+        min_edge=max(image_captioning_model.min_input_edge, object_detection_model.min_input_edge)
+    )
+    
+    # A resized or recompressed copy of an image seen before gets the original's results
+    near_duplicate = find_near_duplicate(shared_image) if caption is None or ingredients is None else None
+    if near_duplicate is not None:
+        if caption is None:
+            caption = near_duplicate['caption']
+            inference_cache.put(caption_key, caption)
+        if ingredients is None:
+            ingredients = near_duplicate['ingredients']
+            inference_cache.put(ingredients_key, ingredients)
+    
+    # Full-quality results are served from the cache at any tier; only misses are degraded
+    num_beams, detection_edge = None, None
+    if ingredients is None:
+        detection_edge = budget.detection_edge(object_detection_model.min_input_edge)
+        if detection_edge < object_detection_model.min_input_edge:
+            ingredients_key = inference_cache.make_key(
+                image_hash, object_detection_model.model_name,
+                dict(detection_settings, shortest_edge=detection_edge)
+            )
+            ingredients = inference_cache.get(ingredients_key)
+        else:
+            detection_edge = None
+    if caption is None:
+        num_beams = budget.caption_beams(
+            image_captioning_model.num_beams,
+            reserve=stage_estimate(DETECTION_STAGES) if ingredients is None else None
+        )
+        if 0 < num_beams < image_captioning_model.num_beams:
+            caption_key = inference_cache.make_key(
+                image_hash, image_captioning_model.model_name, dict(caption_settings, num_beams=num_beams)
+            )
+            caption = inference_cache.get(caption_key)
+        elif num_beams == image_captioning_model.num_beams:
+            num_beams = None
+    
+    # Decode no larger than the models that still run need, unless already decoded for the lookup
+    min_edges = [detection_edge or object_detection_model.min_input_edge]
+    if caption is None and num_beams != 0:
+        min_edges.append(image_captioning_model.min_input_edge)
+    shared_image.min_edge = max(min_edges)
+    
+    # Only the models that missed the cache run, side by side in parallel mode
+    def tracked(name, fn):
+        def run():
+            with progress(name):
+                return fn()
+        return run
+    
+    def caption_unless_out_of_time():
+        try:
+            return caption_image(shared_image.image, num_beams)
+        except RequestCancelled as e:
+            skip_on_deadline(e, 'caption_skipped')
+            return None
+    
+    tasks = {}
+    if caption is not None:
+        with progress('caption', cached=True):
+            pass
+    elif num_beams != 0:
+        tasks['caption'] = tracked('caption', caption_unless_out_of_time)
+    if ingredients is None:
+        tasks['detection'] = tracked('detect', lambda: detect_image_ingredients(shared_image.image, detection_edge))
+    else:
+        with progress('detect', cached=True):
+            pass
+    results = vision_executor.run(tasks)
+    
+    if 'caption' in results:
+        caption = results['caption']
+        if caption not in (None, CAPTION_FAILURE_MESSAGE):
+            inference_cache.put(caption_key, caption)
+    if 'detection' in results:
+        ingredients = results['detection']
+        if ingredients != DEFAULT_INGREDIENTS:
+            inference_cache.put(ingredients_key, ingredients)
+    
+    # Only full-quality results are worth handing to near-duplicates
+    if (near_duplicate_index is not None and results and num_beams is None and detection_edge is None
+            and caption not in (None, CAPTION_FAILURE_MESSAGE) and ingredients != DEFAULT_INGREDIENTS):
+        near_duplicate_index.add(shared_image.perceptual_hash, {'caption': caption, 'ingredients': ingredients})
+    
+    return caption, ingredients
+
+def find_near_duplicate(shared_image):
+    """Stored caption and ingredients of a perceptually near-identical image, or None"""
+    if near_duplicate_index is None:
+        return None
+    try:
+        perceptual_hash = shared_image.perceptual_hash
+    except Exception as e:
+        # Undecodable images fail (and fall back) in the models as before
+        print(f"Error hashing image: {e}")
+        return None
+    with stage('near_duplicate_lookup'):
+        match = near_duplicate_index.lookup(perceptual_hash)
+    return match[0] if match is not None else None
+
+# Always available, so retrieval works before the corpus index has loaded
+builtin_recipe_index = RecipeIndex([recipe for recipes in FALLBACK_RECIPES.values() for recipe in recipes])
+
+def get_recipe_index():
+    """Return the corpus index, or the built-in recipes while it loads or if no corpus is configured"""
+    if app.config['RECIPE_CORPUS']:
+        try:
+            return model_registry.get('retrieval')
+        except ModelNotReady:
+            pass
+    return builtin_recipe_index
+
+def retrieve_recipes(ingredients, k=1):
+    """Best matching corpus recipes for an ingredient list, never empty"""
+    with stage('recipe_retrieval'):
+        recipes = get_recipe_index().recipes_for(ingredients, k)
+    return recipes or [FALLBACK_RECIPES["tomato_onion_chicken"][0]]
+
+def replace_fallbacks(recipe_model, ingredients, recipes):
+    """Swap the model's fixed fallback recipe for the closest match from the corpus"""
+    if not any(recipe_model.is_fallback_recipe(recipe) for recipe in recipes):
+        return recipes
+    FALLBACKS.inc(kind='recipe_generation_failed')
+    return retrieve_recipes(ingredients, len(recipes))
+
+def parse_recipe_mode(data):
+    """Read "mode" from a request body, defaulting to RECIPE_MODE"""
+    mode = data.get('mode') or app.config['RECIPE_MODE']
+    if mode not in ('generate', 'retrieve'):
+        raise ValueError(f"Unknown mode '{mode}'")
+    return mode
+
+def get_recipe_model():
+    """Return the recipe model, or None while it is still loading so callers can use fallbacks"""
+    try:
+        return model_registry.get('recipe')
+    except ModelNotReady:
+        FALLBACKS.inc(kind='recipe_model_loading')
+        return None
+
+def recipe_cache_key(recipe_model, ingredients):
+    return recipe_cache.make_key(ingredients, recipe_model.model_name, recipe_model.generation_settings())
+
+def cache_generated_recipes(recipe_model, key, recipes):
+    """Add freshly generated recipes to the recipe cache unless they are fallbacks"""
+    if recipe_model.model_loaded and not any(recipe_model.is_fallback_recipe(r) for r in recipes):
+        recipe_cache.add(key, recipes)
+
+def cached_recipes(key):
+    """
+    Cached recipes for key, or None to generate another variant
+    
+    When the request's budget would cut generation short, any variant
+    generated so far is served instead of a cheaper recipe.
+    """
+    recipes = recipe_cache.get(key)
+    if recipes is None and current_budget().limits_recipes():
+        recipes = recipe_cache.peek(key)
+    return recipes
+
+def get_recipes(ingredients, num_candidates=1, mode=None):
+    """
+    Return recipes for an ingredient list, generating a new variant only on a cache miss
+    
+    Asking for several candidates always generates them, in one batched
+    call, and each one is added to the cache as a separate variant. In
+    "retrieve" mode, or while the recipe model is unavailable, the closest
+    corpus recipes are returned instead. The request's quality budget can
+    cap the recipe length or switch to corpus recipes, as does a deadline
+    passing during generation; cut-off recipes are not cached.
+    """
+    recipe_model = get_recipe_model()
+    if (mode or app.config['RECIPE_MODE']) == 'retrieve' or recipe_model is None:
+        return retrieve_recipes(ingredients, num_candidates)
+    
+    key = recipe_cache_key(recipe_model, ingredients)
+    if num_candidates == 1:
+        recipes = cached_recipes(key)
+        if recipes is not None:
+            return replace_fallbacks(recipe_model, ingredients, recipes)
+    
+    max_new_tokens = current_budget().recipe_tokens(recipe_model.max_length)
+    if max_new_tokens == 0:
+        return retrieve_recipes(ingredients, num_candidates)
+    
+    try:
+        recipes = recipe_model.generate_recipes(
+            ingredients, num_candidates=num_candidates, max_new_tokens=max_new_tokens,
+            cancellation=current_cancellation()
+        )
+    except RequestCancelled as e:
+        skip_on_deadline(e, 'recipes_retrieved')
+        return retrieve_recipes(ingredients, num_candidates)
+    if max_new_tokens is None:
+        for recipe in recipes:
+            cache_generated_recipes(recipe_model, key, [recipe])
+    return replace_fallbacks(recipe_model, ingredients, recipes)
+
+def get_recipes_batch(ingredient_lists, num_candidates=1, mode=None):
+    """Like get_recipes for many ingredient lists; cache misses run through the model as padded batches"""
+    recipe_model = get_recipe_model()
+    if (mode or app.config['RECIPE_MODE']) == 'retrieve' or recipe_model is None:
+        return [retrieve_recipes(ingredients, num_candidates) for ingredients in ingredient_lists]
+    
+    keys = [recipe_cache_key(recipe_model, ingredients) for ingredients in ingredient_lists]
+    if num_candidates > 1:
+        results = [None] * len(ingredient_lists)
+    else:
+        results = [cached_recipes(key) for key in keys]
+    
+    misses = [i for i, recipes in enumerate(results) if recipes is None]
+    if not misses:
+        return results
+    
+    max_new_tokens = current_budget().recipe_tokens(recipe_model.max_length)
+    if max_new_tokens == 0:
+        for i in misses:
+            results[i] = retrieve_recipes(ingredient_lists[i], num_candidates)
+        return results
+    
+    try:
+        generated = recipe_model.generate_recipes_batch(
+            [ingredient_lists[i] for i in misses],
+            num_candidates=num_candidates,
+            batch_size=app.config['RECIPE_BATCH_SIZE'],
+            max_new_tokens=max_new_tokens,
+            cancellation=current_cancellation()
+        )
+    except RequestCancelled as e:
+        skip_on_deadline(e, 'recipes_retrieved')
+        for i in misses:
+            results[i] = retrieve_recipes(ingredient_lists[i], num_candidates)
+        return results
+    for i, recipes in zip(misses, generated):
+        if max_new_tokens is None:
+            for recipe in recipes:
+                cache_generated_recipes(recipe_model, keys[i], [recipe])
+        results[i] = replace_fallbacks(recipe_model, ingredient_lists[i], recipes)
+    return results
+
+def parse_num_candidates(data):
+    """Read num_candidates from a request body, capped at RECIPE_MAX_CANDIDATES"""
+    num_candidates = int(data.get('num_candidates', 1))
+    if num_candidates < 1:
+        raise ValueError('num_candidates must be at least 1')
+    return min(num_candidates, app.config['RECIPE_MAX_CANDIDATES'])
+
+def run_job(job):
+    """
+    Run the caption -> detect -> recipe pipeline for a job from /api/jobs
+    
+    Workers wait for the models they need instead of failing with
+    ModelNotReady, so jobs submitted during startup simply start later.
+    """
+    payload = job.payload
+    result = {}
+    ingredients = payload.get('ingredients')
+    # The deadline counts from submission, so time spent queued is part of it
+    budget = QualityBudget(payload['quality'], payload['deadline_ms'], started=payload['submitted'])
+    set_budget(budget)
+    # Nobody is connected to a job; only its deadline cancels work
+    set_cancellation(request_token(deadline_probe(budget)) if app.config['REQUEST_CANCELLATION'] else None)
+    
+    if payload.get('filename'):
+        try:
+            model_registry.get('captioning', wait=True)
+            model_registry.get('detection', wait=True)
+            image_bytes = upload_store.read(payload['filename'])
+        finally:
+            # The job has its bytes (or has failed); the upload may be swept again
+            upload_store.unpin(payload.get('upload_pin'))
+        caption, detected = analyze_image(image_bytes, progress=job.stage)
+        if caption is None:
+            job.skip_stage('caption')
+        result.update({
+            'caption': caption,
+            'detected_ingredients': detected,
+            'image_path': upload_url(payload['filename'])
+        })
+        # Ingredients given explicitly take precedence over detected ones
+        if not ingredients:
+            ingredients = detected
+    else:
+        job.skip_stage('caption')
+        job.skip_stage('detect')
+    
+    if payload['mode'] == 'generate':
+        model_registry.get('recipe', wait=True)
+    with job.stage('recipe'):
+        result['recipes'] = get_recipes(ingredients, num_candidates=payload['num_candidates'], mode=payload['mode'])
+    result['ingredients'] = ingredients
+    result['quality'] = budget.to_dict()
+    return result
+
+def _run_job_in_app_context(job):
+    # url_for needs an application and a server name outside requests
+    with app.test_request_context():
+        return run_job(job)
+
+job_queue = JobQueue(
+    _run_job_in_app_context,
+    workers=app.config['JOB_WORKERS'],
+    max_queued=app.config['JOB_QUEUE_SIZE'],
+    result_ttl=app.config['JOB_RESULT_TTL']
+)
+
+def restart_threads_after_fork():
+    """
+    Recreate the background threads in a forked worker process
+
+    A pre-fork server (e.g. gunicorn with preload_app, see gunicorn.conf.py)
+    imports this module and loads the models once in the parent, then forks
+    the workers. Memory, including every weight, is shared copy-on-write,
+    but threads exist only in the process that started them.
+    """
+    job_queue.after_fork()
+    vision_executor.after_fork()
+    upload_store.after_fork()
+    for scheduler in (caption_scheduler, detection_scheduler):
+        if scheduler is not None:
+            scheduler.after_fork()
+    for client in model_servers.values():
+        client.after_fork()
+
+os.register_at_fork(after_in_child=restart_threads_after_fork)
+
+def recipe_events(recipe, **done):
+    """Events for an already complete recipe, in the same shape the streaming generator produces"""
+    events = [('name', recipe.get('name'))]
+    events += [('ingredient', item) for item in recipe['ingredients']]
+    events += [('instruction', step) for step in recipe['instructions']]
+    events.append(('done', dict(recipe=recipe, **done)))
+    return events
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -45,38 +635,40 @@ def upload_image():
         return redirect(request.url)
     
     if file and allowed_file(file.filename):
-        # Create unique filename
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4().hex}.{file_extension}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # Store the upload under its content hash
+        filename, image_bytes = save_upload(file)
         
-        # Process the image
-        caption = image_captioning_model.generate_caption(filepath)
-        ingredients = object_detection_model.detect_ingredients(filepath)
+        # Process the image; results() picks the output up from the cache
+        analyze_image(image_bytes)
         
-        # Store in session for the next step
-        return redirect(url_for('results', filename=filename))
+        return redirect(url_for('results', filename=filename, **quality_args()))
     
     flash('Invalid file type. Please upload a JPG, JPEG or PNG image.')
     return redirect(url_for('index'))
 
 @app.route('/results/<filename>')
 def results(filename):
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    try:
+        image_bytes = upload_store.read(filename)
+    except (ValueError, OSError):
+        abort(404)
     
     # Get ingredients from the image
-    caption = image_captioning_model.generate_caption(filepath)
-    ingredients = object_detection_model.detect_ingredients(filepath)
+    caption, ingredients = analyze_image(image_bytes)
     
     # Generate recipe recommendations
-    recipes = recipe_model.generate_recipes(ingredients)
+    recipes = get_recipes(ingredients)
     
-    return render_template('results.html', 
-                          filename=filename,
-                          caption=caption,
-                          ingredients=ingredients,
-                          recipes=recipes)
+    # Browsers get a downscaled copy instead of the full-size original
+    with stage('display_copy'):
+        display_path = upload_store.display(filename)
+    
+    with stage('template_render'):
+        return render_template('results.html', 
+                              display_path=display_path,
+                              caption=caption,
+                              ingredients=ingredients,
+                              recipes=recipes)
 
 @app.route('/api/ingredients', methods=['POST'])
 def api_detect_ingredients():
@@ -89,20 +681,17 @@ def api_detect_ingredients():
         return jsonify({'error': 'No selected file'}), 400
     
     if file and allowed_file(file.filename):
-        # Create unique filename
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4().hex}.{file_extension}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # Store the upload under its content hash
+        filename, image_bytes = save_upload(file)
         
         # Process the image
-        caption = image_captioning_model.generate_caption(filepath)
-        ingredients = object_detection_model.detect_ingredients(filepath)
+        caption, ingredients = analyze_image(image_bytes)
         
         return jsonify({
             'caption': caption,
             'ingredients': ingredients,
-            'image_path': url_for('static', filename=f'uploads/{filename}')
+            'image_path': upload_url(filename),
+            'quality': g.quality.to_dict()
         })
     
     return jsonify({'error': 'Invalid file type'}), 400
@@ -113,12 +702,442 @@ def api_generate_recipes():
     if not data or 'ingredients' not in data:
         return jsonify({'error': 'No ingredients provided'}), 400
     
+    try:
+        num_candidates = parse_num_candidates(data)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid num_candidates'}), 400
+    
+    try:
+        mode = parse_recipe_mode(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     ingredients = data['ingredients']
-    recipes = recipe_model.generate_recipes(ingredients)
+    recipes = get_recipes(ingredients, num_candidates=num_candidates, mode=mode)
+    
+    return jsonify({
+        'recipes': recipes,
+        'quality': g.quality.to_dict()
+    })
+
+@app.route('/api/recipes/batch', methods=['POST'])
+def api_generate_recipes_batch():
+    """Generate recipes for many ingredient lists in one call, run as padded model batches"""
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('ingredient_lists'), list):
+        return jsonify({'error': 'No ingredient lists provided'}), 400
+    
+    ingredient_lists = data['ingredient_lists']
+    if len(ingredient_lists) > app.config['RECIPE_BATCH_MAX_LISTS']:
+        return jsonify({
+            'error': f"At most {app.config['RECIPE_BATCH_MAX_LISTS']} ingredient lists per request"
+        }), 400
+    if not all(isinstance(ingredients, list) for ingredients in ingredient_lists):
+        return jsonify({'error': 'Each ingredient list must be a list'}), 400
+    
+    try:
+        num_candidates = parse_num_candidates(data)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid num_candidates'}), 400
+    
+    try:
+        mode = parse_recipe_mode(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    results = get_recipes_batch(ingredient_lists, num_candidates=num_candidates, mode=mode)
     
     return jsonify({
-        'recipes': recipes
+        'results': [
+            {'ingredients': ingredients, 'recipes': recipes}
+            for ingredients, recipes in zip(ingredient_lists, results)
+        ],
+        'quality': g.quality.to_dict()
     })
 
+@app.route('/api/recipes/stream', methods=['GET', 'POST'])
+def api_stream_recipes():
+    """
+    Stream a recipe as Server-Sent Events while it is being generated
+    
+    POST a JSON body like /api/recipes, or GET with ?ingredients=a,b,c so
+    browsers can consume it with EventSource.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not data or 'ingredients' not in data:
+            return jsonify({'error': 'No ingredients provided'}), 400
+        ingredients = data['ingredients']
+    else:
+        data = request.args
+        ingredients = [i.strip() for i in request.args.get('ingredients', '').split(',') if i.strip()]
+        if not ingredients:
+            return jsonify({'error': 'No ingredients provided'}), 400
+    
+    try:
+        mode = parse_recipe_mode(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    recipe_model = get_recipe_model() if mode == 'generate' else None
+    key, cached, max_new_tokens = None, None, None
+    if recipe_model is not None:
+        key = recipe_cache_key(recipe_model, ingredients)
+        cached = cached_recipes(key)
+        if cached is None:
+            # Decided before the response starts, so X-Quality-Degradations can report it
+            max_new_tokens = current_budget().recipe_tokens(recipe_model.max_length)
+    cancellation = current_cancellation()
+    
+    def events():
+        if recipe_model is None or max_new_tokens == 0:
+            # Retrieval mode, still loading or no time to generate: answer with the closest corpus recipe right away
+            stream = recipe_events(retrieve_recipes(ingredients)[0], fallback=mode == 'generate')
+        elif cached is not None:
+            # Replay the cached recipe as the same sequence of events
+            stream = recipe_events(cached[0], fallback=False, cached=True)
+        else:
+            stream = recipe_model.stream_recipe_events(ingredients, max_new_tokens, cancellation)
+        
+        completed = False
+        try:
+            for event, value in stream:
+                if (event == 'done' and recipe_model is not None and cached is None and max_new_tokens is None
+                        and not value['fallback'] and not value.get('cancelled')):
+                    cache_generated_recipes(recipe_model, key, [value['recipe']])
+                yield f"event: {event}\ndata: {json.dumps(value)}\n\n"
+            completed = True
+        finally:
+            # Closed early: the server could not send to the client any more
+            if not completed and cancellation is not None:
+                cancellation.cancel('disconnect')
+            if hasattr(stream, 'close'):
+                stream.close()
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/jobs', methods=['POST'])
+def api_submit_job():
+    """
+    Queue an image and/or ingredient list for the full pipeline and return a job id at once
+    
+    Accepts a multipart form with an "image" file and optional "ingredients"
+    (comma separated), "num_candidates" and "mode" fields, or a JSON body with
+    the same keys. Answers 202 with the job's URL, or 429 with Retry-After
+    when the queue is full.
+    """
+    data = request.get_json(silent=True) or request.form
+    ingredients = data.get('ingredients')
+    if isinstance(ingredients, str):
+        ingredients = [i.strip() for i in ingredients.split(',') if i.strip()]
+    if ingredients is not None and not isinstance(ingredients, list):
+        return jsonify({'error': 'ingredients must be a list'}), 400
+    
+    try:
+        num_candidates = parse_num_candidates(data)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid num_candidates'}), 400
+    
+    file = request.files.get('image')
+    if file is not None and file.filename != '' and not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    has_image = file is not None and file.filename != ''
+    if not has_image and not ingredients:
+        return jsonify({'error': 'No image or ingredients provided'}), 400
+    
+    try:
+        mode = parse_recipe_mode(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    payload = {
+        'ingredients': ingredients, 'num_candidates': num_candidates, 'mode': mode, 'filename': None,
+        'upload_pin': None,
+        'quality': g.quality.tier, 'deadline_ms': g.quality.deadline_ms, 'submitted': g.quality.started,
+    }
+    try:
+        # Check for room before writing the upload to disk
+        job_queue.check_capacity()
+        if has_image:
+            payload['filename'], _ = save_upload(file)
+            # The sweeper must not evict the upload before the job has read it
+            payload['upload_pin'] = upload_store.pin(payload['filename'])
+        job = job_queue.submit(payload, stages=['caption', 'detect', 'recipe'])
+    except QueueFull as e:
+        upload_store.unpin(payload['upload_pin'])
+        response = jsonify({'error': str(e)})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    
+    status_url = url_for('api_get_job', job_id=job.id)
+    response = jsonify({'id': job.id, 'status': job.status, 'status_url': status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+@app.route('/api/jobs/<job_id>')
+def api_get_job(job_id):
+    """
+    Return a job's status, per-stage progress and, once finished, its result
+    
+    ?wait=N long-polls for up to N seconds (capped at JOB_MAX_WAIT) until
+    the job finishes, or, with ?since=<version>, until anything changes.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    try:
+        wait = min(float(request.args.get('wait', 0)), app.config['JOB_MAX_WAIT'])
+        since = request.args.get('since', type=int)
+    except ValueError:
+        return jsonify({'error': 'Invalid wait'}), 400
+    if wait > 0:
+        job_queue.wait(job, wait, since=since)
+    
+    return jsonify(job.to_dict(position=job_queue.position(job)))
+
+@app.errorhandler(ModelNotReady)
+def model_not_ready(error):
+    """Answer fast with 503 instead of holding the request while a model loads"""
+    if request.path.startswith('/api/'):
+        response = jsonify({'error': str(error), 'model': error.name, 'state': error.state})
+    else:
+        response = Response(
+            "RecipeSnap is still loading its models. Please try again in a few seconds.",
+            mimetype='text/plain'
+        )
+    response.status_code = 503
+    response.headers['Retry-After'] = str(app.config['MODEL_RETRY_AFTER'])
+    return response
+
+@app.errorhandler(RequestCancelled)
+def request_cancelled(error):
+    """Answer a request whose model work was cancelled"""
+    if error.reason == 'deadline':
+        return jsonify({'error': 'Deadline exceeded', 'stage': error.stage}), 504
+    # 499 (client closed request), for the access log and metrics; nobody reads the body
+    return Response(status=499)
+
+REQUESTS = REGISTRY.counter(
+    'recipesnap_requests_total', 'HTTP requests by endpoint and status code', ['endpoint', 'status']
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    'recipesnap_request_seconds', 'HTTP request duration, including streamed bodies', ['endpoint']
+)
+IN_FLIGHT = REGISTRY.gauge(
+    'recipesnap_requests_in_flight', 'HTTP requests currently being handled', ['endpoint']
+)
+
+@app.before_request
+def start_request_metrics():
+    start_request_timing()
+    g.metrics_started = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or 'unmatched'
+    IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+def quality_args():
+    """Query arguments that carry the request's tier and deadline over to a redirect"""
+    args = {}
+    if g.quality.tier != app.config['QUALITY_TIER']:
+        args['quality'] = g.quality.tier
+    if g.quality.deadline_ms is not None:
+        args['deadline_ms'] = g.quality.deadline_ms
+    return args
+
+@app.before_request
+def start_request_quality():
+    """
+    Read the request's quality tier and deadline
+    
+    From the X-Quality (fast, balanced or quality) and X-Deadline-Ms
+    headers, or the quality and deadline_ms query/form fields for browsers.
+    """
+    tier = request.headers.get('X-Quality') or request.values.get('quality') or app.config['QUALITY_TIER']
+    deadline_ms = request.headers.get('X-Deadline-Ms') or request.values.get('deadline_ms')
+    try:
+        g.quality = QualityBudget(tier, float(deadline_ms) if deadline_ms else None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    set_budget(g.quality)
+
+@app.before_request
+def start_request_cancellation():
+    """Give the request a cancellation token, checked by the model classes while they work"""
+    token = None
+    if app.config['REQUEST_CANCELLATION']:
+        token = request_token(disconnect_probe(request.environ), deadline_probe(g.quality))
+    set_cancellation(token)
+
+@app.after_request
+def add_quality_degradations(response):
+    if 'quality' in g and g.quality.degradations:
+        response.headers['X-Quality-Degradations'] = ', '.join(g.quality.degradations)
+    return response
+
+@app.after_request
+def add_server_timing(response):
+    g.metrics_status = response.status_code
+    if app.config['SERVER_TIMING'] and 'metrics_started' in g:
+        timings = request_timings() + [('total', time.perf_counter() - g.metrics_started)]
+        response.headers['Server-Timing'] = server_timing_header(timings)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    # Runs after a streamed body has been fully sent
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is None:
+        return
+    IN_FLIGHT.dec(endpoint=endpoint)
+    REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_started, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=str(g.get('metrics_status', 500)))
+
+def collect_metrics():
+    """Export the counters the caches, job queue, schedulers and registry already keep"""
+    inference = inference_cache.stats()
+    recipes = recipe_cache.stats()
+    jobs = job_queue.stats()
+    uploads = upload_store.stats()
+    near_duplicates = near_duplicate_index.stats() if near_duplicate_index is not None else {}
+    families = [
+        ('recipesnap_cache_requests_total', 'counter', 'Cache lookups by result', [
+            ({'cache': 'inference', 'result': 'hit'}, inference['hits']),
+            ({'cache': 'inference', 'result': 'disk_hit'}, inference['disk_hits']),
+            ({'cache': 'inference', 'result': 'miss'}, inference['misses']),
+            ({'cache': 'recipe', 'result': 'hit'}, recipes['hits']),
+            ({'cache': 'recipe', 'result': 'miss'}, recipes['misses']),
+            ({'cache': 'near_duplicate', 'result': 'hit'}, near_duplicates.get('hits')),
+            ({'cache': 'near_duplicate', 'result': 'miss'}, near_duplicates.get('misses')),
+        ]),
+        ('recipesnap_cache_entries', 'gauge', 'Entries held in memory by each cache', [
+            ({'cache': 'inference'}, inference['entries']),
+            ({'cache': 'recipe'}, recipes['entries']),
+            ({'cache': 'near_duplicate'}, near_duplicates.get('entries')),
+        ]),
+        ('recipesnap_model_ready', 'gauge', '1 once a model has finished loading', [
+            ({'model': name}, int(info['state'] == 'ready'))
+            for name, info in model_registry.status()['models'].items()
+        ]),
+        ('recipesnap_jobs_queued', 'gauge', 'Jobs waiting for a worker', [({}, jobs['queue_depth'])]),
+        ('recipesnap_jobs_running', 'gauge', 'Jobs being processed', [({}, jobs['running'])]),
+        ('recipesnap_jobs_total', 'counter', 'Jobs by outcome', [
+            ({'outcome': 'succeeded'}, jobs['succeeded']),
+            ({'outcome': 'failed'}, jobs['failed']),
+            ({'outcome': 'rejected'}, jobs['rejected']),
+        ]),
+        ('recipesnap_upload_store_bytes', 'gauge', 'Bytes of stored uploads and display copies',
+         [({}, uploads['bytes'])]),
+        ('recipesnap_uploads_total', 'counter', 'Uploads by outcome', [
+            ({'outcome': 'saved'}, uploads['saved']),
+            ({'outcome': 'deduplicated'}, uploads['deduplicated']),
+            ({'outcome': 'evicted'}, uploads['evicted']),
+        ]),
+    ]
+    
+    schedulers = [(name, s.stats()) for name, s in (('captioning', caption_scheduler), ('detection', detection_scheduler)) if s]
+    if schedulers:
+        families.append(('recipesnap_batch_queue_depth', 'gauge', 'Items waiting for a micro-batch',
+                         [({'model': name}, stats['queue_depth']) for name, stats in schedulers]))
+        families.append(('recipesnap_batches_total', 'counter', 'Micro-batches run',
+                         [({'model': name}, stats['batches']) for name, stats in schedulers]))
+    
+    memory = process_memory()
+    if memory:
+        families.append(('recipesnap_process_memory_bytes', 'gauge',
+                         'Resident memory of this worker process; uss is the part no other process shares', [
+            ({'kind': kind}, memory[f'{kind}_mb'] * 1024 * 1024) for kind in ('rss', 'pss', 'uss')
+        ]))
+    
+    if model_registry.is_ready('recipe'):
+        generation = model_registry.get('recipe').generation_stats()
+        if generation.get('speculative'):
+            families.append(('recipesnap_draft_tokens_total', 'counter', 'Speculative decoding draft tokens', [
+                ({'result': 'proposed'}, generation['draft_tokens_proposed']),
+                ({'result': 'accepted'}, generation['draft_tokens_accepted']),
+            ]))
+    return families
+
+REGISTRY.add_collector(collect_metrics)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.after_request
+def track_first_response(response):
+    if startup_timings['first_response_seconds'] is None:
+        startup_timings['first_response_seconds'] = time.time() - STARTED_AT
+        print(f"First response served {startup_timings['first_response_seconds']:.2f}s after startup")
+    return response
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the web process is up, whether or not the models are loaded"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: per-model load state; 503 until every model is ready"""
+    status = model_registry.status()
+    status.update(startup_timings)
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/api/stats')
+def api_stats():
+    stats = {
+        'startup': dict(startup_timings, **model_registry.status()),
+        'inference_cache': inference_cache.stats(),
+        'near_duplicates': near_duplicate_index.stats() if near_duplicate_index is not None else None,
+        'recipe_cache': recipe_cache.stats(),
+        'vision_execution': vision_executor.stats()
+    }
+    if caption_scheduler is not None:
+        stats['caption_batching'] = caption_scheduler.stats()
+    if detection_scheduler is not None:
+        stats['detection_batching'] = detection_scheduler.stats()
+    stats['jobs'] = job_queue.stats()
+    if model_servers:
+        stats['model_servers'] = [client.stats() for client in model_servers.values()]
+    stats['cancellations'] = cancellation_stats()
+    stats['uploads'] = upload_store.stats()
+    stats['recipe_retrieval'] = get_recipe_index().stats()
+    if model_registry.is_ready('recipe'):
+        stats['recipe_generation'] = model_registry.get('recipe').generation_stats()
+    stats['memory'] = dict(process_memory() or {}, pid=os.getpid(), mapped_weights={
+        name: model_registry.get(name).weight_mapping
+        for name in ('captioning', 'detection', 'recipe') if model_registry.is_ready(name)
+    })
+    return jsonify(stats)
+
+@app.cli.command('warm-recipe-cache')
+@click.option('--top', default=100, show_default=True,
+              help='Refresh this many of the most requested ingredient sets.')
+@click.option('--combos', type=click.File('r'),
+              help='File with one JSON ingredient list per line to pre-generate.')
+def warm_recipe_cache(top, combos):
+    """Pre-generate recipe variants for common ingredient combinations."""
+    ingredient_sets = [recipe_cache.ingredients_from_key(key) for key in recipe_cache.most_requested(top)]
+    if combos:
+        ingredient_sets += [json.loads(line) for line in combos if line.strip()]
+    
+    recipe_model = model_registry.get('recipe', wait=True)
+    generated = 0
+    for ingredients in ingredient_sets:
+        key = recipe_cache_key(recipe_model, ingredients)
+        for _ in range(recipe_cache.missing_variants(key)):
+            cache_generated_recipes(recipe_model, key, recipe_model.generate_recipes(ingredients))
+            generated += 1
+        click.echo(f"{', '.join(ingredients)}: {recipe_cache.variants_per_key - recipe_cache.missing_variants(key)} variants")
+    
+    recipe_cache.save()
+    click.echo(f"Generated {generated} recipes for {len(ingredient_sets)} ingredient sets")
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,438 @@
+"""
+Run a photo archive through caption -> ingredients -> recipes offline
+
+Reads images from a directory (searched recursively), a .tar/.tar.gz or a
+.zip and processes them without the web server, straight through the
+model classes, in three overlapping stages:
+
+- decode: a pool of threads reads and decodes images at the smallest
+  resolution the vision models accept (Pillow releases the GIL while
+  decoding, so the pool uses every core)
+- vision: batches of decoded images are captioned and searched for
+  ingredients, the two models running side by side
+- recipes: batches of ingredient lists go through padded batched
+  generation (or corpus retrieval with --recipe-mode retrieve)
+
+The model calls running side by side split --threads evenly. Bounded
+queues between the stages keep memory flat however large the archive is. Every finished image is appended to the output JSONL as soon
+as its recipes are ready, one record per line:
+
+    {"source": "...", "image_hash": "...", "caption": "...", "ingredients": [...], "recipes": [...]}
+
+Images that failed get {"source": "...", "error": "..."} instead. The
+output file is the checkpoint: rerunning the same command skips every
+image that already has a successful record and retries the failed ones,
+so a killed run resumes where it stopped. When a source appears more
+than once, its last record wins.
+
+Model and precision settings come from the same environment variables as
+the app (CAPTION_MODEL, VISION_PRECISION, VISION_BACKEND, RECIPE_MODEL, ...).
+
+Usage:
+    python batch_process.py photos/ --output results.jsonl
+    python batch_process.py archive.tar.gz --output results.jsonl --recipe-mode retrieve --corpus recipes.jsonl
+    python batch_process.py photos.zip --output results.jsonl --vision-batch 16 --report throughput.json
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Marks the end of a stage's input queue
+_DONE = object()
+
+
+def is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def iter_sources(path):
+    """
+    Yield (source, load) for every image in a directory, tar or zip archive
+
+    source names the image in the output (its path relative to the
+    directory, or its archive member name); load() returns its bytes.
+    Directory and zip members are read by load() itself, so the decode
+    pool reads them in parallel. Tar members can only be read in archive
+    order, so their bytes are read here, as the archive is walked.
+    """
+    if os.path.isdir(path):
+        for directory, subdirectories, files in os.walk(path):
+            subdirectories.sort()
+            for name in sorted(files):
+                if is_image(name):
+                    full_path = os.path.join(directory, name)
+                    source = os.path.relpath(full_path, path).replace(os.sep, "/")
+                    yield source, lambda full_path=full_path: _read_file(full_path)
+    elif zipfile.is_zipfile(path):
+        # ZipFile serializes access to the underlying file, so members can be read from any thread
+        archive = zipfile.ZipFile(path)
+        for info in archive.infolist():
+            if not info.is_dir() and is_image(info.filename):
+                yield info.filename, lambda name=info.filename: archive.read(name)
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if member.isfile() and is_image(member.name):
+                    data = archive.extractfile(member).read()
+                    yield member.name, lambda data=data: data
+    else:
+        raise ValueError(f"{path} is not a directory, tar or zip archive")
+
+
+def load_checkpoint(path):
+    """
+    Return the sources that already have a successful record in an output file
+
+    A run killed mid-write can leave a partial last line; it is cut off so
+    new records start on a line of their own.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+
+    latest = {}
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        latest[record.get("source")] = "error" not in record
+    done.update(source for source, succeeded in latest.items() if succeeded)
+    return done
+
+
+class Throughput:
+    """Per-stage busy time and completed images, shared by the pipeline threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.busy = {"decode": 0.0, "vision": 0.0, "recipes": 0.0, "write": 0.0}
+        self.images = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.busy[stage] += seconds
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def completed(self, images, errors):
+        with self._lock:
+            self.images += images
+            self.errors += errors
+
+    def summary(self):
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            return {
+                "images": self.images,
+                "errors": self.errors,
+                "skipped": self.skipped,
+                "elapsed_seconds": elapsed,
+                "images_per_sec": self.images / elapsed if elapsed else 0.0,
+                "busy_seconds": dict(self.busy),
+            }
+
+
+class Pipeline:
+    """
+    decode pool -> vision thread -> recipe stage (the calling thread), joined by bounded queues
+    """
+
+    def __init__(self, captioner, detector, recipes_for, throughput, decode_workers, vision_batch,
+                 recipe_batch, vision_executor):
+        """
+        Args:
+            captioner: ImageCaptioningModel
+            detector: ObjectDetectionModel
+            recipes_for: Callable turning a list of ingredient lists into a list of recipe lists
+            throughput: Throughput the stages record into
+            decode_workers: Threads reading and decoding images
+            vision_batch: Images per caption/detection call
+            recipe_batch: Ingredient lists per recipes_for call
+            vision_executor: VisionExecutor running captioning and detection
+        """
+        self.captioner = captioner
+        self.detector = detector
+        self.recipes_for = recipes_for
+        self.throughput = throughput
+        self.vision_batch = vision_batch
+        self.recipe_batch = recipe_batch
+        self.vision_executor = vision_executor
+        self.min_edge = max(captioner.min_input_edge, detector.min_input_edge)
+
+        self._decode_pool = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="decode")
+        # Enough decoded images in flight to keep every decode thread busy during a vision batch
+        self._decoded = queue.Queue(maxsize=max(2 * decode_workers, 2 * vision_batch))
+        self._analyzed = queue.Queue(maxsize=2 * max(vision_batch, recipe_batch))
+        self._failure = None
+
+    def _decode(self, load):
+        from models.inference_cache import hash_bytes
+        from models.preprocessing import decode_image
+
+        started = time.perf_counter()
+        data = load()
+        image = decode_image(data, self.min_edge)
+        self.throughput.add("decode", time.perf_counter() - started)
+        return hash_bytes(data), image
+
+    def _read(self, sources, done):
+        """Walk the sources and hand every image not yet done to the decode pool"""
+        try:
+            for source, load in sources:
+                if source in done:
+                    self.throughput.skip()
+                    continue
+                self._decoded.put((source, self._decode_pool.submit(self._decode, load)))
+        except Exception as e:
+            self._failure = e
+        self._decoded.put(_DONE)
+
+    def _analyze_batch(self, images):
+        """Captions and ingredients for a batch, image by image if the batched calls fail"""
+        try:
+            results = self.vision_executor.run({
+                "caption": lambda: self.captioner.generate_captions(images),
+                "detection": lambda: self.detector.detect_ingredients_batch(images),
+            })
+            return results["caption"], results["detection"]
+        except Exception as e:
+            print(f"Error in vision batch, falling back to single images: {e}")
+            return ([self.captioner.generate_caption(image) for image in images],
+                    [self.detector.detect_ingredients(image) for image in images])
+
+    def _vision(self):
+        """Gather decoded images into batches and caption them and detect their ingredients"""
+        finished = False
+        while not finished:
+            batch = []
+            while len(batch) < self.vision_batch:
+                item = self._decoded.get()
+                if item is _DONE:
+                    finished = True
+                    break
+                source, future = item
+                try:
+                    image_hash, image = future.result()
+                except Exception as e:
+                    self._analyzed.put({"source": source, "error": f"decode failed: {e}"})
+                    continue
+                batch.append((source, image_hash, image))
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            captions, ingredients = self._analyze_batch([image for _, _, image in batch])
+            self.throughput.add("vision", time.perf_counter() - started)
+            for (source, image_hash, _), caption, found in zip(batch, captions, ingredients):
+                self._analyzed.put({
+                    "source": source, "image_hash": image_hash, "caption": caption, "ingredients": found,
+                })
+        self._analyzed.put(_DONE)
+
+    def run(self, sources, done, output, checkpoint_every=32, progress_every=10.0):
+        """
+        Process every source not in done, appending one JSON record per image to output
+
+        Returns:
+            Exception or None: Why reading the sources stopped early, if it did
+        """
+        threading.Thread(target=self._read, args=(sources, done), name="reader", daemon=True).start()
+        threading.Thread(target=self._vision, name="vision", daemon=True).start()
+
+        written = 0
+        last_progress = time.perf_counter()
+        finished = False
+        while not finished:
+            batch = []
+            while len(batch) < self.recipe_batch:
+                record = self._analyzed.get()
+                if record is _DONE:
+                    finished = True
+                    break
+                batch.append(record)
+
+            analyzed = [record for record in batch if "error" not in record]
+            if analyzed:
+                started = time.perf_counter()
+                recipes = self.recipes_for([record["ingredients"] for record in analyzed])
+                self.throughput.add("recipes", time.perf_counter() - started)
+                for record, recipe_list in zip(analyzed, recipes):
+                    record["recipes"] = recipe_list
+
+            started = time.perf_counter()
+            for record in batch:
+                output.write(json.dumps(record) + "\n")
+            output.flush()
+            written += len(batch)
+            if written >= checkpoint_every:
+                os.fsync(output.fileno())
+                written = 0
+            self.throughput.add("write", time.perf_counter() - started)
+
+            errors = sum("error" in record for record in batch)
+            self.throughput.completed(len(batch) - errors, errors)
+            if time.perf_counter() - last_progress >= progress_every:
+                last_progress = time.perf_counter()
+                summary = self.throughput.summary()
+                print(f"{summary['images']} images, {summary['errors']} errors, "
+                      f"{summary['images_per_sec']:.2f} images/sec")
+
+        os.fsync(output.fileno())
+        self._decode_pool.shutdown()
+        return self._failure
+
+
+def make_recipes_for(args):
+    """Return the recipe stage's function for --recipe-mode and the model behind it"""
+    if args.recipe_mode == "none":
+        return lambda ingredient_lists: [[] for _ in ingredient_lists], None
+
+    if args.recipe_mode == "retrieve":
+        from models.fallbacks import FALLBACK_RECIPES
+        from models.retrieval import RecipeIndex
+
+        if args.corpus:
+            index = RecipeIndex.from_file(args.corpus)
+        else:
+            index = RecipeIndex([recipe for recipes in FALLBACK_RECIPES.values() for recipe in recipes])
+        return lambda ingredient_lists: [index.recipes_for(ingredients, args.candidates)
+                                         for ingredients in ingredient_lists], index
+
+    from models.recipe_cache import normalize_ingredients
+    from models.recipe_generation import RecipeGenerationModel
+
+    model = RecipeGenerationModel(args.recipe_model, precision=args.recipe_precision,
+                                  structured_output=args.recipe_output == "structured")
+    if not model.model_loaded:
+        raise RuntimeError(f"Recipe model {args.recipe_model} could not be loaded")
+
+    def generate(ingredient_lists):
+        # Photos of the same dish often share an ingredient set; generate each set once per batch
+        unique = {}
+        for ingredients in ingredient_lists:
+            unique.setdefault(normalize_ingredients(ingredients), list(ingredients))
+        generated = model.generate_recipes_batch(list(unique.values()), num_candidates=args.candidates,
+                                                 batch_size=args.recipe_batch)
+        by_key = dict(zip(unique, generated))
+        return [by_key[normalize_ingredients(ingredients)] for ingredients in ingredient_lists]
+
+    return generate, model
+
+
+def print_report(summary):
+    print("\nRecipeSnap Batch Report")
+    print("=======================")
+    print(f"images processed   {summary['images']:>10}")
+    print(f"errors             {summary['errors']:>10}")
+    print(f"skipped (resumed)  {summary['skipped']:>10}")
+    print(f"elapsed            {summary['elapsed_seconds']:>9.1f}s")
+    print(f"throughput         {summary['images_per_sec']:>10.2f} images/sec")
+    print("\nBusy seconds per stage (decode is summed over its threads):")
+    elapsed = summary["elapsed_seconds"] or 1.0
+    for stage_name, seconds in summary["busy_seconds"].items():
+        print(f"  {stage_name:<16} {seconds:>9.1f}s  {seconds / elapsed:>6.0%} of wall time")
+    print("\nThe stage closest to 100% of wall time is the bottleneck.")
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Caption, detect ingredients and suggest recipes for a photo archive")
+    parser.add_argument("input", help="Directory of images, or a .tar(.gz) or .zip archive")
+    parser.add_argument("--output", required=True, help="JSONL file results are appended to (and resumed from)")
+    parser.add_argument("--recipe-mode", default="generate", choices=["generate", "retrieve", "none"])
+    parser.add_argument("--corpus", default=os.environ.get("RECIPE_CORPUS"), help="Recipe corpus for --recipe-mode retrieve")
+    parser.add_argument("--candidates", type=int, default=1, help="Recipes per image")
+    parser.add_argument("--caption-model", default=os.environ.get("CAPTION_MODEL", "nlpconnect/vit-gpt2-image-captioning"))
+    parser.add_argument("--detection-model", default=os.environ.get("DETECTION_MODEL", "facebook/detr-resnet-50"))
+    parser.add_argument("--recipe-model", default=os.environ.get("RECIPE_MODEL", "mistralai/Mistral-7B-Instruct-v0.2"))
+    parser.add_argument("--vision-precision", default=os.environ.get("VISION_PRECISION", "auto"))
+    parser.add_argument("--recipe-precision", default=os.environ.get("RECIPE_PRECISION", "auto"))
+    parser.add_argument("--recipe-output", default=os.environ.get("RECIPE_OUTPUT", "free"), choices=["free", "structured"])
+    parser.add_argument("--decode-workers", type=int, default=cpu_count, help="Threads reading and decoding images")
+    parser.add_argument("--threads", type=int, default=cpu_count, help="Torch threads shared by the model stages")
+    parser.add_argument("--vision-batch", type=int, default=8, help="Images per caption/detection call")
+    parser.add_argument("--recipe-batch", type=int, default=int(os.environ.get("RECIPE_BATCH_SIZE", 8)),
+                        help="Ingredient lists per recipe generation call")
+    parser.add_argument("--checkpoint-every", type=int, default=32, help="Records written between fsyncs")
+    parser.add_argument("--progress-every", type=float, default=10.0, help="Seconds between progress lines")
+    parser.add_argument("--report", help="Write the throughput summary as JSON to this file")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"❌ {args.input} does not exist")
+        sys.exit(1)
+
+    from models.image_captioning import ImageCaptioningModel
+    from models.object_detection import ObjectDetectionModel
+    from models.parallel import VisionExecutor, set_torch_threads, threads_per_call
+
+    # Captioning, detection and (in the main thread) recipe generation run
+    # side by side, each with an intra-op pool of the process-wide size
+    concurrent_calls = 3 if args.recipe_mode == "generate" else 2
+    torch_threads = threads_per_call(concurrent_calls, total=args.threads)
+    set_torch_threads(torch_threads)
+
+    print("Loading models...")
+    captioner = ImageCaptioningModel(args.caption_model, precision=args.vision_precision)
+    detector = ObjectDetectionModel(args.detection_model, precision=args.vision_precision)
+    recipes_for, _ = make_recipes_for(args)
+    vision_executor = VisionExecutor(mode="parallel")
+
+    done = load_checkpoint(args.output)
+    if done:
+        print(f"Resuming: {len(done)} images in {args.output} are already done")
+
+    throughput = Throughput()
+    pipeline = Pipeline(captioner, detector, recipes_for, throughput, args.decode_workers,
+                        args.vision_batch, args.recipe_batch, vision_executor)
+    try:
+        with open(args.output, "a") as output:
+            failure = pipeline.run(iter_sources(args.input), done, output,
+                                   args.checkpoint_every, args.progress_every)
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; rerun the same command to resume from {args.output}")
+        failure = None
+
+    summary = throughput.summary()
+    summary["torch_threads"] = torch_threads
+    print_report(summary)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nThroughput summary written to {args.report}")
+
+    if failure is not None:
+        print(f"❌ Reading {args.input} stopped early: {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
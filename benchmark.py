@@ -0,0 +1,503 @@
+"""
+Offline benchmark suite for RecipeSnap
+
+Builds tiny, randomly initialised stand-ins for the ViT-GPT2 captioning,
+DETR detection and causal-LM recipe models from local configs (no network,
+no downloads), then drives the model classes and the Flask routes at a
+configurable concurrency. Reports p50/p95/p99 latency, throughput,
+tokens/sec and peak RSS per scenario. Every scenario runs in its own
+subprocess so peak RSS is not polluted by the others.
+
+The tiny models are far faster than the real ones, so absolute numbers only
+describe the code around the models: preprocessing, caching, batching,
+scheduling and request handling. Compare runs on the same machine. Any
+RecipeSnap environment variable (BATCHING_ENABLED, VISION_EXECUTION, ...)
+is passed through to the route scenarios.
+
+Usage:
+    python benchmark.py --output baseline.json
+    python benchmark.py --scenarios recipe route_recipes --concurrency 4 --requests 40
+    python benchmark.py --baseline baseline.json --tolerance 0.15   # exit code 1 on regression
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from precision_report import peak_rss_mb
+
+INGREDIENT_POOL = [
+    "tomato", "onion", "chicken", "rice", "garlic", "pepper",
+    "cheese", "pasta", "egg", "potato", "carrot", "apple",
+]
+
+MODEL_SCENARIOS = ["caption", "detection", "recipe", "recipe_batch"]
+ROUTE_SCENARIOS = [
+    "route_ingredients", "route_upload", "route_recipes", "route_recipes_retrieve",
+    "route_recipes_batch", "route_recipes_stream", "route_jobs",
+]
+
+# Metric path -> True if higher is better, used by --baseline
+COMPARED_METRICS = {
+    ("latency_ms", "p50"): False,
+    ("latency_ms", "p95"): False,
+    ("latency_ms", "p99"): False,
+    ("throughput_rps",): True,
+    ("tokens_per_sec",): True,
+    ("peak_rss_mb",): False,
+    ("errors",): False,
+}
+
+
+def build_tiny_models(directory, seed=0):
+    """
+    Save tiny random ViT-GPT2, DETR and causal-LM models under directory
+
+    All three share a character-level tokenizer built in memory. The
+    recipe model never emits end-of-sequence, so every generate call
+    produces the same number of tokens.
+
+    Returns:
+        dict: Model directories keyed by "caption", "detection" and "recipe"
+    """
+    import torch
+    from tokenizers import Tokenizer, decoders, models as tokenizer_models, pre_tokenizers
+    from transformers import (
+        DetrConfig, DetrForObjectDetection, DetrImageProcessor, GPT2Config,
+        PreTrainedTokenizerFast, ResNetConfig, ViTConfig, ViTImageProcessor,
+        VisionEncoderDecoderConfig, VisionEncoderDecoderModel,
+    )
+    try:
+        from transformers import MistralConfig as CausalLMConfig, MistralForCausalLM as CausalLM
+    except ImportError:
+        # transformers releases before Mistral support
+        from transformers import LlamaConfig as CausalLMConfig, LlamaForCausalLM as CausalLM
+
+    paths = {name: os.path.join(directory, name) for name in ("caption", "detection", "recipe")}
+    if all(os.path.isfile(os.path.join(path, "config.json")) for path in paths.values()):
+        return paths
+
+    vocab = {}
+    for token in ["<unk>", "<s>", "</s>", "<pad>", "\n"] + [chr(c) for c in range(32, 127)]:
+        vocab.setdefault(token, len(vocab))
+    backend = Tokenizer(tokenizer_models.WordLevel(vocab=vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    backend.decoder = decoders.Fuse()
+    # Like Mistral's tokenizer, no token_type_ids, which generate() would reject
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, bos_token="<s>", eos_token="</s>", unk_token="<unk>", pad_token="<pad>",
+        model_input_names=["input_ids", "attention_mask"]
+    )
+    special = {"bos_token_id": 1, "eos_token_id": 2, "pad_token_id": 3}
+
+    torch.manual_seed(seed)
+    encoder = ViTConfig(hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=64, image_size=224, patch_size=32)
+    decoder = GPT2Config(vocab_size=len(vocab), n_embd=32, n_layer=2, n_head=2, n_positions=64, **special)
+    config = VisionEncoderDecoderConfig.from_encoder_decoder_configs(encoder, decoder)
+    config.decoder_start_token_id = special["bos_token_id"]
+    config.pad_token_id = special["pad_token_id"]
+    config.eos_token_id = special["eos_token_id"]
+    captioner = VisionEncoderDecoderModel(config=config)
+    captioner.generation_config.decoder_start_token_id = special["bos_token_id"]
+    captioner.generation_config.pad_token_id = special["pad_token_id"]
+    captioner.generation_config.eos_token_id = special["eos_token_id"]
+    captioner.save_pretrained(paths["caption"])
+    ViTImageProcessor(size={"height": 224, "width": 224}).save_pretrained(paths["caption"])
+    tokenizer.save_pretrained(paths["caption"])
+
+    torch.manual_seed(seed)
+    backbone = ResNetConfig(embedding_size=8, hidden_sizes=[8, 16, 16, 32], depths=[1, 1, 1, 1],
+                            out_features=["stage4"])
+    detector = DetrForObjectDetection(DetrConfig(
+        use_timm_backbone=False, backbone_config=backbone, use_pretrained_backbone=False,
+        d_model=32, encoder_layers=1, decoder_layers=1, encoder_attention_heads=2,
+        decoder_attention_heads=2, encoder_ffn_dim=64, decoder_ffn_dim=64, num_queries=10,
+    ))
+    detector.save_pretrained(paths["detection"])
+    DetrImageProcessor(size={"shortest_edge": 320, "longest_edge": 480}).save_pretrained(paths["detection"])
+
+    torch.manual_seed(seed)
+    language_model = CausalLM(CausalLMConfig(
+        vocab_size=len(vocab), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=2, num_key_value_heads=1, max_position_embeddings=2048, **special,
+    ))
+    # Every recipe runs to its full length, so timings compare like with like.
+    # transformers 4.31 rebuilds the generation config from the model config
+    # on generate(), so the model config must not name an end token either
+    language_model.config.eos_token_id = None
+    language_model.generation_config.eos_token_id = None
+    language_model.save_pretrained(paths["recipe"])
+    tokenizer.save_pretrained(paths["recipe"])
+
+    return paths
+
+
+_images = {}
+
+
+def image_bytes(i):
+    """Request i's image, generated before timing starts by run_worker"""
+    if i not in _images:
+        _images[i] = make_image(i)
+    return _images[i]
+
+
+def make_image(seed, size=(640, 480)):
+    """Random JPEG bytes; a different seed gives a different image, so caches don't hide model cost"""
+    import io
+    import numpy as np
+    from PIL import Image
+
+    pixels = np.random.RandomState(seed % (2 ** 32)).randint(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+INGREDIENT_COMBOS = [list(combo) for combo in itertools.combinations(INGREDIENT_POOL, 3)]
+
+
+def ingredient_combo(i):
+    """A distinct ingredient list per request index (up to 220), so the recipe cache rarely hits"""
+    return INGREDIENT_COMBOS[i % len(INGREDIENT_COMBOS)]
+
+
+def percentile(values, q):
+    import numpy as np
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def model_scenario(name, paths, args):
+    """Return (call, token counter) for a scenario that drives a model class directly"""
+    if name == "caption":
+        from models.image_captioning import ImageCaptioningModel
+        model = ImageCaptioningModel(paths["caption"])
+        return lambda i: bool(model.generate_captions([image_bytes(i)])), None
+
+    if name == "detection":
+        from models.object_detection import ObjectDetectionModel
+        model = ObjectDetectionModel(paths["detection"])
+        return lambda i: bool(model.detect_ingredients_batch([image_bytes(i)])), None
+
+    from models.recipe_generation import RecipeGenerationModel
+    model = RecipeGenerationModel(paths["recipe"])
+    if not model.model_loaded:
+        raise RuntimeError("Recipe model failed to load")
+    model.max_length = args.recipe_max_length
+
+    if name == "recipe":
+        tokens = lambda: model.generation_stats()["new_tokens"]
+        return lambda i: not model.is_fallback_recipe(model.generate_recipes(ingredient_combo(i))[0]), tokens
+
+    def generate_batch(i):
+        lists = [ingredient_combo(i * args.batch_lists + j) for j in range(args.batch_lists)]
+        results = model.generate_recipes_batch(lists, batch_size=args.batch_lists)
+        return not any(model.is_fallback_recipe(recipes[0]) for recipes in results)
+    return generate_batch, None
+
+
+def route_scenario(name, paths, args):
+    """Return (call, token counter) for a scenario that drives a Flask route through the test client"""
+    os.environ.update({
+        "CAPTION_MODEL": paths["caption"],
+        "DETECTION_MODEL": paths["detection"],
+        "RECIPE_MODEL": paths["recipe"],
+        "MODEL_LOADING": "eager",
+    })
+    import app as recipesnap
+
+    recipe_model = recipesnap.model_registry.get("recipe")
+    recipe_model.max_length = args.recipe_max_length
+    tokens = lambda: recipe_model.generation_stats()["new_tokens"]
+
+    # One test client per thread
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "client"):
+            local.client = recipesnap.app.test_client()
+        return local.client
+
+    def image_upload(i):
+        import io
+        return {"image": (io.BytesIO(image_bytes(i)), f"bench{i}.jpg")}
+
+    if name == "route_ingredients":
+        return lambda i: client().post(
+            "/api/ingredients", data=image_upload(i), content_type="multipart/form-data"
+        ).status_code == 200, None
+
+    if name == "route_upload":
+        return lambda i: client().post(
+            "/upload", data=image_upload(i), content_type="multipart/form-data", follow_redirects=True
+        ).status_code == 200, tokens
+
+    if name in ("route_recipes", "route_recipes_retrieve"):
+        mode = "retrieve" if name == "route_recipes_retrieve" else "generate"
+        return lambda i: client().post(
+            "/api/recipes", json={"ingredients": ingredient_combo(i), "mode": mode}
+        ).status_code == 200, tokens if mode == "generate" else None
+
+    if name == "route_recipes_batch":
+        return lambda i: client().post("/api/recipes/batch", json={
+            "ingredient_lists": [ingredient_combo(i * args.batch_lists + j) for j in range(args.batch_lists)]
+        }).status_code == 200, None
+
+    if name == "route_recipes_stream":
+        def stream(i):
+            response = client().get("/api/recipes/stream?ingredients=" + ",".join(ingredient_combo(i)))
+            return response.status_code == 200 and b"event: done" in response.get_data()
+        return stream, tokens
+
+    if name == "route_jobs":
+        def job(i):
+            response = client().post("/api/jobs", data=image_upload(i), content_type="multipart/form-data")
+            if response.status_code != 202:
+                return False
+            status_url = response.headers["Location"]
+            while True:
+                response = client().get(status_url + "?wait=30")
+                status = response.get_json()["status"]
+                if status in ("succeeded", "failed"):
+                    return status == "succeeded"
+        return job, tokens
+
+    raise ValueError(f"Unknown scenario '{name}'")
+
+
+def run_worker(args):
+    """Run a single scenario and print its result as JSON"""
+    import numpy as np
+    import torch
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    # Route scenarios write uploads relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="recipesnap-bench-")
+    os.chdir(workdir)
+
+    paths = json.loads(args.paths)
+    started = time.perf_counter()
+    if args.worker in MODEL_SCENARIOS:
+        call, tokens = model_scenario(args.worker, paths, args)
+    else:
+        call, tokens = route_scenario(args.worker, paths, args)
+    setup_seconds = time.perf_counter() - started
+
+    for i in range(-args.warmup, args.requests):
+        image_bytes(i)
+
+    # Negative indices keep warm-up inputs distinct from measured ones
+    for i in range(args.warmup):
+        call(-1 - i)
+
+    def timed(i):
+        started = time.perf_counter()
+        try:
+            ok = call(i)
+        except Exception as e:
+            print(f"Error in {args.worker} request {i}: {e}", file=sys.stderr)
+            ok = False
+        return 1000.0 * (time.perf_counter() - started), ok
+
+    tokens_before = tokens() if tokens else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(timed, range(args.requests)))
+    wall_seconds = time.perf_counter() - started
+
+    latencies = [latency for latency, _ in outcomes]
+    result = {
+        "scenario": args.worker,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "setup_seconds": setup_seconds,
+        "wall_seconds": wall_seconds,
+        "throughput_rps": args.requests / wall_seconds if wall_seconds else 0.0,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else 0.0,
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if tokens:
+        new_tokens = tokens() - tokens_before
+        result["new_tokens"] = new_tokens
+        result["tokens_per_sec"] = new_tokens / wall_seconds if wall_seconds else 0.0
+    print(json.dumps(result))
+
+
+def metric(result, path):
+    value = result
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare_to_baseline(results, baseline, tolerance, settings, failed=()):
+    """
+    Compare each scenario's metrics with the baseline run
+
+    A baseline scenario that failed (is in failed) or did not run at all
+    is a regression, as is any increase of a lower-is-better metric from
+    zero, e.g. errors.
+
+    Returns:
+        list: (scenario, metric name, baseline value, current value, change) for every regression;
+            value and change are None for a scenario that failed or is missing
+    """
+    previous = baseline.get("scenarios", {})
+    regressions = []
+    print(f"\nComparison against baseline (tolerance {tolerance:.0%})")
+    for key in ("requests", "concurrency", "recipe_max_length", "batch_lists", "threads"):
+        before = baseline.get("settings", {}).get(key)
+        if before != settings[key]:
+            print(f"⚠️  {key} differs from the baseline ({before} vs {settings[key]}); results are not comparable")
+    print(f"{'scenario':<24} {'metric':<15} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name in previous:
+        if name not in results:
+            status = "failed" if name in failed else "missing"
+            print(f"{name:<24} {status:<15} {'':>10} {'':>10} {'':>8}  REGRESSION")
+            regressions.append((name, status, None, None, None))
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        for path, higher_is_better in COMPARED_METRICS.items():
+            before, after = metric(previous[name], path), metric(result, path)
+            if before is None or after is None:
+                continue
+            if before:
+                change = (after - before) / before
+            else:
+                # Nothing to compare relative to; any increase from zero counts
+                change = math.inf if after > 0 else 0.0
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            label = ".".join(path)
+            print(f"{name:<24} {label:<15} {before:>10.2f} {after:>10.2f} {change:>+8.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append((name, label, before, after, change))
+    return regressions
+
+
+def print_report(results):
+    print("\nRecipeSnap Benchmark")
+    print("====================")
+    print(f"{'scenario':<24} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'tok/s':>9} "
+          f"{'peak RSS MB':>12} {'errors':>7}")
+    for name, result in results.items():
+        latency = result["latency_ms"]
+        tokens_per_sec = f"{result['tokens_per_sec']:>9.1f}" if "tokens_per_sec" in result else f"{'-':>9}"
+        print(
+            f"{name:<24} {latency['p50']:>9.1f} {latency['p95']:>9.1f} {latency['p99']:>9.1f} "
+            f"{result['throughput_rps']:>8.2f} {tokens_per_sec} {result['peak_rss_mb']:>12.0f} "
+            f"{result['errors']:>7}"
+        )
+
+
+def environment_info():
+    from importlib import metadata
+
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    for package in ("torch", "transformers", "numpy", "flask"):
+        try:
+            info[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            info[package] = None
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RecipeSnap models and routes offline")
+    parser.add_argument("--scenarios", nargs="+", default=MODEL_SCENARIOS + ROUTE_SCENARIOS,
+                        choices=MODEL_SCENARIOS + ROUTE_SCENARIOS, metavar="SCENARIO",
+                        help=f"Scenarios to run (default: all of {', '.join(MODEL_SCENARIOS + ROUTE_SCENARIOS)})")
+    parser.add_argument("--requests", type=int, default=20, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=1, help="Requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests before timing starts")
+    parser.add_argument("--recipe-max-length", type=int, default=512,
+                        help="Prompt plus generated tokens per recipe (prompts are ~380 characters)")
+    parser.add_argument("--batch-lists", type=int, default=4, help="Ingredient lists per batch request")
+    parser.add_argument("--threads", type=int, help="torch threads per worker (default: torch's choice)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model-dir", help="Where to build the tiny models (default: a temporary directory)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against; exit code 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Allowed relative change before a metric counts as a regression")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--paths", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    model_dir = args.model_dir or tempfile.mkdtemp(prefix="recipesnap-tiny-")
+    print(f"Building tiny models in {model_dir}...")
+    paths = build_tiny_models(model_dir, seed=args.seed)
+
+    results = {}
+    failed = []
+    for scenario in args.scenarios:
+        print(f"Running {scenario}...")
+        command = [sys.executable, os.path.abspath(__file__), "--worker", scenario, "--paths", json.dumps(paths),
+                   "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+                   "--warmup", str(args.warmup), "--recipe-max-length", str(args.recipe_max_length),
+                   "--batch-lists", str(args.batch_lists), "--seed", str(args.seed)]
+        if args.threads:
+            command += ["--threads", str(args.threads)]
+
+        env = dict(os.environ, HF_HUB_OFFLINE="1", TRANSFORMERS_OFFLINE="1")
+        completed = subprocess.run(command, capture_output=True, text=True, env=env)
+        if completed.returncode != 0:
+            print(f"❌ {scenario} failed:\n{completed.stderr.strip()}")
+            failed.append(scenario)
+            continue
+        results[scenario] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    if not results:
+        sys.exit(1)
+    print_report(results)
+
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key not in ("worker", "paths")}
+        report = {"environment": environment_info(), "settings": settings, "scenarios": results}
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nFull results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance, vars(args), failed)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%} or failed scenarios")
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Compile serving-ready model artifacts and measure the cold start they save
+
+Loads each model the way the app serves it, in the configured precision
+(bf16 converted, int8 quantized), and saves the result where
+MODEL_ARTIFACTS_DIR points, together with its tokenizer/processor and a
+manifest of sha256 hashes. With MODEL_ARTIFACTS_DIR set, the app loads
+these directly: weights in their serving dtype are memory-mapped from
+safetensors as is, and int8 models skip the fp32 load and the quantization
+pass.
+
+Afterwards every model is loaded once from the original checkpoint and
+once from its artifact, each in a fresh subprocess, and the load times and
+peak RSS are reported. Both loads read files the compile step just read,
+so the page cache is warm for both; the difference is conversion work,
+not disk speed.
+
+Usage:
+    python compile_artifacts.py --vision-precision bf16 --recipe-precision int8
+    python compile_artifacts.py --models recipe --force --output artifacts.json
+    python compile_artifacts.py --verify
+"""
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+
+from precision_report import peak_rss_mb
+
+MODEL_KINDS = ("caption", "detection", "recipe", "draft")
+
+
+def build_model(kind, model_name, precision, artifact_dir):
+    """Load a RecipeSnap model class; artifact_dir "" loads the original checkpoint"""
+    if kind == "caption":
+        from models.image_captioning import ImageCaptioningModel
+        return ImageCaptioningModel(model_name, precision, backend="eager", artifact_dir=artifact_dir)
+    if kind == "detection":
+        from models.object_detection import ObjectDetectionModel
+        return ObjectDetectionModel(model_name, precision, backend="eager", artifact_dir=artifact_dir)
+
+    from models.recipe_generation import RecipeGenerationModel
+    model = RecipeGenerationModel(model_name, precision=precision, prefix_cache=False, artifact_dir=artifact_dir)
+    if not model.model_loaded:
+        raise RuntimeError(f"{model_name} failed to load in {precision}")
+    return model
+
+
+def processors_of(kind, model):
+    if kind == "caption":
+        return [model.feature_extractor, model.tokenizer]
+    if kind == "detection":
+        return [model.processor]
+    return [model.tokenizer]
+
+
+def artifact_kind(kind):
+    # A draft model is loaded by the recipe model class
+    return "recipe" if kind == "draft" else kind
+
+
+def compile_target(target, output_dir, force):
+    """Compile one model unless a usable artifact already exists; returns the Artifact"""
+    import torch
+    from models.artifacts import find_artifact, save_artifact
+
+    kind = artifact_kind(target["kind"])
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if not force:
+        artifact = find_artifact(output_dir, kind, target["model_name"], target["precision"], device)
+        if artifact:
+            print(f"- {artifact.path} is up to date")
+            return artifact
+
+    print(f"- Loading {target['model_name']} in {target['precision']}...")
+    model = build_model(target["kind"], target["model_name"], target["precision"], "")
+    started = time.perf_counter()
+    artifact = save_artifact(output_dir, kind, target["model_name"], target["precision"], device,
+                             model.model, processors_of(target["kind"], model))
+    print(f"- Saved {artifact.path} in {time.perf_counter() - started:.1f}s")
+    del model
+    gc.collect()
+    return artifact
+
+
+def run_worker(args):
+    """Load one model once and print the load time as JSON"""
+    import torch  # noqa: F401 - imported before timing, like the app does
+    import transformers  # noqa: F401
+
+    started = time.perf_counter()
+    model = build_model(args.worker, args.model, args.precision, args.artifact_dir)
+    load_seconds = time.perf_counter() - started
+    print(json.dumps({
+        "load_seconds": load_seconds,
+        "from_artifact": model.artifact is not None,
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def measure_load(target, artifact_dir):
+    command = [sys.executable, os.path.abspath(__file__), "--worker", target["kind"],
+               "--model", target["model_name"], "--precision", target["precision"],
+               "--artifact-dir", artifact_dir]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip())
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def directory_mb(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / (1024 * 1024)
+
+
+def print_report(results):
+    print("\nRecipeSnap Model Artifact Report")
+    print("================================")
+    print(f"{'model':<10} {'precision':<9} {'artifact MB':>12} {'load s before':>14} {'after':>7} "
+          f"{'speedup':>8} {'peak RSS MB before':>19} {'after':>7}")
+    for result in results:
+        before, after = result.get("before"), result.get("after")
+        if not before or not after:
+            print(f"{result['kind']:<10} {result['precision']:<9} {result['artifact_mb']:>12.0f}")
+            continue
+        print(
+            f"{result['kind']:<10} "
+            f"{result['precision']:<9} "
+            f"{result['artifact_mb']:>12.0f} "
+            f"{before['load_seconds']:>14.2f} "
+            f"{after['load_seconds']:>7.2f} "
+            f"{before['load_seconds'] / after['load_seconds']:>7.1f}x "
+            f"{before['peak_rss_mb']:>19.0f} "
+            f"{after['peak_rss_mb']:>7.0f}"
+        )
+
+
+def main():
+    from models.artifacts import default_artifact_dir
+
+    parser = argparse.ArgumentParser(description="Compile serving-ready RecipeSnap model artifacts")
+    parser.add_argument("--models", nargs="+", default=["caption", "detection", "recipe"], choices=MODEL_KINDS,
+                        help="Models to compile; draft compiles --draft-model")
+    parser.add_argument("--caption-model", default=os.environ.get("CAPTION_MODEL", "nlpconnect/vit-gpt2-image-captioning"))
+    parser.add_argument("--detection-model", default=os.environ.get("DETECTION_MODEL", "facebook/detr-resnet-50"))
+    parser.add_argument("--recipe-model", default=os.environ.get("RECIPE_MODEL", "mistralai/Mistral-7B-Instruct-v0.2"))
+    parser.add_argument("--draft-model", default=os.environ.get("RECIPE_DRAFT_MODEL"))
+    parser.add_argument("--vision-precision", default=os.environ.get("VISION_PRECISION", "auto"))
+    parser.add_argument("--recipe-precision", default=os.environ.get("RECIPE_PRECISION", "auto"))
+    parser.add_argument("--output-dir", default=default_artifact_dir() or "model_artifacts",
+                        help="Where to store the artifacts (serve them with MODEL_ARTIFACTS_DIR)")
+    parser.add_argument("--force", action="store_true", help="Recompile even if an artifact is up to date")
+    parser.add_argument("--skip-timing", action="store_true", help="Only compile, do not compare load times")
+    parser.add_argument("--verify", action="store_true",
+                        help="Check the hashes of existing artifacts against their manifests and exit")
+    parser.add_argument("--output", help="Write the full results as JSON to this file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--model", help=argparse.SUPPRESS)
+    parser.add_argument("--precision", help=argparse.SUPPRESS)
+    parser.add_argument("--artifact-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    names = {"caption": args.caption_model, "detection": args.detection_model,
+             "recipe": args.recipe_model, "draft": args.draft_model}
+    targets = []
+    for kind in args.models:
+        if not names[kind]:
+            print(f"❌ No {kind} model configured; set --{kind}-model")
+            sys.exit(1)
+        precision = args.vision_precision if kind in ("caption", "detection") else args.recipe_precision
+        targets.append({"kind": kind, "model_name": names[kind], "precision": precision})
+
+    if args.verify:
+        verify(targets, args.output_dir)
+        return
+
+    results = []
+    for target in targets:
+        print(f"\nCompiling {target['kind']} model")
+        try:
+            artifact = compile_target(target, args.output_dir, args.force)
+        except Exception as e:
+            print(f"❌ Error compiling {target['model_name']}: {e}")
+            continue
+        result = dict(target, path=artifact.path, artifact_mb=directory_mb(artifact.path),
+                      dtype=artifact.manifest["dtype"], quantized=artifact.quantized)
+        results.append(result)
+
+        if args.skip_timing:
+            continue
+        print("- Measuring cold-start load time...")
+        try:
+            result["before"] = measure_load(target, "")
+            result["after"] = measure_load(target, args.output_dir)
+        except Exception as e:
+            print(f"❌ Error measuring {target['model_name']}:\n{e}")
+            continue
+        if not result["after"]["from_artifact"]:
+            print(f"❌ {artifact.path} was not used when loading {target['model_name']}")
+
+    if not results:
+        sys.exit(1)
+    print_report(results)
+    print(f"\nArtifacts stored in {args.output_dir}; serve them with MODEL_ARTIFACTS_DIR={args.output_dir}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Full results written to {args.output}")
+
+
+def verify(targets, output_dir):
+    """Recompute every artifact file hash; exits with status 1 on any mismatch"""
+    import torch
+    from models.artifacts import find_artifact
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    failed = False
+    for target in targets:
+        artifact = find_artifact(output_dir, artifact_kind(target["kind"]), target["model_name"],
+                                 target["precision"], device)
+        if artifact is None:
+            print(f"❌ No usable {target['kind']} artifact for {target['model_name']} ({target['precision']})")
+            failed = True
+            continue
+        corrupted = artifact.verify()
+        if corrupted:
+            print(f"❌ {artifact.path}: hash mismatch in {', '.join(corrupted)}")
+            failed = True
+        else:
+            print(f"✅ {artifact.path}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# Tiny randomly initialised models for tests that need real generate() and
+# forward passes: the benchmark's stand-ins, built from configs in a temporary
+# directory, so nothing is downloaded. Their outputs are noise; tests check
+# behaviour, not text.
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dirs(tmp_path_factory):
+    """Model directories keyed by "caption", "detection" and "recipe" (see benchmark.build_tiny_models)"""
+    pytest.importorskip("torch")
+    from benchmark import build_tiny_models
+
+    return build_tiny_models(str(tmp_path_factory.mktemp("models")))
+
+
+@pytest.fixture(scope="session")
+def tiny_caption_model_dir(tiny_model_dirs):
+    """ViT encoder + GPT-2 decoder captioning model, its image processor and tokenizer"""
+    return tiny_model_dirs["caption"]
+
+
+@pytest.fixture(scope="session")
+def tiny_detection_model_dir(tiny_model_dirs):
+    """DETR with a small ResNet backbone and its image processor"""
+    return tiny_model_dirs["detection"]
+
+
+@pytest.fixture(scope="session")
+def tiny_recipe_model_dir(tiny_model_dirs):
+    """Causal LM of Mistral's architecture family that never ends a sequence early, and its tokenizer"""
+    return tiny_model_dirs["recipe"]
+
+
+@pytest.fixture(scope="session")
+def char_tokenizer(tiny_recipe_model_dir):
+    """The recipe model's tokenizer: one token per printable ASCII character, plus Mistral's special tokens"""
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(tiny_recipe_model_dir)
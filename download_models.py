@@ -3,80 +3,59 @@ Download models script for RecipeSnap
 
 This script downloads all required models in advance, which can be
 helpful for offline use or to avoid delays when first starting the application.
+Only the files are fetched into the Hugging Face cache; no model is loaded,
+so it needs neither the memory nor the time to instantiate Mistral-7B.
+Run compile_artifacts.py afterwards to convert them to serving-ready artifacts.
 """
 
-import os
-import torch
-from transformers import (
-    VisionEncoderDecoderModel, 
-    ViTImageProcessor, 
-    AutoTokenizer,
-    DetrImageProcessor, 
-    DetrForObjectDetection,
-    AutoModelForCausalLM
-)
+from huggingface_hub import HfApi, snapshot_download
+
+# Weight formats other than safetensors; skipped when a model also has safetensors
+LEGACY_WEIGHT_PATTERNS = ["*.bin", "*.pt", "*.pth", "*.h5", "*.msgpack", "*.ot", "*.onnx*", "*.tflite"]
+
+
+def download_checkpoint(model_id):
+    """
+    Download a model repository into the Hugging Face cache
+
+    Repositories often carry the same weights in several formats; when
+    safetensors are available the others are not downloaded.
+
+    Returns:
+        str: Local directory of the downloaded snapshot
+    """
+    files = HfApi().list_repo_files(model_id)
+    ignore = LEGACY_WEIGHT_PATTERNS if any(name.endswith(".safetensors") for name in files) else None
+    return snapshot_download(model_id, ignore_patterns=ignore)
+
 
 def download_models():
     """Download all models required by RecipeSnap."""
     print("RecipeSnap Model Downloader")
     print("===========================")
-    
+
     models = {
         "Image Captioning": "nlpconnect/vit-gpt2-image-captioning",
         "Object Detection": "facebook/detr-resnet-50",
         "Recipe Generation": "mistralai/Mistral-7B-Instruct-v0.2"
     }
-    
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"Using device: {device}")
-    
+
     for model_name, model_id in models.items():
         print(f"\nDownloading {model_name} model: {model_id}")
-        
+        if model_name == "Recipe Generation":
+            print("  Note: This is a large model (~14GB) and may take time.")
+
         try:
-            if model_name == "Image Captioning":
-                print("- Downloading model...")
-                model = VisionEncoderDecoderModel.from_pretrained(model_id)
-                
-                print("- Downloading image processor...")
-                feature_extractor = ViTImageProcessor.from_pretrained(model_id)
-                
-                print("- Downloading tokenizer...")
-                tokenizer = AutoTokenizer.from_pretrained(model_id)
-                
-            elif model_name == "Object Detection":
-                print("- Downloading processor...")
-                processor = DetrImageProcessor.from_pretrained(model_id)
-                
-                print("- Downloading model...")
-                model = DetrForObjectDetection.from_pretrained(model_id)
-                
-            elif model_name == "Recipe Generation":
-                print("- Downloading tokenizer...")
-                tokenizer = AutoTokenizer.from_pretrained(model_id)
-                
-                print("- Downloading model...")
-                print("  Note: This is a large model (~13GB) and may take time.")
-                print("  If you're running on CPU, this might be very slow.")
-                
-                try:
-                    model = AutoModelForCausalLM.from_pretrained(
-                        model_id,
-                        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                        low_cpu_mem_usage=True
-                    )
-                except Exception as e:
-                    print(f"  Warning: Failed to download the full model: {e}")
-                    print("  The application will use fallback recipes instead.")
-            
-            print(f"✅ {model_name} model downloaded successfully!")
-            
+            path = download_checkpoint(model_id)
+            print(f"✅ {model_name} model downloaded to {path}")
+
         except Exception as e:
             print(f"❌ Error downloading {model_name} model: {e}")
             print("  The application may use fallback features instead.")
-    
+
     print("\nModel download completed!")
+    print("Optionally convert the models to serving-ready artifacts with: python compile_artifacts.py")
     print("You can now run the application with: python app.py")
 
 if __name__ == "__main__":
-    download_models() 
\ No newline at end of file
+    download_models()
@@ -0,0 +1,180 @@
+"""
+Export the vision models to compiled backends and check them against eager
+
+Traces DETR and the ViT encoder of the captioning model to TorchScript
+and/or ONNX, stores the graphs where VISION_BACKEND_DIR points (the app
+loads them from there with VISION_BACKEND=torchscript or onnx), then runs
+every backend on the same images and reports:
+
+- the largest output difference from eager, relative to the output scale
+- whether the captions and detected ingredients are unchanged
+- per-image latency of the backend-dependent part (preprocessing excluded)
+
+Exits with status 1 if any backend differs from eager by more than
+--tolerance.
+
+Usage:
+    python export_vision.py --backends torchscript onnx
+    python export_vision.py --images static/uploads --runs 10 --output export.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from precision_report import find_images
+
+
+def measure(captioner, detector, images, runs):
+    """Mean per-image latency of the encoder + decoder loop and of the DETR forward pass"""
+    import numpy as np
+
+    caption_ms, detection_ms = [], []
+    captions, ingredients = [], []
+    for image in images:
+        pixel_values = captioner.feature_extractor(images=[image], return_tensors="pt").pixel_values
+        detection_inputs = dict(detector.processor(images=[image], return_tensors="pt"))
+
+        for run in range(runs + 1):
+            started = time.perf_counter()
+            caption = captioner.generate_captions_from_pixel_values(pixel_values)[0]
+            caption_elapsed = time.perf_counter() - started
+
+            # Same seed per image so the random ingredient padding is comparable
+            np.random.seed(0)
+            started = time.perf_counter()
+            found = detector.detect_ingredients_from_inputs(dict(detection_inputs), [image.size])[0]
+            detection_elapsed = time.perf_counter() - started
+
+            # The first run warms up the graph
+            if run > 0:
+                caption_ms.append(1000.0 * caption_elapsed)
+                detection_ms.append(1000.0 * detection_elapsed)
+        captions.append(caption)
+        ingredients.append(found)
+
+    return {
+        "caption_ms": sum(caption_ms) / len(caption_ms),
+        "detection_ms": sum(detection_ms) / len(detection_ms),
+        "captions": captions,
+        "ingredients": ingredients,
+    }
+
+
+def output_difference(reference, candidate, images):
+    """Largest relative output difference of both graphs over images"""
+    from models.precision import cast_inputs
+    from models.vision_backends import max_difference
+
+    caption, detection = 0.0, 0.0
+    for image in images:
+        pixel_values = reference[0].feature_extractor(images=[image], return_tensors="pt").pixel_values
+        pixel_values = pixel_values.to(reference[0].device, dtype=reference[0].input_dtype)
+        caption = max(caption, max_difference(reference[0].encoder, candidate[0].encoder, (pixel_values,)))
+
+        inputs = dict(reference[1].processor(images=[image], return_tensors="pt"))
+        inputs = {k: v.to(reference[1].device) for k, v in cast_inputs(inputs, reference[1].input_dtype).items()}
+        inputs = (inputs["pixel_values"], inputs["pixel_mask"])
+        detection = max(detection, max_difference(reference[1].graph, candidate[1].graph, inputs))
+    return caption, detection
+
+
+def print_report(results):
+    print("\nRecipeSnap Vision Backend Report")
+    print("================================")
+    print(f"{'backend':<12} {'load s':>7} {'caption ms':>11} {'detect ms':>10} "
+          f"{'caption diff':>13} {'detect diff':>12} {'captions':>9} {'ingredients':>12}")
+    for result in results:
+        print(
+            f"{result['backend']:<12} "
+            f"{result['load_seconds']:>7.1f} "
+            f"{result['caption_ms']:>11.1f} "
+            f"{result['detection_ms']:>10.1f} "
+            f"{result.get('caption_difference', 0.0):>13.1e} "
+            f"{result.get('detection_difference', 0.0):>12.1e} "
+            f"{result.get('caption_match', 1.0):>9.0%} "
+            f"{result.get('ingredient_match', 1.0):>12.0%}"
+        )
+
+
+def main():
+    from models.vision_backends import VISION_BACKENDS, artifact_path, default_backend, example_images
+
+    parser = argparse.ArgumentParser(description="Export the RecipeSnap vision models and compare backends")
+    parser.add_argument("--backends", nargs="+", default=["torchscript", "onnx"],
+                        choices=[backend for backend in VISION_BACKENDS if backend != "eager"])
+    parser.add_argument("--caption-model", default=os.environ.get("CAPTION_MODEL", "nlpconnect/vit-gpt2-image-captioning"))
+    parser.add_argument("--detection-model", default=os.environ.get("DETECTION_MODEL", "facebook/detr-resnet-50"))
+    parser.add_argument("--precision", default=os.environ.get("VISION_PRECISION", "auto"))
+    parser.add_argument("--output-dir", default=default_backend()[1], help="Where to store the exported graphs")
+    parser.add_argument("--force", action="store_true", help="Re-export even if a graph already exists")
+    parser.add_argument("--images", help="Directory of images to compare on (default: generated noise images)")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per image")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="Largest accepted relative output difference")
+    parser.add_argument("--output", help="Write the full results as JSON to this file")
+    args = parser.parse_args()
+
+    from models.image_captioning import ImageCaptioningModel
+    from models.object_detection import ObjectDetectionModel
+    from models.preprocessing import decode_image
+
+    images = [decode_image(path) for path in find_images(args.images)] if args.images else example_images(4)
+    if not images:
+        print(f"❌ No images found in {args.images}")
+        sys.exit(1)
+
+    if args.force:
+        for backend in args.backends:
+            for kind, name in (("caption-encoder", args.caption_model), ("detection", args.detection_model)):
+                # ONNX keeps large weights in a .data file next to the graph
+                for path in glob.glob(artifact_path(args.output_dir, kind, name, args.precision, backend) + "*"):
+                    os.remove(path)
+
+    models = {}
+    results = []
+    for backend in ["eager"] + args.backends:
+        print(f"Loading {backend}...")
+        started = time.perf_counter()
+        captioner = ImageCaptioningModel(args.caption_model, args.precision, backend, args.output_dir)
+        detector = ObjectDetectionModel(args.detection_model, args.precision, backend, args.output_dir)
+        load_seconds = time.perf_counter() - started
+        if captioner.backend != backend or detector.backend != backend:
+            print(f"❌ {backend} could not be loaded")
+            continue
+
+        models[backend] = (captioner, detector)
+        result = {"backend": backend, "load_seconds": load_seconds}
+        result.update(measure(captioner, detector, images, args.runs))
+        results.append(result)
+
+    reference = results[0]
+    failed = False
+    for result in results[1:]:
+        caption, detection = output_difference(models["eager"], models[result["backend"]], images)
+        result["caption_difference"] = caption
+        result["detection_difference"] = detection
+        pairs = list(zip(reference["captions"], result["captions"]))
+        result["caption_match"] = sum(a == b for a, b in pairs) / len(pairs)
+        pairs = list(zip(reference["ingredients"], result["ingredients"]))
+        result["ingredient_match"] = sum(a == b for a, b in pairs) / len(pairs)
+        failed = failed or max(caption, detection) > args.tolerance
+
+    print_report(results)
+    print(f"\nGraphs stored in {args.output_dir}; serve them with VISION_BACKEND=<backend> "
+          f"VISION_BACKEND_DIR={args.output_dir}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Full results written to {args.output}")
+
+    if failed or len(results) < len(args.backends) + 1:
+        print(f"❌ A backend failed or differs from eager by more than {args.tolerance}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
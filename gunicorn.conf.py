@@ -0,0 +1,34 @@
+"""
+Gunicorn settings for serving RecipeSnap from several worker processes
+
+The app, and with it every model, is loaded once in the master process
+before the workers are forked. The workers then share that one copy of the
+weights copy-on-write instead of each loading their own. Run with:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+WEB_WORKERS, WEB_THREADS, WEB_TIMEOUT and BIND size and place the server.
+memory_report.py measures how much memory each extra worker costs.
+"""
+
+import gc
+import os
+
+bind = os.environ.get('BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('WEB_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+# Recipe generation on CPU can take minutes
+timeout = int(os.environ.get('WEB_TIMEOUT', 300))
+
+# Load the app in the master before forking. The models must be loaded by
+# then: a background loading thread would not be forked into the workers
+preload_app = True
+os.environ['MODEL_LOADING'] = 'eager'
+
+
+def when_ready(server):
+    # Everything allocated so far lives as long as the master. Freezing it
+    # keeps the workers' garbage collectors from writing to these objects,
+    # which would give every worker its own copy of the pages they are on
+    gc.freeze()
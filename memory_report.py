@@ -0,0 +1,193 @@
+"""
+Per-worker memory report for multi-process RecipeSnap serving
+
+Starts N worker processes the way a pre-fork server would, sends each a
+few requests, then reads every process's resident memory from
+/proc/<pid>/smaps_rollup while all of them are alive (Linux only):
+
+- USS: memory only this worker uses, i.e. the cost of one more worker
+- PSS: the worker's fair share of the pages it shares with the others
+- RSS: everything the worker touches, shared or not
+
+Modes:
+- prefork: load the models in a parent process, then fork the workers
+  (what gunicorn.conf.py does), so the weights are shared copy-on-write
+- independent: every worker imports the app and loads its own models
+
+Each mode runs in its own subprocess. MODEL_MMAP=1 and the other RecipeSnap
+environment variables apply to the workers as usual.
+
+Usage:
+    python memory_report.py --workers 4 --modes prefork independent
+    MODEL_MMAP=1 python memory_report.py --budget-mb 64000 --output memory.json
+"""
+
+import argparse
+import gc
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from models.weight_sharing import process_memory
+
+SAMPLE_INGREDIENTS = ["tomato", "onion", "chicken"]
+
+
+def sample_image(seed):
+    import numpy as np
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    pixels = np.random.RandomState(seed).randint(0, 255, (480, 640, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def serve_requests(app_module, count):
+    """Send requests through every model so each worker touches the pages serving needs"""
+    client = app_module.app.test_client()
+    for i in range(count):
+        client.post("/api/ingredients", data={"image": (io.BytesIO(sample_image(i)), f"{i}.jpg")})
+        client.post("/api/recipes", json={"ingredients": SAMPLE_INGREDIENTS + [str(i)]})
+
+
+def start_workers(count, requests, preloaded_app=None):
+    """
+    Fork count workers that serve requests, then wait until told to exit
+
+    Returns:
+        list: (pid, ready pipe, release pipe) per worker
+    """
+    workers = []
+    for _ in range(count):
+        ready_read, ready_write = os.pipe()
+        release_read, release_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            os.close(release_write)
+            # Pipes of the workers forked earlier, or they would never see their release
+            for _, other_ready, other_release in workers:
+                os.close(other_ready)
+                os.close(other_release)
+            app_module = preloaded_app
+            if app_module is None:
+                import app as app_module
+            serve_requests(app_module, requests)
+            os.write(ready_write, b"1")
+            # Stay alive, so every worker is measured while the others still share its pages
+            os.read(release_read, 1)
+            os._exit(0)
+        os.close(ready_write)
+        os.close(release_read)
+        workers.append((pid, ready_read, release_write))
+    return workers
+
+
+def run_worker(args):
+    """Measure one mode and print the result as JSON"""
+    os.environ["MODEL_LOADING"] = "eager"
+    # Uploads go to a scratch directory rather than static/uploads
+    os.chdir(tempfile.mkdtemp(prefix="recipesnap-memory-"))
+
+    preloaded_app = None
+    if args.worker == "prefork":
+        import app as preloaded_app
+        gc.freeze()
+
+    workers = start_workers(args.workers, args.requests, preloaded_app)
+    for _, ready, _ in workers:
+        os.read(ready, 1)
+
+    result = {
+        "mode": args.worker,
+        "workers": [process_memory(pid) for pid, _, _ in workers],
+        "parent": process_memory(),
+    }
+    for pid, ready, release in workers:
+        os.close(release)
+        os.close(ready)
+        os.waitpid(pid, 0)
+    print(json.dumps(result))
+
+
+def summarize(result, budget_mb):
+    """Mean per-worker figures, total PSS and how many workers fit in budget_mb"""
+    workers = result["workers"]
+    for key in ("uss_mb", "pss_mb", "rss_mb"):
+        result[f"mean_{key}"] = sum(worker[key] for worker in workers) / len(workers)
+    # PSS adds up to the real total: each shared page is split between its sharers
+    result["total_pss_mb"] = sum(worker["pss_mb"] for worker in workers) + result["parent"]["pss_mb"]
+    # Memory paid once however many workers there are; every worker adds its USS on top
+    result["fixed_mb"] = result["total_pss_mb"] - len(workers) * result["mean_uss_mb"]
+    if budget_mb:
+        result["workers_in_budget"] = max(0, int((budget_mb - result["fixed_mb"]) // result["mean_uss_mb"]))
+
+
+def print_report(results):
+    print("\nRecipeSnap Memory Report")
+    print("========================")
+    print(f"{'mode':<12} {'workers':>8} {'USS MB':>9} {'PSS MB':>9} {'RSS MB':>9} "
+          f"{'total PSS MB':>13} {'fixed MB':>9} {'fit':>5}")
+    for result in results:
+        print(
+            f"{result['mode']:<12} "
+            f"{len(result['workers']):>8} "
+            f"{result['mean_uss_mb']:>9.0f} "
+            f"{result['mean_pss_mb']:>9.0f} "
+            f"{result['mean_rss_mb']:>9.0f} "
+            f"{result['total_pss_mb']:>13.0f} "
+            f"{result['fixed_mb']:>9.0f} "
+            f"{result.get('workers_in_budget', '-'):>5}"
+        )
+    print("\nUSS, PSS and RSS are per-worker means. Each extra worker costs about its USS;")
+    print("fixed is what all workers share, paid once.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-worker memory of multi-process serving")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes to start")
+    parser.add_argument("--modes", nargs="+", default=["prefork", "independent"],
+                        choices=["prefork", "independent"])
+    parser.add_argument("--requests", type=int, default=3, help="Image and recipe requests per worker")
+    parser.add_argument("--budget-mb", type=float, help="Report how many workers fit in this much memory")
+    parser.add_argument("--output", help="Write the full results as JSON to this file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    if process_memory() is None:
+        print("❌ /proc/self/smaps_rollup is not available; this report needs Linux")
+        sys.exit(1)
+
+    results = []
+    for mode in args.modes:
+        print(f"Measuring {mode} with {args.workers} workers...")
+        command = [sys.executable, os.path.abspath(__file__), "--worker", mode,
+                   "--workers", str(args.workers), "--requests", str(args.requests)]
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"❌ {mode} failed:\n{completed.stderr.strip()}")
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        summarize(result, args.budget_mb)
+        results.append(result)
+
+    if not results:
+        return
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nFull results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# Serving-ready model artifacts. compile_artifacts.py loads each model once
+# the way the app serves it (precision applied, quantized if int8) and saves
+# the result, so serving processes load exactly those weights instead of
+# converting the downloaded checkpoint again on every start.
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+
+from models.vision_backends import model_slug
+from models.weight_sharing import safetensors_files
+
+ARTIFACT_FORMAT = 1
+
+# What each model class is saved as; the name is part of the artifact directory
+ARTIFACT_KINDS = ("caption", "detection", "recipe")
+
+MANIFEST_NAME = "manifest.json"
+
+# Dynamically quantized modules cannot be stored as safetensors
+QUANTIZED_WEIGHTS_NAME = "model.int8.pt"
+
+
+def default_artifact_dir():
+    """Artifact directory from MODEL_ARTIFACTS_DIR; None (unset) disables artifacts"""
+    return os.environ.get("MODEL_ARTIFACTS_DIR") or None
+
+
+def artifact_dir(directory, kind, model_name, precision):
+    """Directory an artifact is stored in, e.g. model_artifacts/recipe-mistralai_Mistral-7B-Instruct-v0.2-int8"""
+    return os.path.join(directory, f"{kind}-{model_slug(model_name)}-{precision}")
+
+
+def file_digest(path, chunk_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _describe_files(paths, hashes=True):
+    files = {}
+    for path in paths:
+        entry = {"bytes": os.path.getsize(path)}
+        if hashes:
+            entry["sha256"] = file_digest(path)
+        files[os.path.basename(path)] = entry
+    return files
+
+
+def save_artifact(directory, kind, model_name, precision, device, model, processors):
+    """
+    Save a model as loaded for serving, with its processors, as an artifact
+
+    Floating point models are saved as safetensors in the dtype they run
+    in. Quantized models are saved with torch.save, since their packed
+    int8 weights have no safetensors form. The directory is written next
+    to its final place and renamed over it, so a running server never sees
+    a half-written artifact.
+
+    Args:
+        directory: Artifact root directory
+        kind: One of ARTIFACT_KINDS
+        model_name: Model id or local directory the model was loaded from
+        precision: Precision mode the model was loaded with
+        device: Device the model was prepared for; artifacts only load there
+        model: The loaded (and possibly quantized) Hugging Face model
+        processors: Tokenizers and image processors to save alongside
+
+    Returns:
+        Artifact: The saved artifact
+    """
+    import torch
+    import transformers
+
+    if kind not in ARTIFACT_KINDS:
+        raise ValueError(f"Unknown artifact kind '{kind}', expected one of {ARTIFACT_KINDS}")
+    path = artifact_dir(directory, kind, model_name, precision)
+    staging = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    model = model.to("cpu") if device.type != "cpu" else model
+    quantized = any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in model.modules())
+    if quantized:
+        state_dict = model.state_dict()
+        # Non-persistent buffers (e.g. rotary frequencies) are not in the
+        # state dict but cannot be recomputed on the meta device at load
+        buffers = {name: buffer for name, buffer in model.named_buffers() if name not in state_dict}
+        torch.save({"state_dict": state_dict, "buffers": buffers}, os.path.join(staging, QUANTIZED_WEIGHTS_NAME))
+        model.config.save_pretrained(staging)
+        if getattr(model, "generation_config", None) is not None:
+            model.generation_config.save_pretrained(staging)
+    else:
+        model.save_pretrained(staging, safe_serialization=True)
+    for processor in processors:
+        processor.save_pretrained(staging)
+
+    dtype = next((p.dtype for p in model.parameters() if p.is_floating_point()), torch.float32)
+    manifest = {
+        "format": ARTIFACT_FORMAT,
+        "kind": kind,
+        "model_name": model_name,
+        "precision": precision,
+        "device": device.type,
+        "dtype": str(dtype).replace("torch.", ""),
+        "quantized": quantized,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "files": _describe_files(sorted(
+            os.path.join(staging, name) for name in os.listdir(staging) if name != MANIFEST_NAME
+        )),
+        "source_files": _describe_files(safetensors_files(model_name)),
+    }
+    with open(os.path.join(staging, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging, path)
+    return Artifact(path, manifest)
+
+
+def find_artifact(directory, kind, model_name, precision, device):
+    """
+    Return the usable artifact for a model, or None to load the checkpoint as usual
+
+    Only cheap checks run here (manifest fields, file sizes); full hashes
+    are checked by Artifact.verify. An artifact that exists but does not
+    match is ignored with a message saying why.
+    """
+    if not directory:
+        return None
+    path = artifact_dir(directory, kind, model_name, precision)
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        artifact = Artifact(path, manifest)
+        problem = artifact.mismatch(kind, model_name, precision, device)
+    except Exception as e:
+        problem = f"unreadable manifest ({e})"
+    if problem:
+        print(f"Ignoring model artifact {path}: {problem}")
+        return None
+    return artifact
+
+
+class Artifact:
+    """A compiled model directory and its manifest"""
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.quantized = manifest["quantized"]
+
+    def mismatch(self, kind, model_name, precision, device):
+        """Why this artifact cannot stand in for the given model, or None if it can"""
+        import torch
+
+        manifest = self.manifest
+        if manifest.get("format") != ARTIFACT_FORMAT:
+            return f"format {manifest.get('format')} instead of {ARTIFACT_FORMAT}"
+        expected = {"kind": kind, "model_name": model_name, "precision": precision, "device": device.type}
+        for field, value in expected.items():
+            if manifest.get(field) != value:
+                return f"compiled for {field} {manifest.get(field)!r}, not {value!r}"
+        # Pickled quantized modules are tied to the torch version that packed them
+        if self.quantized and manifest.get("torch") != torch.__version__:
+            return f"quantized with torch {manifest.get('torch')}, running {torch.__version__}"
+
+        for name, entry in manifest["files"].items():
+            file_path = os.path.join(self.path, name)
+            if not os.path.exists(file_path) or os.path.getsize(file_path) != entry["bytes"]:
+                return f"{name} is missing or incomplete"
+
+        # The source checkpoint changed since the artifact was compiled
+        source = {os.path.basename(p): os.path.getsize(p) for p in safetensors_files(model_name)}
+        for name, entry in manifest.get("source_files", {}).items():
+            if name in source and source[name] != entry["bytes"]:
+                return f"source checkpoint file {name} changed"
+        return None
+
+    def verify(self):
+        """Names of the artifact files whose sha256 differs from the manifest"""
+        return [
+            name for name, entry in self.manifest["files"].items()
+            if not os.path.exists(os.path.join(self.path, name))
+            or file_digest(os.path.join(self.path, name)) != entry["sha256"]
+        ]
+
+    def load_model(self, model_class):
+        """
+        Load the model saved in this artifact
+
+        Safetensors are loaded in their saved dtype, so nothing is converted
+        and the weights map straight from the file. A quantized model is
+        built on the meta device with its Linear layers swapped for dynamic
+        int8 ones, then given the saved tensors, skipping both the fp32
+        load and the quantization pass. Torch before 2.1 can neither
+        memory-map the saved file nor assign tensors to meta parameters, so
+        there the model is built on the CPU and the tensors copied in.
+
+        Args:
+            model_class: VisionEncoderDecoderModel, DetrForObjectDetection,
+                AutoModelForCausalLM, ...
+        """
+        import torch
+
+        if not self.quantized:
+            dtype = getattr(torch, self.manifest["dtype"])
+            return model_class.from_pretrained(self.path, torch_dtype=dtype, low_cpu_mem_usage=True)
+
+        from transformers import AutoConfig, GenerationConfig
+
+        assign = "assign" in inspect.signature(torch.nn.Module.load_state_dict).parameters
+        config = AutoConfig.from_pretrained(self.path)
+        with torch.device("meta" if assign else "cpu"):
+            model = getattr(model_class, "from_config", model_class)(config)
+        _quantize_linear_layers(model)
+
+        weights_path = os.path.join(self.path, QUANTIZED_WEIGHTS_NAME)
+        if assign:
+            saved = torch.load(weights_path, mmap=True, weights_only=False)
+            model.load_state_dict(saved["state_dict"], assign=True)
+        else:
+            saved = torch.load(weights_path, weights_only=False)
+            model.load_state_dict(saved["state_dict"])
+        for name, buffer in saved["buffers"].items():
+            module_name, _, buffer_name = name.rpartition(".")
+            model.get_submodule(module_name)._buffers[buffer_name] = buffer
+        if os.path.exists(os.path.join(self.path, "generation_config.json")):
+            model.generation_config = GenerationConfig.from_pretrained(self.path)
+
+        left_on_meta = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers())
+                        if tensor.is_meta]
+        if left_on_meta:
+            raise RuntimeError(f"artifact has no weights for {', '.join(left_on_meta[:5])}")
+        return model.eval()
+
+
+def _quantize_linear_layers(module):
+    """Replace every nn.Linear with an empty dynamic int8 Linear, as quantize_dynamic would"""
+    import torch
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicLinear
+
+    for name, child in module.named_children():
+        if type(child) is torch.nn.Linear:
+            setattr(module, name, DynamicLinear(child.in_features, child.out_features,
+                                                bias_=child.bias is not None, dtype=torch.qint8))
+        else:
+            _quantize_linear_layers(child)
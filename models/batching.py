@@ -0,0 +1,177 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class _Request:
+    __slots__ = ('item', 'future', 'enqueued_at')
+
+    def __init__(self, item):
+        self.item = item
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batcher in front of a batched inference function.
+
+    Callers submit single items from any thread. A background worker collects
+    whatever arrives within max_wait_ms (or until max_batch_size items are
+    queued), runs batch_fn once on the whole list and hands each caller its
+    own result. If a batch fails, its items are retried one at a time so a
+    single bad input only fails its own request.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=10, name="batch",
+                 initializer=None, initargs=()):
+        """
+        Args:
+            batch_fn: Callable taking a list of items and returning a list of
+                results in the same order
+            max_batch_size: Largest number of items per batch_fn call
+            max_wait_ms: How long to hold the first item waiting for company
+            name: Used for the worker thread name and in logs
+            initializer: Optional callable run once in the worker thread
+                before any batch (e.g. to set up thread-local state)
+            initargs: Arguments passed to initializer
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self.name = name
+        self._initializer = initializer
+        self._initargs = initargs
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._items = 0
+        self._errors = 0
+        self._cancelled = 0
+        self._wait_time = 0.0
+        self._run_time = 0.0
+
+        self._worker = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._worker.start()
+
+    def after_fork(self):
+        """Start a new worker in a forked child, where the parent's thread no longer exists"""
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        """Queue one item and return a Future for its result"""
+        request = _Request(item)
+        self._queue.put(request)
+        return request.future
+
+    def __call__(self, item):
+        """Submit one item and block until its result is ready"""
+        return self.submit(item).result()
+
+    def shutdown(self, wait=True):
+        """Stop the worker after the items already queued have been processed"""
+        self._queue.put(_STOP)
+        if wait:
+            self._worker.join()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        stop = False
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is _STOP:
+                stop = True
+                break
+            batch.append(request)
+        return batch, stop
+
+    def _run(self):
+        if self._initializer is not None:
+            self._initializer(*self._initargs)
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch, stop = self._collect(first)
+            self._execute(batch)
+            if stop:
+                return
+
+    def _execute(self, batch):
+        # Drop requests whose callers already gave up
+        live = [r for r in batch if r.future.set_running_or_notify_cancel()]
+        started = time.monotonic()
+        with self._stats_lock:
+            self._cancelled += len(batch) - len(live)
+            self._wait_time += sum(started - r.enqueued_at for r in live)
+        if not live:
+            return
+
+        try:
+            results = self.batch_fn([r.item for r in live])
+            if len(results) != len(live):
+                raise RuntimeError(
+                    f"{self.name}: batch function returned {len(results)} results for {len(live)} items"
+                )
+        except Exception as e:
+            if len(live) == 1:
+                self._fail(live[0], e)
+            else:
+                # Isolate the failure by retrying each request on its own
+                for request in live:
+                    self._execute_single(request)
+        else:
+            for request, result in zip(live, results):
+                request.future.set_result(result)
+        finally:
+            with self._stats_lock:
+                self._batch_sizes[len(live)] += 1
+                self._items += len(live)
+                self._run_time += time.monotonic() - started
+
+    def _execute_single(self, request):
+        try:
+            result = self.batch_fn([request.item])[0]
+        except Exception as e:
+            self._fail(request, e)
+        else:
+            request.future.set_result(result)
+
+    def _fail(self, request, error):
+        print(f"Error in {self.name} batch item: {error}")
+        with self._stats_lock:
+            self._errors += 1
+        request.future.set_exception(error)
+
+    def stats(self):
+        """Return queue depth, batch-size distribution and timing counters"""
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches': batches,
+                'items': self._items,
+                'errors': self._errors,
+                'cancelled': self._cancelled,
+                'mean_batch_size': self._items / batches if batches else 0.0,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+                'mean_queue_wait_ms': 1000.0 * self._wait_time / self._items if self._items else 0.0,
+                'total_run_seconds': self._run_time,
+            }
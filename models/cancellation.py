@@ -0,0 +1,196 @@
+# Cooperative cancellation of model work nobody is waiting for any more. A
+# CancellationToken travels with the request in a context variable (like the
+# QualityBudget in models.quality). The model classes pass it to generate()
+# as a stopping criterion, and callers waiting on a batch scheduler drop their
+# queued items once it is cancelled.
+
+import contextvars
+import select
+import socket
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from models.metrics import REGISTRY
+from models.quality import stage_estimate
+
+CANCELLATIONS = REGISTRY.counter(
+    "recipesnap_cancellations_total", "Model work stopped or dropped because its request was cancelled",
+    ["stage", "reason"]
+)
+RECLAIMED_SECONDS = REGISTRY.counter(
+    "recipesnap_cancellation_reclaimed_seconds_total",
+    "Estimated model time not spent on cancelled requests, from the stages' mean durations",
+    ["stage"]
+)
+
+_current_cancellation = contextvars.ContextVar("cancellation", default=None)
+
+
+class RequestCancelled(Exception):
+    """Raised where model work stops because its request was cancelled"""
+
+    def __init__(self, reason, stage):
+        super().__init__(f"{stage} cancelled ({reason})")
+        self.reason = reason
+        self.stage = stage
+
+
+def record_cancellation(stage, reason, estimate_stages=None, started=None):
+    """
+    Count a cancellation and the model time it saved
+
+    The time saved is the mean duration of estimate_stages (default: the
+    stage itself) minus what had already been spent since started
+    (time.perf_counter()).
+    """
+    expected = stage_estimate(estimate_stages or (stage,)) or 0.0
+    spent = time.perf_counter() - started if started is not None else 0.0
+    CANCELLATIONS.inc(stage=stage, reason=reason)
+    RECLAIMED_SECONDS.inc(max(0.0, expected - spent), stage=stage)
+
+
+class CancellationToken:
+    """
+    Whether the work for one request should stop, and why
+
+    Cancelled explicitly with cancel(), or found cancelled by a probe: a
+    callable returning a reason ("disconnect", "deadline") or None. Probes
+    are polled at most every poll_interval seconds, however often the token
+    is checked. The first reason found sticks.
+
+    A token is also a transformers stopping criterion: passed to generate()
+    it ends generation at the next decoding step once cancelled. It returns
+    a single bool, as generate() in transformers 4.31 expects, which stops
+    every sequence of the call (beams, candidates and batch rows alike).
+    """
+
+    def __init__(self, probes=(), poll_interval=0.05):
+        self._probes = list(probes)
+        self.poll_interval = poll_interval
+        self._reason = None
+        self._polled_at = 0.0
+        self._lock = threading.Lock()
+
+    def cancel(self, reason):
+        with self._lock:
+            if self._reason is None:
+                self._reason = reason
+
+    @property
+    def reason(self):
+        """Why the request was cancelled, or None while its work should go on"""
+        if self._reason is None and self._probes:
+            now = time.monotonic()
+            if now - self._polled_at >= self.poll_interval:
+                self._polled_at = now
+                for probe in self._probes:
+                    reason = probe()
+                    if reason:
+                        self.cancel(reason)
+                        break
+        return self._reason
+
+    def raise_if_cancelled(self, stage, started=None, estimate_stages=None, reasons=None):
+        """
+        Raise RequestCancelled if the request was cancelled (for one of reasons, default any)
+
+        Args:
+            stage: Where the work stopped, for the metrics
+            started: time.perf_counter() the stopped work started at, if it started
+            estimate_stages: Stages whose mean duration the stopped work would have taken
+            reasons: Only these reasons cancel this work
+        """
+        reason = self.reason
+        if reason is None or (reasons is not None and reason not in reasons):
+            return
+        record_cancellation(stage, reason, estimate_stages, started)
+        raise RequestCancelled(reason, stage)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.reason is not None
+
+
+def wait_for(future, cancellation, stage, estimate_stages=None, reasons=None):
+    """
+    Wait for a batch scheduler's result, dropping the queued item if the request is cancelled first
+
+    An item whose batch has already started is waited for, since the batch
+    is shared with other requests.
+
+    Raises:
+        RequestCancelled: The item was dropped before it ran
+    """
+    if cancellation is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=cancellation.poll_interval)
+        except FutureTimeout:
+            pass
+        reason = cancellation.reason
+        if reason is not None and (reasons is None or reason in reasons) and future.cancel():
+            record_cancellation(stage, reason, estimate_stages)
+            raise RequestCancelled(reason, stage)
+
+
+def connection_closed(sock):
+    """True if the peer closed sock; data waiting to be read (e.g. a pipelined request) does not count"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
+
+
+def disconnect_probe(environ):
+    """
+    Probe for a WSGI request's client having gone away, or None if the server does not expose the socket
+
+    The Werkzeug development server and gunicorn's sync and thread workers
+    put the client socket in the environ.
+    """
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None:
+        return None
+    return lambda: "disconnect" if connection_closed(sock) else None
+
+
+def deadline_probe(budget):
+    """Probe for a QualityBudget's deadline having passed, or None without a deadline"""
+    if budget.deadline_ms is None:
+        return None
+    return lambda: "deadline" if budget.remaining() < 0 else None
+
+
+def request_token(*probes):
+    """A token polling the given probes, skipping None (unavailable) ones"""
+    return CancellationToken([probe for probe in probes if probe is not None])
+
+
+def set_cancellation(token):
+    """Make token the current request's (context's) cancellation token"""
+    _current_cancellation.set(token)
+
+
+def current_cancellation():
+    """The current request's cancellation token, or None outside requests or with cancellation off"""
+    return _current_cancellation.get()
+
+
+def cancellation_stats():
+    """Cancellations by stage and reason, and the model time they saved"""
+    by_stage, by_reason, reclaimed = {}, {}, {}
+    for _, labels, value in CANCELLATIONS.samples():
+        labels = dict(labels)
+        by_stage[labels["stage"]] = by_stage.get(labels["stage"], 0) + value
+        by_reason[labels["reason"]] = by_reason.get(labels["reason"], 0) + value
+    for _, labels, value in RECLAIMED_SECONDS.samples():
+        reclaimed[dict(labels)["stage"]] = value
+    return {
+        "total": sum(by_stage.values()),
+        "by_stage": by_stage,
+        "by_reason": by_reason,
+        "reclaimed_seconds": sum(reclaimed.values()),
+        "reclaimed_seconds_by_stage": reclaimed,
+    }
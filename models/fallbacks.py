@@ -0,0 +1,68 @@
+# Fallback outputs used when a model fails or isn't loaded yet. Kept free of
+# torch/transformers imports so the web app can use them before any model loads.
+
+# Returned when captioning fails; never cached
+CAPTION_FAILURE_MESSAGE = "Failed to generate caption for this image."
+
+# Returned when detection fails; never cached
+DEFAULT_INGREDIENTS = ["tomato", "onion", "chicken", "rice"]
+
+# Pre-defined recipes for common ingredient combinations
+FALLBACK_RECIPES = {
+    "tomato_onion_chicken": [
+        {
+            "name": "Quick Chicken Cacciatore",
+            "ingredients": [
+                "2 chicken breasts", "1 onion, diced", "2 tomatoes, chopped",
+                "2 cloves garlic, minced", "1 tbsp olive oil",
+                "1 tsp dried oregano", "Salt and pepper to taste"
+            ],
+            "instructions": [
+                "Season chicken with salt and pepper.",
+                "Heat olive oil in a skillet over medium heat.",
+                "Cook chicken until browned on both sides, about 5 minutes per side.",
+                "Add onions and garlic, cook until softened.",
+                "Add tomatoes and oregano, simmer for 15 minutes until sauce thickens.",
+                "Serve hot with pasta or rice."
+            ]
+        }
+    ],
+    "apple_cinnamon": [
+        {
+            "name": "Simple Apple Crumble",
+            "ingredients": [
+                "3 apples, peeled and sliced", "1/2 cup flour", 
+                "1/2 cup rolled oats", "1/4 cup brown sugar",
+                "1/4 cup butter, cold and cubed", "1 tsp cinnamon",
+                "1/4 tsp nutmeg", "Pinch of salt"
+            ],
+            "instructions": [
+                "Preheat oven to 350°F (175°C).",
+                "Place apple slices in a baking dish.",
+                "Mix flour, oats, sugar, cinnamon, nutmeg, and salt in a bowl.",
+                "Cut in butter until mixture resembles coarse crumbs.",
+                "Sprinkle topping over apples.",
+                "Bake for 35-40 minutes until golden and bubbly.",
+                "Serve warm with ice cream if desired."
+            ]
+        }
+    ],
+    "pasta_tomato_cheese": [
+        {
+            "name": "Quick Pasta Marinara",
+            "ingredients": [
+                "8 oz pasta", "2 tomatoes, diced", "1/4 cup grated cheese",
+                "2 cloves garlic, minced", "1 tbsp olive oil",
+                "1 tsp dried basil", "Salt and pepper to taste"
+            ],
+            "instructions": [
+                "Cook pasta according to package directions.",
+                "In a separate pan, heat olive oil over medium heat.",
+                "Add garlic and cook for 30 seconds until fragrant.",
+                "Add tomatoes and basil, cook for 5-7 minutes.",
+                "Drain pasta and add to the sauce.",
+                "Top with cheese and serve immediately."
+            ]
+        }
+    ]
+}
@@ -1,46 +1,175 @@
+import time
 import torch
-from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
-from PIL import Image
+from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer, StoppingCriteriaList
+from transformers.modeling_outputs import BaseModelOutput
+from models.fallbacks import CAPTION_FAILURE_MESSAGE
+from models.preprocessing import decode_image, processor_min_edge
+from models.precision import apply_precision, model_input_dtype
+from models.metrics import stage, FALLBACKS
+from models.weight_sharing import map_weights
+from models.artifacts import default_artifact_dir, find_artifact
+from models.cancellation import RequestCancelled
+from models.vision_backends import (
+    VISION_BACKENDS, VitEncoderGraph, artifact_path, check_images, default_backend, example_images, load_graph
+)
 
 class ImageCaptioningModel:
-    def __init__(self, model_name="nlpconnect/vit-gpt2-image-captioning"):
+    def __init__(self, model_name="nlpconnect/vit-gpt2-image-captioning", precision="auto", backend=None, backend_dir=None,
+                 mmap_weights=False, artifact_dir=None):
+        """
+        Args:
+            model_name: Model id or local directory
+            precision: One of models.precision.PRECISION_MODES
+            backend: How the ViT encoder runs: "eager", "torchscript" or
+                "onnx"; defaults to the VISION_BACKEND environment variable.
+                The GPT-2 decoder always runs through generate() with its
+                key/value cache
+            backend_dir: Where exported graphs are stored (and exported to on
+                first use); defaults to VISION_BACKEND_DIR
+            mmap_weights: Serve the weights from a memory mapping of the
+                checkpoint, shared by every process on the machine
+            artifact_dir: Where compile_artifacts.py stored serving-ready
+                models; defaults to MODEL_ARTIFACTS_DIR. A matching artifact
+                is loaded instead of model_name, with nothing to convert
+        """
+        self.model_name = model_name
+        self.precision = precision
+        default_name, default_dir = default_backend()
+        self.backend = backend or default_name
+        if self.backend not in VISION_BACKENDS:
+            raise ValueError(f"Unknown vision backend '{self.backend}', expected one of {VISION_BACKENDS}")
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model = VisionEncoderDecoderModel.from_pretrained(model_name)
-        self.feature_extractor = ViTImageProcessor.from_pretrained(model_name)
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.artifact = find_artifact(artifact_dir if artifact_dir is not None else default_artifact_dir(),
+                                      "caption", model_name, precision, self.device)
+        source = self.artifact.path if self.artifact else model_name
+        if self.artifact:
+            self.model = self.artifact.load_model(VisionEncoderDecoderModel)
+        else:
+            self.model = VisionEncoderDecoderModel.from_pretrained(model_name)
+        self.feature_extractor = ViTImageProcessor.from_pretrained(source)
+        self.tokenizer = AutoTokenizer.from_pretrained(source)
         
         self.model.to(self.device)
+        if not self.artifact:
+            self.model = apply_precision(self.model, precision, self.device)
+        self.input_dtype = model_input_dtype(self.model)
+        self.weight_mapping = map_weights(self.model, source) if mmap_weights else None
         
         # Set generation parameters
         self.max_length = 16
         self.num_beams = 4
         self.gen_kwargs = {"max_length": self.max_length, "num_beams": self.num_beams}
+        
+        # Shortest edge the processor resizes to; decoding beyond it is wasted
+        self.min_input_edge = processor_min_edge(self.feature_extractor, default=224)
+        
+        self.encoder = self._load_encoder(backend_dir or default_dir)
+    
+    def _load_encoder(self, backend_dir):
+        """Load the encoder for self.backend, falling back to eager if it cannot be exported"""
+        module = VitEncoderGraph(self.model).eval()
+        if self.backend == "eager":
+            return module
+        
+        def graph_inputs(images):
+            pixel_values = self.feature_extractor(images=images, return_tensors="pt").pixel_values
+            return (pixel_values.to(self.device, dtype=self.input_dtype),)
+        
+        path = artifact_path(backend_dir, "caption-encoder", self.model_name, self.precision, self.backend)
+        try:
+            # The processor resizes every image to the same size, so only the batch size varies
+            return load_graph(
+                module, graph_inputs(example_images()), self.backend, path, self.device,
+                input_names=["pixel_values"], output_names=["last_hidden_state"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "last_hidden_state": {0: "batch"}},
+                check_inputs=[graph_inputs(check_images())],
+            )
+        except Exception as e:
+            print(f"Error loading {self.backend} caption encoder, using eager: {e}")
+            self.backend = "eager"
+            return module
     
-    def generate_caption(self, image_path):
+    def generate_captions_from_pixel_values(self, pixel_values, num_beams=None, cancellation=None):
         """
-        Generate a caption for an image
+        Generate captions from already preprocessed pixel values
         
         Args:
-            image_path: Path to the image file
+            pixel_values: Float tensor of shape (batch, 3, height, width)
+            num_beams: Beams to search with instead of self.num_beams (1 = greedy)
+            cancellation: CancellationToken ending generation early once cancelled
             
         Returns:
-            str: The generated caption
-        """
-        try:
-            # Load image
-            image = Image.open(image_path).convert('RGB')
+            list: One caption per image in the batch
             
-            # Process image
-            pixel_values = self.feature_extractor(images=[image], return_tensors="pt").pixel_values
-            pixel_values = pixel_values.to(self.device)
+        Raises:
+            RequestCancelled: The token was cancelled before the captions were complete
+        """
+        if cancellation is not None:
+            cancellation.raise_if_cancelled('caption_generate', estimate_stages=('caption_encode', 'caption_generate'))
+        pixel_values = pixel_values.to(self.device, dtype=self.input_dtype)
+        
+        # Encode once; generate() then only runs the decoder, expanding the
+        # encoder states for beam search itself
+        with stage('caption_encode'), torch.no_grad():
+            encoder_outputs = BaseModelOutput(last_hidden_state=self.encoder(pixel_values))
+        
+        # Generate captions
+        gen_kwargs = dict(self.gen_kwargs, num_beams=num_beams) if num_beams else dict(self.gen_kwargs)
+        if cancellation is not None:
+            gen_kwargs['stopping_criteria'] = StoppingCriteriaList([cancellation])
+        started = time.perf_counter()
+        with stage('caption_generate'), torch.no_grad():
+            output_ids = self.model.generate(encoder_outputs=encoder_outputs, **gen_kwargs)
+        if cancellation is not None:
+            cancellation.raise_if_cancelled('caption_generate', started)
+        
+        # Decode captions
+        return self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+    
+    def generate_captions(self, images, num_beams=None, cancellation=None):
+        """
+        Generate captions for several images with a single batched generate call
+        
+        Unlike generate_caption this raises on failure, so a caller batching
+        requests together can tell which inputs went wrong.
+        
+        Args:
+            images: List of image file paths, raw bytes or decoded PIL images
+            num_beams: Beams to search with instead of self.num_beams (1 = greedy)
+            cancellation: CancellationToken ending generation early once cancelled
             
-            # Generate caption
-            output_ids = self.model.generate(pixel_values, **self.gen_kwargs)
+        Returns:
+            list: One caption per image, in input order
+        """
+        # Load images (already decoded ones are passed through)
+        images = [decode_image(image, self.min_input_edge) for image in images]
+        
+        # Process images
+        with stage('caption_preprocess'):
+            pixel_values = self.feature_extractor(images=images, return_tensors="pt").pixel_values
+        
+        return self.generate_captions_from_pixel_values(pixel_values, num_beams, cancellation)
+    
+    def generate_caption(self, image, num_beams=None, cancellation=None):
+        """
+        Generate a caption for an image
+        
+        Args:
+            image: Path to the image file, or a decoded PIL image
+            num_beams: Beams to search with instead of self.num_beams (1 = greedy)
+            cancellation: CancellationToken ending generation early once cancelled
             
-            # Decode caption
-            caption = self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)[0]
+        Returns:
+            str: The generated caption
             
-            return caption
+        Raises:
+            RequestCancelled: The token was cancelled before the caption was complete
+        """
+        try:
+            return self.generate_captions([image], num_beams, cancellation)[0]
+        except RequestCancelled:
+            raise
         except Exception as e:
             print(f"Error in generating caption: {e}")
-            return "Failed to generate caption for this image." 
\ No newline at end of file
+            FALLBACKS.inc(kind='caption_failure')
+            return CAPTION_FAILURE_MESSAGE
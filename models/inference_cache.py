@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def hash_bytes(data):
+    """Return the SHA-256 hex digest of raw image bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file on disk, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InferenceCache:
+    """
+    Content-addressed cache for model outputs.
+
+    Entries are keyed by the image digest, the model id and the generation
+    settings, so the same image run through the same model configuration is
+    only ever computed once. Lookups go to an in-memory LRU first and then to
+    an optional on-disk tier (one JSON file per key) that survives restarts.
+    """
+
+    def __init__(self, max_entries=512, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_hash, model_id, settings=None):
+        """Build a cache key from an image digest, a model id and its settings"""
+        settings_str = json.dumps(settings or {}, sort_keys=True, default=str)
+        raw = f"{image_hash}|{model_id}|{settings_str}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _remember(self, key, value):
+        # Caller must hold the lock
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return _MISSING
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return _MISSING
+        except (OSError, ValueError) as e:
+            print(f"Error reading inference cache entry {key}: {e}")
+            return _MISSING
+
+    def _write_disk(self, key, value):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            # Atomic rename so concurrent readers never see a partial file
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as e:
+            print(f"Error writing inference cache entry {key}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is not cached"""
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is not _MISSING:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.disk_hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        """Store a JSON-serialisable value in both cache tiers"""
+        with self._lock:
+            self._remember(key, value)
+        self._write_disk(key, value)
+
+    def get_or_compute(self, key, compute, cacheable=None):
+        """
+        Return the cached value for key, computing and storing it on a miss
+
+        Args:
+            key: Key built with make_key
+            compute: Zero-argument callable producing the value
+            cacheable: Optional predicate; values it rejects (e.g. failure
+                placeholders) are returned but not stored
+
+        Returns:
+            The cached or freshly computed value
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        value = compute()
+        if cacheable is None or cacheable(value):
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        """Return hit/miss counters and the current in-memory size"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
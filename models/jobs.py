@@ -0,0 +1,292 @@
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+_STOP = object()
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when max_queued jobs are already waiting"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+
+
+class Job:
+    """
+    One pipeline run and its per-stage progress
+
+    Every change bumps version and wakes long-polling readers, which can ask
+    to be woken on the next change rather than only on completion.
+    """
+
+    def __init__(self, payload, stages, changed):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = QUEUED
+        self.stages = {name: {'status': 'pending', 'seconds': None} for name in stages}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self._changed = changed
+
+    @property
+    def finished(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    def _update(self, **fields):
+        with self._changed:
+            for key, value in fields.items():
+                setattr(self, key, value)
+            self.version += 1
+            self._changed.notify_all()
+
+    def _update_stage(self, name, **fields):
+        with self._changed:
+            self.stages.setdefault(name, {'status': 'pending', 'seconds': None}).update(fields)
+            self.version += 1
+            self._changed.notify_all()
+
+    @contextmanager
+    def stage(self, name, cached=False):
+        """Mark stage name running for the duration of the block, then done (or failed)"""
+        started = time.perf_counter()
+        self._update_stage(name, status='running')
+        try:
+            yield
+        except Exception:
+            self._update_stage(name, status='failed', seconds=time.perf_counter() - started)
+            raise
+        info = {'status': 'done', 'seconds': time.perf_counter() - started}
+        if cached:
+            info['cached'] = True
+        self._update_stage(name, **info)
+
+    def skip_stage(self, name):
+        self._update_stage(name, status='skipped')
+
+    def to_dict(self, position=None):
+        with self._changed:
+            data = {
+                'id': self.id,
+                'status': self.status,
+                'version': self.version,
+                'stages': {name: dict(info) for name, info in self.stages.items()},
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+            }
+            if position is not None:
+                data['position'] = position
+            if self.status == SUCCEEDED:
+                data['result'] = self.result
+            if self.status == FAILED:
+                data['error'] = self.error
+            return data
+
+
+class JobQueue:
+    """
+    Bounded queue of pipeline jobs served by a fixed pool of worker threads
+
+    Submitting never blocks: once max_queued jobs are waiting, submit raises
+    QueueFull with an estimate of when a slot frees up, so the web tier can
+    answer 429 immediately. Finished jobs are kept for result_ttl seconds
+    so clients can collect them, then dropped; idle workers wake up now and
+    then to drop them even while no jobs arrive.
+    """
+
+    def __init__(self, run_job, workers=2, max_queued=32, result_ttl=600, name="jobs"):
+        """
+        Args:
+            run_job: Callable taking a Job and returning its JSON-serialisable
+                result; it reports progress through job.stage()
+            workers: Number of worker threads, sized independently of the
+                web server's concurrency
+            max_queued: Jobs allowed to wait for a worker before submit fails
+            result_ttl: Seconds finished jobs stay retrievable
+            name: Used for the worker thread names and in logs
+        """
+        self.run_job = run_job
+        self.max_queued = max(1, int(max_queued))
+        self.result_ttl = result_ttl
+        self.name = name
+        # How often idle workers look for expired results
+        self._expire_every = min(60.0, max(0.1, result_ttl))
+
+        self._lock = threading.Condition()
+        self._pending = deque()
+        self._jobs = {}
+        self._running = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._succeeded = 0
+        self._failed = 0
+        self._wait_time = 0.0
+        self._run_time = 0.0
+
+        self._start_workers(max(1, int(workers)))
+
+    def _start_workers(self, count):
+        self._workers = [
+            threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+            for i in range(count)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def after_fork(self):
+        """
+        Start new workers in a forked child, where the parent's threads no longer exist
+
+        Jobs submitted in the parent stay behind with it.
+        """
+        self._lock = threading.Condition()
+        self._pending = deque()
+        self._jobs = {}
+        self._running = 0
+        self._start_workers(len(self._workers))
+
+    def submit(self, payload, stages=()):
+        """
+        Queue a job and return it without waiting for it to start
+
+        Raises:
+            QueueFull: If max_queued jobs are already waiting
+        """
+        with self._lock:
+            self._expire()
+            self.check_capacity()
+            job = Job(payload, stages, self._lock)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._submitted += 1
+            self._lock.notify_all()
+            return job
+
+    def get(self, job_id):
+        """Return the job called job_id, or None if it is unknown or has expired"""
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """Number of jobs ahead of job in the queue, or None once it has started"""
+        with self._lock:
+            if job.status != QUEUED:
+                return None
+            try:
+                return self._pending.index(job)
+            except ValueError:
+                return None
+
+    def wait(self, job, timeout, since=None):
+        """
+        Long-poll: block until job finishes, or until its version passes since
+
+        Returns:
+            bool: False if timeout seconds passed without that happening
+        """
+        def changed():
+            return job.finished or (since is not None and job.version > since)
+
+        with self._lock:
+            return self._lock.wait_for(changed, timeout)
+
+    def shutdown(self, wait=True):
+        """Stop the workers after the jobs already queued have run"""
+        with self._lock:
+            for _ in self._workers:
+                self._pending.append(_STOP)
+            self._lock.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def check_capacity(self):
+        """
+        Raise QueueFull, counted as a rejection, if submit would currently fail
+
+        Lets callers refuse work before doing anything expensive for it.
+        """
+        with self._lock:
+            if len(self._pending) >= self.max_queued:
+                self._rejected += 1
+                raise QueueFull(self.retry_after())
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up, from the mean job time"""
+        with self._lock:
+            finished = self._succeeded + self._failed
+            mean_seconds = self._run_time / finished if finished else 1.0
+            return max(1, int(round(mean_seconds / len(self._workers))))
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._lock.wait_for(lambda: self._pending, self._expire_every):
+                    self._expire()
+                job = self._pending.popleft()
+                if job is _STOP:
+                    return
+                self._running += 1
+            self._execute(job)
+
+    def _execute(self, job):
+        started = time.time()
+        job._update(status=RUNNING, started_at=started)
+        try:
+            result = self.run_job(job)
+        except Exception as e:
+            print(f"Error in {self.name} job {job.id}: {e}")
+            job._update(status=FAILED, error=str(e), finished_at=time.time())
+        else:
+            job._update(status=SUCCEEDED, result=result, finished_at=time.time())
+
+        with self._lock:
+            self._running -= 1
+            self._wait_time += started - job.created_at
+            self._run_time += job.finished_at - started
+            if job.status == SUCCEEDED:
+                self._succeeded += 1
+            else:
+                self._failed += 1
+
+    def stats(self):
+        """Return queue depth, worker utilisation and job counters"""
+        with self._lock:
+            self._expire()
+            finished = self._succeeded + self._failed
+            return {
+                'workers': len(self._workers),
+                'queue_depth': sum(1 for job in self._pending if job is not _STOP),
+                'max_queued': self.max_queued,
+                'running': self._running,
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'succeeded': self._succeeded,
+                'failed': self._failed,
+                'retained': len(self._jobs),
+                'mean_queue_wait_ms': 1000.0 * self._wait_time / finished if finished else 0.0,
+                'mean_run_seconds': self._run_time / finished if finished else 0.0,
+            }
@@ -0,0 +1,285 @@
+# Process-wide metrics in the Prometheus text exposition format. Kept free of
+# torch/transformers imports (and of prometheus_client) so every module can
+# record into it.
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# 1ms to ~2min, roughly x2.5 per bucket: covers a cache lookup up to a full CPU generate
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0, 120.0)
+
+# Counter increments and histogram observations made in the current context,
+# while the model server records them to replay in its client's process
+_recorded_updates = contextvars.ContextVar("recorded_updates", default=None)
+
+
+def _record(metric, method, value, labels):
+    updates = _recorded_updates.get()
+    if updates is not None:
+        updates.append((metric.name, method, value, labels))
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Return (suffix, labels, value) tuples for rendering"""
+        with self._lock:
+            return [("", key, value) for key, value in sorted(self._values.items())]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _record(self, "inc", amount, labels)
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+        _record(self, "observe", value, labels)
+
+    def mean(self, **labels):
+        """Mean of every observation so far with these labels, or None before the first one"""
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ((), 0.0))
+        count = sum(counts)
+        return total / count if count else None
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(("_bucket", key + (("le", _format_value(bound)),), cumulative))
+                samples.append(("_sum", key, total))
+                samples.append(("_count", key, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Metrics recorded as events happen plus collectors read at scrape time
+
+    Collectors let components that already keep their own counters (the
+    caches, schedulers and job queue all have stats()) be exported without
+    double bookkeeping: each is a callable returning (name, type,
+    documentation, [(labels dict, value), ...]) tuples.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name):
+        """The metric registered as name, or None"""
+        with self._lock:
+            return self._metrics.get(name)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+
+        def family(name, metric_type, documentation, samples):
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            family(metric.name, metric.type, metric.documentation, metric.samples())
+
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                family(name, metric_type, documentation, [
+                    ("", tuple(sorted(labels.items())), value) for labels, value in samples if value is not None
+                ])
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "recipesnap_stage_seconds", "Time spent in each processing stage", ["stage"]
+)
+FALLBACKS = REGISTRY.counter(
+    "recipesnap_fallbacks_total", "Responses that used a fallback instead of model output", ["kind"]
+)
+GENERATED_TOKENS = REGISTRY.counter(
+    "recipesnap_generated_tokens_total", "Tokens generated by the recipe model"
+)
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "recipesnap_generation_tokens_per_second", "Recipe generation speed per generate call",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000),
+)
+
+# Stage timings of the request being handled, for the Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request_timing():
+    """Start collecting stage timings for the current request (context)"""
+    _request_timings.set([])
+
+
+def request_timings():
+    """Stage (name, seconds) pairs recorded so far in the current request, in order"""
+    return list(_request_timings.get() or ())
+
+
+def record_stage(name, seconds):
+    """Record a stage duration into recipesnap_stage_seconds and the current request's Server-Timing"""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    """Time a block into recipesnap_stage_seconds and the current request's Server-Timing"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+@contextmanager
+def record_updates():
+    """Collect the counter increments and histogram observations made in this context"""
+    updates = []
+    token = _recorded_updates.set(updates)
+    try:
+        yield updates
+    finally:
+        _recorded_updates.reset(token)
+
+
+def replay_updates(updates):
+    """
+    Apply updates collected by record_updates in another process to this one's metrics
+
+    Stage durations also go into the current request's Server-Timing.
+    Metrics this process has not registered are skipped.
+    """
+    for name, method, value, labels in updates:
+        metric = REGISTRY.get(name)
+        if metric is STAGE_SECONDS:
+            record_stage(labels["stage"], value)
+        elif metric is not None:
+            getattr(metric, method)(value, **labels)
+
+
+def server_timing_header(timings):
+    """Format (name, seconds) pairs as a Server-Timing header, summing repeated stages"""
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={1000.0 * seconds:.1f}" for name, seconds in totals.items())
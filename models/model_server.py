@@ -0,0 +1,597 @@
+# Out-of-process model serving. serve_models.py hosts the caption, detection
+# and recipe models in a process of their own behind a Unix socket, and the
+# web app reaches them through a pooled ModelServerClient (the client-side
+# model classes are in models.remote_models). Requests and replies are
+# pickled over multiprocessing connections, except tensor arguments: those
+# are copied into a shared memory segment each pooled connection reuses and
+# read by the server in place. Pickles are trusted, so only local processes
+# allowed to write to the socket file can connect.
+
+import os
+import stat
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from models.cancellation import CancellationToken, RequestCancelled
+from models.metrics import record_updates, replay_updates
+from models.registry import ModelNotReady
+from models.weight_sharing import process_memory
+
+MODEL_NAMES = ("captioning", "detection", "recipe")
+
+# What clients may call on each model
+EXPOSED_METHODS = {
+    "captioning": {"generate_captions_from_pixel_values"},
+    "detection": {"detect_ingredients_from_inputs"},
+    "recipe": {"generate_recipes", "generate_recipes_batch", "stream_recipe_events", "generation_stats"},
+}
+# Methods given a cancellation token, cancelled when the client asks or hangs up
+CANCELLABLE_METHODS = {
+    "generate_captions_from_pixel_values", "generate_recipes", "generate_recipes_batch", "stream_recipe_events"
+}
+# Methods returning a generator, whose items are sent as they come
+STREAMING_METHODS = {"stream_recipe_events"}
+
+# Plain attributes of each model its client-side class mirrors
+MIRRORED_ATTRIBUTES = {
+    "captioning": ("model_name", "precision", "backend", "max_length", "num_beams", "gen_kwargs",
+                   "min_input_edge", "weight_mapping"),
+    "detection": ("model_name", "precision", "backend", "threshold", "min_input_edge", "weight_mapping"),
+    "recipe": ("model_name", "precision", "structured_output", "max_length", "temperature", "top_p",
+               "repetition_penalty", "draft_lookahead", "model_loaded", "weight_mapping"),
+}
+
+# Tensors in a shared memory segment start on cache line boundaries
+_ALIGNMENT = 64
+
+
+class ModelServerError(RuntimeError):
+    """A model call failed inside the model server"""
+
+
+def model_factories(config):
+    """
+    Zero-argument factories building the caption, detection and recipe models in this process
+
+    Args:
+        config: Mapping with the app's model settings (CAPTION_MODEL,
+            VISION_PRECISION, MODEL_MMAP, RECIPE_OUTPUT, ...)
+    """
+    # Models are imported and built lazily so a server answers immediately
+    def captioning():
+        from models.image_captioning import ImageCaptioningModel
+        return ImageCaptioningModel(config['CAPTION_MODEL'], precision=config['VISION_PRECISION'],
+                                    mmap_weights=config['MODEL_MMAP'], artifact_dir=config['MODEL_ARTIFACTS_DIR'])
+
+    def detection():
+        from models.object_detection import ObjectDetectionModel
+        return ObjectDetectionModel(config['DETECTION_MODEL'], precision=config['VISION_PRECISION'],
+                                    mmap_weights=config['MODEL_MMAP'], artifact_dir=config['MODEL_ARTIFACTS_DIR'])
+
+    def recipe():
+        from models.recipe_generation import RecipeGenerationModel
+        return RecipeGenerationModel(
+            config['RECIPE_MODEL'],
+            precision=config['RECIPE_PRECISION'],
+            prefix_cache=config['RECIPE_PREFIX_CACHE'],
+            draft_model_name=config['RECIPE_DRAFT_MODEL'],
+            draft_lookahead=config['RECIPE_DRAFT_LOOKAHEAD'],
+            mmap_weights=config['MODEL_MMAP'],
+            artifact_dir=config['MODEL_ARTIFACTS_DIR'],
+            structured_output=config['RECIPE_OUTPUT'] == 'structured'
+        )
+
+    return {"captioning": captioning, "detection": detection, "recipe": recipe}
+
+
+def model_server_sockets(value):
+    """
+    Socket of the model server hosting each model, from a MODEL_SERVER setting
+
+    value is a socket path for every model, optionally followed or replaced
+    by name=path entries for single models, e.g.
+    "/run/vision.sock,recipe=/run/recipe.sock". Models without a socket
+    run in this process.
+    """
+    sockets = {}
+    default = None
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, separator, path = entry.partition("=")
+        if not separator:
+            default = entry
+        elif name in MODEL_NAMES:
+            sockets[name] = path
+        else:
+            raise ValueError(f"Unknown model '{name}' in MODEL_SERVER, expected one of {MODEL_NAMES}")
+    if default:
+        for name in MODEL_NAMES:
+            sockets.setdefault(name, default)
+    return sockets
+
+
+class SharedTensor:
+    """Stands in for a tensor argument stored in the connection's shared memory segment"""
+
+    def __init__(self, offset, shape, dtype):
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+
+def _map_arguments(value, is_leaf, convert):
+    """Apply convert to every leaf in value, looking inside dicts, lists and tuples"""
+    if is_leaf(value):
+        return convert(value)
+    if isinstance(value, dict):
+        return {key: _map_arguments(item, is_leaf, convert) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_map_arguments(item, is_leaf, convert) for item in value)
+    return value
+
+
+class _SharedArena:
+    """A shared memory segment one client connection reuses for the tensors it sends"""
+
+    def __init__(self):
+        self.segment = None
+
+    @property
+    def size(self):
+        return self.segment.size if self.segment is not None else 0
+
+    def pack(self, args, kwargs):
+        """
+        Copy the tensors in args and kwargs into the segment
+
+        Returns:
+            tuple: (args, kwargs) with SharedTensor placeholders, and the
+            segment's name, or None if there were no tensors
+        """
+        # Without torch imported there are no torch tensors to look for
+        torch = sys.modules.get("torch")
+        tensor_types = (np.ndarray, torch.Tensor) if torch else (np.ndarray,)
+
+        def is_tensor(value):
+            return isinstance(value, tensor_types)
+
+        arrays = []
+
+        def collect(value):
+            array = value if isinstance(value, np.ndarray) else value.detach().cpu().numpy()
+            arrays.append(np.ascontiguousarray(array))
+            return value
+
+        _map_arguments((args, kwargs), is_tensor, collect)
+        if not arrays:
+            return args, kwargs, None
+
+        offsets, total = [], 0
+        for array in arrays:
+            offsets.append(total)
+            total += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+        if total > self.size:
+            self._grow(total)
+
+        placeholders = iter(range(len(arrays)))
+
+        def store(value):
+            i = next(placeholders)
+            array, offset = arrays[i], offsets[i]
+            np.ndarray(array.shape, array.dtype, buffer=self.segment.buf, offset=offset)[...] = array
+            return SharedTensor(offset, array.shape, array.dtype.str)
+
+        args, kwargs = _map_arguments((args, kwargs), is_tensor, store)
+        return args, kwargs, self.segment.name
+
+    def _grow(self, size):
+        # Doubling keeps resizes rare as batches grow; the server switches when it sees the new name
+        size = max(size, 2 * self.size, 1 << 20)
+        self.close()
+        self.segment = SharedMemory(create=True, size=size)
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment.unlink()
+            self.segment = None
+
+
+def _attach(name):
+    """Map an existing segment without making this process responsible for removing it"""
+    try:
+        return SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        segment = SharedMemory(name=name)
+        # Before 3.13 attaching registers the segment for removal when this
+        # process exits, but the client that created it owns it
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class _AttachedSegment:
+    """Server side of a connection's _SharedArena"""
+
+    def __init__(self):
+        self.segment = None
+
+    def unpack(self, name, args, kwargs):
+        """Replace SharedTensor placeholders by tensors reading the segment in place"""
+        if name is None:
+            return args, kwargs
+        import torch
+
+        if self.segment is None or self.segment.name != name:
+            self.close()
+            self.segment = _attach(name)
+
+        def tensor(shared):
+            array = np.ndarray(shared.shape, np.dtype(shared.dtype), buffer=self.segment.buf, offset=shared.offset)
+            return torch.from_numpy(array)
+
+        return _map_arguments((args, kwargs), lambda value: isinstance(value, SharedTensor), tensor)
+
+    def close(self):
+        if self.segment is not None:
+            try:
+                self.segment.close()
+            except BufferError:
+                # A tensor still reads it; the mapping goes away with that tensor
+                pass
+            self.segment = None
+
+
+class _ClientProbe:
+    """
+    Cancellation probe for a call: the client sent ("cancel", reason) or hung up
+
+    Clients send nothing else while a call runs, so anything readable on
+    the connection is one of the two.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._lock = threading.Lock()
+        self._reason = None
+
+    def __call__(self):
+        with self._lock:
+            if self._reason is None:
+                try:
+                    if self.connection.poll(0):
+                        message = self.connection.recv()
+                        self._reason = message[1] if message[0] == "cancel" else "disconnect"
+                except (OSError, EOFError):
+                    self._reason = "disconnect"
+            return self._reason
+
+
+class ModelServer:
+    """
+    Serve a ModelRegistry's models to ModelServerClients on a Unix socket
+
+    Each client connection is served by its own thread and runs one call
+    at a time; clients open several connections for concurrent calls.
+    Calls on a model that is still loading fail with ModelNotReady, so
+    clients can poll "status" while the server starts.
+    """
+
+    def __init__(self, registry, socket_path):
+        self.registry = registry
+        self.socket_path = socket_path
+        self._lock = threading.Lock()
+        self._connections = 0
+        self._calls = 0
+
+    def serve_forever(self):
+        # A socket left behind by a server that did not shut down cleanly
+        if os.path.exists(self.socket_path) and stat.S_ISSOCK(os.stat(self.socket_path).st_mode):
+            os.unlink(self.socket_path)
+        with Listener(self.socket_path, family="AF_UNIX") as listener:
+            print(f"Serving models on {self.socket_path}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except OSError as e:
+                    print(f"Error accepting model server connection: {e}")
+                    continue
+                threading.Thread(target=self._serve, args=(connection,), name="model-client", daemon=True).start()
+
+    def _serve(self, connection):
+        segment = _AttachedSegment()
+        with self._lock:
+            self._connections += 1
+        try:
+            while True:
+                request = connection.recv()
+                if request[0] == "cancel":
+                    # Sent while the reply to the last call was on its way
+                    continue
+                self._handle(connection, segment, *request)
+        except (OSError, EOFError):
+            pass
+        finally:
+            segment.close()
+            connection.close()
+            with self._lock:
+                self._connections -= 1
+
+    def status(self):
+        with self._lock:
+            counts = {"connections": self._connections, "calls": self._calls}
+        return dict(self.registry.status(), pid=os.getpid(), memory=process_memory(), **counts)
+
+    def describe(self, name):
+        """The attributes of model name that its client-side class mirrors"""
+        model = self.registry.get(name)
+        attributes = {attribute: getattr(model, attribute, None) for attribute in MIRRORED_ATTRIBUTES[name]}
+        artifact = getattr(model, "artifact", None)
+        attributes["processor_source"] = artifact.path if artifact else model.model_name
+        return attributes
+
+    def _call(self, connection, segment, model_name, method, args, kwargs, segment_name):
+        if model_name is None:
+            if method not in ("status", "describe"):
+                raise ValueError(f"Unknown model server method '{method}'")
+            return getattr(self, method)(*args)
+
+        model = self.registry.get(model_name)
+        if method not in EXPOSED_METHODS.get(model_name, ()):
+            raise ValueError(f"{model_name} has no method '{method}' for clients")
+        args, kwargs = segment.unpack(segment_name, args, kwargs)
+        if method in CANCELLABLE_METHODS:
+            kwargs["cancellation"] = CancellationToken([_ClientProbe(connection)])
+        result = getattr(model, method)(*args, **kwargs)
+        if method in STREAMING_METHODS:
+            try:
+                for item in result:
+                    connection.send(("event", item, None))
+            finally:
+                result.close()
+            result = None
+        return result
+
+    def _handle(self, connection, segment, *request):
+        with self._lock:
+            self._calls += 1
+        with record_updates() as updates:
+            try:
+                reply = ("ok", self._call(connection, segment, *request))
+            except (ConnectionError, EOFError):
+                # The client is gone
+                raise
+            except ModelNotReady as e:
+                reply = ("not_ready", (e.name, e.state, e.error))
+            except RequestCancelled as e:
+                reply = ("cancelled", (e.reason, e.stage))
+            except Exception as e:
+                print(f"Error in model server call {request[0]}.{request[1]}: {e}")
+                reply = ("error", f"{type(e).__name__}: {e}")
+        connection.send(reply + (updates,))
+
+
+class _Channel:
+    """One pooled connection to a model server, with its shared memory segment"""
+
+    def __init__(self, socket_path):
+        self.connection = Client(socket_path, family="AF_UNIX")
+        self.arena = _SharedArena()
+
+    def send(self, model, method, args, kwargs):
+        args, kwargs, segment_name = self.arena.pack(args, kwargs)
+        self.connection.send((model, method, args, kwargs, segment_name))
+
+    def receive(self, cancellation=None):
+        """
+        The next message from the server
+
+        While waiting, a cancelled token is passed on to the server once;
+        the server then stops the call at its next check and replies as usual.
+        """
+        if cancellation is not None:
+            cancel_sent = False
+            while not self.connection.poll(cancellation.poll_interval):
+                reason = cancellation.reason
+                if reason is not None and not cancel_sent:
+                    self.connection.send(("cancel", reason))
+                    cancel_sent = True
+        return self.connection.recv()
+
+    def usable(self):
+        """False once the server closed the connection, e.g. because it restarted"""
+        try:
+            return not self.connection.poll(0)
+        except (OSError, EOFError):
+            return False
+
+    def close(self):
+        try:
+            self.connection.close()
+        except OSError:
+            pass
+        self.arena.close()
+
+
+class ModelServerClient:
+    """
+    Pooled connections to a model server
+
+    A call holds one connection, with its shared memory segment, until the
+    reply arrives. Up to pool_size calls run at once and further ones wait
+    for a free connection. Idle connections stay open for the next call.
+    """
+
+    def __init__(self, socket_path, pool_size=8):
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self._init_pool()
+
+    def _init_pool(self):
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._idle = []
+        self._opened = 0
+        self._closed = 0
+        self._calls = 0
+        self._pool_wait_seconds = 0.0
+
+    def after_fork(self):
+        """Start over with an empty pool in a forked child; the parent keeps its connections"""
+        self._init_pool()
+
+    @contextmanager
+    def _channel(self):
+        started = time.perf_counter()
+        self._slots.acquire()
+        channel = None
+        try:
+            with self._lock:
+                self._pool_wait_seconds += time.perf_counter() - started
+                self._calls += 1
+                while self._idle and channel is None:
+                    channel = self._idle.pop()
+                    if not channel.usable():
+                        channel.close()
+                        self._closed += 1
+                        channel = None
+            if channel is None:
+                channel = _Channel(self.socket_path)
+                with self._lock:
+                    self._opened += 1
+            yield channel
+        except BaseException:
+            # The connection may be halfway through a call; never reuse it
+            if channel is not None:
+                channel.close()
+                with self._lock:
+                    self._closed += 1
+            raise
+        else:
+            with self._lock:
+                self._idle.append(channel)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _result(kind, value, updates):
+        # The server's metric updates for the call, e.g. stage durations, count here too
+        replay_updates(updates)
+        if kind == "ok":
+            return value
+        if kind == "not_ready":
+            raise ModelNotReady(*value)
+        if kind == "cancelled":
+            raise RequestCancelled(*value)
+        raise ModelServerError(value)
+
+    def call(self, model, method, *args, cancellation=None, **kwargs):
+        """
+        Call method on the server's model (None for the server itself) and return its result
+
+        Tensors among the arguments, also inside dicts, lists and tuples, go
+        through shared memory and arrive as CPU tensors.
+
+        Raises:
+            ModelNotReady: The model is still loading on the server
+            RequestCancelled: cancellation was cancelled before the call finished
+            ModelServerError: The call failed on the server
+            OSError, EOFError: The server is unreachable
+        """
+        with self._channel() as channel:
+            channel.send(model, method, args, kwargs)
+            kind, value, updates = channel.receive(cancellation)
+        return self._result(kind, value, updates)
+
+    def stream(self, model, method, *args, cancellation=None, **kwargs):
+        """
+        Call a streaming method and yield its items as they arrive
+
+        Closing the generator early cancels the call on the server and waits
+        for its final reply, so the connection can be reused.
+        """
+        with self._channel() as channel:
+            channel.send(model, method, args, kwargs)
+            while True:
+                kind, value, updates = channel.receive(cancellation)
+                if kind != "event":
+                    break
+                try:
+                    yield value
+                except GeneratorExit:
+                    reason = cancellation.reason if cancellation is not None else None
+                    channel.connection.send(("cancel", reason or "closed"))
+                    while kind == "event":
+                        kind, value, updates = channel.receive()
+                    replay_updates(updates)
+                    return
+        self._result(kind, value, updates)
+
+    def model_attributes(self, name, poll_interval=0.5):
+        """
+        Wait until the server has loaded model name, then return the attributes its client class mirrors
+
+        Keeps trying while the server is not up yet, so the web tier can
+        start first.
+
+        Raises:
+            RuntimeError: The server does not serve the model, or failed to load it
+        """
+        waiting = False
+        while True:
+            try:
+                status = self.call(None, "status")
+            except (OSError, EOFError) as e:
+                if not waiting:
+                    print(f"Waiting for the model server at {self.socket_path}: {e}")
+                    waiting = True
+                time.sleep(poll_interval)
+                continue
+            model = status["models"].get(name)
+            if model is None:
+                raise RuntimeError(f"The model server at {self.socket_path} does not serve '{name}'")
+            if model["state"] == "ready":
+                return self.call(None, "describe", name)
+            if model["state"] == "failed":
+                raise RuntimeError(f"The model server failed to load '{name}': {model['error']}")
+            time.sleep(poll_interval)
+
+    def factory(self, name):
+        """Registry factory for the client-side stand-in of the server's model called name"""
+        def build():
+            from models.remote_models import remote_model
+            return remote_model(self, name)
+        return build
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "socket": self.socket_path,
+                "pool_size": self.pool_size,
+                "open_connections": self._opened - self._closed,
+                "idle_connections": len(self._idle),
+                "calls": self._calls,
+                "mean_pool_wait_ms": 1000.0 * self._pool_wait_seconds / self._calls if self._calls else 0.0,
+                "shared_memory_bytes": sum(channel.arena.size for channel in self._idle),
+            }
+        try:
+            stats["server"] = self.call(None, "status")
+        except Exception as e:
+            stats["server"] = {"error": str(e)}
+        return stats
+
+    def close(self):
+        """Close the idle connections and remove their shared memory segments"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._closed += len(idle)
+        for channel in idle:
+            channel.close()
@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+HASH_BITS = 64
+
+
+def dhash(image, hash_size=8):
+    """
+    Difference hash of a PIL image as a hash_size * hash_size bit integer
+
+    The image is shrunk to (hash_size + 1) x hash_size grey pixels and each
+    bit records whether a pixel is brighter than its right neighbour. Only
+    the coarse brightness structure survives, so resizing, recompression
+    and small crops change few bits, while a different photo changes about
+    half of them.
+    """
+    pixels = image.convert("L").resize((hash_size + 1, hash_size), Image.BOX).tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class NearDuplicateIndex:
+    """
+    Bounded LRU index of perceptual hashes, searchable by Hamming distance
+
+    A multi-index hash table: every hash is split into threshold + 1
+    chunks, each chunk indexed in its own table. Two hashes at most
+    threshold bits apart must agree exactly on at least one chunk
+    (pigeonhole), so a lookup only checks the hashes sharing a chunk with
+    the query instead of every entry. Unlike a BK-tree, entries can be
+    removed cheaply, which keeps the LRU bound exact.
+    """
+
+    def __init__(self, max_entries=10000, threshold=6, bits=HASH_BITS):
+        """
+        Args:
+            max_entries: Hashes kept; the least recently matched are dropped first
+            threshold: Largest Hamming distance that counts as the same image
+            bits: Hash length in bits
+        """
+        if not 0 <= threshold < bits:
+            raise ValueError(f"threshold must be between 0 and {bits - 1}")
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.bits = bits
+
+        # (shift, mask) of each chunk; the first bits % chunks chunks get one bit more
+        chunks = threshold + 1
+        width, extra = divmod(bits, chunks)
+        self._chunks = []
+        shift = 0
+        for i in range(chunks):
+            size = width + (1 if i < extra else 0)
+            self._chunks.append((shift, (1 << size) - 1))
+            shift += size
+
+        self._entries = OrderedDict()
+        self._tables = [{} for _ in self._chunks]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.hit_distance = 0
+
+    def _keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self._chunks]
+
+    def _remove(self, value):
+        # Caller must hold the lock
+        del self._entries[value]
+        for table, key in zip(self._tables, self._keys(value)):
+            bucket = table[key]
+            bucket.discard(value)
+            if not bucket:
+                del table[key]
+
+    def add(self, value, result):
+        """Store result under perceptual hash value, replacing any result stored for the same hash"""
+        with self._lock:
+            if value in self._entries:
+                self._entries[value] = result
+                self._entries.move_to_end(value)
+                return
+            self._entries[value] = result
+            for table, key in zip(self._tables, self._keys(value)):
+                table.setdefault(key, set()).add(value)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def lookup(self, value):
+        """
+        Return (result, distance) of the closest stored hash within threshold, or None
+
+        A match counts as a use of the stored entry for the LRU bound.
+        """
+        with self._lock:
+            candidates = set()
+            for table, key in zip(self._tables, self._keys(value)):
+                candidates.update(table.get(key, ()))
+
+            best, best_distance = None, self.threshold + 1
+            for candidate in candidates:
+                distance = hamming_distance(value, candidate)
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.hit_distance += best_distance
+            self._entries.move_to_end(best)
+            return self._entries[best], best_distance
+
+    def stats(self):
+        """Return size, threshold and hit-rate counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'mean_hit_distance': self.hit_distance / self.hits if self.hits else 0.0,
+            }
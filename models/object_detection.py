@@ -1,15 +1,62 @@
 import torch
 from transformers import DetrImageProcessor, DetrForObjectDetection
-from PIL import Image
+from transformers.models.detr.modeling_detr import DetrObjectDetectionOutput
 import numpy as np
+from models.fallbacks import DEFAULT_INGREDIENTS
+from models.preprocessing import decode_image, processor_min_edge
+from models.precision import apply_precision, model_input_dtype, cast_inputs
+from models.metrics import stage, FALLBACKS
+from models.weight_sharing import map_weights
+from models.artifacts import default_artifact_dir, find_artifact
+from models.vision_backends import (
+    VISION_BACKENDS, DetrGraph, artifact_path, check_images, default_backend, example_images, load_graph
+)
 
 class ObjectDetectionModel:
-    def __init__(self, model_name="facebook/detr-resnet-50"):
+    def __init__(self, model_name="facebook/detr-resnet-50", precision="auto", backend=None, backend_dir=None,
+                 mmap_weights=False, artifact_dir=None):
+        """
+        Args:
+            model_name: Model id or local directory
+            precision: One of models.precision.PRECISION_MODES
+            backend: How the forward pass runs: "eager", "torchscript" or
+                "onnx"; defaults to the VISION_BACKEND environment variable
+            backend_dir: Where exported graphs are stored (and exported to on
+                first use); defaults to VISION_BACKEND_DIR
+            mmap_weights: Serve the weights from a memory mapping of the
+                checkpoint, shared by every process on the machine
+            artifact_dir: Where compile_artifacts.py stored serving-ready
+                models; defaults to MODEL_ARTIFACTS_DIR
+        """
+        self.model_name = model_name
+        self.precision = precision
+        default_name, default_dir = default_backend()
+        self.backend = backend or default_name
+        if self.backend not in VISION_BACKENDS:
+            raise ValueError(f"Unknown vision backend '{self.backend}', expected one of {VISION_BACKENDS}")
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.processor = DetrImageProcessor.from_pretrained(model_name)
-        self.model = DetrForObjectDetection.from_pretrained(model_name)
+        self.artifact = find_artifact(artifact_dir if artifact_dir is not None else default_artifact_dir(),
+                                      "detection", model_name, precision, self.device)
+        source = self.artifact.path if self.artifact else model_name
+        self.processor = DetrImageProcessor.from_pretrained(source)
+        if self.artifact:
+            self.model = self.artifact.load_model(DetrForObjectDetection)
+        else:
+            self.model = DetrForObjectDetection.from_pretrained(model_name)
         
         self.model.to(self.device)
+        if not self.artifact:
+            self.model = apply_precision(self.model, precision, self.device)
+        self.input_dtype = model_input_dtype(self.model)
+        self.weight_mapping = map_weights(self.model, source) if mmap_weights else None
+        
+        # Minimum confidence for a detection to count
+        self.threshold = 0.5
+        
+        # Shortest edge the processor resizes to; decoding beyond it is wasted
+        self.min_input_edge = processor_min_edge(self.processor, default=800)
+        
+        self.graph = self._load_graph(backend_dir or default_dir)
         
         # Common food items that the model can detect
         self.food_categories = {
@@ -27,58 +74,147 @@ class ObjectDetectionModel:
             "eggs", "milk", "butter", "oil", "sugar", "salt", "pepper"
         ]
     
-    def detect_ingredients(self, image_path):
+    def _load_graph(self, backend_dir):
+        """Load the forward pass for self.backend, falling back to eager if it cannot be exported"""
+        module = DetrGraph(self.model).eval()
+        if self.backend == "eager":
+            return module
+        
+        def graph_inputs(images):
+            inputs = cast_inputs(dict(self.processor(images=images, return_tensors="pt")), self.input_dtype)
+            return inputs["pixel_values"].to(self.device), inputs["pixel_mask"].to(self.device)
+        
+        # Two sizes, so the check covers padding and the pixel mask
+        example_inputs = graph_inputs(example_images())
+        path = artifact_path(backend_dir, "detection", self.model_name, self.precision, self.backend)
+        try:
+            return load_graph(
+                module, example_inputs, self.backend, path, self.device,
+                input_names=["pixel_values", "pixel_mask"], output_names=["logits", "pred_boxes"],
+                dynamic_axes={
+                    "pixel_values": {0: "batch", 2: "height", 3: "width"},
+                    "pixel_mask": {0: "batch", 1: "height", 2: "width"},
+                    "logits": {0: "batch"},
+                    "pred_boxes": {0: "batch"},
+                },
+                check_inputs=[graph_inputs(check_images())],
+            )
+        except Exception as e:
+            print(f"Error loading {self.backend} detection graph, using eager: {e}")
+            self.backend = "eager"
+            return module
+    
+    def _foods_from_detections(self, results):
+        """Map one image's post-processed detections to a list of ingredient names"""
+        detected_foods = []
+        for label in results["labels"]:
+            # Check if this is a food item we care about
+            label_id = label.item()
+            if label_id in self.food_categories:
+                food_name = self.food_categories[label_id]
+                if food_name not in detected_foods:
+                    detected_foods.append(food_name)
+        
+        # If we didn't detect many foods, add some plausible ones
+        # This makes the app more useful even with limited detection
+        if len(detected_foods) < 3:
+            FALLBACKS.inc(kind='padded_ingredients')
+            # Add some random additional foods to make recipes more interesting
+            for food in np.random.permutation(self.additional_foods)[:3]:
+                if food not in detected_foods:
+                    detected_foods.append(str(food))
+        
+        return detected_foods
+    
+    def detect_ingredients_from_inputs(self, inputs, image_sizes):
         """
-        Detect food ingredients in an image
+        Detect food ingredients from already preprocessed processor outputs
         
         Args:
-            image_path: Path to the image file
+            inputs: Dict with pixel_values (and optionally pixel_mask) tensors
+            image_sizes: List of (width, height) of the images, used to scale boxes
             
         Returns:
-            list: List of detected ingredients
+            list: One list of detected ingredients per image
         """
-        try:
-            # Load image
-            image = Image.open(image_path).convert('RGB')
-            
-            # Process image
-            inputs = self.processor(images=image, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            # Perform inference
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-            
-            # Post-process outputs
-            target_sizes = torch.tensor([image.size[::-1]]).to(self.device)
+        inputs = {k: v.to(self.device) for k, v in cast_inputs(inputs, self.input_dtype).items()}
+        pixel_values = inputs["pixel_values"]
+        pixel_mask = inputs.get("pixel_mask")
+        if pixel_mask is None:
+            batch, _, height, width = pixel_values.shape
+            pixel_mask = torch.ones((batch, height, width), dtype=torch.long, device=self.device)
+        
+        # Perform inference
+        with stage('detection_forward'), torch.no_grad():
+            logits, pred_boxes = self.graph(pixel_values, pixel_mask)
+        outputs = DetrObjectDetectionOutput(logits=logits, pred_boxes=pred_boxes)
+        
+        # Post-processing expects fp32 scores and boxes
+        if self.input_dtype != torch.float32:
+            outputs.logits = outputs.logits.float()
+            outputs.pred_boxes = outputs.pred_boxes.float()
+        
+        # Post-process outputs
+        with stage('detection_postprocess'):
+            target_sizes = torch.tensor([(height, width) for width, height in image_sizes]).to(self.device)
             results = self.processor.post_process_object_detection(
-                outputs, target_sizes=target_sizes, threshold=0.5
-            )[0]
+                outputs, target_sizes=target_sizes, threshold=self.threshold
+            )
             
             # Extract food items
-            detected_foods = []
-            for score, label, box in zip(results["scores"], results["labels"], results["boxes"]):
-                box = [round(i, 2) for i in box.tolist()]
-                
-                # Check if this is a food item we care about
-                label_id = label.item()
-                if label_id in self.food_categories:
-                    food_name = self.food_categories[label_id]
-                    if food_name not in detected_foods:
-                        detected_foods.append(food_name)
-            
-            # If we didn't detect many foods, add some plausible ones
-            # This makes the app more useful even with limited detection
-            if len(detected_foods) < 3:
-                # Add some random additional foods to make recipes more interesting
-                np.random.shuffle(self.additional_foods)
-                for food in self.additional_foods[:3]:
-                    if food not in detected_foods:
-                        detected_foods.append(food)
+            return [self._foods_from_detections(result) for result in results]
+    
+    def input_size(self, shortest_edge):
+        """Processor size for a smaller shortest edge, keeping the processor's longest/shortest ratio"""
+        size = self.processor.size
+        longest_edge = size["longest_edge"] if isinstance(size, dict) else getattr(size, "longest_edge", None)
+        if not longest_edge:
+            return {"shortest_edge": shortest_edge, "longest_edge": shortest_edge * 5 // 3}
+        return {"shortest_edge": shortest_edge, "longest_edge": longest_edge * shortest_edge // self.min_input_edge}
+    
+    def detect_ingredients_batch(self, images, shortest_edge=None):
+        """
+        Detect food ingredients in several images with a single forward pass
+        
+        The processor pads the images to a common size and returns a pixel
+        mask, so images of different resolutions can share a batch. Unlike
+        detect_ingredients this raises on failure.
+        
+        Args:
+            images: List of image file paths, raw bytes or decoded PIL images
+            shortest_edge: Resize to this shortest edge instead of the
+                processor's own, e.g. a smaller one for a faster forward pass
             
-            return detected_foods
+        Returns:
+            list: One list of detected ingredients per image, in input order
+        """
+        # Load images (already decoded ones are passed through)
+        images = [decode_image(image, shortest_edge or self.min_input_edge) for image in images]
+        
+        # Process images
+        with stage('detection_preprocess'):
+            if shortest_edge and shortest_edge != self.min_input_edge:
+                inputs = self.processor(images=images, size=self.input_size(shortest_edge), return_tensors="pt")
+            else:
+                inputs = self.processor(images=images, return_tensors="pt")
         
+        return self.detect_ingredients_from_inputs(dict(inputs), [image.size for image in images])
+    
+    def detect_ingredients(self, image, shortest_edge=None):
+        """
+        Detect food ingredients in an image
+        
+        Args:
+            image: Path to the image file, or a decoded PIL image
+            shortest_edge: Resize to this shortest edge instead of the processor's own
+            
+        Returns:
+            list: List of detected ingredients
+        """
+        try:
+            return self.detect_ingredients_batch([image], shortest_edge)[0]
         except Exception as e:
             print(f"Error in detecting ingredients: {e}")
+            FALLBACKS.inc(kind='default_ingredients')
             # Return some default ingredients if detection fails
-            return ["tomato", "onion", "chicken", "rice"] 
\ No newline at end of file
+            return list(DEFAULT_INGREDIENTS)
@@ -0,0 +1,150 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def threads_per_call(concurrent_calls, total=None):
+    """
+    Intra-op threads for each of concurrent_calls model calls running side by side on total threads
+
+    Every thread that runs a torch op in parallel uses an intra-op pool of
+    the process-wide size, so calls running side by side must share the
+    cores evenly.
+
+    Args:
+        concurrent_calls: Model calls that run at the same time
+        total: Threads to share; defaults to os.cpu_count()
+    """
+    total = total or os.cpu_count() or 1
+    return max(1, total // max(1, concurrent_calls))
+
+
+def set_torch_threads(num_threads):
+    """
+    Size torch's intra-op thread pool for the whole process
+
+    The setting is not per thread: every thread adopts the last value set
+    when it first runs a parallel op. Giving models different shares of the
+    cores takes separate processes (see serve_models.py --cpus).
+    """
+    import torch
+    torch.set_num_threads(num_threads)
+
+
+def set_interop_threads(num_threads):
+    """Size the process-wide inter-op pool; only possible before torch runs any parallel work"""
+    import torch
+    try:
+        torch.set_num_interop_threads(num_threads)
+    except RuntimeError as e:
+        print(f"Could not set inter-op threads to {num_threads}: {e}")
+
+
+def _torch_threads():
+    """torch's intra-op pool size, or None before torch is imported"""
+    torch = sys.modules.get("torch")
+    return torch.get_num_threads() if torch is not None else None
+
+
+class VisionExecutor:
+    """
+    Runs the independent per-image vision tasks (caption, detection)
+
+    In "sequential" mode tasks run one after another in the calling thread.
+    In "parallel" mode every branch has its own worker threads; size torch's
+    process-wide intra-op pool with threads_per_call so the branches don't
+    oversubscribe the cores. Wall time is tracked against the summed branch
+    time so the speedup of the parallel mode can be read off stats().
+    """
+
+    def __init__(self, mode="sequential", branches=("caption", "detection"), workers_per_branch=1):
+        """
+        Args:
+            mode: "sequential" or "parallel"
+            branches: Names of the branches that get worker threads in parallel mode
+            workers_per_branch: Concurrent requests each branch may serve
+        """
+        if mode not in ("sequential", "parallel"):
+            raise ValueError(f"Unknown vision execution mode: {mode}")
+
+        self.mode = mode
+        self.branches = tuple(branches)
+        self.workers_per_branch = workers_per_branch
+        self._executors = {}
+        if mode == "parallel":
+            self._start_executors()
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._wall_time = 0.0
+        self._branch_time = 0.0
+
+    def _start_executors(self):
+        for branch in self.branches:
+            self._executors[branch] = ThreadPoolExecutor(
+                max_workers=self.workers_per_branch, thread_name_prefix=f"vision-{branch}"
+            )
+
+    def after_fork(self):
+        """Replace the branch pools in a forked child, where their threads no longer exist"""
+        self._lock = threading.Lock()
+        if self.mode == "parallel":
+            self._start_executors()
+
+    @staticmethod
+    def _timed(fn):
+        started = time.perf_counter()
+        result = fn()
+        return result, time.perf_counter() - started
+
+    def run(self, tasks):
+        """
+        Run a dict of branch name -> zero-argument callable
+
+        Returns:
+            dict: Branch name -> result
+        """
+        started = time.perf_counter()
+        if self.mode == "parallel":
+            # Each branch runs in a copy of the caller's context, so per-request
+            # state such as stage timings follows the work into the pool
+            futures = {
+                name: self._executors[name].submit(contextvars.copy_context().run, self._timed, fn)
+                if name in self._executors
+                else None
+                for name, fn in tasks.items()
+            }
+            timed = {
+                name: future.result() if future is not None else self._timed(tasks[name])
+                for name, future in futures.items()
+            }
+        else:
+            timed = {name: self._timed(fn) for name, fn in tasks.items()}
+        wall = time.perf_counter() - started
+
+        if timed:
+            with self._lock:
+                self._requests += 1
+                self._wall_time += wall
+                self._branch_time += sum(duration for _, duration in timed.values())
+
+        return {name: result for name, (result, _) in timed.items()}
+
+    def stats(self):
+        """Return mean per-request wall time, summed branch time and the resulting speedup"""
+        with self._lock:
+            requests = self._requests
+            wall = self._wall_time
+            branch = self._branch_time
+        return {
+            'mode': self.mode,
+            'branches': list(self.branches),
+            'torch_threads': _torch_threads(),
+            'requests': requests,
+            'mean_wall_ms': 1000.0 * wall / requests if requests else 0.0,
+            'mean_branch_sum_ms': 1000.0 * branch / requests if requests else 0.0,
+            'speedup': branch / wall if wall else 0.0,
+        }
@@ -0,0 +1,59 @@
+import torch
+
+# "auto" keeps the original behaviour: fp16 on GPU, fp32 on CPU
+PRECISION_MODES = ("auto", "fp32", "bf16", "int8")
+
+
+def load_dtype(precision, device):
+    """
+    Return the torch dtype to load weights in for a precision mode
+
+    int8 loads in fp32 and is quantized afterwards by apply_precision.
+    """
+    if precision not in PRECISION_MODES:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISION_MODES}")
+    if precision == "bf16":
+        return torch.bfloat16
+    if precision == "auto" and device.type == "cuda":
+        return torch.float16
+    return torch.float32
+
+
+def apply_precision(model, precision, device):
+    """
+    Convert a loaded model to the requested precision
+
+    int8 applies dynamic quantization to every nn.Linear: weights are
+    stored as int8 and activations are quantized on the fly, which cuts
+    Linear-layer memory by ~4x and speeds up CPU matmuls. Quantized kernels
+    only exist on CPU, so on GPU the model is left as loaded. Layers that
+    are not nn.Linear (convolutions, GPT-2's Conv1D, layer norms) keep
+    their original precision.
+
+    Returns:
+        The converted model (dynamic quantization returns a new module)
+    """
+    if precision == "bf16":
+        return model.to(dtype=torch.bfloat16)
+    if precision == "int8":
+        if device.type != "cpu":
+            print(f"int8 dynamic quantization is CPU-only; keeping {next(model.parameters()).dtype} on {device}")
+            return model
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def model_input_dtype(model):
+    """Floating point dtype the model's inputs must be cast to"""
+    for param in model.parameters():
+        if param.is_floating_point():
+            return param.dtype
+    return torch.float32
+
+
+def cast_inputs(inputs, dtype):
+    """Cast the floating point tensors in a dict of model inputs to dtype, leaving masks and ids alone"""
+    return {
+        k: v.to(dtype=dtype) if torch.is_tensor(v) and v.is_floating_point() else v
+        for k, v in inputs.items()
+    }
@@ -0,0 +1,93 @@
+import io
+import math
+import threading
+from PIL import Image
+from models.metrics import stage
+from models.near_duplicates import dhash
+
+
+def processor_min_edge(processor, default=0):
+    """
+    Return the shortest image edge (in pixels) a HF image processor resizes to
+
+    ViTImageProcessor uses a fixed height/width, DetrImageProcessor a
+    shortest_edge; decoding anything larger than this is wasted work.
+    """
+    size = getattr(processor, 'size', None)
+    if size is None:
+        return default
+    if isinstance(size, int):
+        return size
+
+    def _get(name):
+        if isinstance(size, dict):
+            return size.get(name)
+        return getattr(size, name, None)
+
+    if _get('shortest_edge'):
+        return int(_get('shortest_edge'))
+    return int(max(_get('height') or 0, _get('width') or 0)) or default
+
+
+def decode_image(source, min_edge=None):
+    """
+    Decode an image into an RGB PIL image
+
+    For JPEGs, min_edge enables reduced-size decoding: libjpeg scales the
+    image down by 1/2, 1/4 or 1/8 while decoding, as long as the shortest
+    edge stays at or above min_edge. A 12MP phone photo then decodes at a
+    fraction of the cost and memory.
+
+    Args:
+        source: Raw bytes, a file path, a binary file object or a PIL image
+        min_edge: Smallest shortest-edge any consumer of the image needs
+
+    Returns:
+        PIL.Image.Image: The decoded RGB image
+    """
+    if isinstance(source, Image.Image):
+        return source if source.mode == 'RGB' else source.convert('RGB')
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    with stage('image_decode'):
+        image = Image.open(source)
+        if min_edge and image.format == 'JPEG':
+            width, height = image.size
+            scale = min_edge / min(width, height)
+            if scale < 1:
+                image.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+        return image.convert('RGB')
+
+
+class SharedImage:
+    """
+    An uploaded image decoded at most once and shared by every model
+
+    Decoding is deferred until the first model asks for the image, so
+    requests answered entirely from cache never decode at all.
+    """
+
+    def __init__(self, data, min_edge=None):
+        self.data = data
+        self.min_edge = min_edge
+        self._image = None
+        self._perceptual_hash = None
+        self._lock = threading.Lock()
+
+    @property
+    def image(self):
+        with self._lock:
+            if self._image is None:
+                self._image = decode_image(self.data, self.min_edge)
+            return self._image
+    
+    @property
+    def perceptual_hash(self):
+        """dHash of the decoded image, for finding resized or recompressed copies"""
+        image = self.image
+        with self._lock:
+            if self._perceptual_hash is None:
+                with stage('perceptual_hash'):
+                    self._perceptual_hash = dhash(image)
+            return self._perceptual_hash
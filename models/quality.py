@@ -0,0 +1,182 @@
+# Per-request quality tiers and deadlines. A QualityBudget travels with the
+# request in a context variable (like the stage timings in models.metrics) and
+# is asked, stage by stage, how much work the request can still afford.
+
+import contextvars
+import time
+
+from models.metrics import REGISTRY, STAGE_SECONDS, TOKENS_PER_SECOND
+
+# None keeps the model's own setting. caption_beams 0 skips captioning;
+# max_new_tokens 0 answers with pre-built recipes instead of generating
+QUALITY_TIERS = {
+    "fast": {"caption_beams": 0, "detection_edge": 480, "max_new_tokens": 0},
+    "balanced": {"caption_beams": 1, "detection_edge": 640, "max_new_tokens": 384},
+    "quality": {"caption_beams": None, "detection_edge": None, "max_new_tokens": None},
+}
+
+# Smallest input edge a deadline can shrink detection to
+MIN_DETECTION_EDGE = QUALITY_TIERS["fast"]["detection_edge"]
+
+# Below this many tokens a generated recipe is too truncated to be worth it
+MIN_RECIPE_TOKENS = 128
+
+CAPTION_STAGES = ("caption_preprocess", "caption_encode", "caption_generate")
+DETECTION_STAGES = ("detection_preprocess", "detection_forward", "detection_postprocess")
+
+DEGRADATIONS = REGISTRY.counter(
+    "recipesnap_degradations_total", "Cheaper processing applied because of a quality tier or deadline",
+    ["kind", "reason"]
+)
+
+_current_budget = contextvars.ContextVar("quality_budget", default=None)
+
+
+def stage_estimate(stages):
+    """Expected seconds for a sequence of stages, from their mean so far; None until all have run once"""
+    means = [STAGE_SECONDS.mean(stage=name) for name in stages]
+    if any(mean is None for mean in means):
+        return None
+    return sum(means)
+
+
+class QualityBudget:
+    """
+    What one request may spend: a quality tier and an optional deadline
+
+    The tier sets fixed degradations. The deadline adds more as it runs
+    out: before each stage, the stage's cost is estimated from the mean
+    duration observed so far (recipesnap_stage_seconds), and the stage is
+    made cheaper when the remaining time cannot cover it. Until a stage has
+    run once there is nothing to estimate from, and it runs unchanged.
+    Every degradation applied is recorded, so the response can report it.
+    """
+
+    def __init__(self, tier="quality", deadline_ms=None, started=None):
+        """
+        Args:
+            tier: One of QUALITY_TIERS
+            deadline_ms: Time the whole request may take, or None for no deadline
+            started: time.monotonic() the deadline counts from; defaults to now
+        """
+        if tier not in QUALITY_TIERS:
+            raise ValueError(f"Unknown quality tier '{tier}', expected one of {sorted(QUALITY_TIERS)}")
+        if deadline_ms is not None and deadline_ms <= 0:
+            raise ValueError("deadline_ms must be positive")
+        self.tier = tier
+        self.settings = QUALITY_TIERS[tier]
+        self.deadline_ms = deadline_ms
+        self.started = time.monotonic() if started is None else started
+        self.degradations = []
+
+    def remaining(self):
+        """Seconds left before the deadline (negative once missed), or None without one"""
+        if self.deadline_ms is None:
+            return None
+        return self.started + self.deadline_ms / 1000.0 - time.monotonic()
+
+    def affords(self, seconds):
+        """True unless the deadline leaves less than seconds; unknown costs are always affordable"""
+        remaining = self.remaining()
+        return remaining is None or seconds is None or remaining >= seconds
+
+    def degrade(self, degradation, reason):
+        """Record a degradation ("tier" or "deadline" reason) once per request"""
+        if degradation in self.degradations:
+            return
+        self.degradations.append(degradation)
+        DEGRADATIONS.inc(kind=degradation.split("=", 1)[0], reason=reason)
+
+    def caption_beams(self, default_beams, reserve=None):
+        """
+        Beams to caption with: default_beams, 1 for greedy search or 0 to skip captioning
+
+        Captions do not feed the recipes, so they are the first thing given
+        up. reserve is the estimated time later stages need.
+        """
+        beams = self.settings["caption_beams"]
+        reason = "tier"
+        if beams is None or beams >= default_beams:
+            beams = default_beams
+            reason = "deadline"
+
+        estimate = stage_estimate(CAPTION_STAGES)
+        if estimate is not None:
+            reserve = reserve or 0.0
+            if beams > 1 and not self.affords(estimate + reserve):
+                beams, reason = 1, "deadline"
+            # Beam search runs every step for each beam; greedy costs about one beam's share
+            if beams == 1 and not self.affords(estimate / default_beams + reserve):
+                beams, reason = 0, "deadline"
+
+        if beams == 0:
+            self.degrade("caption_skipped", reason)
+        elif beams < default_beams:
+            self.degrade("caption_greedy", reason)
+        return beams
+
+    def detection_edge(self, default_edge):
+        """Shortest input edge to detect at, at most default_edge (the processor's own)"""
+        edge = self.settings["detection_edge"]
+        reason = "tier"
+        if edge is None or edge >= default_edge:
+            edge = default_edge
+            reason = "deadline"
+
+        estimate = stage_estimate(DETECTION_STAGES)
+        if edge > MIN_DETECTION_EDGE and estimate is not None:
+            # DETR's cost grows with the pixel count
+            if not self.affords(estimate * (edge / default_edge) ** 2):
+                edge, reason = MIN_DETECTION_EDGE, "deadline"
+
+        if edge < default_edge:
+            self.degrade(f"detection_edge={edge}", reason)
+        return edge
+
+    def limits_recipes(self):
+        """True if recipe generation may be cut short or replaced for this request"""
+        return self.settings["max_new_tokens"] is not None or self.deadline_ms is not None
+
+    def recipe_tokens(self, default_tokens):
+        """
+        Most new tokens a generated recipe may have: None for the model's own
+        limit, a smaller cap, or 0 when pre-built recipes should be used instead
+
+        Args:
+            default_tokens: Most tokens the model generates without a cap
+        """
+        tokens = self.settings["max_new_tokens"]
+        if tokens == 0:
+            self.degrade("recipes_retrieved", "tier")
+            return 0
+        reason = "tier"
+
+        remaining = self.remaining()
+        tokens_per_second = TOKENS_PER_SECOND.mean()
+        if remaining is not None and tokens_per_second:
+            prefill = STAGE_SECONDS.mean(stage="recipe_prefill") or 0.0
+            affordable = int((remaining - prefill) * tokens_per_second)
+            if affordable < MIN_RECIPE_TOKENS:
+                self.degrade("recipes_retrieved", "deadline")
+                return 0
+            if affordable < (tokens or default_tokens):
+                tokens, reason = affordable, "deadline"
+
+        if tokens is None or tokens >= default_tokens:
+            return None
+        self.degrade(f"max_new_tokens={tokens}", reason)
+        return tokens
+
+    def to_dict(self):
+        return {"tier": self.tier, "deadline_ms": self.deadline_ms, "degradations": list(self.degradations)}
+
+
+def set_budget(budget):
+    """Make budget the current request's (context's) budget"""
+    _current_budget.set(budget)
+
+
+def current_budget():
+    """The current request's budget; full quality without a deadline outside of requests"""
+    budget = _current_budget.get()
+    return budget if budget is not None else QualityBudget()
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_ingredients(ingredients):
+    """Return the canonical form of an ingredient list: lowercased, de-duplicated and sorted"""
+    return tuple(sorted({str(i).strip().lower() for i in ingredients if str(i).strip()}))
+
+
+class RecipeCache:
+    """
+    Recipe cache keyed on the canonical ingredient set.
+
+    ["onion", "tomato"] and ["Tomato", "onion", "onion"] share an entry. Each
+    entry keeps up to variants_per_key independently generated results, and
+    a lookup only counts as a hit once all variants exist, so users still see
+    sampling diversity instead of the same recipe forever. Variants expire
+    after ttl_seconds and whole entries are evicted least-recently-used.
+
+    With a path, entries (and per-key request counts used by the warm-up
+    command) are persisted to a JSON file and reloaded on start.
+    """
+
+    def __init__(self, max_entries=1024, variants_per_key=3, ttl_seconds=7 * 24 * 3600,
+                 path=None, save_interval=5.0):
+        self.max_entries = max_entries
+        self.variants_per_key = max(1, variants_per_key)
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.save_interval = save_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        self.hits = 0
+        self.misses = 0
+
+        if self.path:
+            self._load()
+
+    @staticmethod
+    def make_key(ingredients, model_id, settings=None):
+        """Build a cache key from the canonical ingredient set, model id and generation settings"""
+        settings_str = json.dumps(settings or {}, sort_keys=True, default=str)
+        settings_hash = hashlib.sha256(f"{model_id}|{settings_str}".encode('utf-8')).hexdigest()[:16]
+        return f"{settings_hash}|{','.join(normalize_ingredients(ingredients))}"
+
+    @staticmethod
+    def ingredients_from_key(key):
+        """Recover the canonical ingredient list from a cache key"""
+        ingredients = key.split('|', 1)[1]
+        return ingredients.split(',') if ingredients else []
+
+    def _new_entry(self):
+        return {'variants': [], 'requests': 0}
+
+    def _expire(self, entry, now):
+        if self.ttl_seconds:
+            entry['variants'] = [v for v in entry['variants'] if now - v['created'] < self.ttl_seconds]
+
+    def _entry(self, key):
+        # Caller must hold the lock
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._new_entry()
+            self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def get(self, key):
+        """
+        Return a cached result for key, or None when another variant should be generated
+
+        Every call counts as a request for key, which the warm-up command
+        uses to find the most common ingredient combinations.
+        """
+        with self._lock:
+            entry = self._entry(key)
+            entry['requests'] += 1
+            self._dirty = True
+            self._expire(entry, time.time())
+            if len(entry['variants']) < self.variants_per_key:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return random.choice(entry['variants'])['recipes']
+
+    def peek(self, key):
+        """Return any cached variant for key, even before all variants exist, without counting a request"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._expire(entry, time.time())
+            if not entry['variants']:
+                return None
+            return random.choice(entry['variants'])['recipes']
+
+    def add(self, key, recipes):
+        """Store one more generated variant for key"""
+        with self._lock:
+            entry = self._entry(key)
+            self._expire(entry, time.time())
+            entry['variants'].append({'created': time.time(), 'recipes': recipes})
+            # Keep the newest variants if we somehow overshoot
+            del entry['variants'][:-self.variants_per_key]
+            self._dirty = True
+        self._maybe_save()
+
+    def missing_variants(self, key):
+        """Number of variants still to generate before key is fully cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return self.variants_per_key
+            self._expire(entry, time.time())
+            return self.variants_per_key - len(entry['variants'])
+
+    def most_requested(self, limit):
+        """Return up to limit keys ordered by how often they were requested"""
+        with self._lock:
+            ranked = sorted(self._entries.items(), key=lambda item: item[1]['requests'], reverse=True)
+        return [key for key, entry in ranked[:limit] if entry['requests'] > 0]
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error loading recipe cache from {self.path}: {e}")
+            return
+
+        now = time.time()
+        for key, entry in data.get('entries', {}).items():
+            self._expire(entry, now)
+            self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _maybe_save(self):
+        if self.path and time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def save(self):
+        """Write the cache to its backing file if anything changed"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps({'entries': self._entries})
+            self._dirty = False
+            self._last_save = time.monotonic()
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving recipe cache to {self.path}: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def stats(self):
+        """Return hit/miss counters and the number of cached ingredient sets"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'variants_per_key': self.variants_per_key,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -1,166 +1,217 @@
 import os
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import copy
+import contextvars
+import threading
+import time
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteriaList, TextIteratorStreamer
 import torch
+from models.recipe_parser import RecipeStreamParser, StructuredRecipeParser
+from models.structured_output import SCHEMA_OPENING, STRUCTURED_PROMPT_SUFFIX, schema_constraints
+from models.fallbacks import FALLBACK_RECIPES
+from models.precision import load_dtype, apply_precision
+from models.speculative import SpeculationMonitor, fix_draft_lookahead
+from models.metrics import stage, GENERATED_TOKENS
+from models.weight_sharing import map_weights
+from models.artifacts import default_artifact_dir, find_artifact
+from models.cancellation import CancellationToken, RequestCancelled
+
+# Everything in the prompt before the ingredient list; identical for every
+# request, so its key/value cache is computed once at load time
+PROMPT_PREFIX = "<s>[INST] You are a helpful cooking assistant. Create a delicious recipe using all or some of these ingredients:"
+
+PROMPT_SUFFIX = """ {ingredients}.
+        
+Please provide:
+1. A creative recipe name
+2. List of ingredients with measurements
+3. Step-by-step cooking instructions
+4. A brief description of the dish
+5. Preparation time and cooking time
+
+Keep the recipe practical and make it taste great! [/INST]"""
 
 class RecipeGenerationModel:
-    def __init__(self, model_name="mistralai/Mistral-7B-Instruct-v0.2"):
+    def __init__(self, model_name="mistralai/Mistral-7B-Instruct-v0.2", precision="auto", prefix_cache=True,
+                 draft_model_name=None, draft_lookahead=5, mmap_weights=False, artifact_dir=None,
+                 structured_output=False):
+        self.model_name = model_name
+        self.precision = precision
+        self.prefix_ids = None
+        self.prefix_cache = None
+        self.draft_model = None
+        self.draft_lookahead = draft_lookahead
+        # Constrain responses to a fixed schema and stop once it is complete
+        self.structured_output = structured_output
+        self.mmap_weights = mmap_weights
+        self.weight_mapping = None
+        # Serving-ready artifacts from compile_artifacts.py, if any
+        self.artifact_dir = artifact_dir if artifact_dir is not None else default_artifact_dir()
+        self.artifact = None
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.fallback_recipes = self._get_fallback_recipes()
+        
+        # Generation parameters
+        self.max_length = 1024
+        self.temperature = 0.7
+        self.top_p = 0.9
+        self.repetition_penalty = 1.1
         
         # Initialize tokenizer and model
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                low_cpu_mem_usage=True
-            )
-            self.model.to(self.device)
+            self.artifact = find_artifact(self.artifact_dir, "recipe", model_name, precision, self.device)
+            self.tokenizer = AutoTokenizer.from_pretrained(self.artifact.path if self.artifact else model_name)
+            # Batched prompts are left-padded so every sequence ends where generation starts
+            self.tokenizer.padding_side = "left"
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.model = self._load_model(model_name, self.artifact)
+            if mmap_weights:
+                self.weight_mapping = map_weights(self.model, self.artifact.path if self.artifact else model_name)
             
-            # Generation parameters
-            self.max_length = 1024
-            self.temperature = 0.7
-            self.top_p = 0.9
-            self.repetition_penalty = 1.1
+            if prefix_cache:
+                self._build_prefix_cache()
         except Exception as e:
             print(f"Error loading model: {e}")
             self.model_loaded = False
-            self.fallback_recipes = self._get_fallback_recipes()
         else:
             self.model_loaded = True
+            if draft_model_name:
+                self._load_draft_model(draft_model_name)
+            self.monitor = SpeculationMonitor(self.model, self.draft_model)
+    
+    def _load_model(self, model_name, artifact):
+        """Load a causal LM in self.precision, from its artifact when there is one"""
+        if artifact:
+            model = artifact.load_model(AutoModelForCausalLM)
+            return model.to(self.device)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=load_dtype(self.precision, self.device),
+            low_cpu_mem_usage=True
+        )
+        model.to(self.device)
+        return apply_precision(model, self.precision, self.device)
+    
+    def _load_draft_model(self, draft_model_name):
+        """
+        Load a small model sharing the tokenizer to propose tokens for assisted decoding
+        
+        The draft guesses up to draft_lookahead tokens at a time and the main model
+        checks them all in one forward pass, keeping the longest prefix it
+        agrees with, so the output distribution is unchanged. A draft that
+        fails to load or uses a different vocabulary is skipped.
+        """
+        try:
+            artifact = find_artifact(self.artifact_dir, "recipe", draft_model_name, self.precision, self.device)
+            draft_tokenizer = AutoTokenizer.from_pretrained(artifact.path if artifact else draft_model_name)
+            if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                print(f"Draft model {draft_model_name} uses a different tokenizer; speculative decoding disabled")
+                return
+            draft_model = self._load_model(draft_model_name, artifact)
+            if self.mmap_weights:
+                map_weights(draft_model, artifact.path if artifact else draft_model_name)
+            # A fixed lookahead instead of transformers' adaptive schedule, so
+            # the configured value is what actually runs
+            fix_draft_lookahead(draft_model, self.draft_lookahead)
+        except Exception as e:
+            print(f"Error loading draft model: {e}")
+            return
+        self.draft_model = draft_model
+        print(f"Speculative decoding with draft model {draft_model_name}, lookahead {self.draft_lookahead}")
+    
+    def generation_stats(self):
+        """Tokens/sec of single-recipe generation and, with a draft model, its acceptance rate"""
+        if not self.model_loaded:
+            return {"speculative": False, "calls": 0}
+        stats = self.monitor.stats()
+        stats["draft_lookahead"] = self.draft_lookahead if self.draft_model is not None else None
+        return stats
     
     def _get_fallback_recipes(self):
         """Return pre-defined recipes for common ingredient combinations"""
-        recipes = {
-            "tomato_onion_chicken": [
-                {
-                    "name": "Quick Chicken Cacciatore",
-                    "ingredients": [
-                        "2 chicken breasts", "1 onion, diced", "2 tomatoes, chopped",
-                        "2 cloves garlic, minced", "1 tbsp olive oil",
-                        "1 tsp dried oregano", "Salt and pepper to taste"
-                    ],
-                    "instructions": [
-                        "Season chicken with salt and pepper.",
-                        "Heat olive oil in a skillet over medium heat.",
-                        "Cook chicken until browned on both sides, about 5 minutes per side.",
-                        "Add onions and garlic, cook until softened.",
-                        "Add tomatoes and oregano, simmer for 15 minutes until sauce thickens.",
-                        "Serve hot with pasta or rice."
-                    ]
-                }
-            ],
-            "apple_cinnamon": [
-                {
-                    "name": "Simple Apple Crumble",
-                    "ingredients": [
-                        "3 apples, peeled and sliced", "1/2 cup flour", 
-                        "1/2 cup rolled oats", "1/4 cup brown sugar",
-                        "1/4 cup butter, cold and cubed", "1 tsp cinnamon",
-                        "1/4 tsp nutmeg", "Pinch of salt"
-                    ],
-                    "instructions": [
-                        "Preheat oven to 350°F (175°C).",
-                        "Place apple slices in a baking dish.",
-                        "Mix flour, oats, sugar, cinnamon, nutmeg, and salt in a bowl.",
-                        "Cut in butter until mixture resembles coarse crumbs.",
-                        "Sprinkle topping over apples.",
-                        "Bake for 35-40 minutes until golden and bubbly.",
-                        "Serve warm with ice cream if desired."
-                    ]
-                }
-            ],
-            "pasta_tomato_cheese": [
-                {
-                    "name": "Quick Pasta Marinara",
-                    "ingredients": [
-                        "8 oz pasta", "2 tomatoes, diced", "1/4 cup grated cheese",
-                        "2 cloves garlic, minced", "1 tbsp olive oil",
-                        "1 tsp dried basil", "Salt and pepper to taste"
-                    ],
-                    "instructions": [
-                        "Cook pasta according to package directions.",
-                        "In a separate pan, heat olive oil over medium heat.",
-                        "Add garlic and cook for 30 seconds until fragrant.",
-                        "Add tomatoes and basil, cook for 5-7 minutes.",
-                        "Drain pasta and add to the sauce.",
-                        "Top with cheese and serve immediately."
-                    ]
-                }
-            ]
-        }
-        return recipes
+        return FALLBACK_RECIPES
+    
+    def is_fallback_recipe(self, recipe):
+        """Return True if recipe is one of the pre-defined fallback recipes rather than a generated one"""
+        return any(recipe == fallback for recipes in self.fallback_recipes.values() for fallback in recipes)
+    
+    def generation_settings(self):
+        """Model id and sampling settings that determine what generate_recipes produces"""
+        settings = {"model": self.model_name, "precision": self.precision, **self._generation_kwargs()}
+        if self.structured_output:
+            settings["output"] = "structured"
+        return settings
     
     def _format_prompt(self, ingredients):
         """Format the ingredients into a prompt for the model"""
         ingredients_str = ", ".join(ingredients)
-        prompt = f"""<s>[INST] You are a helpful cooking assistant. Create a delicious recipe using all or some of these ingredients: {ingredients_str}.
+        suffix = STRUCTURED_PROMPT_SUFFIX if self.structured_output else PROMPT_SUFFIX
+        return PROMPT_PREFIX + suffix.format(ingredients=ingredients_str)
+    
+    def _build_prefix_cache(self):
+        """Run the constant prompt prefix through the model once and keep its past_key_values"""
+        prefix_ids = self.tokenizer(PROMPT_PREFIX, return_tensors="pt").input_ids.to(self.device)
+        with torch.no_grad():
+            outputs = self.model(input_ids=prefix_ids, use_cache=True)
+        self.prefix_ids = prefix_ids[0]
+        self.prefix_cache = outputs.past_key_values
+        print(f"Cached key/values for {len(self.prefix_ids)} prompt prefix tokens")
+    
+    def _copy_prefix_cache(self, length):
+        """Return a private copy of the prefix cache truncated to length tokens"""
+        if hasattr(self.prefix_cache, "crop"):
+            # Cache objects are extended in place during generation
+            cache = copy.deepcopy(self.prefix_cache)
+            if length < len(self.prefix_ids):
+                cache.crop(length)
+            return cache
+        # Legacy tuple caches are never modified, so slicing views is enough
+        return tuple(
+            tuple(tensor[:, :, :length] for tensor in layer) for layer in self.prefix_cache
+        )
+    
+    def _prepare_inputs(self, ingredients):
+        """
+        Tokenize the prompt and, when possible, reuse the cached prefix
         
-Please provide:
-1. A creative recipe name
-2. List of ingredients with measurements
-3. Step-by-step cooking instructions
-4. A brief description of the dish
-5. Preparation time and cooking time
-
-Keep the recipe practical and make it taste great! [/INST]"""
-        return prompt
+        Only the ingredient list and the template tail are run through the
+        model here; generate then starts from a cache covering all but the
+        last prompt token, which works the same across transformers versions.
+        
+        Returns:
+            tuple: (input_ids, extra keyword arguments for generate)
+        """
+        with stage('recipe_prefill'):
+            prompt = self._format_prompt(ingredients)
+            input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to(self.device)
+            if self.prefix_cache is None:
+                return input_ids, {}
+            
+            # The prefix can tokenize differently at its boundary with the
+            # ingredient list, so only reuse the tokens that actually match
+            prompt_ids = input_ids[0]
+            limit = min(len(self.prefix_ids), len(prompt_ids) - 1)
+            matches = (prompt_ids[:limit] == self.prefix_ids[:limit]).tolist()
+            cached = matches.index(False) if False in matches else limit
+            if cached == 0:
+                return input_ids, {}
+            
+            cache = self._copy_prefix_cache(cached)
+            with torch.no_grad():
+                if len(prompt_ids) - 1 > cached:
+                    outputs = self.model(input_ids=input_ids[:, cached:-1], past_key_values=cache, use_cache=True)
+                    cache = outputs.past_key_values
+            
+            return input_ids, {"past_key_values": cache, "attention_mask": torch.ones_like(input_ids)}
     
     def _parse_response(self, response):
         """Parse the model's response into a structured recipe format"""
         try:
-            lines = response.split('\n')
-            recipe = {}
-            
-            # Extract recipe name (typically the first non-empty line)
-            for line in lines:
-                if line.strip() and not line.lower().startswith(('recipe', 'here', '#')):
-                    recipe['name'] = line.strip().strip('#').strip()
-                    break
-            
-            # Extract ingredients and instructions
-            in_ingredients = False
-            in_instructions = False
-            ingredients = []
-            instructions = []
-            
-            for line in lines:
-                line = line.strip()
-                
-                # Check section headers
-                if "ingredient" in line.lower() and (":" in line or "-" in line or "#" in line):
-                    in_ingredients = True
-                    in_instructions = False
-                    continue
-                elif "instruction" in line.lower() and (":" in line or "-" in line or "#" in line):
-                    in_ingredients = False
-                    in_instructions = True
-                    continue
-                elif "preparation time" in line.lower() or "cooking time" in line.lower():
-                    in_ingredients = False
-                    in_instructions = False
-                
-                # Skip empty lines and section headers
-                if not line or line.startswith("#") or ":" in line and len(line) < 20:
-                    continue
-                
-                # Collect ingredients and instructions
-                if in_ingredients and line:
-                    if line.startswith("-") or line.startswith("*"):
-                        line = line[1:].strip()
-                    if any(char.isdigit() for char in line):  # Likely an ingredient with measurement
-                        ingredients.append(line)
-                
-                if in_instructions and line:
-                    if line.startswith("-") or line.startswith("*"):
-                        line = line[1:].strip()
-                    if line[0].isdigit() and line[1] in ['.', ')']: # Numbered instruction
-                        line = line[2:].strip()
-                    instructions.append(line)
-            
-            recipe["ingredients"] = ingredients
-            recipe["instructions"] = instructions
-            
-            return recipe
+            with stage('recipe_parse'):
+                parser = self._new_parser()
+                parser.feed(response)
+                parser.close()
+                return parser.recipe
         
         except Exception as e:
             print(f"Error parsing recipe response: {e}")
@@ -170,50 +221,294 @@ Keep the recipe practical and make it taste great! [/INST]"""
                 "instructions": ["Step 1: Cook ingredients", "Step 2: Serve and enjoy"]
             }
     
-    def generate_recipes(self, ingredients):
+    def _new_parser(self):
+        return StructuredRecipeParser() if self.structured_output else RecipeStreamParser()
+    
+    def _generation_kwargs(self, max_new_tokens=None):
+        """Sampling settings shared by every generate call; max_new_tokens replaces max_length"""
+        length = {"max_new_tokens": max_new_tokens} if max_new_tokens else {"max_length": self.max_length}
+        return {
+            **length,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "repetition_penalty": self.repetition_penalty,
+            "do_sample": True
+        }
+    
+    def _generation_controls(self, prompt_length, cancellation=None):
+        """generate() logits processors and stopping criteria: the schema's and the cancellation token"""
+        controls = schema_constraints(self.tokenizer, prompt_length) if self.structured_output else {}
+        if cancellation is not None:
+            controls["stopping_criteria"] = controls.get("stopping_criteria", StoppingCriteriaList())
+            controls["stopping_criteria"].append(cancellation)
+        return controls
+    
+    def _assisted_generate(self, input_ids, max_new_tokens=None, cancellation=None, **kwargs):
+        """
+        Generate a single sequence, through the draft model when one is loaded
+        
+        Assisted decoding only supports one sequence per call, so batched
+        generation always uses plain generate.
+        
+        Raises:
+            RequestCancelled: cancellation was cancelled before the sequence was complete
+        """
+        if self.draft_model is not None:
+            kwargs["assistant_model"] = self.draft_model
+        kwargs.update(self._generation_controls(input_ids.shape[1], cancellation))
+        if cancellation is not None:
+            cancellation.raise_if_cancelled('recipe_generate')
+        self.monitor.start()
+        output = None
+        started = time.perf_counter()
+        try:
+            with stage('recipe_generate'), torch.no_grad():
+                output = self.model.generate(input_ids, **kwargs, **self._generation_kwargs(max_new_tokens))
+        finally:
+            self.monitor.stop(None if output is None else output.shape[1] - input_ids.shape[1])
+        if cancellation is not None:
+            cancellation.raise_if_cancelled('recipe_generate', started)
+        return output
+    
+    def _decode_recipe(self, output_ids):
+        """Decode one generated sequence and parse the text after the prompt"""
+        response = self.tokenizer.decode(output_ids, skip_special_tokens=True)
+        
+        # Extract the response after the prompt
+        response = response.split("[/INST]")[-1].strip()
+        
+        # Parse the response
+        return self._parse_response(response)
+    
+    def _generate_padded_batch(self, ingredient_lists, num_candidates, max_new_tokens=None, cancellation=None):
+        """Run one left-padded batch of prompts through a single generate call"""
+        prompts = [self._format_prompt(ingredients) for ingredients in ingredient_lists]
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+        controls = self._generation_controls(inputs.input_ids.shape[1], cancellation)
+        
+        started = time.perf_counter()
+        with stage('recipe_batch_generate'), torch.no_grad():
+            output = self.model.generate(
+                **inputs,
+                num_return_sequences=num_candidates,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **controls,
+                **self._generation_kwargs(max_new_tokens)
+            )
+        if cancellation is not None:
+            cancellation.raise_if_cancelled('recipe_batch_generate', started)
+        # Sequences that finish early are padded up to the longest one
+        GENERATED_TOKENS.inc(int((output[:, inputs.input_ids.shape[1]:] != self.tokenizer.pad_token_id).sum()))
+        
+        # Candidates for the same prompt are adjacent in the output
+        recipes = [self._decode_recipe(sequence) for sequence in output]
+        return [recipes[i:i + num_candidates] for i in range(0, len(recipes), num_candidates)]
+    
+    def generate_recipes_batch(self, ingredient_lists, num_candidates=1, batch_size=8, max_new_tokens=None,
+                               cancellation=None):
+        """
+        Generate recipes for many ingredient lists using padded batches
+        
+        Prompts are sorted by length before batching to keep padding low, and
+        a batch that fails falls back for its own entries only. Batched
+        generation does not use the prefix cache.
+        
+        Args:
+            ingredient_lists: List of ingredient lists
+            num_candidates: Recipes to sample per ingredient list
+            batch_size: Ingredient lists per generate call
+            max_new_tokens: Cap on each recipe's length, below the model's max_length
+            cancellation: CancellationToken stopping the running batch and
+                dropping the remaining ones once cancelled
+            
+        Returns:
+            list: One list of num_candidates recipe dictionaries per ingredient list
+            
+        Raises:
+            RequestCancelled: The token was cancelled before every batch was done
+        """
+        fallback = [self.fallback_recipes["tomato_onion_chicken"][0]]
+        results = [fallback for _ in ingredient_lists]
+        if not self.model_loaded:
+            return results
+        
+        pending = [i for i, ingredients in enumerate(ingredient_lists) if ingredients]
+        pending.sort(key=lambda i: len(self._format_prompt(ingredient_lists[i])))
+        
+        for start in range(0, len(pending), batch_size):
+            indices = pending[start:start + batch_size]
+            if cancellation is not None:
+                batches_left = -(-(len(pending) - start) // batch_size)
+                cancellation.raise_if_cancelled(
+                    'recipe_batch_generate', estimate_stages=('recipe_batch_generate',) * batches_left
+                )
+            try:
+                batch = self._generate_padded_batch(
+                    [ingredient_lists[i] for i in indices], num_candidates, max_new_tokens, cancellation
+                )
+            except RequestCancelled:
+                raise
+            except Exception as e:
+                print(f"Error generating recipe batch: {e}")
+                continue
+            for i, recipes in zip(indices, batch):
+                results[i] = recipes
+        
+        return results
+    
+    def generate_recipes(self, ingredients, num_candidates=1, max_new_tokens=None, cancellation=None):
         """
         Generate recipe recommendations based on detected ingredients
         
         Args:
             ingredients: List of detected ingredients
+            num_candidates: Number of alternative recipes to sample; more than
+                one are produced by a single batched generate call
+            max_new_tokens: Cap on the recipe's length, below the model's
+                max_length; a cut-off recipe keeps whatever was parsed so far
+            cancellation: CancellationToken ending generation early once cancelled
             
         Returns:
             list: List of recipe dictionaries
+            
+        Raises:
+            RequestCancelled: The token was cancelled before the recipes were complete
         """
         # If model failed to load, use fallback recipes
         if not self.model_loaded or not ingredients:
             # Return a default fallback recipe
             return [self.fallback_recipes["tomato_onion_chicken"][0]]
         
+        if num_candidates > 1:
+            return self.generate_recipes_batch(
+                [ingredients], num_candidates=num_candidates, max_new_tokens=max_new_tokens,
+                cancellation=cancellation
+            )[0]
+        
         try:
-            # Create prompt from ingredients
-            prompt = self._format_prompt(ingredients)
+            # Create prompt from ingredients, reusing the cached prefix
+            input_ids, cache_kwargs = self._prepare_inputs(ingredients)
             
             # Generate recipe
-            input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to(self.device)
+            output = self._assisted_generate(
+                input_ids, max_new_tokens=max_new_tokens, cancellation=cancellation, **cache_kwargs
+            )
             
-            with torch.no_grad():
-                output = self.model.generate(
-                    input_ids,
-                    max_length=self.max_length,
-                    temperature=self.temperature,
-                    top_p=self.top_p,
-                    repetition_penalty=self.repetition_penalty,
-                    do_sample=True
-                )
+            # Return as a list of recipes
+            return [self._decode_recipe(output[0])]
+        
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            print(f"Error generating recipes: {e}")
+            # Return a default fallback recipe
+            return [self.fallback_recipes["tomato_onion_chicken"][0]] 
+    
+    def stream_recipe_events(self, ingredients, max_new_tokens=None, cancellation=None):
+        """
+        Generate a recipe and yield structured events as soon as they are known
+        
+        Generation runs in a background thread feeding a TextIteratorStreamer;
+        the text is parsed incrementally, so the recipe name, each ingredient
+        and each instruction step are emitted the moment their line completes.
+        
+        Closing the generator before "done" (e.g. when the client went away)
+        stops generation at the next token instead of letting it run on.
+        
+        Args:
+            ingredients: List of detected ingredients
+            max_new_tokens: Cap on the recipe's length, below the model's max_length
+            cancellation: CancellationToken ending generation early once cancelled;
+                the recipe is then cut off where it was
             
-            response = self.tokenizer.decode(output[0], skip_special_tokens=True)
+        Yields:
+            tuple: (event, data) pairs. Events are "token" (raw text),
+            "name", "ingredient", "instruction", "error" and finally "done",
+            whose data holds the full recipe, timing information and, when
+            cancellation cut the recipe off, the reason as "cancelled"
+        """
+        started = time.perf_counter()
+        first_content_ms = None
+        
+        def timing():
+            return {
+                "first_content_ms": first_content_ms,
+                "total_ms": 1000.0 * (time.perf_counter() - started)
+            }
+        
+        # If model failed to load, stream the fallback recipe in one go
+        if not self.model_loaded or not ingredients:
+            recipe = self.fallback_recipes["tomato_onion_chicken"][0]
+            yield "name", recipe["name"]
+            for item in recipe["ingredients"]:
+                yield "ingredient", item
+            for step in recipe["instructions"]:
+                yield "instruction", step
+            yield "done", dict(recipe=recipe, fallback=True, **timing())
+            return
+        
+        parser = self._new_parser()
+        if self.structured_output:
+            # The prompt ends with the schema's opening, which the streamer skips
+            parser.feed(SCHEMA_OPENING)
+        errors = []
+        cancelled = []
+        cancellation = cancellation or CancellationToken()
+        
+        try:
+            input_ids, cache_kwargs = self._prepare_inputs(ingredients)
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
             
-            # Extract the response after the prompt
-            response = response.split("[/INST]")[-1].strip()
+            def run_generate():
+                try:
+                    self._assisted_generate(
+                        input_ids, max_new_tokens, cancellation=cancellation, streamer=streamer, **cache_kwargs
+                    )
+                except RequestCancelled as e:
+                    # The recipe stays cut off where it was
+                    cancelled.append(e.reason)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    # Unblock the consumer, which would otherwise wait forever if
+                    # generate() never ran or failed; after a generate() that ended
+                    # the streamer itself this only queues a stop nobody reads
+                    streamer.end()
             
-            # Parse the response
-            recipe = self._parse_response(response)
+            # In a copy of this context, so per-request state such as metrics being recorded follows generation
+            thread = threading.Thread(
+                target=contextvars.copy_context().run, args=(run_generate,), name="recipe-stream", daemon=True
+            )
+            thread.start()
             
-            # Return as a list of recipes
-            return [recipe]
+            finished = False
+            try:
+                for text in streamer:
+                    if not text:
+                        continue
+                    yield "token", text
+                    for event, value in parser.feed(text):
+                        if first_content_ms is None:
+                            first_content_ms = 1000.0 * (time.perf_counter() - started)
+                        yield event, value
+                finished = True
+            finally:
+                if not finished:
+                    # Nobody reads the rest of the recipe
+                    cancellation.cancel("closed")
+                thread.join()
+            
+            for event, value in parser.close():
+                yield event, value
+            
+            if errors:
+                raise errors[0]
         
         except Exception as e:
-            print(f"Error generating recipes: {e}")
-            # Return a default fallback recipe
-            return [self.fallback_recipes["tomato_onion_chicken"][0]] 
\ No newline at end of file
+            print(f"Error streaming recipe: {e}")
+            yield "error", str(e)
+            recipe = self.fallback_recipes["tomato_onion_chicken"][0]
+            yield "done", dict(recipe=recipe, fallback=True, **timing())
+            return
+        
+        yield "done", dict(recipe=parser.recipe, fallback=False, cancelled=cancelled[0] if cancelled else None, **timing())
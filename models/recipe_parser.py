@@ -0,0 +1,195 @@
+class RecipeStreamParser:
+    """
+    Incremental parser for free-text recipe responses
+
+    Text can be fed in arbitrary chunks as it is generated. Every time a line
+    is completed the parser updates the recipe and returns structured events
+    for whatever became known: the recipe name, each ingredient and each
+    instruction step. Feeding a whole response at once and calling close()
+    gives the same recipe RecipeGenerationModel._parse_response returns.
+    """
+
+    def __init__(self):
+        self.name = None
+        self.ingredients = []
+        self.instructions = []
+        self._buffer = ""
+        self._in_ingredients = False
+        self._in_instructions = False
+
+    @property
+    def recipe(self):
+        """The recipe parsed so far, in the same shape as _parse_response"""
+        recipe = {}
+        if self.name is not None:
+            recipe['name'] = self.name
+        recipe['ingredients'] = list(self.ingredients)
+        recipe['instructions'] = list(self.instructions)
+        return recipe
+
+    def feed(self, text):
+        """
+        Add a chunk of generated text
+
+        Returns:
+            list: (event, value) tuples for every item completed by this chunk
+        """
+        self._buffer += text
+        events = []
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            events.extend(self._parse_line(line))
+        return events
+
+    def close(self):
+        """Flush the final, unterminated line and return its events"""
+        line, self._buffer = self._buffer, ""
+        return self._parse_line(line) if line else []
+
+    def _parse_line(self, raw_line):
+        events = []
+
+        # Recipe name is the first non-empty line that isn't a preamble or header
+        if self.name is None and raw_line.strip() and not raw_line.lower().startswith(('recipe', 'here', '#')):
+            self.name = raw_line.strip().strip('#').strip()
+            events.append(('name', self.name))
+
+        line = raw_line.strip()
+        lower = line.lower()
+
+        # Check section headers
+        if "ingredient" in lower and (":" in line or "-" in line or "#" in line):
+            self._in_ingredients = True
+            self._in_instructions = False
+            return events
+        elif "instruction" in lower and (":" in line or "-" in line or "#" in line):
+            self._in_ingredients = False
+            self._in_instructions = True
+            return events
+        elif "preparation time" in lower or "cooking time" in lower:
+            self._in_ingredients = False
+            self._in_instructions = False
+
+        # Skip empty lines and section headers
+        if not line or line.startswith("#") or ":" in line and len(line) < 20:
+            return events
+
+        # Collect ingredients and instructions
+        if self._in_ingredients:
+            item = line[1:].strip() if line.startswith(("-", "*")) else line
+            if any(char.isdigit() for char in item):  # Likely an ingredient with measurement
+                self.ingredients.append(item)
+                events.append(('ingredient', item))
+
+        if self._in_instructions:
+            step = line[1:].strip() if line.startswith(("-", "*")) else line
+            if len(step) > 1 and step[0].isdigit() and step[1] in ['.', ')']:  # Numbered instruction
+                step = step[2:].strip()
+            self.instructions.append(step)
+            events.append(('instruction', step))
+
+        return events
+
+
+class StructuredRecipeParser:
+    """
+    Incremental parser for responses in the structured recipe schema
+
+    The schema (see models.structured_output) is line based:
+
+        Name: <recipe name>
+        Ingredients:
+        - <quantity> <ingredient>
+        Instructions:
+        1. <step>
+        END
+
+    Unlike RecipeStreamParser nothing is guessed: each line's section is
+    known from the headers. The recipe is complete at the END line, or at
+    the first line after at least one step that is not a step; anything
+    after that is ignored. Events are the same as RecipeStreamParser's.
+    """
+
+    def __init__(self):
+        self.name = None
+        self.ingredients = []
+        self.instructions = []
+        self.section = "name"
+        self.complete = False
+        self._buffer = ""
+
+    @property
+    def recipe(self):
+        recipe = {}
+        if self.name is not None:
+            recipe['name'] = self.name
+        recipe['ingredients'] = list(self.ingredients)
+        recipe['instructions'] = list(self.instructions)
+        return recipe
+
+    @property
+    def at_line_start(self):
+        """True if the next text starts a new line"""
+        return self._buffer == ""
+
+    @property
+    def partial_line(self):
+        """Text of the current, unterminated line"""
+        return self._buffer
+
+    def feed(self, text):
+        """
+        Add a chunk of generated text
+
+        Returns:
+            list: (event, value) tuples for every item completed by this chunk
+        """
+        self._buffer += text
+        events = []
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            events.extend(self._parse_line(line))
+        # The end marker is usually the last thing generated, without a newline
+        if self.instructions and self._buffer.strip() == "END":
+            self.complete = True
+        return events
+
+    def close(self):
+        """Flush the final, unterminated line and return its events"""
+        line, self._buffer = self._buffer, ""
+        return self._parse_line(line) if line else []
+
+    def _parse_line(self, raw_line):
+        line = raw_line.strip()
+        if self.complete or not line:
+            return []
+        lower = line.lower()
+
+        if self.section == "name" and lower.startswith("name:"):
+            if self.name is None and line[5:].strip():
+                self.name = line[5:].strip()
+                return [('name', self.name)]
+            return []
+        if lower.rstrip(":") == "ingredients":
+            self.section = "ingredients"
+            return []
+        if lower.rstrip(":") == "instructions":
+            self.section = "instructions"
+            return []
+
+        if self.section == "ingredients":
+            item = line.lstrip("-*").strip()
+            if item:
+                self.ingredients.append(item)
+                return [('ingredient', item)]
+        elif self.section == "instructions":
+            number = line.split(".", 1)[0].split(")", 1)[0]
+            if number.isdigit() and len(number) < len(line):
+                step = line[len(number) + 1:].strip()
+                if step:
+                    self.instructions.append(step)
+                    return [('instruction', step)]
+            elif self.instructions:
+                # END, or the model moving on to something outside the schema
+                self.complete = True
+        return []
@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+
+PENDING = 'pending'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+def model_config_from_env():
+    """
+    The model settings, read from the environment
+
+    Shared by the web app and the model server (serve_models.py), so both
+    build the same models from the same variables and defaults.
+    """
+    return {
+        # Hugging Face model ids or local directories
+        'CAPTION_MODEL': os.environ.get('CAPTION_MODEL', 'nlpconnect/vit-gpt2-image-captioning'),
+        'DETECTION_MODEL': os.environ.get('DETECTION_MODEL', 'facebook/detr-resnet-50'),
+        'RECIPE_MODEL': os.environ.get('RECIPE_MODEL', 'mistralai/Mistral-7B-Instruct-v0.2'),
+        # auto | fp32 | bf16 | int8 (dynamic quantization of Linear layers, CPU only)
+        'RECIPE_PRECISION': os.environ.get('RECIPE_PRECISION', 'auto'),
+        'VISION_PRECISION': os.environ.get('VISION_PRECISION', 'auto'),
+        # Serve weights from memory-mapped checkpoints, shared by all worker processes on the machine
+        'MODEL_MMAP': os.environ.get('MODEL_MMAP', '0') == '1',
+        # Serving-ready models written by compile_artifacts.py
+        'MODEL_ARTIFACTS_DIR': os.environ.get('MODEL_ARTIFACTS_DIR', ''),  # empty = disabled
+        # Precompute the KV cache of the fixed prompt prefix once at load time
+        'RECIPE_PREFIX_CACHE': os.environ.get('RECIPE_PREFIX_CACHE', '1') == '1',
+        # Optional small model sharing Mistral's tokenizer for speculative decoding
+        'RECIPE_DRAFT_MODEL': os.environ.get('RECIPE_DRAFT_MODEL'),  # unset = disabled
+        'RECIPE_DRAFT_LOOKAHEAD': int(os.environ.get('RECIPE_DRAFT_LOOKAHEAD', 5)),
+        # "free" text parsed heuristically, or "structured": a fixed schema enforced while
+        # decoding, with generation stopped as soon as the recipe is complete
+        'RECIPE_OUTPUT': os.environ.get('RECIPE_OUTPUT', 'free'),
+    }
+
+
+class ModelNotReady(Exception):
+    """Raised when a model is requested before it has finished loading"""
+
+    def __init__(self, name, state, error=None):
+        self.name = name
+        self.state = state
+        self.error = error
+        message = f"Model '{name}' is {state}"
+        if error:
+            message += f": {error}"
+        super().__init__(message)
+
+
+class _Entry:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.instance = None
+        self.state = PENDING
+        self.error = None
+        self.load_seconds = None
+        self.scheduled = False
+        self.lock = threading.Lock()
+        self.loaded = threading.Event()
+
+
+class ModelRegistry:
+    """
+    Lazily constructed models, loaded on first use or by a background warm-up
+
+    Factories are plain callables that import and build a model, so neither
+    torch nor transformers is imported until a model is actually needed and
+    the web server can start serving immediately. Requests for a model that
+    is still loading raise ModelNotReady instead of blocking, unless the
+    caller explicitly asks to wait.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self.created_at = time.time()
+        self.ready_at = None
+
+    def register(self, name, factory):
+        """Register a zero-argument factory that builds the model called name"""
+        self._entries[name] = _Entry(name, factory)
+
+    @property
+    def names(self):
+        return list(self._entries)
+
+    def _load(self, entry):
+        with entry.lock:
+            if entry.state in (READY, FAILED):
+                return
+            entry.state = LOADING
+            started = time.perf_counter()
+            try:
+                entry.instance = entry.factory()
+            except Exception as e:
+                print(f"Error loading model '{entry.name}': {e}")
+                entry.state = FAILED
+                entry.error = str(e)
+            else:
+                entry.state = READY
+            entry.load_seconds = time.perf_counter() - started
+            entry.loaded.set()
+
+        if self.ready_at is None and all(e.state == READY for e in self._entries.values()):
+            self.ready_at = time.time()
+            print(f"All models ready {self.ready_at - self.created_at:.1f}s after startup")
+
+    def _load_in_background(self, entries):
+        for entry in entries:
+            entry.scheduled = True
+
+        def run():
+            for entry in entries:
+                self._load(entry)
+
+        thread = threading.Thread(target=run, name="model-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def warm_up(self, names=None):
+        """Start loading the given models (default: all, in registration order) in a background thread"""
+        entries = [self._entries[name] for name in (names or self.names)]
+        return self._load_in_background(entries)
+
+    def load_all(self):
+        """Load every model in the calling thread"""
+        for entry in self._entries.values():
+            self._load(entry)
+
+    def is_ready(self, name):
+        return self._entries[name].state == READY
+
+    def get(self, name, wait=False, timeout=None):
+        """
+        Return the model called name
+
+        Args:
+            name: Registered model name
+            wait: Block until the model is loaded (loading it in this thread
+                if nobody else is) instead of raising ModelNotReady
+            timeout: Longest time to wait, in seconds
+
+        Raises:
+            ModelNotReady: If the model is still loading (and wait is False)
+                or failed to load
+        """
+        entry = self._entries[name]
+        if entry.state == READY:
+            return entry.instance
+
+        if wait:
+            if entry.state == PENDING:
+                self._load(entry)
+            elif not entry.loaded.wait(timeout):
+                raise ModelNotReady(name, entry.state)
+        elif entry.state == PENDING and not entry.scheduled:
+            # First use in lazy mode: start loading, but answer this request fast
+            self._load_in_background([entry])
+            raise ModelNotReady(name, LOADING)
+
+        if entry.state == READY:
+            return entry.instance
+        raise ModelNotReady(name, entry.state, entry.error)
+
+    def get_all(self, names):
+        """
+        Return several models at once, like get
+
+        Every model that is not loaded yet is scheduled before ModelNotReady
+        is raised, so in lazy mode one request starts all the loads it needs.
+        """
+        instances = []
+        not_ready = None
+        for name in names:
+            try:
+                instances.append(self.get(name))
+            except ModelNotReady as e:
+                not_ready = not_ready or e
+        if not_ready is not None:
+            raise not_ready
+        return instances
+
+    def status(self):
+        """Return per-model state and load time, plus overall readiness"""
+        models = {
+            name: {
+                'state': entry.state,
+                'load_seconds': entry.load_seconds,
+                'error': entry.error,
+            }
+            for name, entry in self._entries.items()
+        }
+        return {
+            'ready': all(m['state'] == READY for m in models.values()),
+            'seconds_to_ready': self.ready_at - self.created_at if self.ready_at else None,
+            'models': models,
+        }
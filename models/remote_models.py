@@ -0,0 +1,107 @@
+# Client-side stand-ins for the model classes when the models run in a model
+# server (serve_models.py). Each one subclasses its model class without
+# loading any weights: decoding and preprocessing images, batching helpers
+# and fallbacks run here as before, and only the forward passes and
+# generation go to the server, pixel tensors through shared memory.
+
+import time
+
+from transformers import DetrImageProcessor, ViTImageProcessor
+
+from models.cancellation import RequestCancelled
+from models.image_captioning import ImageCaptioningModel
+from models.object_detection import ObjectDetectionModel
+from models.recipe_generation import RecipeGenerationModel
+
+
+class RemoteCaptioningModel(ImageCaptioningModel):
+    """ImageCaptioningModel whose encoder and decoder run in the model server"""
+
+    def __init__(self, client, attributes):
+        self.client = client
+        self.__dict__.update(attributes)
+        self.artifact = None
+        self.feature_extractor = ViTImageProcessor.from_pretrained(self.processor_source)
+
+    def generate_captions_from_pixel_values(self, pixel_values, num_beams=None, cancellation=None):
+        if cancellation is not None:
+            cancellation.raise_if_cancelled('caption_generate', estimate_stages=('caption_encode', 'caption_generate'))
+        return self.client.call(
+            "captioning", "generate_captions_from_pixel_values", pixel_values, num_beams, cancellation=cancellation
+        )
+
+
+class RemoteDetectionModel(ObjectDetectionModel):
+    """ObjectDetectionModel whose forward pass and post-processing run in the model server"""
+
+    def __init__(self, client, attributes):
+        self.client = client
+        self.__dict__.update(attributes)
+        self.artifact = None
+        self.processor = DetrImageProcessor.from_pretrained(self.processor_source)
+
+    def detect_ingredients_from_inputs(self, inputs, image_sizes):
+        return self.client.call("detection", "detect_ingredients_from_inputs", dict(inputs), list(image_sizes))
+
+
+class RemoteRecipeModel(RecipeGenerationModel):
+    """RecipeGenerationModel generating in the model server; falls back like the model does if the call fails"""
+
+    def __init__(self, client, attributes):
+        self.client = client
+        self.__dict__.update(attributes)
+        self.artifact = None
+        self.fallback_recipes = self._get_fallback_recipes()
+
+    def generation_stats(self):
+        return self.client.call("recipe", "generation_stats")
+
+    def generate_recipes_batch(self, ingredient_lists, num_candidates=1, batch_size=8, max_new_tokens=None,
+                               cancellation=None):
+        try:
+            return self.client.call(
+                "recipe", "generate_recipes_batch", ingredient_lists, num_candidates=num_candidates,
+                batch_size=batch_size, max_new_tokens=max_new_tokens, cancellation=cancellation
+            )
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            print(f"Error generating recipe batch: {e}")
+            return [[self.fallback_recipes["tomato_onion_chicken"][0]] for _ in ingredient_lists]
+
+    def generate_recipes(self, ingredients, num_candidates=1, max_new_tokens=None, cancellation=None):
+        try:
+            return self.client.call(
+                "recipe", "generate_recipes", ingredients, num_candidates=num_candidates,
+                max_new_tokens=max_new_tokens, cancellation=cancellation
+            )
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            print(f"Error generating recipes: {e}")
+            return [self.fallback_recipes["tomato_onion_chicken"][0]]
+
+    def stream_recipe_events(self, ingredients, max_new_tokens=None, cancellation=None):
+        started = time.perf_counter()
+        try:
+            yield from self.client.stream(
+                "recipe", "stream_recipe_events", ingredients, max_new_tokens, cancellation=cancellation
+            )
+        except Exception as e:
+            print(f"Error streaming recipe: {e}")
+            yield "error", str(e)
+            recipe = self.fallback_recipes["tomato_onion_chicken"][0]
+            yield "done", dict(recipe=recipe, fallback=True, first_content_ms=None,
+                               total_ms=1000.0 * (time.perf_counter() - started))
+
+
+REMOTE_MODEL_CLASSES = {
+    "captioning": RemoteCaptioningModel,
+    "detection": RemoteDetectionModel,
+    "recipe": RemoteRecipeModel,
+}
+
+
+def remote_model(client, name):
+    """Client-side stand-in for the model called name, once the server has loaded it"""
+    return REMOTE_MODEL_CLASSES[name](client, client.model_attributes(name))
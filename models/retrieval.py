@@ -0,0 +1,240 @@
+import json
+import re
+import threading
+import time
+
+import numpy as np
+
+# Words in ingredient lines that say how much or how it is cut rather than what it is
+_STOP_WORDS = {
+    'a', 'an', 'and', 'or', 'of', 'to', 'the', 'for', 'with', 'into', 'in', 'at', 'as', 'if',
+    'cup', 'tbsp', 'tsp', 'tablespoon', 'teaspoon', 'oz', 'ounce', 'lb', 'pound', 'g', 'kg',
+    'ml', 'l', 'pinch', 'dash', 'can', 'package', 'pkg', 'jar', 'bunch', 'clove', 'slice',
+    'piece', 'stick', 'large', 'small', 'medium', 'whole', 'fresh', 'dried', 'chopped',
+    'diced', 'minced', 'sliced', 'grated', 'shredded', 'cubed', 'peeled', 'cooked', 'cold',
+    'warm', 'hot', 'softened', 'melted', 'beaten', 'taste', 'optional', 'divided', 'about',
+    'plus', 'more', 'cut', 'finely', 'roughly', 'thinly', 'inch', 'cm',
+}
+
+
+def _singular(word):
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith('oes'):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def ingredient_terms(text):
+    """Index terms of an ingredient line or name, e.g. "2 tomatoes, chopped" -> {"tomato"}"""
+    words = (_singular(word) for word in re.findall(r"[a-z]+", text.lower()))
+    return {word for word in words if len(word) > 1 and word not in _STOP_WORDS}
+
+
+def normalize_recipe(record):
+    """Map a corpus record onto the app's recipe format: name, ingredients, instructions"""
+    instructions = record.get('instructions', record.get('directions', []))
+    if isinstance(instructions, str):
+        instructions = [line.strip() for line in instructions.splitlines() if line.strip()]
+    return {
+        'name': record.get('name') or record.get('title') or 'Untitled Recipe',
+        'ingredients': list(record.get('ingredients', [])),
+        'instructions': list(instructions),
+    }
+
+
+def load_corpus(path):
+    """Read recipes from a JSON array (or {"recipes": [...]}) or a JSON Lines file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        data = json.load(f)
+    return data['recipes'] if isinstance(data, dict) else data
+
+
+class RecipeIndex:
+    """
+    Inverted index over the ingredients of a recipe corpus
+
+    Recipes are scored by IDF-weighted ingredient overlap, normalised by the
+    recipe's own weight (cosine similarity of binary ingredient vectors):
+    rare shared ingredients count more than salt or oil, and recipes that
+    need many other ingredients rank below ones that use mostly what the
+    user has.
+
+    Each ingredient term maps to the recipes using it, stored in flat NumPy
+    arrays (CSR layout) twice: sorted by recipe id for membership tests, and
+    by the recipe's normalisation factor, highest first, for candidate
+    generation. Terms found in more than 1/bitset_fraction of the recipes
+    also get a packed bitset over the corpus, making membership tests for
+    them a single bit lookup. A query scores only a prefix of each of its posting lists
+    and grows the prefixes until no unseen recipe can beat the k-th best
+    score, so results are exact while common ingredients such as onion,
+    present in a large share of the corpus, are never scanned in full.
+    """
+
+    def __init__(self, recipes, bitset_fraction=32):
+        """
+        Args:
+            recipes: Recipe records. Terms come from an "NER" or "keywords"
+                list when present (as in RecipeNLG), else from the ingredient lines
+            bitset_fraction: Terms in more than 1/bitset_fraction of the
+                recipes get a bitset; there can be at most bitset_fraction
+                times the mean ingredients per recipe of them, so the
+                bitsets stay a small multiple of the posting lists
+        """
+        self.recipes = [normalize_recipe(record) for record in recipes]
+        # Posting list prefix scanned per requested recipe before widening
+        self.initial_depth = 64
+        self._lock = threading.Lock()
+        self._queries = 0
+        self._query_time = 0.0
+
+        started = time.perf_counter()
+        vocabulary = {}
+        term_ids, recipe_ids = [], []
+        for recipe_id, record in enumerate(recipes):
+            keywords = record.get('NER') or record.get('keywords')
+            terms = set()
+            for line in keywords or record.get('ingredients', []):
+                terms |= ingredient_terms(line)
+            for term in terms:
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                recipe_ids.append(recipe_id)
+
+        self.vocabulary = vocabulary
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        recipe_ids = np.asarray(recipe_ids, dtype=np.int32)
+
+        document_frequency = np.bincount(term_ids, minlength=len(vocabulary))
+        self._offsets = np.concatenate(([0], np.cumsum(document_frequency))).astype(np.int64)
+
+        count = max(len(self.recipes), 1)
+        self._weights = np.log1p(count / np.maximum(document_frequency, 1)).astype(np.float32)
+        squared = np.bincount(recipe_ids, weights=self._weights[term_ids] ** 2, minlength=len(self.recipes))
+        with np.errstate(divide='ignore'):
+            self._inv_norms = np.where(squared > 0, 1.0 / np.sqrt(squared), 0.0).astype(np.float32)
+
+        # Posting lists, term t at offsets[t]:offsets[t + 1] of both arrays
+        order = np.lexsort((recipe_ids, term_ids))
+        self._postings = recipe_ids[order]
+        order = np.lexsort((-self._inv_norms[recipe_ids], term_ids))
+        self._impact_postings = recipe_ids[order]
+
+        self._bitsets = {}
+        for term_id in np.flatnonzero(document_frequency * bitset_fraction > count):
+            members = np.zeros(len(self.recipes), dtype=bool)
+            members[self._postings[self._offsets[term_id]:self._offsets[term_id + 1]]] = True
+            self._bitsets[int(term_id)] = np.packbits(members)
+        self.build_seconds = time.perf_counter() - started
+
+    @classmethod
+    def from_file(cls, path):
+        index = cls(load_corpus(path))
+        print(f"Indexed {len(index.recipes)} recipes ({len(index.vocabulary)} ingredient terms) "
+              f"from {path} in {index.build_seconds:.1f}s")
+        return index
+
+    def _score(self, candidates, term_ids):
+        """Exact cosine numerators for candidate recipe ids, by binary search in each posting list"""
+        scores = np.zeros(len(candidates), dtype=np.float32)
+        for term_id in term_ids:
+            bitset = self._bitsets.get(term_id)
+            if bitset is not None:
+                members = (bitset[candidates >> 3] >> (7 - (candidates & 7))) & 1
+            else:
+                postings = self._postings[self._offsets[term_id]:self._offsets[term_id + 1]]
+                found = np.searchsorted(postings, candidates)
+                found[found == len(postings)] = 0
+                members = postings[found] == candidates
+            scores += members * self._weights[term_id] ** 2
+        return scores * self._inv_norms[candidates]
+
+    def _unseen_bound(self, term_ids, depth):
+        """
+        Highest score a recipe outside the first depth entries of every posting list could have
+
+        Such a recipe can only contain terms whose lists are longer than
+        depth, and its normalisation factor is at most the one at position
+        depth of each of those lists.
+        """
+        limits = []
+        for term_id in term_ids:
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            if end - start > depth:
+                limits.append((float(self._inv_norms[self._impact_postings[start + depth]]),
+                               float(self._weights[term_id]) ** 2))
+        # Best case: it contains the terms with the highest limits
+        bound, total = 0.0, 0.0
+        for limit, weight in sorted(limits, reverse=True):
+            total += weight
+            bound = max(bound, limit * total)
+        return bound
+
+    def search(self, ingredients, k=3):
+        """
+        Return the k best matching recipes for an ingredient list
+
+        Args:
+            ingredients: Ingredient names, e.g. the detected ingredients
+            k: Number of recipes to return
+
+        Returns:
+            list: (recipe dictionary, score in [0, 1]) pairs, best first;
+            empty if no recipe shares an ingredient with the query
+        """
+        started = time.perf_counter()
+        terms = set()
+        for ingredient in ingredients:
+            terms |= ingredient_terms(ingredient)
+        term_ids = [self.vocabulary[term] for term in terms if term in self.vocabulary]
+
+        results = []
+        if term_ids and k > 0:
+            longest = max(self._offsets[t + 1] - self._offsets[t] for t in term_ids)
+            depth = self.initial_depth * k
+            while True:
+                candidates = np.sort(np.concatenate([
+                    self._impact_postings[self._offsets[t]:min(self._offsets[t] + depth, self._offsets[t + 1])]
+                    for t in term_ids
+                ]))
+                candidates = candidates[np.concatenate(([True], candidates[1:] != candidates[:-1]))]
+                scores = self._score(candidates, term_ids)
+                if len(candidates) > k:
+                    top = np.argpartition(-scores, k - 1)[:k]
+                else:
+                    top = np.arange(len(candidates))
+                if depth >= longest or (len(top) == k and scores[top].min() >= self._unseen_bound(term_ids, depth)):
+                    break
+                depth *= 4
+
+            top = top[np.argsort(-scores[top], kind='stable')]
+            query_norm = float(np.sqrt(np.sum(self._weights[term_ids] ** 2)))
+            results = [(self.recipes[candidates[i]], float(scores[i]) / query_norm) for i in top]
+
+        with self._lock:
+            self._queries += 1
+            self._query_time += time.perf_counter() - started
+        return results
+
+    def recipes_for(self, ingredients, k=1):
+        """Recipe dictionaries only, like RecipeGenerationModel.generate_recipes"""
+        return [recipe for recipe, _ in self.search(ingredients, k)]
+
+    def stats(self):
+        """Return corpus size, index memory and query latency"""
+        with self._lock:
+            return {
+                'recipes': len(self.recipes),
+                'terms': len(self.vocabulary),
+                'postings': int(len(self._postings)),
+                'bitsets': len(self._bitsets),
+                'index_bytes': int(self._postings.nbytes + self._impact_postings.nbytes
+                                   + self._offsets.nbytes + self._weights.nbytes + self._inv_norms.nbytes
+                                   + sum(bitset.nbytes for bitset in self._bitsets.values())),
+                'build_seconds': self.build_seconds,
+                'queries': self._queries,
+                'mean_query_us': 1e6 * self._query_time / self._queries if self._queries else 0.0,
+            }
@@ -0,0 +1,100 @@
+import threading
+import time
+from models.metrics import GENERATED_TOKENS, TOKENS_PER_SECOND
+
+
+class SpeculationMonitor:
+    """
+    Tokens/sec and draft acceptance rate of recipe generation
+
+    transformers does not report how many draft tokens were accepted, so the
+    monitor counts forward passes with hooks instead. Each assisted decoding
+    step runs the draft once per proposed token and the target model once to
+    verify them, and that verification always contributes exactly one token
+    of its own. So for a generate call:
+
+        proposed = draft forward passes
+        accepted = new tokens - target forward passes
+
+    Counters are kept per thread, so concurrent generate calls (e.g. the SSE
+    stream thread and a regular request) do not mix their counts.
+    """
+
+    def __init__(self, model, draft_model=None):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.speculative = draft_model is not None
+        self.calls = 0
+        self.new_tokens = 0
+        self.seconds = 0.0
+        self.proposed = 0
+        self.accepted = 0
+        self.steps = 0
+        model.register_forward_hook(self._hook("target"))
+        if draft_model is not None:
+            draft_model.register_forward_hook(self._hook("draft"))
+
+    def _hook(self, counter):
+        def hook(module, inputs, outputs):
+            counts = getattr(self._local, "counts", None)
+            if counts is not None:
+                counts[counter] += 1
+        return hook
+
+    def start(self):
+        """Start counting forward passes made by the calling thread"""
+        self._local.counts = {"target": 0, "draft": 0}
+        self._local.started = time.perf_counter()
+
+    def stop(self, new_tokens):
+        """Stop counting and record a generate call that produced new_tokens tokens (None if it failed)"""
+        counts = getattr(self._local, "counts", None)
+        elapsed = time.perf_counter() - getattr(self._local, "started", 0.0)
+        self._local.counts = None
+        if counts is None or new_tokens is None:
+            return
+        GENERATED_TOKENS.inc(new_tokens)
+        if elapsed > 0:
+            TOKENS_PER_SECOND.observe(new_tokens / elapsed)
+
+        with self._lock:
+            self.calls += 1
+            self.new_tokens += new_tokens
+            self.seconds += elapsed
+            if self.speculative and counts["draft"]:
+                self.proposed += counts["draft"]
+                self.steps += counts["target"]
+                self.accepted += max(0, min(new_tokens - counts["target"], counts["draft"]))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "speculative": self.speculative,
+                "calls": self.calls,
+                "new_tokens": self.new_tokens,
+                "tokens_per_sec": self.new_tokens / self.seconds if self.seconds else 0.0,
+                "draft_tokens_proposed": self.proposed,
+                "draft_tokens_accepted": self.accepted,
+                "acceptance_rate": self.accepted / self.proposed if self.proposed else None,
+                "verification_steps": self.steps,
+            }
+
+
+def fix_draft_lookahead(draft_model, lookahead):
+    """
+    Make assisted decoding propose up to lookahead draft tokens at every step
+
+    transformers 4.31 keeps the lookahead in the draft model's
+    max_assistant_tokens attribute, starting at 5 and adapting it after
+    every step (+2 when all draft tokens were accepted, -1 otherwise).
+    The draft model's class is swapped for a subclass where the attribute
+    is a constant, so those updates are ignored. Later versions read
+    num_assistant_tokens from the generation config instead and keep it
+    with the "constant" schedule.
+    """
+    draft_model.generation_config.num_assistant_tokens = lookahead
+    draft_model.generation_config.num_assistant_tokens_schedule = "constant"
+    model_class = type(draft_model)
+    draft_model.__class__ = type(model_class.__name__, (model_class,), {
+        "max_assistant_tokens": property(lambda self: lookahead, lambda self, value: None),
+    })
@@ -0,0 +1,238 @@
+# Structured recipe output. The prompt asks for a fixed line-based schema and
+# opens it with "Name:". While generating, a logits processor restricts the
+# start of every line to what the schema allows next and ends each sequence
+# with EOS as soon as its recipe is complete, and a stopping criterion ends
+# the generate call once every sequence is, instead of sampling descriptions
+# and chatter up to max_length for the parser to drop.
+
+import weakref
+
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+
+from models.recipe_parser import StructuredRecipeParser
+
+# Ends the prompt, so the response starts inside the schema
+SCHEMA_OPENING = "Name:"
+
+STRUCTURED_PROMPT_SUFFIX = """ {ingredients}.
+
+Answer in exactly this format, with nothing before or after it:
+Name: <recipe name>
+Ingredients:
+- <quantity> <ingredient>
+Instructions:
+1. <step>
+END [/INST] """ + SCHEMA_OPENING
+
+# Dropped with their tokenizer, so models loaded and released don't pile up
+_VOCABULARIES = weakref.WeakKeyDictionary()
+
+
+def _compatible(text, header):
+    """True if a line starting with text can still become exactly the header line"""
+    if header.startswith(text):
+        return bool(text)
+    return text.startswith(header) and text[len(header):].lstrip(" ").startswith("\n")
+
+
+class TokenVocabulary:
+    """Decoded text of every token of a tokenizer, with token masks cached by what they allow"""
+
+    def __init__(self, tokenizer):
+        self.texts = tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+        self._masks = {}
+
+    def mask(self, key, predicate):
+        """Bool tensor over the vocabulary of the tokens whose text satisfies predicate"""
+        if key not in self._masks:
+            self._masks[key] = torch.tensor([predicate(text) for text in self.texts], dtype=torch.bool)
+        return self._masks[key]
+
+    def line_start(self, kind):
+        """Tokens that can begin an ingredient ("item") or instruction ("step") line"""
+        if kind == "item":
+            return self.mask("item", lambda text: text.lstrip().startswith(("-", "*")))
+        return self.mask("step", lambda text: text.lstrip()[:1].isdigit())
+
+    def header(self, partial, header):
+        """Tokens that continue a line reading partial so far towards header"""
+        return self.mask(("header", partial, header), lambda text: _compatible((partial + text).lstrip(), header))
+
+    def newline(self):
+        return self.mask("newline", lambda text: "\n" in text)
+
+
+def token_vocabulary(tokenizer):
+    """The TokenVocabulary of a tokenizer, built once (it decodes every token)"""
+    if tokenizer not in _VOCABULARIES:
+        _VOCABULARIES[tokenizer] = TokenVocabulary(tokenizer)
+    return _VOCABULARIES[tokenizer]
+
+
+class _Response:
+    """One row's parser and the response tokens fed to it so far"""
+
+    def __init__(self):
+        self.parser = StructuredRecipeParser()
+        self.parser.feed(SCHEMA_OPENING)
+        self.ids = None
+        # Tokens before prefix_offset are done; those up to read_offset have
+        # been fed, and are decoded again only for the spacing of what follows
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+
+class RecipeSchemaTracker:
+    """
+    Parses what each sequence of one generate call has produced so far
+
+    The logits processor and the stopping criterion share one tracker, and
+    each row's parser is only fed the tokens added since the last call, so
+    a step costs the same however long the responses already are. Assisted
+    decoding also shows the tracker draft tokens it then rejects; a row
+    that no longer continues what was fed is parsed again from the start.
+    """
+
+    def __init__(self, tokenizer, prompt_length):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self._special_ids = set(tokenizer.all_special_ids)
+        self._responses = []
+
+    def parsers(self, input_ids):
+        """One StructuredRecipeParser per row, fed the row's response so far"""
+        rows = input_ids[:, self.prompt_length:]
+        if len(self._responses) != rows.shape[0]:
+            self._responses = [_Response() for _ in range(rows.shape[0])]
+        for i, row in enumerate(rows):
+            self._responses[i] = self._advance(self._responses[i], row)
+        return [response.parser for response in self._responses]
+
+    def _advance(self, response, row):
+        fed = 0 if response.ids is None else len(response.ids)
+        if fed > len(row) or (fed and not torch.equal(row[:fed], response.ids)):
+            response, fed = _Response(), 0
+        if len(row) == fed:
+            return response
+        response.ids = row
+        if not response.parser.complete:
+            response.parser.feed(self._new_text(response))
+        return response
+
+    def _new_text(self, response):
+        """
+        Text of the tokens after read_offset
+
+        Decoding a few tokens on their own can lose the space a tokenizer
+        puts before a word, or split a character encoded over several byte
+        tokens, so the new tokens are decoded together with those before
+        them and only the difference is returned; an incomplete character
+        is held back until its last byte arrives. Special tokens (EOS, then
+        padding) add no text and are skipped.
+        """
+        ids = response.ids[response.prefix_offset:].tolist()
+        if set(ids[response.read_offset - response.prefix_offset:]) <= self._special_ids:
+            response.prefix_offset = response.read_offset = len(response.ids)
+            return ""
+        before = self.tokenizer.decode(ids[:response.read_offset - response.prefix_offset], skip_special_tokens=True)
+        text = self.tokenizer.decode(ids, skip_special_tokens=True)
+        if len(text) <= len(before) or text.endswith("\ufffd"):
+            return ""
+        response.prefix_offset, response.read_offset = response.read_offset, len(response.ids)
+        return text[len(before):]
+
+
+class RecipeSchemaLogitsProcessor(LogitsProcessor):
+    """
+    Keep every line of the response inside the recipe schema
+
+    A new line must start with what the schema allows next: a bullet in
+    the ingredients, a step number in the instructions, or the next header
+    once its section has an entry. A line that has started a header must
+    spell it out. The model therefore cannot wander into preambles, blank
+    lines or extra sections; the text of the name, ingredients and steps
+    themselves is left free. End of sequence is only allowed once the
+    recipe has at least one instruction step, and is the only token
+    allowed once the recipe is complete.
+    """
+
+    def __init__(self, tracker, eos_token_id):
+        self.tracker = tracker
+        self.eos_token_id = eos_token_id
+        self.vocabulary = token_vocabulary(tracker.tokenizer)
+
+    def _headers(self, parser):
+        """Headers that may come next"""
+        if parser.section == "name":
+            return ["Ingredients:"]
+        if parser.section == "ingredients":
+            return ["Instructions:"] if parser.ingredients else []
+        return ["END"] if parser.instructions else []
+
+    def _allowed(self, parser):
+        """Masks of the tokens allowed next, or None for any token"""
+        partial = parser.partial_line.lstrip()
+        if parser.at_line_start or not partial:
+            allowed = [self.vocabulary.header("", header) for header in self._headers(parser)]
+            if parser.section != "name":
+                allowed.append(self.vocabulary.line_start("item" if parser.section == "ingredients" else "step"))
+            return allowed
+        for header in self._headers(parser):
+            if header.startswith(partial):
+                return [self.vocabulary.header(partial, header)]
+        return None
+
+    def __call__(self, input_ids, scores):
+        vocab_size = scores.shape[-1]
+        for row, parser in enumerate(self.tracker.parsers(input_ids)):
+            if parser.complete:
+                if self.eos_token_id is not None:
+                    scores[row] = -float("inf")
+                    scores[row, self.eos_token_id] = 0.0
+                continue
+            allowed = self._allowed(parser)
+            if allowed:
+                mask = torch.zeros(vocab_size, dtype=torch.bool)
+                for tokens in allowed:
+                    size = min(vocab_size, len(tokens))
+                    mask[:size] |= tokens[:size]
+                scores[row, ~mask.to(scores.device)] = -float("inf")
+            elif parser.section == "name" and parser.name is None and parser.partial_line.strip().lower() == "name:":
+                # No empty recipe name
+                newline = self.vocabulary.newline()[:vocab_size].to(scores.device)
+                scores[row, :len(newline)][newline] = -float("inf")
+            if self.eos_token_id is not None and not parser.instructions:
+                scores[row, self.eos_token_id] = -float("inf")
+        return scores
+
+
+class RecipeSchemaStoppingCriteria(StoppingCriteria):
+    """
+    Finish the generate call once every sequence's recipe is complete
+
+    Returns a single bool, as generate() in transformers 4.31 expects of a
+    stopping criterion. Sequences that complete earlier end with EOS, which
+    RecipeSchemaLogitsProcessor forces, and are padded from then on.
+    """
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return all(parser.complete for parser in self.tracker.parsers(input_ids))
+
+
+def schema_constraints(tokenizer, prompt_length):
+    """
+    generate() keyword arguments that keep one call's output inside the schema
+
+    Args:
+        tokenizer: The model's tokenizer
+        prompt_length: Length of the (padded) prompt in input_ids
+    """
+    tracker = RecipeSchemaTracker(tokenizer, prompt_length)
+    return {
+        "logits_processor": LogitsProcessorList([RecipeSchemaLogitsProcessor(tracker, tokenizer.eos_token_id)]),
+        "stopping_criteria": StoppingCriteriaList([RecipeSchemaStoppingCriteria(tracker)]),
+    }
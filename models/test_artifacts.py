@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from models.artifacts import (  # noqa: E402
+    MANIFEST_NAME, artifact_dir, default_artifact_dir, find_artifact, save_artifact
+)
+from models.recipe_generation import RecipeGenerationModel  # noqa: E402
+
+CPU = torch.device("cpu")
+
+
+def compile_recipe_model(directory, model_dir, precision="fp32"):
+    model = RecipeGenerationModel(model_dir, precision=precision, prefix_cache=False, artifact_dir="")
+    return save_artifact(str(directory), "recipe", model_dir, precision, CPU, model.model, [model.tokenizer]), model
+
+
+def logits(model, input_ids):
+    with torch.no_grad():
+        return model(input_ids).logits
+
+
+def test_artifact_directory_names_the_model_and_precision(monkeypatch):
+    assert artifact_dir("artifacts", "recipe", "mistralai/Mistral-7B-Instruct-v0.2", "int8") == os.path.join(
+        "artifacts", "recipe-mistralai_Mistral-7B-Instruct-v0.2-int8")
+    monkeypatch.setenv("MODEL_ARTIFACTS_DIR", "")
+    assert default_artifact_dir() is None
+    assert find_artifact(None, "recipe", "model", "fp32", CPU) is None
+
+
+def test_model_loads_from_its_artifact_unchanged(tmp_path, tiny_recipe_model_dir):
+    artifact, original = compile_recipe_model(tmp_path, tiny_recipe_model_dir)
+
+    assert not artifact.quantized
+    assert artifact.manifest["dtype"] == "float32"
+    assert artifact.verify() == []
+    assert "model.safetensors" in artifact.manifest["files"]
+    assert not [name for name in os.listdir(tmp_path) if ".tmp-" in name]
+
+    loaded = RecipeGenerationModel(tiny_recipe_model_dir, precision="fp32", artifact_dir=str(tmp_path))
+    assert loaded.artifact.path == artifact.path
+    input_ids = original.tokenizer("egg, rice", return_tensors="pt").input_ids
+    assert torch.equal(logits(loaded.model, input_ids), logits(original.model, input_ids))
+
+
+def test_quantized_model_loads_without_requantizing(tmp_path, tiny_recipe_model_dir):
+    # Pickling the quantized model walks transformers' lazy modules, some of which import torchvision
+    pytest.importorskip("torchvision")
+    artifact, original = compile_recipe_model(tmp_path, tiny_recipe_model_dir, precision="int8")
+
+    assert artifact.quantized
+    loaded = RecipeGenerationModel(tiny_recipe_model_dir, precision="int8", artifact_dir=str(tmp_path))
+    assert loaded.artifact is not None
+    assert any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in loaded.model.modules())
+    input_ids = original.tokenizer("egg, rice", return_tensors="pt").input_ids
+    assert torch.allclose(logits(loaded.model, input_ids), logits(original.model, input_ids))
+
+
+def test_mismatched_or_incomplete_artifacts_are_ignored(tmp_path, tiny_recipe_model_dir):
+    artifact, _ = compile_recipe_model(tmp_path, tiny_recipe_model_dir)
+    directory = str(tmp_path)
+
+    assert find_artifact(directory, "recipe", tiny_recipe_model_dir, "fp32", CPU) is not None
+    assert find_artifact(directory, "recipe", tiny_recipe_model_dir, "bf16", CPU) is None
+    assert artifact.mismatch("recipe", tiny_recipe_model_dir, "fp32", torch.device("cuda")).startswith("compiled for")
+    assert artifact.mismatch("caption", tiny_recipe_model_dir, "fp32", CPU).startswith("compiled for kind")
+
+    with open(os.path.join(artifact.path, "model.safetensors"), "ab") as f:
+        f.write(b"\0")
+    assert artifact.mismatch("recipe", tiny_recipe_model_dir, "fp32", CPU) == "model.safetensors is missing or incomplete"
+
+    with open(os.path.join(artifact.path, MANIFEST_NAME), "w") as f:
+        f.write("{")
+    assert find_artifact(directory, "recipe", tiny_recipe_model_dir, "fp32", CPU) is None
+
+
+def test_changed_source_checkpoint_invalidates_the_artifact(tmp_path, tiny_recipe_model_dir):
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    # Only safetensors checkpoints are tracked
+    source = str(tmp_path / "source")
+    AutoModelForCausalLM.from_pretrained(tiny_recipe_model_dir).save_pretrained(source, safe_serialization=True)
+    AutoTokenizer.from_pretrained(tiny_recipe_model_dir).save_pretrained(source)
+    artifact, _ = compile_recipe_model(tmp_path / "artifacts", source)
+    with open(os.path.join(source, "model.safetensors"), "ab") as f:
+        f.write(b"\0")
+
+    assert artifact.mismatch("recipe", source, "fp32", CPU) == "source checkpoint file model.safetensors changed"
+
+
+def test_verify_finds_corrupted_files(tmp_path, tiny_recipe_model_dir):
+    artifact, _ = compile_recipe_model(tmp_path, tiny_recipe_model_dir)
+    path = os.path.join(artifact.path, "model.safetensors")
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+    assert artifact.mismatch("recipe", tiny_recipe_model_dir, "fp32", CPU) is None
+    assert artifact.verify() == ["model.safetensors"]
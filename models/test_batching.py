@@ -0,0 +1,130 @@
+import threading
+
+import pytest
+
+from models.batching import BatchScheduler
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(batch_fn, **kwargs):
+        scheduler = BatchScheduler(batch_fn, **kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.shutdown()
+
+
+def gated(batch_fn):
+    """
+    batch_fn holding its first batch until released, so items submitted meanwhile queue up
+
+    Returns:
+        tuple: The wrapped function, a function waiting for the first batch to
+        start, the event releasing it, and the list of every batch run
+    """
+    started, release = threading.Event(), threading.Event()
+    batches = []
+
+    def run(items):
+        batches.append(list(items))
+        if len(batches) == 1:
+            started.set()
+            release.wait(5)
+        return batch_fn(items)
+    return run, lambda: started.wait(5), release, batches
+
+
+def test_items_queued_together_run_as_one_batch(make_scheduler):
+    batch_fn, wait_started, release, batches = gated(lambda items: [item * 2 for item in items])
+    scheduler = make_scheduler(batch_fn, max_batch_size=8, max_wait_ms=50)
+
+    first = scheduler.submit(0)
+    wait_started()
+    futures = [scheduler.submit(i) for i in range(1, 5)]
+    release.set()
+
+    assert first.result(5) == 0
+    assert [future.result(5) for future in futures] == [2, 4, 6, 8]
+    assert batches == [[0], [1, 2, 3, 4]]
+    assert scheduler.stats()["batch_sizes"] == {1: 1, 4: 1}
+
+
+def test_batches_are_capped_at_max_batch_size(make_scheduler):
+    batch_fn, wait_started, release, batches = gated(lambda items: items)
+    scheduler = make_scheduler(batch_fn, max_batch_size=2, max_wait_ms=50)
+
+    scheduler.submit("first")
+    wait_started()
+    futures = [scheduler.submit(i) for i in range(5)]
+    release.set()
+
+    assert [future.result(5) for future in futures] == list(range(5))
+    assert [len(batch) for batch in batches[1:]] == [2, 2, 1]
+
+
+def test_a_bad_item_only_fails_its_own_request(make_scheduler):
+    def batch_fn(items):
+        if "bad" in items:
+            raise ValueError("undecodable image")
+        return [item.upper() for item in items]
+    batch_fn, wait_started, release, _ = gated(batch_fn)
+    scheduler = make_scheduler(batch_fn, max_wait_ms=50)
+
+    scheduler.submit("first")
+    wait_started()
+    futures = [scheduler.submit(item) for item in ("good", "bad", "fine")]
+    release.set()
+
+    assert futures[0].result(5) == "GOOD"
+    assert futures[2].result(5) == "FINE"
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert scheduler.stats()["errors"] == 1
+
+
+def test_wrong_number_of_results_fails_the_request(make_scheduler):
+    scheduler = make_scheduler(lambda items: [], max_wait_ms=0)
+
+    with pytest.raises(RuntimeError):
+        scheduler("item")
+
+
+def test_cancelled_requests_are_skipped(make_scheduler):
+    batch_fn, wait_started, release, batches = gated(lambda items: items)
+    scheduler = make_scheduler(batch_fn, max_wait_ms=50)
+
+    scheduler.submit("first")
+    wait_started()
+    dropped = scheduler.submit("dropped")
+    kept = scheduler.submit("kept")
+    assert dropped.cancel()
+    release.set()
+
+    assert kept.result(5) == "kept"
+    assert batches[1] == ["kept"]
+    assert scheduler.stats()["cancelled"] == 1
+
+
+def test_initializer_runs_in_the_worker(make_scheduler):
+    local = threading.local()
+    scheduler = make_scheduler(
+        lambda items: [getattr(local, "value", None)] * len(items), max_wait_ms=0,
+        initializer=lambda value: setattr(local, "value", value), initargs=("set",)
+    )
+
+    assert scheduler("item") == "set"
+    assert getattr(local, "value", None) is None
+
+
+def test_shutdown_finishes_queued_items():
+    scheduler = BatchScheduler(lambda items: items, max_wait_ms=0)
+    futures = [scheduler.submit(i) for i in range(3)]
+
+    scheduler.shutdown()
+
+    assert [future.result(0) for future in futures] == [0, 1, 2]
@@ -0,0 +1,164 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from models.cancellation import CancellationToken, RequestCancelled, request_token, wait_for
+
+
+def cancel_after(calls, reason="disconnect"):
+    """A probe that finds the request cancelled from its calls-th poll on"""
+    polls = []
+
+    def probe():
+        polls.append(None)
+        return reason if len(polls) >= calls else None
+    return probe
+
+
+def test_first_reason_sticks():
+    token = CancellationToken()
+    assert token.reason is None
+
+    token.cancel("deadline")
+    token.cancel("disconnect")
+
+    assert token.reason == "deadline"
+
+
+def test_probes_are_polled_at_most_every_poll_interval():
+    polled_often = CancellationToken([cancel_after(2)], poll_interval=0)
+    polled_rarely = CancellationToken([cancel_after(2)], poll_interval=3600)
+    for token in (polled_often, polled_rarely):
+        token.reason
+    assert polled_often.reason == "disconnect"
+    assert polled_rarely.reason is None
+
+
+def test_request_token_skips_unavailable_probes():
+    assert request_token(None, cancel_after(1)).reason == "disconnect"
+
+
+def test_raise_if_cancelled_only_for_the_given_reasons():
+    token = CancellationToken()
+    token.raise_if_cancelled("recipe_generate")
+    token.cancel("disconnect")
+
+    token.raise_if_cancelled("recipe_generate", reasons=("deadline",))
+    with pytest.raises(RequestCancelled) as raised:
+        token.raise_if_cancelled("recipe_generate")
+    assert (raised.value.reason, raised.value.stage) == ("disconnect", "recipe_generate")
+
+
+def test_token_is_a_single_bool_stopping_criterion():
+    torch = pytest.importorskip("torch")
+    token = CancellationToken()
+    input_ids = torch.zeros(4, 3, dtype=torch.long)
+
+    # One flag for the whole call: generate() in transformers 4.31 can't take one per sequence
+    assert token(input_ids, None) is False
+    token.cancel("disconnect")
+    assert token(input_ids, None) is True
+
+
+def test_wait_for_drops_a_queued_item():
+    future = Future()
+    token = CancellationToken(poll_interval=0.01)
+    token.cancel("disconnect")
+
+    with pytest.raises(RequestCancelled):
+        wait_for(future, token, "caption_generate")
+    assert future.cancelled()
+
+
+def test_wait_for_waits_for_an_item_already_running():
+    future = Future()
+    future.set_running_or_notify_cancel()
+    token = CancellationToken(poll_interval=0.01)
+    token.cancel("disconnect")
+    future.set_result("caption")
+
+    assert wait_for(future, token, "caption_generate") == "caption"
+
+
+@pytest.fixture(scope="module")
+def caption_model(tiny_caption_model_dir, tmp_path_factory):
+    from models.image_captioning import ImageCaptioningModel
+
+    return ImageCaptioningModel(tiny_caption_model_dir, artifact_dir=str(tmp_path_factory.mktemp("artifacts")))
+
+
+@pytest.fixture(scope="module")
+def recipe_model(tiny_recipe_model_dir):
+    from models.recipe_generation import RecipeGenerationModel
+
+    model = RecipeGenerationModel(tiny_recipe_model_dir)
+    assert model.model_loaded
+    return model
+
+
+def stream(model, cancellation, timeout=60):
+    """The events of stream_recipe_events, failing the test if it never finishes"""
+    events = []
+    thread = threading.Thread(
+        target=lambda: events.extend(model.stream_recipe_events(["egg"], 16, cancellation)), daemon=True
+    )
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "stream_recipe_events did not finish"
+    return events
+
+
+def images(count):
+    from PIL import Image
+
+    return [Image.new("RGB", (256, 256), (40 * i, 120, 200)) for i in range(count)]
+
+
+def test_beam_search_caption_runs_with_a_token(caption_model):
+    captions = caption_model.generate_captions(images(2), num_beams=4, cancellation=CancellationToken())
+
+    assert len(captions) == 2
+
+
+def test_cancelled_beam_search_caption_raises(caption_model):
+    token = CancellationToken([cancel_after(3)], poll_interval=0)
+
+    with pytest.raises(RequestCancelled):
+        caption_model.generate_captions(images(2), num_beams=4, cancellation=token)
+
+
+def test_recipe_candidates_and_batches_run_with_a_token(recipe_model):
+    token = CancellationToken()
+
+    candidates = recipe_model.generate_recipes(["egg"], num_candidates=2, max_new_tokens=8, cancellation=token)
+    batch = recipe_model.generate_recipes_batch([["egg"], ["rice", "salt"]], max_new_tokens=8, cancellation=token)
+
+    assert len(candidates) == 2
+    assert not any(recipe_model.is_fallback_recipe(recipe) for recipe in candidates)
+    assert not any(recipe_model.is_fallback_recipe(recipes[0]) for recipes in batch)
+
+
+def test_cancelled_recipe_batch_raises(recipe_model):
+    token = CancellationToken([cancel_after(3)], poll_interval=0)
+
+    with pytest.raises(RequestCancelled):
+        recipe_model.generate_recipes_batch([["egg"], ["rice", "salt"]], max_new_tokens=32, cancellation=token)
+
+
+def test_stream_finishes_when_cancelled_before_generating(recipe_model):
+    token = CancellationToken()
+    token.cancel("deadline")
+
+    events = stream(recipe_model, token)
+
+    assert events[-1][0] == "done"
+    assert events[-1][1]["cancelled"] == "deadline"
+    assert not events[-1][1]["fallback"]
+
+
+def test_stream_cancelled_while_generating_keeps_what_it_has(recipe_model):
+    events = stream(recipe_model, CancellationToken([cancel_after(3)], poll_interval=0))
+
+    assert events[-1][0] == "done"
+    assert events[-1][1]["cancelled"] == "disconnect"
@@ -0,0 +1,74 @@
+import os
+
+from models.inference_cache import InferenceCache, hash_bytes, hash_file
+
+
+def test_hash_file_matches_hash_bytes(tmp_path):
+    data = os.urandom(3000)
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(data)
+
+    assert hash_file(str(path), chunk_size=1024) == hash_bytes(data)
+
+
+def test_key_depends_on_image_model_and_settings():
+    key = InferenceCache.make_key("abc", "caption", {"num_beams": 4, "max_length": 16})
+
+    assert key == InferenceCache.make_key("abc", "caption", {"max_length": 16, "num_beams": 4})
+    assert key != InferenceCache.make_key("abd", "caption", {"num_beams": 4, "max_length": 16})
+    assert key != InferenceCache.make_key("abc", "detection", {"num_beams": 4, "max_length": 16})
+    assert key != InferenceCache.make_key("abc", "caption", {"num_beams": 1, "max_length": 16})
+
+
+def test_get_or_compute_computes_once():
+    cache = InferenceCache()
+    calls = []
+
+    def compute():
+        calls.append(None)
+        return "a bowl of fruit"
+
+    assert cache.get_or_compute("key", compute) == "a bowl of fruit"
+    assert cache.get_or_compute("key", compute) == "a bowl of fruit"
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_rejected_values_are_not_stored():
+    cache = InferenceCache()
+
+    cache.get_or_compute("key", lambda: "failed", cacheable=lambda value: value != "failed")
+
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = InferenceCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["entries"] == 2
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    InferenceCache(cache_dir=str(tmp_path)).put("key", {"labels": ["apple"]})
+    cache = InferenceCache(cache_dir=str(tmp_path))
+
+    assert cache.get("key") == {"labels": ["apple"]}
+    assert cache.get("key") == {"labels": ["apple"]}
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_corrupt_disk_entry_is_a_miss(tmp_path):
+    cache = InferenceCache(cache_dir=str(tmp_path))
+    cache.put("key", "value")
+    with open(cache._disk_path("key"), "w") as f:
+        f.write("{not json")
+
+    assert InferenceCache(cache_dir=str(tmp_path)).get("key", "default") == "default"
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from models.jobs import FAILED, QUEUED, SUCCEEDED, JobQueue, QueueFull
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.01)
+
+
+def blocked_queue(**kwargs):
+    """A queue whose jobs run until release is set"""
+    release = threading.Event()
+
+    def run_job(job):
+        release.wait(5)
+        return job.payload
+
+    return JobQueue(run_job, **kwargs), release
+
+
+def test_job_result_and_stages():
+    def run_job(job):
+        with job.stage("caption"):
+            pass
+        job.skip_stage("detection")
+        return {"echo": job.payload}
+
+    jobs = JobQueue(run_job, workers=1)
+    job = jobs.submit("hello", stages=("caption", "detection"))
+
+    assert jobs.wait(job, timeout=5)
+    data = job.to_dict()
+    assert data["status"] == SUCCEEDED
+    assert data["result"] == {"echo": "hello"}
+    assert data["stages"]["caption"]["status"] == "done"
+    assert data["stages"]["detection"]["status"] == "skipped"
+    jobs.shutdown()
+
+
+def test_failed_job_reports_its_error():
+    def run_job(job):
+        raise ValueError("no ingredients")
+
+    jobs = JobQueue(run_job, workers=1)
+    job = jobs.submit(None)
+
+    assert jobs.wait(job, timeout=5)
+    assert job.to_dict()["status"] == FAILED
+    assert job.to_dict()["error"] == "no ingredients"
+    assert jobs.stats()["failed"] == 1
+    jobs.shutdown()
+
+
+def test_full_queue_rejects_submissions():
+    jobs, release = blocked_queue(workers=1, max_queued=1)
+    running = jobs.submit(1)
+    wait_until(lambda: running.status != QUEUED)
+    waiting = jobs.submit(2)
+
+    assert jobs.position(waiting) == 0
+    with pytest.raises(QueueFull) as raised:
+        jobs.submit(3)
+    assert raised.value.retry_after >= 1
+    assert jobs.stats()["rejected"] == 1
+
+    release.set()
+    jobs.shutdown()
+
+
+def test_wait_returns_on_the_next_change():
+    jobs, release = blocked_queue(workers=1)
+    job = jobs.submit(1)
+    wait_until(lambda: job.status != QUEUED)
+    version = job.version
+
+    assert not jobs.wait(job, timeout=0.05, since=version)
+    release.set()
+    assert jobs.wait(job, timeout=5, since=version)
+    jobs.shutdown()
+
+
+def test_get_drops_expired_results_without_new_submissions():
+    jobs = JobQueue(lambda job: "done", workers=1, result_ttl=0.05)
+    job = jobs.submit(None)
+    assert jobs.wait(job, timeout=5)
+    assert jobs.get(job.id) is job
+
+    time.sleep(0.1)
+    assert jobs.get(job.id) is None
+    assert jobs.stats()["retained"] == 0
+    jobs.shutdown()
+
+
+def test_idle_workers_drop_expired_results():
+    jobs = JobQueue(lambda job: "done", workers=1, result_ttl=0.1)
+    job = jobs.submit(None)
+    assert jobs.wait(job, timeout=5)
+
+    # Nobody submits, reads or asks for stats any more
+    wait_until(lambda: not jobs._jobs, timeout=2.0)
+    jobs.shutdown()
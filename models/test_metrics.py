@@ -0,0 +1,83 @@
+import pytest
+
+from models.metrics import (
+    MetricsRegistry, request_timings, server_timing_header, stage, start_request_timing, STAGE_SECONDS
+)
+
+
+def test_counters_and_gauges_render_with_labels():
+    registry = MetricsRegistry()
+    requests = registry.counter("app_requests_total", "Requests", ["endpoint"])
+    in_flight = registry.gauge("app_in_flight", "Requests in flight")
+    requests.inc(endpoint="/api/recipes")
+    requests.inc(2, endpoint='say "hi"')
+    with in_flight.track_inprogress():
+        rendered = registry.render()
+
+    assert "# TYPE app_requests_total counter" in rendered
+    assert 'app_requests_total{endpoint="/api/recipes"} 1' in rendered
+    assert 'app_requests_total{endpoint="say \\"hi\\""} 2' in rendered
+    assert "app_in_flight 1" in rendered
+    assert "app_in_flight 0" in registry.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("app_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 5.0):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+
+    assert 'app_seconds_bucket{le="0.1"} 1' in lines
+    assert 'app_seconds_bucket{le="1"} 3' in lines
+    assert 'app_seconds_bucket{le="+Inf"} 4' in lines
+    assert "app_seconds_count 4" in lines
+    assert latency.mean() == pytest.approx(6.25 / 4)
+
+
+def test_labels_must_match_the_declaration():
+    counter = MetricsRegistry().counter("app_total", "Things", ["kind"])
+
+    with pytest.raises(ValueError):
+        counter.inc(stage="caption")
+
+
+def test_registering_a_name_twice_returns_the_first_metric():
+    registry = MetricsRegistry()
+
+    assert registry.counter("app_total", "Things") is registry.counter("app_total", "Things")
+
+
+def test_collectors_are_read_at_scrape_time():
+    registry = MetricsRegistry()
+    size = {"entries": 3}
+    registry.add_collector(lambda: [("cache_entries", "gauge", "Entries", [({}, size["entries"]), ({"x": "y"}, None)])])
+
+    def broken():
+        raise RuntimeError("scheduler gone")
+    registry.add_collector(broken)
+    size["entries"] = 5
+
+    rendered = registry.render()
+    assert "cache_entries 5" in rendered
+    assert 'x="y"' not in rendered
+
+
+def test_stages_are_timed_into_the_request_and_the_histogram():
+    before = STAGE_SECONDS.samples()
+    start_request_timing()
+    with stage("test_stage"):
+        pass
+    with stage("test_stage"):
+        pass
+
+    assert [name for name, _ in request_timings()] == ["test_stage", "test_stage"]
+    assert STAGE_SECONDS.mean(stage="test_stage") >= 0
+    assert len(STAGE_SECONDS.samples()) > len(before)
+
+
+def test_server_timing_header_sums_repeated_stages():
+    header = server_timing_header([("caption", 0.1), ("recipe", 0.25), ("caption", 0.05)])
+
+    assert header == "caption;dur=150.0, recipe;dur=250.0"
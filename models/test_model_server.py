@@ -0,0 +1,218 @@
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+np = pytest.importorskip("numpy")
+
+from models.cancellation import CancellationToken, RequestCancelled  # noqa: E402
+from models.metrics import STAGE_SECONDS, record_stage, record_updates, replay_updates, request_timings, \
+    start_request_timing  # noqa: E402
+from models.model_server import ModelServer, ModelServerClient, ModelServerError, model_server_sockets  # noqa: E402
+from models.registry import ModelNotReady, ModelRegistry  # noqa: E402
+
+# The server runs in a process of its own, as serve_models.py does, so
+# shared memory segments are created and attached across processes
+fork = multiprocessing.get_context("fork")
+
+
+class FakeCaptioner:
+    """Captions describing the pixel tensor it was given"""
+
+    model_name = "fake-captioner"
+    num_beams = 4
+
+    def generate_captions_from_pixel_values(self, pixel_values, num_beams=None, cancellation=None):
+        record_stage("caption_generate", 0.25)
+        return [f"{tuple(pixel_values.shape)} {pixel_values.dtype} {float(pixel_values.sum()):.1f} {num_beams}"]
+
+
+class FakeRecipeModel:
+    """Recipes naming their ingredients; "boom" fails and "wait" runs until cancelled"""
+
+    model_name = "fake-recipes"
+
+    def __init__(self):
+        self.stream_stopped = fork.Event()
+
+    def generate_recipes(self, ingredients, num_candidates=1, max_new_tokens=None, cancellation=None):
+        if ingredients == ["boom"]:
+            raise RuntimeError("generation failed")
+        while ingredients == ["wait"]:
+            cancellation.raise_if_cancelled("recipe_generate")
+            time.sleep(0.01)
+        return [{"name": " and ".join(ingredients)}] * num_candidates
+
+    def stream_recipe_events(self, ingredients, max_new_tokens=None, cancellation=None):
+        try:
+            for i in range(max_new_tokens):
+                cancellation.raise_if_cancelled("recipe_generate")
+                yield "token", str(i)
+                time.sleep(0.01)
+            yield "done", {"recipe": {"name": ingredients[0]}}
+        finally:
+            self.stream_stopped.set()
+
+
+@pytest.fixture
+def serve():
+    """Start a model server process for a registry on a socket path; stopped after the test"""
+    processes = []
+
+    def start(registry, socket_path):
+        process = fork.Process(target=ModelServer(registry, socket_path).serve_forever, daemon=True)
+        process.start()
+        processes.append(process)
+        for _ in range(500):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.01)
+    yield start
+    for process in processes:
+        process.terminate()
+        process.join()
+
+
+@pytest.fixture(scope="module")
+def recipes():
+    return FakeRecipeModel()
+
+
+@pytest.fixture
+def socket_path(tmp_path, recipes, serve):
+    registry = ModelRegistry()
+    registry.register("captioning", FakeCaptioner)
+    registry.register("recipe", lambda: recipes)
+    registry.load_all()
+    path = str(tmp_path / "models.sock")
+    serve(registry, path)
+    return path
+
+
+@pytest.fixture
+def client(socket_path):
+    client = ModelServerClient(socket_path, pool_size=2)
+    yield client
+    client.close()
+
+
+def test_socket_setting_assigns_every_model():
+    assert model_server_sockets("/run/models.sock") == dict.fromkeys(("captioning", "detection", "recipe"),
+                                                                     "/run/models.sock")
+    assert model_server_sockets("/run/vision.sock, recipe=/run/recipe.sock")["recipe"] == "/run/recipe.sock"
+    assert model_server_sockets("recipe=/run/recipe.sock") == {"recipe": "/run/recipe.sock"}
+    assert model_server_sockets("") == {}
+    with pytest.raises(ValueError):
+        model_server_sockets("draft=/run/draft.sock")
+
+
+def test_tensors_arrive_through_shared_memory(client):
+    pixel_values = torch.ones(2, 3, 4, 4)
+
+    assert client.call("captioning", "generate_captions_from_pixel_values", pixel_values, 1) == [
+        "(2, 3, 4, 4) torch.float32 96.0 1"]
+    assert client.call("captioning", "generate_captions_from_pixel_values",
+                       np.full((5,), 2, dtype=np.int64), None) == ["(5,) torch.int64 10.0 None"]
+    assert client.stats()["shared_memory_bytes"] >= 1 << 20
+
+    # A tensor larger than the segment gets a new one
+    large = torch.ones(1024, 1024)
+    assert client.call("captioning", "generate_captions_from_pixel_values", large)[0].startswith("(1024, 1024)")
+    assert client.stats()["shared_memory_bytes"] >= large.numel() * 4
+
+
+def test_idle_connections_are_reused(client):
+    for _ in range(3):
+        client.call("recipe", "generate_recipes", ["egg"])
+
+    stats = client.stats()
+    assert stats["open_connections"] == 1
+    assert stats["calls"] == 3
+    assert stats["server"]["models"]["recipe"]["state"] == "ready"
+
+
+def test_server_metric_updates_are_replayed_in_the_client(client):
+    start_request_timing()
+
+    client.call("captioning", "generate_captions_from_pixel_values", torch.zeros(1, 3, 2, 2))
+
+    assert request_timings() == [("caption_generate", 0.25)]
+
+
+def test_failures_come_back_as_exceptions(client):
+    with pytest.raises(ModelServerError, match="generation failed"):
+        client.call("recipe", "generate_recipes", ["boom"])
+    with pytest.raises(ModelServerError, match="no method"):
+        client.call("recipe", "load_state_dict", {})
+    with pytest.raises(ModelServerError):
+        client.call("detection", "detect_ingredients_from_inputs", {}, [])
+    assert client.call("recipe", "generate_recipes", ["egg"], num_candidates=2) == [{"name": "egg"}] * 2
+
+
+def test_describe_returns_the_mirrored_attributes(client):
+    attributes = client.call(None, "describe", "recipe")
+
+    assert attributes["model_name"] == "fake-recipes"
+    assert attributes["processor_source"] == "fake-recipes"
+    assert attributes["structured_output"] is None
+
+
+def test_models_still_loading_are_not_ready(tmp_path, serve):
+    release = fork.Event()
+    registry = ModelRegistry()
+    registry.register("recipe", lambda: release.wait(5) and FakeRecipeModel())
+    path = str(tmp_path / "loading.sock")
+    serve(registry, path)
+    client = ModelServerClient(path)
+
+    with pytest.raises(ModelNotReady):
+        client.call("recipe", "generate_recipes", ["egg"])
+    release.set()
+    assert client.model_attributes("recipe", poll_interval=0.01)["model_name"] == "fake-recipes"
+    client.close()
+
+
+def test_cancelling_the_token_stops_the_call_on_the_server(client):
+    token = CancellationToken()
+    threading.Timer(0.1, token.cancel, ["deadline"]).start()
+
+    with pytest.raises(RequestCancelled) as raised:
+        client.call("recipe", "generate_recipes", ["wait"], cancellation=token)
+
+    assert raised.value.reason == "deadline"
+    assert client.call("recipe", "generate_recipes", ["egg"]) == [{"name": "egg"}]
+    assert client.stats()["open_connections"] == 1
+
+
+def test_stream_yields_events_as_they_come(client):
+    events = list(client.stream("recipe", "stream_recipe_events", ["soup"], 3))
+
+    assert events == [("token", "0"), ("token", "1"), ("token", "2"), ("done", {"recipe": {"name": "soup"}})]
+
+
+def test_closing_a_stream_stops_it_on_the_server(client, recipes):
+    recipes.stream_stopped.clear()
+    stream = client.stream("recipe", "stream_recipe_events", ["soup"], 10000)
+    assert next(stream) == ("token", "0")
+
+    stream.close()
+
+    assert recipes.stream_stopped.wait(5)
+    assert client.call("recipe", "generate_recipes", ["egg"]) == [{"name": "egg"}]
+    assert client.stats()["open_connections"] == 1
+
+
+def test_recorded_updates_replay_into_this_process():
+    with record_updates() as updates:
+        STAGE_SECONDS.observe(0.5, stage="replayed_stage")
+    before = STAGE_SECONDS.mean(stage="replayed_stage")
+    start_request_timing()
+
+    replay_updates(updates + [("not_registered_here_total", "inc", 1, {})])
+
+    assert updates == [("recipesnap_stage_seconds", "observe", 0.5, {"stage": "replayed_stage"})]
+    assert request_timings() == [("replayed_stage", 0.5)]
+    assert STAGE_SECONDS.mean(stage="replayed_stage") == before
@@ -0,0 +1,89 @@
+import io
+import random
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from models.near_duplicates import NearDuplicateIndex, dhash, hamming_distance  # noqa: E402
+from models.preprocessing import SharedImage  # noqa: E402
+
+
+def photo(seed, size=(320, 240)):
+    """A smooth random image, with the coarse light and dark areas of a photo"""
+    rng = random.Random(seed)
+    coarse = Image.new("RGB", (6, 5))
+    coarse.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(30)])
+    return coarse.resize(size, Image.BICUBIC)
+
+
+def jpeg_bytes(image, quality=90):
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def reload(data):
+    return Image.open(io.BytesIO(data))
+
+
+def test_resized_and_recompressed_copies_hash_close():
+    for seed in range(5):
+        original = photo(seed)
+        copies = [original.resize((160, 120)), reload(jpeg_bytes(original, quality=40)),
+                  original.crop((4, 3, 316, 237))]
+
+        assert all(hamming_distance(dhash(original), dhash(copy)) <= 6 for copy in copies)
+
+
+def test_different_photos_hash_far_apart():
+    hashes = [dhash(photo(seed)) for seed in range(10)]
+
+    assert all(0 <= value < 2 ** 64 for value in hashes)
+    assert min(hamming_distance(a, b) for i, a in enumerate(hashes) for b in hashes[i + 1:]) > 6
+
+
+def test_shared_image_hashes_the_decoded_image():
+    data = jpeg_bytes(photo(1))
+
+    assert SharedImage(data).perceptual_hash == dhash(reload(data))
+
+
+def test_lookup_finds_the_closest_hash_within_the_threshold():
+    rng = random.Random(0)
+    stored = [rng.getrandbits(64) for _ in range(500)]
+    index = NearDuplicateIndex(threshold=6)
+    for value in stored:
+        index.add(value, value)
+
+    for value in stored[:50]:
+        flipped = value
+        for bit in rng.sample(range(64), rng.randrange(7)):
+            flipped ^= 1 << bit
+        closest = min(stored, key=lambda candidate: hamming_distance(candidate, flipped))
+        assert index.lookup(flipped) == (closest, hamming_distance(closest, flipped))
+    assert index.lookup(stored[0] ^ 0b1111111) is None
+
+
+def test_index_is_bounded_by_least_recent_use():
+    index = NearDuplicateIndex(max_entries=2, threshold=2)
+    index.add(0b0001, "a")
+    index.add(0b1111 << 20, "b")
+    index.lookup(0b0001)
+    index.add(0b1111 << 40, "c")
+
+    assert index.lookup(0b1111 << 20) is None
+    assert index.lookup(0b0011) == ("a", 1)
+    index.add(0b0001, "a2")
+    assert index.lookup(0b0001) == ("a2", 0)
+    stats = index.stats()
+    assert stats["entries"] == 2
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+    assert stats["mean_hit_distance"] == pytest.approx(1 / 3)
+
+
+def test_threshold_must_fit_the_hash():
+    with pytest.raises(ValueError):
+        NearDuplicateIndex(threshold=64)
+    assert NearDuplicateIndex(threshold=0).lookup(5) is None
@@ -0,0 +1,80 @@
+import contextvars
+import threading
+
+import pytest
+
+from models.parallel import VisionExecutor, set_torch_threads, threads_per_call
+
+
+@pytest.fixture
+def torch_threads():
+    torch = pytest.importorskip("torch")
+    original = torch.get_num_threads()
+    yield torch
+    torch.set_num_threads(original)
+
+
+def test_threads_per_call_splits_evenly():
+    assert threads_per_call(2, total=8) == 4
+    assert threads_per_call(3, total=8) == 2
+    assert threads_per_call(1, total=8) == 8
+
+
+def test_threads_per_call_gives_every_call_a_thread():
+    assert threads_per_call(4, total=2) == 1
+    assert threads_per_call(0, total=2) == 2
+
+
+def test_set_torch_threads_applies_to_every_thread(torch_threads):
+    torch = torch_threads
+    set_torch_threads(2)
+    executor = VisionExecutor("parallel")
+
+    def work():
+        torch.ones(64, 64) @ torch.ones(64, 64)
+        return torch.get_num_threads()
+
+    results = executor.run({"caption": work, "detection": work})
+
+    assert results == {"caption": 2, "detection": 2}
+    assert torch.get_num_threads() == 2
+    assert executor.stats()["torch_threads"] == 2
+
+
+def test_parallel_mode_runs_branches_in_their_own_threads():
+    executor = VisionExecutor("parallel")
+    results = executor.run({
+        "caption": lambda: threading.current_thread().name,
+        "detection": lambda: threading.current_thread().name,
+    })
+
+    assert results["caption"].startswith("vision-caption")
+    assert results["detection"].startswith("vision-detection")
+
+
+def test_parallel_mode_runs_unknown_branches_in_the_caller():
+    executor = VisionExecutor("parallel", branches=("caption",))
+    results = executor.run({"recipe": lambda: threading.current_thread().name})
+
+    assert results["recipe"] == threading.current_thread().name
+
+
+def test_sequential_mode_runs_in_the_caller():
+    executor = VisionExecutor("sequential")
+    results = executor.run({"caption": lambda: threading.current_thread().name})
+
+    assert results["caption"] == threading.current_thread().name
+    assert executor.stats()["requests"] == 1
+
+
+def test_branches_see_the_callers_context():
+    request_id = contextvars.ContextVar("request_id")
+    request_id.set("abc")
+    executor = VisionExecutor("parallel")
+
+    assert executor.run({"caption": request_id.get})["caption"] == "abc"
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        VisionExecutor("threaded")
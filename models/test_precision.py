@@ -0,0 +1,66 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from models.precision import apply_precision, cast_inputs, load_dtype, model_input_dtype  # noqa: E402
+
+CPU = torch.device("cpu")
+
+
+def small_model():
+    return torch.nn.Sequential(torch.nn.Linear(8, 8), torch.nn.LayerNorm(8), torch.nn.Linear(8, 2)).eval()
+
+
+def test_load_dtype_per_mode():
+    assert load_dtype("auto", CPU) == torch.float32
+    assert load_dtype("auto", torch.device("cuda")) == torch.float16
+    assert load_dtype("bf16", CPU) == torch.bfloat16
+    assert load_dtype("int8", CPU) == torch.float32
+    with pytest.raises(ValueError):
+        load_dtype("fp8", CPU)
+
+
+def test_bf16_converts_every_weight():
+    model = apply_precision(small_model(), "bf16", CPU)
+
+    assert model_input_dtype(model) == torch.bfloat16
+    assert model(torch.rand(1, 8, dtype=torch.bfloat16)).dtype == torch.bfloat16
+
+
+def test_int8_quantizes_linear_layers_only():
+    model = small_model()
+    inputs = torch.rand(4, 8)
+    expected = model(inputs)
+
+    quantized = apply_precision(model, "int8", CPU)
+
+    assert type(quantized[0]).__module__.startswith("torch.ao.nn.quantized")
+    assert isinstance(quantized[1], torch.nn.LayerNorm)
+    assert model_input_dtype(quantized) == torch.float32
+    assert torch.allclose(quantized(inputs), expected, atol=0.1)
+
+
+def test_int8_is_skipped_off_cpu():
+    model = small_model()
+
+    assert apply_precision(model, "int8", torch.device("meta")) is model
+
+
+def test_cast_inputs_leaves_ids_and_masks_alone():
+    inputs = {"pixel_values": torch.rand(1, 3), "attention_mask": torch.ones(1, 3, dtype=torch.long), "other": None}
+
+    cast = cast_inputs(inputs, torch.bfloat16)
+
+    assert cast["pixel_values"].dtype == torch.bfloat16
+    assert cast["attention_mask"].dtype == torch.long
+    assert cast["other"] is None
+
+
+@pytest.mark.parametrize("precision", ["bf16", "int8"])
+def test_recipe_model_generates_in_each_precision(tiny_recipe_model_dir, precision):
+    from models.recipe_generation import RecipeGenerationModel
+
+    model = RecipeGenerationModel(tiny_recipe_model_dir, precision=precision, prefix_cache=False)
+
+    assert model.model_loaded
+    assert not model.is_fallback_recipe(model.generate_recipes(["egg"], max_new_tokens=8)[0])
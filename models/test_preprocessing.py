@@ -0,0 +1,60 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import models.preprocessing as preprocessing  # noqa: E402
+from models.preprocessing import SharedImage, decode_image, processor_min_edge  # noqa: E402
+
+
+def encode(size, format="JPEG", mode="RGB"):
+    buffer = io.BytesIO()
+    Image.new(mode, size, "orange" if mode == "RGB" else 128).save(buffer, format)
+    return buffer.getvalue()
+
+
+def test_min_edge_of_processor_sizes():
+    assert processor_min_edge(SimpleNamespace(size={"height": 224, "width": 224})) == 224
+    assert processor_min_edge(SimpleNamespace(size={"shortest_edge": 800, "longest_edge": 1333})) == 800
+    assert processor_min_edge(SimpleNamespace(size=SimpleNamespace(shortest_edge=None, height=384, width=384))) == 384
+    assert processor_min_edge(SimpleNamespace(size=256)) == 256
+    assert processor_min_edge(SimpleNamespace(), default=224) == 224
+
+
+def test_large_jpeg_decodes_reduced_but_not_below_min_edge():
+    image = decode_image(encode((2000, 1600)), min_edge=224)
+
+    assert image.mode == "RGB"
+    assert 224 <= min(image.size) < 1600
+    assert image.size[0] / image.size[1] == 2000 / 1600
+
+
+def test_small_min_edge_never_upscales_or_skips_other_formats():
+    assert decode_image(encode((300, 200)), min_edge=224).size == (300, 200)
+    assert decode_image(encode((2000, 1600), "PNG"), min_edge=224).size == (2000, 1600)
+    assert decode_image(encode((2000, 1600))).size == (2000, 1600)
+
+
+def test_decoded_images_are_rgb():
+    assert decode_image(encode((10, 10), "PNG", "L")).mode == "RGB"
+    grey = Image.new("L", (10, 10))
+    assert decode_image(grey).mode == "RGB"
+    rgb = Image.new("RGB", (10, 10))
+    assert decode_image(rgb) is rgb
+
+
+def test_shared_image_decodes_once_and_only_when_asked(monkeypatch):
+    decoded = []
+
+    def counting_decode(source, min_edge=None):
+        decoded.append(min_edge)
+        return decode_image(source, min_edge)
+    monkeypatch.setattr(preprocessing, "decode_image", counting_decode)
+
+    shared = SharedImage(encode((640, 480)), min_edge=224)
+    assert decoded == []
+
+    assert shared.image is shared.image
+    assert decoded == [224]
@@ -0,0 +1,130 @@
+import time
+
+import pytest
+
+import models.quality as quality
+from models.quality import MIN_DETECTION_EDGE, QualityBudget, current_budget, set_budget
+
+
+class FakeMeans:
+    """Stands in for a histogram, with fixed means per stage"""
+
+    def __init__(self, means=None, overall=None):
+        self.means = means or {}
+        self.overall = overall
+
+    def mean(self, stage=None):
+        return self.overall if stage is None else self.means.get(stage)
+
+
+@pytest.fixture
+def observed(monkeypatch):
+    """Set the stage means and generation speed the budget estimates from"""
+    def observe(stage_means=None, tokens_per_second=None):
+        monkeypatch.setattr(quality, "STAGE_SECONDS", FakeMeans(stage_means))
+        monkeypatch.setattr(quality, "TOKENS_PER_SECOND", FakeMeans(overall=tokens_per_second))
+    observe()
+    return observe
+
+
+def budget(tier="quality", seconds_left=None):
+    return QualityBudget(tier, seconds_left and seconds_left * 1000)
+
+
+def test_tiers_and_deadlines_are_validated():
+    with pytest.raises(ValueError):
+        QualityBudget("best")
+    with pytest.raises(ValueError):
+        QualityBudget(deadline_ms=0)
+    assert QualityBudget().remaining() is None
+    assert 0 < QualityBudget(deadline_ms=1000).remaining() <= 1
+
+
+def test_full_quality_changes_nothing(observed):
+    full = budget()
+
+    assert full.caption_beams(4) == 4
+    assert full.detection_edge(800) == 800
+    assert full.recipe_tokens(512) is None
+    assert not full.limits_recipes()
+    assert full.degradations == []
+
+
+def test_fast_tier_skips_captions_and_generation(observed):
+    fast = budget("fast")
+
+    assert fast.caption_beams(4) == 0
+    assert fast.detection_edge(800) == 480
+    assert fast.recipe_tokens(512) == 0
+    assert fast.limits_recipes()
+    assert fast.to_dict() == {
+        "tier": "fast", "deadline_ms": None,
+        "degradations": ["caption_skipped", "detection_edge=480", "recipes_retrieved"],
+    }
+
+
+def test_balanced_tier_caps_work(observed):
+    balanced = budget("balanced")
+
+    assert balanced.caption_beams(4) == 1
+    assert balanced.detection_edge(800) == 640
+    assert balanced.detection_edge(600) == 600
+    assert balanced.recipe_tokens(512) == 384
+    assert balanced.recipe_tokens(256) is None
+    assert balanced.degradations == ["caption_greedy", "detection_edge=640", "max_new_tokens=384"]
+
+
+def test_stages_without_estimates_run_unchanged(observed):
+    late = budget(seconds_left=0.001)
+
+    assert late.caption_beams(4) == 4
+    assert late.detection_edge(800) == 800
+    assert late.recipe_tokens(512) is None
+
+
+def test_deadline_degrades_captioning_step_by_step(observed):
+    observed({name: 0.2 for name in quality.CAPTION_STAGES})
+
+    assert budget(seconds_left=10).caption_beams(4) == 4
+    # Beam search (0.6s) does not fit, greedy (0.15s) does
+    assert budget(seconds_left=0.4).caption_beams(4) == 1
+    # Nothing fits once the later stages' reserve is taken out
+    tight = budget(seconds_left=0.4)
+    assert tight.caption_beams(4, reserve=0.3) == 0
+    assert tight.degradations == ["caption_skipped"]
+
+
+def test_deadline_shrinks_detection_to_the_smallest_edge(observed):
+    observed({name: 0.5 for name in quality.DETECTION_STAGES})
+
+    assert budget(seconds_left=10).detection_edge(800) == 800
+    tight = budget(seconds_left=1)
+    assert tight.detection_edge(800) == MIN_DETECTION_EDGE
+    assert tight.to_dict()["degradations"] == [f"detection_edge={MIN_DETECTION_EDGE}"]
+
+
+def test_deadline_caps_recipe_tokens_by_generation_speed(observed):
+    observed({"recipe_prefill": 0.5}, tokens_per_second=100)
+
+    assert budget(seconds_left=60).recipe_tokens(512) is None
+    capped = budget(seconds_left=3.5).recipe_tokens(512)
+    assert 250 <= capped <= 300
+    assert budget(seconds_left=1).recipe_tokens(512) == 0
+
+
+def test_degradations_are_recorded_once(observed):
+    fast = budget("fast")
+    fast.caption_beams(4)
+    fast.caption_beams(4)
+
+    assert fast.degradations == ["caption_skipped"]
+
+
+def test_current_budget_defaults_to_full_quality():
+    assert current_budget().tier == "quality"
+    fast = QualityBudget("fast", started=time.monotonic())
+    set_budget(fast)
+    try:
+        assert current_budget() is fast
+    finally:
+        set_budget(None)
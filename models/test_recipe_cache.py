@@ -0,0 +1,68 @@
+import models.recipe_cache as recipe_cache
+from models.recipe_cache import RecipeCache, normalize_ingredients
+
+KEY = RecipeCache.make_key(["tomato", "onion"], "mistral")
+
+
+def recipe(name):
+    return [{"name": name, "ingredients": [], "instructions": []}]
+
+
+def test_ingredient_sets_are_canonical():
+    assert normalize_ingredients(["Tomato ", "onion", "onion", ""]) == ("onion", "tomato")
+    assert RecipeCache.make_key(["Tomato", "onion", "onion"], "mistral") == KEY
+    assert RecipeCache.make_key(["tomato", "onion"], "mistral", {"temperature": 0.5}) != KEY
+    assert RecipeCache.ingredients_from_key(KEY) == ["onion", "tomato"]
+
+
+def test_hit_only_once_every_variant_exists():
+    cache = RecipeCache(variants_per_key=2)
+
+    assert cache.get(KEY) is None
+    cache.add(KEY, recipe("first"))
+    assert cache.get(KEY) is None
+    assert cache.peek(KEY) == recipe("first")
+    assert cache.missing_variants(KEY) == 1
+    cache.add(KEY, recipe("second"))
+
+    assert cache.get(KEY) in (recipe("first"), recipe("second"))
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_variants_expire_after_the_ttl(monkeypatch):
+    cache = RecipeCache(variants_per_key=1, ttl_seconds=60)
+    cache.add(KEY, recipe("old"))
+    now = recipe_cache.time.time()
+    monkeypatch.setattr(recipe_cache.time, "time", lambda: now + 120)
+
+    assert cache.get(KEY) is None
+    assert cache.peek(KEY) is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = RecipeCache(max_entries=2, variants_per_key=1)
+    keys = [RecipeCache.make_key([name], "mistral") for name in ("egg", "rice", "leek")]
+    cache.add(keys[0], recipe("egg"))
+    cache.add(keys[1], recipe("rice"))
+    cache.get(keys[0])
+    cache.add(keys[2], recipe("leek"))
+
+    assert cache.peek(keys[1]) is None
+    assert cache.peek(keys[0]) == recipe("egg")
+
+
+def test_entries_and_request_counts_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache" / "recipes.json")
+    rare = RecipeCache.make_key(["leek"], "mistral")
+    cache = RecipeCache(variants_per_key=1, path=path)
+    cache.add(KEY, recipe("soup"))
+    for _ in range(3):
+        cache.get(KEY)
+    cache.get(rare)
+    cache.save()
+
+    reloaded = RecipeCache(variants_per_key=1, path=path)
+
+    assert reloaded.get(KEY) == recipe("soup")
+    assert reloaded.most_requested(5) == [KEY, rare]
@@ -0,0 +1,144 @@
+import pytest
+
+pytest.importorskip("torch")
+
+from models.cancellation import CancellationToken  # noqa: E402
+from models.recipe_generation import RecipeGenerationModel  # noqa: E402
+from models.recipe_parser import RecipeStreamParser  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def recipe_model(tiny_recipe_model_dir):
+    model = RecipeGenerationModel(tiny_recipe_model_dir)
+    assert model.model_loaded
+    return model
+
+
+def test_stream_events_add_up_to_the_final_recipe(recipe_model):
+    events = list(recipe_model.stream_recipe_events(["egg", "tomato"], max_new_tokens=48))
+
+    event, done = events[-1]
+    assert event == "done"
+    assert not done["fallback"]
+    assert done["total_ms"] > 0
+    parser = RecipeStreamParser()
+    expected = []
+    for event, value in events:
+        if event == "token":
+            expected.extend(parser.feed(value))
+    expected.extend(parser.close())
+    assert [(event, value) for event, value in events if event in ("name", "ingredient", "instruction")] == expected
+    assert parser.recipe == done["recipe"]
+
+
+def test_closing_the_stream_stops_generation(recipe_model):
+    token = CancellationToken()
+    stream = recipe_model.stream_recipe_events(["egg"], max_new_tokens=500, cancellation=token)
+
+    assert next(stream)[0] == "token"
+    stream.close()
+
+    assert token.reason == "closed"
+
+
+def test_stream_without_ingredients_is_the_fallback_recipe(recipe_model):
+    events = list(recipe_model.stream_recipe_events([]))
+
+    assert events[0][0] == "name"
+    assert events[-1][0] == "done"
+    assert events[-1][1]["fallback"]
+    assert recipe_model.is_fallback_recipe(events[-1][1]["recipe"])
+
+
+def cache_length(cache):
+    return cache.get_seq_length() if hasattr(cache, "get_seq_length") else cache[0][0].shape[2]
+
+
+def test_prefix_cache_covers_all_but_the_last_prompt_token(recipe_model):
+    input_ids, kwargs = recipe_model._prepare_inputs(["egg", "tomato"])
+
+    assert len(recipe_model.prefix_ids) < input_ids.shape[1]
+    assert cache_length(kwargs["past_key_values"]) == input_ids.shape[1] - 1
+
+
+def test_prefix_cache_gives_the_same_output_as_the_full_prompt(recipe_model):
+    import torch
+
+    input_ids, kwargs = recipe_model._prepare_inputs(["egg", "tomato"])
+    with torch.no_grad():
+        cached = recipe_model.model.generate(input_ids, do_sample=False, max_new_tokens=12, **kwargs)
+        full = recipe_model.model.generate(input_ids, do_sample=False, max_new_tokens=12,
+                                           attention_mask=torch.ones_like(input_ids))
+
+    assert torch.equal(cached, full)
+
+
+def test_generating_leaves_the_prefix_cache_intact(recipe_model):
+    recipe_model.generate_recipes(["egg"], max_new_tokens=8)
+    recipe_model.generate_recipes(["rice", "salt"], max_new_tokens=8)
+
+    assert cache_length(recipe_model.prefix_cache) == len(recipe_model.prefix_ids)
+    _, kwargs = recipe_model._prepare_inputs(["egg", "tomato"])
+    assert cache_length(kwargs["past_key_values"]) > len(recipe_model.prefix_ids)
+
+
+def test_candidates_come_from_one_generate_call(recipe_model, monkeypatch):
+    calls = []
+    generate = recipe_model.model.generate
+
+    def counting_generate(*args, **kwargs):
+        calls.append(kwargs.get("num_return_sequences"))
+        return generate(*args, **kwargs)
+    monkeypatch.setattr(recipe_model.model, "generate", counting_generate)
+
+    recipes = recipe_model.generate_recipes(["egg"], num_candidates=3, max_new_tokens=8)
+
+    assert len(recipes) == 3
+    assert calls == [3]
+
+
+def test_batch_keeps_input_order_across_batches(recipe_model, monkeypatch):
+    batches = []
+
+    def recording_batch(ingredient_lists, num_candidates, *args):
+        batches.append(ingredient_lists)
+        return [[{"name": ingredients[0], "ingredients": ingredients, "instructions": []}] * num_candidates
+                for ingredients in ingredient_lists]
+    monkeypatch.setattr(recipe_model, "_generate_padded_batch", recording_batch)
+    lists = [["rice", "beans", "onion"], ["egg"], [], ["leek", "potato"]]
+
+    results = recipe_model.generate_recipes_batch(lists, num_candidates=2, batch_size=2)
+
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert [recipes[0]["name"] for recipes in results[:2]] == ["rice", "egg"]
+    assert len(results[0]) == 2
+    assert recipe_model.is_fallback_recipe(results[2][0])
+    assert results[3][0]["name"] == "leek"
+
+
+def test_failed_batch_only_falls_back_for_its_own_lists(recipe_model, monkeypatch):
+    def flaky_batch(ingredient_lists, num_candidates, *args):
+        if ["egg"] in ingredient_lists:
+            raise RuntimeError("out of memory")
+        return [[{"name": "ok", "ingredients": [], "instructions": []}] for _ in ingredient_lists]
+    monkeypatch.setattr(recipe_model, "_generate_padded_batch", flaky_batch)
+
+    results = recipe_model.generate_recipes_batch([["egg"], ["rice", "beans", "onion", "garlic"]], batch_size=1)
+
+    assert recipe_model.is_fallback_recipe(results[0][0])
+    assert results[1][0]["name"] == "ok"
+
+
+def test_padded_batch_matches_prompts_run_alone(recipe_model):
+    import torch
+
+    prompts = [recipe_model._format_prompt(["egg"]), recipe_model._format_prompt(["rice", "beans", "onion"])]
+    inputs = recipe_model.tokenizer(prompts, return_tensors="pt", padding=True)
+    pad = recipe_model.tokenizer.pad_token_id
+    with torch.no_grad():
+        batch = recipe_model.model.generate(**inputs, do_sample=False, max_new_tokens=6, pad_token_id=pad)
+        alone = recipe_model.model.generate(**recipe_model.tokenizer(prompts[:1], return_tensors="pt"),
+                                            do_sample=False, max_new_tokens=6, pad_token_id=pad)
+
+    assert recipe_model.tokenizer.padding_side == "left"
+    assert torch.equal(batch[0, -6:], alone[0, -6:])
@@ -0,0 +1,109 @@
+from models.recipe_parser import RecipeStreamParser, StructuredRecipeParser
+
+RESPONSE = """Here is a recipe for you!
+
+Tomato Egg Stir-Fry
+
+Preparation time: 10 minutes
+
+## Ingredients:
+- 2 tomatoes, diced
+- 3 eggs
+- salt to taste
+
+## Instructions:
+1. Whisk the eggs.
+2. Fry the tomatoes until soft.
+3) Stir in the eggs and season.
+"""
+
+RECIPE = {
+    "name": "Tomato Egg Stir-Fry",
+    "ingredients": ["2 tomatoes, diced", "3 eggs"],
+    "instructions": ["Whisk the eggs.", "Fry the tomatoes until soft.", "Stir in the eggs and season."],
+}
+
+
+def parse(chunks):
+    parser = RecipeStreamParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    events.extend(parser.close())
+    return parser.recipe, events
+
+
+def test_whole_response_is_parsed():
+    recipe, events = parse([RESPONSE])
+
+    assert recipe == RECIPE
+    assert events == [("name", RECIPE["name"])] + [("ingredient", item) for item in RECIPE["ingredients"]] + [
+        ("instruction", step) for step in RECIPE["instructions"]
+    ]
+
+
+def test_chunking_does_not_change_the_result():
+    whole = parse([RESPONSE])
+
+    assert parse(list(RESPONSE)) == whole
+    assert parse([RESPONSE[i:i + 7] for i in range(0, len(RESPONSE), 7)]) == whole
+
+
+def test_items_are_emitted_once_their_line_is_complete():
+    parser = RecipeStreamParser()
+    parser.feed("Soup\nIngredients:\n- 1 leek")
+
+    assert parser.feed(", sliced") == []
+    assert parser.feed("\n- 2 potatoes") == [("ingredient", "1 leek, sliced")]
+    assert parser.close() == [("ingredient", "2 potatoes")]
+
+
+def test_recipe_without_a_name_has_no_name_key():
+    assert "name" not in RecipeStreamParser().recipe
+
+
+STRUCTURED_RESPONSE = """Name: Tomato Egg Stir-Fry
+Ingredients:
+- 2 tomatoes, diced
+- 3 eggs
+Instructions:
+1. Whisk the eggs.
+2. Fry the tomatoes until soft.
+3. Stir in the eggs and season.
+END"""
+
+
+def test_structured_response_is_parsed_by_section():
+    parser = StructuredRecipeParser()
+    events = []
+    for char in STRUCTURED_RESPONSE:
+        events.extend(parser.feed(char))
+        if parser.complete:
+            break
+
+    assert parser.complete
+    assert parser.recipe == RECIPE
+    assert events == [("name", RECIPE["name"])] + [("ingredient", item) for item in RECIPE["ingredients"]] + [
+        ("instruction", step) for step in RECIPE["instructions"]
+    ]
+    assert parser.partial_line == "END"
+
+
+def test_structured_recipe_ends_at_the_first_line_outside_the_schema():
+    parser = StructuredRecipeParser()
+    parser.feed("Name: Soup\nIngredients:\n- leek\nInstructions:\n1. Boil.\n")
+
+    assert not parser.complete
+    assert parser.at_line_start
+    assert parser.feed("Enjoy!\n2. Serve.\n") == []
+    assert parser.complete
+    assert parser.recipe["instructions"] == ["Boil."]
+
+
+def test_structured_items_wait_for_their_line_to_end():
+    parser = StructuredRecipeParser()
+
+    assert parser.feed("Name: Soup\nIngredients:\n- 1 le") == [("name", "Soup")]
+    assert parser.partial_line == "- 1 le"
+    assert parser.close() == [("ingredient", "1 le")]
+    assert parser.recipe == {"name": "Soup", "ingredients": ["1 le"], "instructions": []}
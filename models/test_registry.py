@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from models.registry import FAILED, LOADING, READY, ModelNotReady, ModelRegistry, model_config_from_env
+
+
+def blocked_factory(value="model"):
+    """A factory that only finishes once the returned event is set"""
+    release = threading.Event()
+
+    def factory():
+        release.wait(5)
+        return value
+    return factory, release
+
+
+def test_first_use_starts_loading_without_blocking():
+    registry = ModelRegistry()
+    factory, release = blocked_factory()
+    registry.register("recipe", factory)
+
+    with pytest.raises(ModelNotReady) as raised:
+        registry.get("recipe")
+    assert raised.value.state == LOADING
+
+    release.set()
+    assert registry.get("recipe", wait=True, timeout=5) == "model"
+    assert registry.is_ready("recipe")
+
+
+def test_wait_loads_in_the_caller():
+    registry = ModelRegistry()
+    registry.register("captioning", lambda: threading.current_thread().name)
+
+    assert registry.get("captioning", wait=True) == threading.current_thread().name
+
+
+def test_wait_times_out_while_another_thread_loads():
+    registry = ModelRegistry()
+    factory, release = blocked_factory()
+    registry.register("recipe", factory)
+    registry.warm_up()
+
+    with pytest.raises(ModelNotReady):
+        registry.get("recipe", wait=True, timeout=0.05)
+    release.set()
+
+
+def test_failed_load_is_reported():
+    registry = ModelRegistry()
+
+    def broken():
+        raise OSError("no such model")
+    registry.register("detection", broken)
+    registry.load_all()
+
+    with pytest.raises(ModelNotReady) as raised:
+        registry.get("detection")
+    assert raised.value.state == FAILED
+    status = registry.status()
+    assert not status["ready"]
+    assert status["models"]["detection"]["error"] == "no such model"
+
+
+def test_get_all_schedules_every_missing_model():
+    registry = ModelRegistry()
+    factories = {name: blocked_factory(name) for name in ("captioning", "detection")}
+    for name, (factory, _) in factories.items():
+        registry.register(name, factory)
+
+    with pytest.raises(ModelNotReady):
+        registry.get_all(["captioning", "detection"])
+    for _, release in factories.values():
+        release.set()
+
+    assert registry.get("detection", wait=True, timeout=5) == "detection"
+    assert registry.get("captioning", wait=True, timeout=5) == "captioning"
+
+
+def test_status_reports_readiness_once_every_model_loaded():
+    registry = ModelRegistry()
+    registry.register("captioning", lambda: "caption model")
+    registry.register("recipe", lambda: "recipe model")
+
+    assert registry.status()["seconds_to_ready"] is None
+    registry.load_all()
+
+    status = registry.status()
+    assert status["ready"]
+    assert status["seconds_to_ready"] >= 0
+    assert {model["state"] for model in status["models"].values()} == {READY}
+
+
+def test_model_config_reads_the_environment_with_defaults(monkeypatch):
+    for name in model_config_from_env():
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("RECIPE_MODEL", "/models/recipe")
+    monkeypatch.setenv("MODEL_MMAP", "1")
+    monkeypatch.setenv("RECIPE_DRAFT_LOOKAHEAD", "3")
+
+    config = model_config_from_env()
+
+    assert config["RECIPE_MODEL"] == "/models/recipe"
+    assert config["CAPTION_MODEL"] == "nlpconnect/vit-gpt2-image-captioning"
+    assert config["MODEL_MMAP"] is True
+    assert config["RECIPE_PREFIX_CACHE"] is True
+    assert config["RECIPE_DRAFT_MODEL"] is None
+    assert config["RECIPE_DRAFT_LOOKAHEAD"] == 3
+    assert config["RECIPE_OUTPUT"] == "free"
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+Image = pytest.importorskip("PIL.Image")
+
+from models.image_captioning import ImageCaptioningModel  # noqa: E402
+from models.model_server import ModelServerClient  # noqa: E402
+from models.object_detection import ObjectDetectionModel  # noqa: E402
+from models.remote_models import RemoteRecipeModel, remote_model  # noqa: E402
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def client(tiny_caption_model_dir, tiny_detection_model_dir, tiny_recipe_model_dir, tmp_path_factory):
+    """A client of serve_models.py hosting the tiny models"""
+    socket_path = str(tmp_path_factory.mktemp("server") / "models.sock")
+    env = dict(os.environ, CAPTION_MODEL=tiny_caption_model_dir, DETECTION_MODEL=tiny_detection_model_dir,
+               RECIPE_MODEL=tiny_recipe_model_dir, VISION_BACKEND="eager", HF_HUB_OFFLINE="1")
+    server = subprocess.Popen([sys.executable, "serve_models.py", "--socket", socket_path, "--threads", "1"],
+                              cwd=REPO, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    client = ModelServerClient(socket_path, pool_size=2)
+    yield client
+    client.close()
+    server.terminate()
+    server.wait()
+
+
+@pytest.fixture(scope="module")
+def photo():
+    return Image.new("RGB", (320, 240), (180, 90, 40))
+
+
+def test_remote_vision_models_match_local_ones(client, photo, tiny_caption_model_dir):
+    captioner = remote_model(client, "captioning")
+    detector = remote_model(client, "detection")
+
+    assert isinstance(captioner, ImageCaptioningModel)
+    assert captioner.model_name == tiny_caption_model_dir
+    assert captioner.generate_caption(photo) == ImageCaptioningModel(tiny_caption_model_dir).generate_caption(photo)
+    # Too few detections are padded with random foods, so only the shape of the result can be compared
+    [ingredients] = detector.detect_ingredients_batch([photo])
+    assert isinstance(detector, ObjectDetectionModel)
+    assert len(ingredients) >= 3
+    assert all(isinstance(ingredient, str) for ingredient in ingredients)
+    assert client.stats()["server"]["calls"] >= 2
+
+
+def test_remote_recipe_model_generates_and_streams(client):
+    recipes = remote_model(client, "recipe")
+
+    assert recipes.model_loaded
+    assert len(recipes.generate_recipes(["egg"], num_candidates=2, max_new_tokens=8)) == 2
+    assert [len(result) for result in recipes.generate_recipes_batch([["egg"], ["rice"]], max_new_tokens=8)] == [1, 1]
+    events = list(recipes.stream_recipe_events(["egg"], max_new_tokens=8))
+    assert events[0][0] == "token"
+    assert events[-1][0] == "done"
+    assert not events[-1][1]["fallback"]
+
+
+def test_unreachable_server_falls_back_to_the_builtin_recipe(client, tmp_path):
+    attributes = client.call(None, "describe", "recipe")
+    recipes = RemoteRecipeModel(ModelServerClient(str(tmp_path / "gone.sock")), attributes)
+
+    assert recipes.is_fallback_recipe(recipes.generate_recipes(["egg"])[0])
+    assert all(recipes.is_fallback_recipe(result[0]) for result in recipes.generate_recipes_batch([["egg"], ["rice"]]))
+    events = list(recipes.stream_recipe_events(["egg"]))
+    assert events[0][0] == "error"
+    assert events[-1][1]["fallback"]
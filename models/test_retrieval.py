@@ -0,0 +1,104 @@
+import json
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from models.retrieval import RecipeIndex, ingredient_terms, load_corpus, normalize_recipe  # noqa: E402
+
+
+def test_ingredient_terms_drop_quantities_and_plurals():
+    assert ingredient_terms("2 large tomatoes, diced") == {"tomato"}
+    assert ingredient_terms("1 cup cherries") == {"cherry"}
+    assert ingredient_terms("Salt to taste") == {"salt"}
+    assert ingredient_terms("1 lb swiss cheese") == {"swiss", "cheese"}
+
+
+def test_corpus_records_are_normalized():
+    recipe = normalize_recipe({"title": "Toast", "ingredients": ["bread"], "directions": "Toast it.\n\nEat."})
+
+    assert recipe == {"name": "Toast", "ingredients": ["bread"], "instructions": ["Toast it.", "Eat."]}
+
+
+@pytest.mark.parametrize("layout", ["list", "dict", "jsonl"])
+def test_load_corpus_layouts(tmp_path, layout):
+    recipes = [{"name": "Toast", "ingredients": ["bread"]}, {"name": "Tea", "ingredients": ["tea"]}]
+    path = tmp_path / ("corpus.jsonl" if layout == "jsonl" else "corpus.json")
+    if layout == "jsonl":
+        path.write_text("\n".join(json.dumps(recipe) for recipe in recipes) + "\n")
+    else:
+        path.write_text(json.dumps(recipes if layout == "list" else {"recipes": recipes}))
+
+    assert load_corpus(str(path)) == recipes
+
+
+def test_best_match_shares_the_rarest_ingredients():
+    index = RecipeIndex([
+        {"name": "Salted rice", "ingredients": ["rice", "salt", "oil"]},
+        {"name": "Saffron rice", "ingredients": ["rice", "saffron", "salt"]},
+        {"name": "Salad", "ingredients": ["lettuce", "salt", "oil"]},
+    ])
+
+    (best, score), *rest = index.search(["saffron", "rice"], k=3)
+
+    assert best["name"] == "Saffron rice"
+    assert 0 < score <= 1
+    assert all(other < score for _, other in rest)
+    assert index.search(["unobtainium"]) == []
+
+
+def brute_force(index, ingredients, k):
+    """Scores of every recipe computed directly from the cosine definition"""
+    idf = {term: float(index._weights[term_id]) for term, term_id in index.vocabulary.items()}
+    query = set().union(*(ingredient_terms(i) for i in ingredients)) & set(idf)
+    query_norm = sum(idf[term] ** 2 for term in query) ** 0.5
+    scores = []
+    for recipe in index.recipes:
+        terms = set().union(*(ingredient_terms(line) for line in recipe["ingredients"]))
+        norm = sum(idf[term] ** 2 for term in terms) ** 0.5
+        shared = sum(idf[term] ** 2 for term in terms & query)
+        if shared:
+            scores.append(shared / norm / query_norm)
+    return sorted(scores, reverse=True)[:k]
+
+
+def test_early_termination_matches_a_full_scan():
+    rng = random.Random(0)
+    # Zipf-like ingredient popularity, so a few terms are in most recipes
+    pantry = [f"ingredient{i}" for i in range(200)]
+    weights = [1 / (i + 1) for i in range(len(pantry))]
+    corpus = [
+        {"name": f"recipe {n}", "ingredients": rng.choices(pantry, weights, k=rng.randint(2, 12))}
+        for n in range(3000)
+    ]
+    index = RecipeIndex(corpus, bitset_fraction=8)
+    index.initial_depth = 2
+    assert index.stats()["bitsets"] > 0
+
+    for _ in range(30):
+        query = rng.sample(pantry[:40], 3) + rng.sample(pantry, 2)
+        k = rng.choice([1, 3, 10])
+        found = [score for _, score in index.search(query, k)]
+        assert found == pytest.approx(brute_force(index, query, k), rel=1e-5)
+
+
+def test_match_at_the_end_of_every_posting_list_is_found():
+    # The match has the most terms, so it comes last in the impact order of both query terms
+    corpus = [{"name": "apple pie", "ingredients": ["apple", "salt", "oil"]}] * 300
+    corpus += [{"name": "bean stew", "ingredients": ["bean", "salt", "oil"]}] * 300
+    corpus.append({"name": "apple and bean bake", "ingredients": ["apple", "bean", "salt", "oil"]})
+    index = RecipeIndex(corpus)
+    index.initial_depth = 2
+
+    assert index.recipes_for(["apple", "bean"])[0]["name"] == "apple and bean bake"
+
+
+def test_stats_count_queries():
+    index = RecipeIndex([{"name": "Toast", "ingredients": ["bread"]}])
+    index.recipes_for(["bread"])
+
+    stats = index.stats()
+    assert stats["recipes"] == 1
+    assert stats["queries"] == 1
+    assert stats["index_bytes"] > 0
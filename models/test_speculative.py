@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from models.speculative import SpeculationMonitor  # noqa: E402
+
+
+def run(module, times):
+    for _ in range(times):
+        module(torch.ones(1, 2))
+
+
+def test_acceptance_is_counted_from_forward_passes():
+    target, draft = torch.nn.Linear(2, 2), torch.nn.Linear(2, 2)
+    monitor = SpeculationMonitor(target, draft)
+
+    # Two steps proposing 5 draft tokens each; 8 new tokens from 2 verifications
+    monitor.start()
+    run(draft, 10)
+    run(target, 2)
+    monitor.stop(8)
+
+    stats = monitor.stats()
+    assert stats["draft_tokens_proposed"] == 10
+    assert stats["draft_tokens_accepted"] == 6
+    assert stats["acceptance_rate"] == 0.6
+    assert stats["new_tokens"] == 8
+
+
+def test_passes_are_only_counted_for_the_calling_thread():
+    target, draft = torch.nn.Linear(2, 2), torch.nn.Linear(2, 2)
+    monitor = SpeculationMonitor(target, draft)
+
+    monitor.start()
+    other = threading.Thread(target=run, args=(draft, 50))
+    other.start()
+    other.join()
+    run(draft, 4)
+    run(target, 1)
+    monitor.stop(5)
+
+    assert monitor.stats()["draft_tokens_proposed"] == 4
+
+
+def test_failed_calls_and_plain_decoding_record_no_acceptance():
+    target = torch.nn.Linear(2, 2)
+    monitor = SpeculationMonitor(target)
+
+    monitor.start()
+    run(target, 3)
+    monitor.stop(None)
+    monitor.start()
+    run(target, 3)
+    monitor.stop(3)
+
+    stats = monitor.stats()
+    assert not stats["speculative"]
+    assert stats["calls"] == 1
+    assert stats["acceptance_rate"] is None
+
+
+def test_recipe_model_decodes_through_a_draft(tiny_recipe_model_dir):
+    from models.recipe_generation import RecipeGenerationModel
+
+    model = RecipeGenerationModel(tiny_recipe_model_dir, draft_model_name=tiny_recipe_model_dir, draft_lookahead=3)
+    assert model.draft_model is not None
+    # Sampling this cold always picks the draft's (greedy) choice
+    model.temperature = 1e-4
+
+    recipe = model.generate_recipes(["egg"], max_new_tokens=40)[0]
+
+    assert not model.is_fallback_recipe(recipe)
+    stats = model.generation_stats()
+    assert stats["speculative"]
+    assert stats["draft_lookahead"] == 3
+    # The draft is the model itself and never ends a sequence early: every
+    # step proposes exactly the lookahead and all of it is accepted
+    assert stats["verification_steps"] > 1
+    assert stats["draft_tokens_proposed"] == 3 * stats["verification_steps"]
+    assert stats["draft_tokens_accepted"] == stats["draft_tokens_proposed"]
+
+
+def test_lookahead_stays_fixed_across_calls(tiny_recipe_model_dir):
+    from models.recipe_generation import RecipeGenerationModel
+
+    model = RecipeGenerationModel(tiny_recipe_model_dir, draft_model_name=tiny_recipe_model_dir, draft_lookahead=1)
+    for _ in range(2):
+        model.generate_recipes(["egg"], max_new_tokens=20)
+
+    stats = model.generation_stats()
+    assert stats["draft_tokens_proposed"] == stats["verification_steps"]
+    assert model.draft_model.max_assistant_tokens == 1
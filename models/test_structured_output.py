@@ -0,0 +1,161 @@
+import gc
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from models.structured_output import (  # noqa: E402
+    _VOCABULARIES, RecipeSchemaLogitsProcessor, RecipeSchemaStoppingCriteria, RecipeSchemaTracker,
+    schema_constraints, token_vocabulary
+)
+
+PROMPT = "[INST] egg [/INST]\nName:"
+COMPLETE = " Egg\nIngredients:\n- 1 egg\nInstructions:\n1. Cook it\nEND"
+INCOMPLETE = " Egg\nIngredients:\n- 1 egg\nInstruc"
+
+
+def rows(tokenizer, *responses):
+    """input_ids of the prompt followed by each response, padded to the same length"""
+    prompt = tokenizer(PROMPT, add_special_tokens=False).input_ids
+    responses = [tokenizer(response, add_special_tokens=False).input_ids for response in responses]
+    width = max(len(response) for response in responses)
+    ids = [prompt + response + [tokenizer.pad_token_id] * (width - len(response)) for response in responses]
+    return torch.tensor(ids), len(prompt)
+
+
+def allowed_text(tokenizer, scores):
+    """Characters left finite in one row of processed scores"""
+    return {tokenizer.convert_ids_to_tokens(i) for i in torch.isfinite(scores).nonzero().flatten().tolist()}
+
+
+def test_tracker_parses_each_row_after_the_prompt(char_tokenizer):
+    input_ids, prompt_length = rows(char_tokenizer, COMPLETE, INCOMPLETE)
+    complete, incomplete = RecipeSchemaTracker(char_tokenizer, prompt_length).parsers(input_ids)
+
+    assert complete.complete
+    assert complete.recipe == {"name": "Egg", "ingredients": ["1 egg"], "instructions": ["Cook it"]}
+    assert not incomplete.complete
+    assert incomplete.partial_line == "Instruc"
+
+
+def test_tracker_feeds_each_step_only_the_new_tokens(char_tokenizer, monkeypatch):
+    input_ids, prompt_length = rows(char_tokenizer, COMPLETE + "\nmore text", INCOMPLETE)
+    tracker = RecipeSchemaTracker(char_tokenizer, prompt_length)
+    decoded = []
+    decode = char_tokenizer.decode
+
+    def recording_decode(ids, **kwargs):
+        decoded.append(len(ids))
+        return decode(ids, **kwargs)
+    monkeypatch.setattr(char_tokenizer, "decode", recording_decode)
+
+    for length in range(prompt_length, input_ids.shape[1] + 1):
+        parsers = tracker.parsers(input_ids[:, :length])
+        parsers = tracker.parsers(input_ids[:, :length])
+
+    assert max(decoded) <= 2
+    assert [parser.recipe for parser in parsers] == [
+        parser.recipe for parser in RecipeSchemaTracker(char_tokenizer, prompt_length).parsers(input_ids)
+    ]
+    assert parsers[0].complete
+    assert parsers[1].partial_line == "Instruc"
+
+
+def test_tracker_starts_over_when_draft_tokens_are_rejected(char_tokenizer):
+    drafted, prompt_length = rows(char_tokenizer, " Egg\nIngredients:\n- 1 egg\nInstructions:\n1. Fry")
+    accepted, _ = rows(char_tokenizer, " Egg\nIngredients:\n- 2 eggs\n")
+    tracker = RecipeSchemaTracker(char_tokenizer, prompt_length)
+    tracker.parsers(drafted)
+
+    [parser] = tracker.parsers(accepted)
+
+    assert parser.ingredients == ["2 eggs"]
+    assert parser.section == "ingredients"
+    assert parser.at_line_start
+
+
+def test_stopping_criterion_waits_for_every_sequence(char_tokenizer):
+    input_ids, prompt_length = rows(char_tokenizer, COMPLETE, INCOMPLETE)
+    criterion = RecipeSchemaStoppingCriteria(RecipeSchemaTracker(char_tokenizer, prompt_length))
+
+    # A plain bool: generate() in transformers 4.31 can't take one flag per sequence
+    assert criterion(input_ids, None) is False
+    done, _ = rows(char_tokenizer, COMPLETE, COMPLETE)
+    assert criterion(done, None) is True
+
+
+def test_complete_sequence_may_only_end(char_tokenizer):
+    input_ids, prompt_length = rows(char_tokenizer, COMPLETE, INCOMPLETE)
+    processor = RecipeSchemaLogitsProcessor(RecipeSchemaTracker(char_tokenizer, prompt_length),
+                                            char_tokenizer.eos_token_id)
+
+    scores = processor(input_ids, torch.zeros(2, len(char_tokenizer)))
+
+    assert allowed_text(char_tokenizer, scores[0]) == {char_tokenizer.eos_token}
+    assert allowed_text(char_tokenizer, scores[1]) == {"t"}
+
+
+def test_new_line_must_follow_the_schema(char_tokenizer):
+    input_ids, prompt_length = rows(char_tokenizer, " Egg\nIngredients:\n", " Egg\nIngredients:\n- 1 egg\n")
+    processor = RecipeSchemaLogitsProcessor(RecipeSchemaTracker(char_tokenizer, prompt_length),
+                                            char_tokenizer.eos_token_id)
+
+    scores = processor(input_ids, torch.zeros(2, len(char_tokenizer)))
+
+    # A bullet, and the next header only once the section has an entry
+    assert "-" in allowed_text(char_tokenizer, scores[0])
+    assert "I" not in allowed_text(char_tokenizer, scores[0])
+    assert {"-", "I"} <= allowed_text(char_tokenizer, scores[1])
+    assert {"\n", "A", char_tokenizer.eos_token}.isdisjoint(allowed_text(char_tokenizer, scores[1]))
+
+
+def test_generate_several_sequences_with_schema_constraints(char_tokenizer, tiny_recipe_model_dir):
+    from transformers import AutoModelForCausalLM
+
+    model = AutoModelForCausalLM.from_pretrained(tiny_recipe_model_dir)
+    inputs = char_tokenizer([PROMPT], return_tensors="pt", add_special_tokens=False)
+    prompt_length = inputs.input_ids.shape[1]
+
+    output = model.generate(
+        **inputs, do_sample=True, num_return_sequences=3, max_new_tokens=24,
+        pad_token_id=char_tokenizer.pad_token_id, **schema_constraints(char_tokenizer, prompt_length)
+    )
+
+    assert output.shape[0] == 3
+
+
+def test_vocabulary_is_built_once_and_released_with_its_tokenizer(tiny_recipe_model_dir):
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tiny_recipe_model_dir)
+    vocabulary = token_vocabulary(tokenizer)
+    assert token_vocabulary(tokenizer) is vocabulary
+    assert token_vocabulary(AutoTokenizer.from_pretrained(tiny_recipe_model_dir)) is not vocabulary
+
+    gc.collect()
+    count = len(_VOCABULARIES)
+    del tokenizer
+    gc.collect()
+
+    assert len(_VOCABULARIES) == count - 1
+
+
+def test_processor_and_criterion_share_one_tracker(char_tokenizer):
+    constraints = schema_constraints(char_tokenizer, 10)
+    [processor], [criterion] = constraints["logits_processor"], constraints["stopping_criteria"]
+
+    assert processor.tracker is criterion.tracker
+
+
+def test_structured_model_samples_several_candidates(tiny_recipe_model_dir):
+    from models.recipe_generation import RecipeGenerationModel
+
+    model = RecipeGenerationModel(tiny_recipe_model_dir, precision="auto", structured_output=True)
+    assert model.model_loaded
+
+    candidates = model.generate_recipes(["egg"], num_candidates=2, max_new_tokens=16)
+    batch = model.generate_recipes_batch([["egg"], ["rice", "salt"]], max_new_tokens=16)
+
+    assert len(candidates) == 2
+    assert not any(model.is_fallback_recipe(recipe) for recipe in candidates)
+    assert not any(model.is_fallback_recipe(recipes[0]) for recipes in batch)
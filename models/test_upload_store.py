@@ -0,0 +1,149 @@
+import os
+import time
+
+import pytest
+
+from models.upload_store import UploadStore, sniff_extension
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+JPEG = b"\xff\xd8\xff" + b"\x01" * 100
+
+
+@pytest.fixture
+def make_store(tmp_path):
+    stores = []
+
+    def make(**kwargs):
+        store = UploadStore(str(tmp_path / "uploads"), sweep_interval=3600, **kwargs)
+        # Let the sweep the sweeper starts with finish before the test arranges files
+        deadline = time.monotonic() + 5
+        while store.last_sweep is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.shutdown()
+
+
+def age(store, name, seconds):
+    """Make an upload look unused for seconds"""
+    then = time.time() - seconds
+    os.utime(store.path(name), (then, then))
+
+
+def test_sniff_extension_prefers_the_content():
+    assert sniff_extension(PNG, "jpg") == "png"
+    assert sniff_extension(JPEG, "png") == "jpg"
+    assert sniff_extension(b"GIF89a", "jpeg") == "jpeg"
+
+
+def test_same_bytes_are_stored_once(make_store):
+    store = make_store()
+    name = store.save(PNG, "png")
+
+    assert store.save(PNG, "png") == name
+    assert store.read(name) == PNG
+    assert store.relative_path(name) == f"{name[:2]}/{name[2:4]}/{name}"
+    assert store.stats()["saved"] == 1
+    assert store.stats()["deduplicated"] == 1
+
+
+def test_only_plain_legacy_names_are_accepted(make_store):
+    store = make_store()
+    assert store.relative_path("placeholder.png") == "placeholder.png"
+    for name in ("../app.py", "sub/file.png", ".hidden", ""):
+        with pytest.raises(ValueError):
+            store.relative_path(name)
+
+
+def test_sweep_removes_uploads_unused_for_max_age(make_store):
+    store = make_store(max_age=60)
+    old = store.save(PNG, "png")
+    new = store.save(JPEG, "jpg")
+    age(store, old, 120)
+
+    assert store.sweep()["removed"] == 1
+    assert not os.path.exists(store.path(old))
+    assert os.path.exists(store.path(new))
+
+
+def test_sweep_evicts_least_recently_used_past_max_bytes(make_store):
+    store = make_store(max_age=None)
+    first = store.save(PNG, "png")
+    second = store.save(JPEG, "jpg")
+    age(store, first, 30)
+    # Lowered after saving, which would otherwise wake the background sweeper
+    store.max_bytes = 150
+
+    store.sweep()
+
+    assert not os.path.exists(store.path(first))
+    assert os.path.exists(store.path(second))
+
+
+def test_legacy_uploads_are_never_swept(make_store, tmp_path):
+    store = make_store(max_age=1)
+    legacy = tmp_path / "uploads" / "placeholder.png"
+    legacy.write_bytes(PNG)
+    os.utime(legacy, (0, 0))
+
+    store.sweep()
+
+    assert legacy.exists()
+    assert store.pin("placeholder.png") is None
+
+
+def test_pinned_upload_survives_sweeps_until_unpinned(make_store):
+    store = make_store(max_age=60)
+    name = store.save(PNG, "png")
+    pin = store.pin(name)
+    age(store, name, 120)
+    store.max_bytes = 50
+
+    store.sweep()
+    assert store.read(name) == PNG
+    assert store.stats()["skipped_pinned"] == 1
+    assert store.stats()["pinned"] == 1
+
+    store.unpin(pin)
+    age(store, name, 120)
+    store.sweep()
+    assert not os.path.exists(store.path(name))
+    assert store.stats()["pinned"] == 0
+
+
+def test_pin_is_honoured_by_other_stores_on_the_same_directory(make_store):
+    store = make_store(max_age=60)
+    other = make_store(max_age=60)
+    name = store.save(PNG, "png")
+    store.pin(name)
+    age(store, name, 120)
+
+    other.sweep()
+
+    assert os.path.exists(store.path(name))
+
+
+def test_stale_pins_are_ignored(make_store):
+    store = make_store(max_age=60, pin_timeout=30)
+    name = store.save(PNG, "png")
+    pin = store.pin(name)
+    os.utime(pin, (time.time() - 60, time.time() - 60))
+    age(store, name, 120)
+
+    store.sweep()
+
+    assert not os.path.exists(store.path(name))
+    assert not os.path.exists(pin)
+
+
+def test_pin_of_a_missing_upload_fails(make_store, tmp_path):
+    store = make_store()
+    name = store.save(PNG, "png")
+    os.remove(store.path(name))
+
+    with pytest.raises(FileNotFoundError):
+        store.pin(name)
+    assert os.listdir(os.path.dirname(store.path(name))) == []
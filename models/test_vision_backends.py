@@ -0,0 +1,100 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from models.vision_backends import (  # noqa: E402
+    artifact_path, check_images, example_images, load_graph, max_difference, model_slug
+)
+
+
+class ScaleByWidth(torch.nn.Module):
+    """Multiplies by the input's width, read as a Python int, so a trace bakes in the traced width"""
+
+    def __init__(self):
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.ones(1))
+
+    def forward(self, pixel_values):
+        return pixel_values * self.weight * int(pixel_values.shape[-1])
+
+
+class Doubler(torch.nn.Module):
+    def __init__(self, factor=2.0):
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.full((1,), factor))
+
+    def forward(self, pixel_values):
+        return pixel_values * self.weight
+
+
+def graph_kwargs(tmp_path, backend, name="graph"):
+    return dict(
+        backend=backend,
+        path=str(tmp_path / f"{name}.{'pt' if backend == 'torchscript' else 'onnx'}"),
+        device=torch.device("cpu"),
+        input_names=["pixel_values"],
+        output_names=["output"],
+        dynamic_axes={"pixel_values": {0: "batch", 2: "height", 3: "width"}, "output": {0: "batch"}},
+    )
+
+
+def test_artifact_path_names_kind_model_and_precision():
+    path = artifact_path("compiled", "detection", "facebook/detr-resnet-50", "bf16", "onnx")
+    assert path == os.path.join("compiled", "detection-facebook_detr-resnet-50-bf16.onnx")
+    assert model_slug("/models/my model/") == "models_my_model"
+
+
+def test_check_images_differ_from_example_images():
+    examples = example_images()
+    checks = check_images()
+    assert len(checks) != len(examples)
+    assert {image.size for image in checks}.isdisjoint(image.size for image in examples)
+
+
+def test_eager_backend_returns_the_module(tmp_path):
+    module = Doubler()
+    assert load_graph(module, (torch.ones(1, 3, 4, 4),), **graph_kwargs(tmp_path, "eager")) is module
+
+
+@pytest.mark.parametrize("backend", ["torchscript", "onnx"])
+def test_exported_graph_matches_eager(tmp_path, backend):
+    if backend == "onnx":
+        pytest.importorskip("onnxruntime")
+    module = Doubler().eval()
+    example = (torch.rand(2, 3, 8, 8),)
+    graph = load_graph(module, example, check_inputs=[(torch.rand(1, 3, 4, 6),)], **graph_kwargs(tmp_path, backend))
+
+    assert max_difference(module, graph, (torch.rand(3, 3, 5, 7),)) < 1e-6
+
+
+@pytest.mark.filterwarnings("ignore::torch.jit.TracerWarning")
+def test_graph_specialized_on_the_export_shape_is_rejected(tmp_path):
+    module = ScaleByWidth().eval()
+    example = (torch.rand(2, 3, 8, 8),)
+    kwargs = graph_kwargs(tmp_path, "torchscript")
+
+    # On the export shape alone the trace looks right
+    assert load_graph(module, example, **kwargs) is not module
+    with pytest.raises(ValueError):
+        load_graph(module, example, check_inputs=[(torch.rand(1, 3, 8, 16),)], **kwargs)
+
+
+def test_artifact_from_other_weights_is_rejected(tmp_path):
+    example = (torch.rand(2, 3, 8, 8),)
+    kwargs = graph_kwargs(tmp_path, "torchscript")
+    load_graph(Doubler(2.0).eval(), example, **kwargs)
+
+    with pytest.raises(ValueError):
+        load_graph(Doubler(3.0).eval(), example, **kwargs)
+
+
+def test_onnx_without_onnxruntime_fails_clearly(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "onnxruntime", None)
+    kwargs = graph_kwargs(tmp_path, "onnx")
+
+    with pytest.raises(RuntimeError, match="requirements-onnx.txt"):
+        load_graph(Doubler().eval(), (torch.rand(1, 3, 4, 4),), **kwargs)
+    assert not os.path.exists(kwargs["path"])
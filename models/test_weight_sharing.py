@@ -0,0 +1,56 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+safetensors_torch = pytest.importorskip("safetensors.torch")
+
+from models.weight_sharing import _SAFETENSORS_DTYPES, map_weights, mmap_safetensors, process_memory  # noqa: E402
+
+
+def test_itemsizes_match_torch():
+    for dtype_name, itemsize in _SAFETENSORS_DTYPES.values():
+        assert torch.empty((), dtype=getattr(torch, dtype_name)).element_size() == itemsize
+
+
+def test_mmap_safetensors_reads_every_dtype(tmp_path):
+    tensors = {
+        "f32": torch.arange(6, dtype=torch.float32).reshape(2, 3),
+        "f16": torch.arange(4, dtype=torch.float16),
+        "bf16": torch.arange(4, dtype=torch.bfloat16),
+        "i64": torch.arange(3, dtype=torch.int64),
+        "u8": torch.arange(5, dtype=torch.uint8),
+        "mask": torch.tensor([True, False, True]),
+    }
+    path = str(tmp_path / "model.safetensors")
+    safetensors_torch.save_file(tensors, path)
+
+    mapped = mmap_safetensors(path)
+
+    assert set(mapped) == set(tensors)
+    for name, tensor in tensors.items():
+        assert mapped[name].dtype == tensor.dtype
+        assert torch.equal(mapped[name], tensor)
+
+
+def test_map_weights_points_matching_weights_at_the_file(tmp_path):
+    model = torch.nn.Sequential(torch.nn.Linear(4, 3), torch.nn.Linear(3, 2))
+    safetensors_torch.save_file({name: tensor.contiguous() for name, tensor in model.state_dict().items()},
+                                str(tmp_path / "model.safetensors"))
+    expected = {name: tensor.clone() for name, tensor in model.state_dict().items()}
+    # A weight converted on load keeps its own memory
+    model[1].bias.data = model[1].bias.data.double()
+
+    report = map_weights(model, str(tmp_path))
+
+    assert report["tensors"] == 3
+    assert report["total_tensors"] == 4
+    for name, tensor in model.state_dict().items():
+        assert torch.equal(tensor.float(), expected[name])
+    assert model[0](torch.ones(1, 4)).shape == (1, 3)
+
+
+def test_process_memory_reports_this_process():
+    memory = process_memory()
+    if memory is None:
+        pytest.skip("/proc/self/smaps_rollup is not available")
+    assert memory["rss_mb"] > 0
+    assert memory["uss_mb"] <= memory["rss_mb"]
@@ -0,0 +1,344 @@
+import glob
+import io
+import os
+import re
+import threading
+import time
+import uuid
+
+from models.inference_cache import hash_bytes
+
+# Content-hash upload names, e.g. 3f...9c.jpg; anything else is a legacy flat upload
+_HASH_NAME = re.compile(r"^([0-9a-f]{64})\.(jpg|jpeg|png)$")
+_DISPLAY_SUFFIX = ".display.jpg"
+# Empty marker files next to an upload, <hash>.pin-<id>, keep it from being swept
+_PIN_SUFFIX = ".pin-"
+
+
+def sniff_extension(data, fallback):
+    """File extension from an image's magic bytes, so the same image always gets the same name"""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    return fallback
+
+
+def _stem(path):
+    """An upload's path up to its content hash, shared by every file stored for it"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, name.split(".", 1)[0])
+
+
+class UploadStore:
+    """
+    Content-addressed, size-bounded store for uploaded images
+
+    Uploads are named by the SHA-256 of their bytes and sharded two levels
+    deep (ab/cd/abcd....jpg) to keep directories small, so uploading the
+    same image again writes nothing. Each stored image is treated as used
+    whenever it is saved or read again; a background sweeper deletes images
+    unused for max_age seconds, and the least recently used ones once the
+    store grows past max_bytes. A downscaled JPEG for display in the
+    browser is made on first request and evicted with its original.
+    Pinned uploads (see pin()) are never swept.
+
+    Files directly in root (older uuid-named uploads, placeholder.png) are
+    served as before but never swept.
+    """
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, max_age=7 * 24 * 3600, sweep_interval=300,
+                 display_edge=1024, pin_timeout=24 * 3600):
+        """
+        Args:
+            root: Directory to store uploads in (served as static files)
+            max_bytes: Size the store is swept back under (to 90%) when exceeded
+            max_age: Seconds an unused upload is kept; None keeps them forever
+            sweep_interval: Seconds between background sweeps
+            display_edge: Longest edge of the display copies
+            pin_timeout: Seconds after which a pin is ignored, in case its
+                process died without unpinning
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.display_edge = display_edge
+        self.pin_timeout = pin_timeout
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._bytes = None  # Unknown until the first sweep has scanned the store
+        self.saved = 0
+        self.deduplicated = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self.derivatives = 0
+        self.pins = 0
+        self.skipped_pinned = 0
+        self.last_sweep = None
+
+        os.makedirs(root, exist_ok=True)
+        self._start_sweeper()
+
+    def _start_sweeper(self):
+        self._sweeper = threading.Thread(target=self._run_sweeper, name="upload-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def after_fork(self):
+        """Start a new sweeper in a forked child, where the parent's thread no longer exists"""
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._start_sweeper()
+
+    def shutdown(self):
+        self._stopped = True
+        self._wake.set()
+
+    def _shard(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4])
+
+    def relative_path(self, name):
+        """Path of an upload relative to root, e.g. for url_for('static', ...)"""
+        match = _HASH_NAME.match(name)
+        if match:
+            return f"{name[:2]}/{name[2:4]}/{name}"
+        # Legacy flat upload: only a plain file name, never a path
+        if not name or name != os.path.basename(name) or name.startswith("."):
+            raise ValueError(f"Invalid upload name: {name!r}")
+        return name
+
+    def path(self, name):
+        """Filesystem path of an upload"""
+        return os.path.join(self.root, *self.relative_path(name).split("/"))
+
+    def save(self, data, extension):
+        """
+        Store image bytes and return their upload name
+
+        Args:
+            data: Raw image bytes
+            extension: Extension of the uploaded file, used if the content is not recognised
+        """
+        digest = hash_bytes(data)
+        name = f"{digest}.{sniff_extension(data, extension)}"
+        path = self.path(name)
+        if os.path.exists(path):
+            self._touch(path)
+            with self._lock:
+                self.deduplicated += 1
+            return name
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.saved += 1
+            if self._bytes is not None:
+                self._bytes += len(data)
+                over = self.max_bytes and self._bytes > self.max_bytes
+            else:
+                over = False
+        if over:
+            self._wake.set()
+        return name
+
+    def read(self, name):
+        """
+        Return an upload's bytes, marking it as recently used
+
+        Raises:
+            ValueError: If name is not a valid upload name
+            FileNotFoundError: If there is no such upload (or it was evicted)
+        """
+        path = self.path(name)
+        with open(path, "rb") as f:
+            data = f.read()
+        self._touch(path)
+        return data
+
+    def display(self, name):
+        """
+        Relative path of a downscaled copy of an upload for display, made on first use
+
+        Images that already fit within display_edge, and legacy uploads,
+        are displayed as they are.
+        """
+        match = _HASH_NAME.match(name)
+        if not match:
+            return self.relative_path(name)
+        relative = f"{name[:2]}/{name[2:4]}/{match.group(1)}{_DISPLAY_SUFFIX}"
+        path = os.path.join(self.root, *relative.split("/"))
+        if os.path.exists(path):
+            return relative
+
+        from PIL import Image
+        from models.preprocessing import decode_image
+
+        try:
+            with open(self.path(name), "rb") as f:
+                image = decode_image(f.read(), self.display_edge)
+        except Exception as e:
+            print(f"Error creating display copy of {name}: {e}")
+            return self.relative_path(name)
+        if max(image.size) <= self.display_edge:
+            return self.relative_path(name)
+
+        image.thumbnail((self.display_edge, self.display_edge), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=85, optimize=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.derivatives += 1
+            if self._bytes is not None:
+                self._bytes += buffer.tell()
+        return relative
+
+    def pin(self, name):
+        """
+        Keep an upload from being swept until unpin(), e.g. while a queued job still has to read it
+
+        Pins are marker files next to the upload, so the sweepers of every
+        worker process sharing the store honour them.
+
+        Returns:
+            Token to pass to unpin(), or None for legacy uploads (never swept)
+
+        Raises:
+            FileNotFoundError: If the upload is not stored (any more)
+        """
+        if not _HASH_NAME.match(name):
+            return None
+        path = self.path(name)
+        marker = f"{_stem(path)}{_PIN_SUFFIX}{uuid.uuid4().hex}"
+        with self._lock:
+            open(marker, "wb").close()
+            if not os.path.exists(path):
+                os.remove(marker)
+                raise FileNotFoundError(path)
+            self.pins += 1
+        return marker
+
+    def unpin(self, token):
+        """Release a pin returned by pin(); the upload can be swept again"""
+        if token is None:
+            return
+        with self._lock:
+            try:
+                os.remove(token)
+            except FileNotFoundError:
+                return
+            self.pins -= 1
+
+    def _pinned(self, path):
+        """True if the upload path (or a file derived from it) has a pin younger than pin_timeout"""
+        cutoff = time.time() - self.pin_timeout
+        for marker in glob.glob(f"{_stem(path)}{_PIN_SUFFIX}*"):
+            try:
+                if os.stat(marker).st_mtime > cutoff:
+                    return True
+            except FileNotFoundError:
+                pass
+        return False
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _scan(self):
+        """Group stored files by content hash: digest -> [last used, total bytes, paths]"""
+        groups = {}
+        for first in os.scandir(self.root):
+            if not first.is_dir() or len(first.name) != 2:
+                continue
+            for second in os.scandir(first.path):
+                if not second.is_dir():
+                    continue
+                for entry in os.scandir(second.path):
+                    try:
+                        info = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    group = groups.setdefault(entry.name.split(".", 1)[0], [0.0, 0, []])
+                    group[0] = max(group[0], info.st_mtime)
+                    group[1] += info.st_size
+                    group[2].append(entry.path)
+        return groups
+
+    def sweep(self):
+        """
+        Delete uploads unused for max_age, then the least recently used ones while over max_bytes
+
+        Returns:
+            dict: Number of uploads and bytes removed
+        """
+        groups = sorted(self._scan().values())
+        total = sum(size for _, size, _ in groups)
+        target = int(self.max_bytes * 0.9) if self.max_bytes and total > self.max_bytes else None
+        cutoff = time.time() - self.max_age if self.max_age else None
+
+        removed, removed_bytes, skipped = 0, 0, 0
+        for last_used, size, paths in groups:
+            expired = cutoff is not None and last_used < cutoff
+            if not expired and (target is None or total <= target):
+                break
+            # Checked again under the lock, so a pin taken since the scan is honoured
+            with self._lock:
+                if self._pinned(paths[0]):
+                    skipped += 1
+                    continue
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            total -= size
+            removed += 1
+            removed_bytes += size
+
+        with self._lock:
+            self._bytes = total
+            self.evicted += removed
+            self.evicted_bytes += removed_bytes
+            self.skipped_pinned += skipped
+            self.last_sweep = time.time()
+        if removed:
+            print(f"Evicted {removed} uploads ({removed_bytes / (1024 * 1024):.1f} MB); "
+                  f"{total / (1024 * 1024):.1f} MB stored")
+        return {"removed": removed, "removed_bytes": removed_bytes}
+
+    def _run_sweeper(self):
+        while not self._stopped:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping uploads: {e}")
+            self._wake.wait(self.sweep_interval)
+            self._wake.clear()
+
+    def stats(self):
+        """Return stored bytes, deduplication and eviction counters"""
+        with self._lock:
+            return {
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_age_seconds': self.max_age,
+                'saved': self.saved,
+                'deduplicated': self.deduplicated,
+                'display_copies': self.derivatives,
+                'evicted': self.evicted,
+                'evicted_bytes': self.evicted_bytes,
+                'pinned': self.pins,
+                'skipped_pinned': self.skipped_pinned,
+                'last_sweep': self.last_sweep,
+            }
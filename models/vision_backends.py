@@ -0,0 +1,179 @@
+import os
+import re
+
+import numpy as np
+import torch
+
+# "eager" runs the Hugging Face module as loaded; the others run an exported graph of it
+VISION_BACKENDS = ("eager", "torchscript", "onnx")
+
+_EXTENSIONS = {"torchscript": "pt", "onnx": "onnx"}
+
+
+def default_backend():
+    """Backend and artifact directory from VISION_BACKEND / VISION_BACKEND_DIR"""
+    return os.environ.get("VISION_BACKEND", "eager"), os.environ.get("VISION_BACKEND_DIR", "compiled_models")
+
+
+def model_slug(model_name):
+    """Model id or path as a file name part, e.g. facebook_detr-resnet-50"""
+    return re.sub(r"[^A-Za-z0-9.-]+", "_", model_name).strip("_")
+
+
+def artifact_path(directory, kind, model_name, precision, backend):
+    """File an exported graph is stored in, e.g. compiled_models/detection-facebook_detr-resnet-50-auto.onnx"""
+    return os.path.join(directory, f"{kind}-{model_slug(model_name)}-{precision}.{_EXTENSIONS[backend]}")
+
+
+class DetrGraph(torch.nn.Module):
+    """DETR forward with tensor-only inputs and outputs, as needed for tracing/export"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values, pixel_mask):
+        outputs = self.model(pixel_values=pixel_values, pixel_mask=pixel_mask)
+        return outputs.logits, outputs.pred_boxes
+
+
+class VitEncoderGraph(torch.nn.Module):
+    """Encoder half of a VisionEncoderDecoderModel: pixel values to hidden states"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.encoder = model.get_encoder()
+
+    def forward(self, pixel_values):
+        return self.encoder(pixel_values=pixel_values).last_hidden_state
+
+
+class TorchScriptGraph:
+    """A module saved with torch.jit.trace; takes and returns tensors"""
+
+    def __init__(self, path, device):
+        self.module = torch.jit.load(path, map_location=device)
+        self.module.eval()
+
+    def __call__(self, *inputs):
+        with torch.no_grad():
+            return self.module(*inputs)
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise RuntimeError(
+            "the onnx backend needs onnx and onnxruntime: pip install -r requirements-onnx.txt"
+        ) from None
+    return onnxruntime
+
+
+class OnnxGraph:
+    """An ONNX export run with onnxruntime; takes and returns torch tensors"""
+
+    def __init__(self, path, device):
+        onnxruntime = _import_onnxruntime()
+        providers = ["CPUExecutionProvider"]
+        if device.type == "cuda":
+            providers.insert(0, "CUDAExecutionProvider")
+        self.device = device
+        self.session = onnxruntime.InferenceSession(path, providers=providers)
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    def __call__(self, *inputs):
+        feed = {name: tensor.detach().cpu().numpy() for name, tensor in zip(self.input_names, inputs)}
+        outputs = tuple(torch.from_numpy(np.asarray(output)).to(self.device) for output in self.session.run(None, feed))
+        # Match the traced module: a single output is returned as is
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+def export_graph(module, example_inputs, backend, path, input_names, output_names, dynamic_axes):
+    """
+    Write module to path as a TorchScript trace or an ONNX graph
+
+    Args:
+        module: A DetrGraph or VitEncoderGraph in eval mode
+        example_inputs: Tuple of tensors to trace with
+        backend: "torchscript" or "onnx"
+        path: Output file
+        input_names, output_names: Graph input/output names (ONNX)
+        dynamic_axes: Axes that vary between calls, by input/output name (ONNX;
+            a trace records shape arithmetic as tensor ops, so it already
+            accepts other batch sizes and image sizes)
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with torch.no_grad():
+        if backend == "torchscript":
+            traced = torch.jit.trace(module, example_inputs, check_trace=False)
+            torch.jit.save(traced, path)
+        elif backend == "onnx":
+            torch.onnx.export(module, example_inputs, path, input_names=input_names,
+                              output_names=output_names, dynamic_axes=dynamic_axes, opset_version=17)
+        else:
+            raise ValueError(f"Unknown vision backend '{backend}', expected one of {VISION_BACKENDS}")
+
+
+def max_difference(reference, candidate, inputs):
+    """Largest absolute output difference between two graphs, relative to the reference's magnitude"""
+    with torch.no_grad():
+        expected = reference(*inputs)
+        actual = candidate(*inputs)
+    if torch.is_tensor(expected):
+        expected, actual = (expected,), (actual,)
+    worst = 0.0
+    for a, b in zip(expected, actual):
+        a, b = a.float().cpu(), b.float().cpu()
+        worst = max(worst, (a - b).abs().max().item() / max(1.0, a.abs().max().item()))
+    return worst
+
+
+def load_graph(module, example_inputs, backend, path, device, input_names, output_names,
+               dynamic_axes, check_inputs=(), tolerance=1e-3):
+    """
+    Return a callable running module through backend, exporting it to path first if needed
+
+    The loaded graph is checked against module on example_inputs and on
+    every tuple in check_inputs each time, so an artifact exported from
+    different weights or a different precision is caught at startup rather
+    than serving wrong outputs. check_inputs should differ from
+    example_inputs in batch size and image size: a graph that specialized
+    on the shapes it was exported with is caught the same way.
+
+    Raises:
+        ValueError: If the graph's outputs differ from module's by more than tolerance
+        RuntimeError: The onnx backend's packages are not installed
+    """
+    if backend == "eager":
+        return module
+    if backend == "onnx":
+        _import_onnxruntime()
+    if not os.path.exists(path):
+        print(f"Exporting {type(module).__name__} to {path}...")
+        export_graph(module, example_inputs, backend, path, input_names, output_names, dynamic_axes)
+
+    graph = TorchScriptGraph(path, device) if backend == "torchscript" else OnnxGraph(path, device)
+    difference = max(max_difference(module, graph, inputs) for inputs in (example_inputs, *check_inputs))
+    if difference > tolerance:
+        raise ValueError(f"{path} differs from the eager model by {difference:.2e}; delete it to re-export")
+    return graph
+
+
+def example_images(count=2):
+    """Deterministic noise images of different sizes, used to export and check graphs"""
+    from PIL import Image
+
+    state = np.random.RandomState(0)
+    return [
+        Image.fromarray(state.randint(0, 255, (480 + 64 * i, 640 - 96 * i, 3), dtype=np.uint8))
+        for i in range(count)
+    ]
+
+
+def check_images():
+    """A single portrait noise image, unlike example_images(), to check graphs on another batch and image size"""
+    from PIL import Image
+
+    state = np.random.RandomState(1)
+    return [Image.fromarray(state.randint(0, 255, (640, 400, 3), dtype=np.uint8))]
@@ -0,0 +1,141 @@
+# Sharing model weights between server worker processes. torch is imported
+# inside the functions that need it, so app.py can report process_memory()
+# before any model is loaded.
+
+import glob
+import json
+import mmap
+import os
+import struct
+import warnings
+
+# safetensors dtype -> (torch dtype name, bytes per element); torch.dtype has
+# no itemsize before torch 2.1
+_SAFETENSORS_DTYPES = {
+    "F64": ("float64", 8), "F32": ("float32", 4), "F16": ("float16", 2), "BF16": ("bfloat16", 2),
+    "I64": ("int64", 8), "I32": ("int32", 4), "I16": ("int16", 2), "I8": ("int8", 1),
+    "U8": ("uint8", 1), "BOOL": ("bool", 1),
+}
+
+
+def safetensors_files(model_name):
+    """Local .safetensors files of a model directory or an already downloaded hub model"""
+    if os.path.isdir(model_name):
+        return sorted(glob.glob(os.path.join(model_name, "*.safetensors")))
+    from huggingface_hub import snapshot_download
+    try:
+        directory = snapshot_download(model_name, allow_patterns=["*.safetensors"], local_files_only=True)
+    except Exception:
+        return []
+    return sorted(glob.glob(os.path.join(directory, "*.safetensors")))
+
+
+def mmap_safetensors(path):
+    """
+    Map a .safetensors file and return {name: tensor} views into the mapping
+
+    The mapping is private (copy-on-write) and file-backed: pages come from
+    the page cache and are shared by every process mapping the same file
+    until one of them writes to a page, which then gets a private copy.
+    """
+    import torch
+
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    start = 8 + header_size
+    tensors = {}
+    with warnings.catch_warnings():
+        # frombuffer warns about writable buffers being shared; that is the point here
+        warnings.simplefilter("ignore")
+        for name, info in header.items():
+            if name == "__metadata__" or info["dtype"] not in _SAFETENSORS_DTYPES:
+                continue
+            dtype_name, itemsize = _SAFETENSORS_DTYPES[info["dtype"]]
+            dtype = getattr(torch, dtype_name)
+            begin, end = info["data_offsets"]
+            count = (end - begin) // itemsize
+            if count == 0:
+                continue
+            tensor = torch.frombuffer(mapping, dtype=dtype, count=count, offset=start + begin)
+            tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+
+def map_weights(model, model_name):
+    """
+    Point a loaded model's weights at memory-mapped views of its safetensors files
+
+    Every parameter or buffer whose checkpoint tensor has the same name,
+    shape and dtype is switched to the mapped view, and the copy the loader
+    made is freed. Weights converted on load (a different dtype, int8
+    quantization) or on a GPU keep their own memory. Inference never
+    writes to weights, so the mapped pages stay shared between all worker
+    processes on the machine, forked or not.
+
+    Returns:
+        dict: Number of tensors and bytes mapped, out of the model's total
+    """
+    import torch
+
+    # Quantized modules also store their dtype in the state dict
+    state = {name: value for name, value in model.state_dict(keep_vars=True).items() if torch.is_tensor(value)}
+    prefix = getattr(model, "base_model_prefix", "")
+    mapped, mapped_bytes = 0, 0
+    total_bytes = sum(tensor.numel() * tensor.element_size() for tensor in state.values())
+
+    # Keep the mappings alive as long as the model
+    model._mapped_weights = []
+    for path in safetensors_files(model_name):
+        tensors = mmap_safetensors(path)
+        model._mapped_weights.append(tensors)
+        for name, source in tensors.items():
+            # Checkpoints saved from a base model lack the head model's prefix
+            target = state.get(name)
+            if target is None and prefix:
+                target = state.get(f"{prefix}.{name}")
+            if (target is None or target.device.type != "cpu"
+                    or target.dtype != source.dtype or target.shape != source.shape):
+                continue
+            with torch.no_grad():
+                target.data = source
+            mapped += 1
+            mapped_bytes += source.numel() * source.element_size()
+
+    report = {
+        "tensors": mapped,
+        "total_tensors": len(state),
+        "mapped_mb": mapped_bytes / (1024 * 1024),
+        "total_mb": total_bytes / (1024 * 1024),
+    }
+    print(f"Memory-mapped {mapped}/{len(state)} weight tensors of {model_name} "
+          f"({report['mapped_mb']:.0f} of {report['total_mb']:.0f} MB)")
+    return report
+
+
+def process_memory(pid="self"):
+    """
+    Resident memory of a process in MB, from /proc/<pid>/smaps_rollup (Linux)
+
+    rss counts every resident page; pss splits shared pages evenly between
+    the processes sharing them; uss counts only pages no other process
+    shares, i.e. what the process would free by exiting. Returns None
+    where smaps_rollup is unavailable.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    except OSError:
+        return None
+    return {
+        "rss_mb": fields.get("Rss", 0.0),
+        "pss_mb": fields.get("Pss", 0.0),
+        "uss_mb": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0),
+        "shared_mb": fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0),
+    }
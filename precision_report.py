@@ -0,0 +1,232 @@
+"""
+Precision comparison report for RecipeSnap
+
+Runs the recipe model (and optionally the vision models) once per precision
+mode and reports tokens/sec, first-token latency, peak RSS and how closely
+each mode's output agrees with the first (reference) mode. Every mode is
+measured in its own subprocess so peak RSS is not polluted by the others.
+
+Decoding is greedy here, unlike the sampled decoding used when serving, so
+differences in the output come from the precision change alone.
+
+Usage:
+    python precision_report.py --modes fp32 bf16 int8 --max-new-tokens 64
+    python precision_report.py --images static/uploads --output precision.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+SAMPLE_INGREDIENTS = [
+    ["tomato", "onion", "chicken"],
+    ["pasta", "cheese", "garlic", "tomato"],
+    ["apple", "butter", "sugar"],
+    ["rice", "eggs", "pepper", "onion"],
+]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure_recipe_model(model_name, precision, max_new_tokens):
+    import torch
+    from models.recipe_generation import RecipeGenerationModel
+
+    started = time.perf_counter()
+    model = RecipeGenerationModel(model_name, precision=precision)
+    load_seconds = time.perf_counter() - started
+    if not model.model_loaded:
+        raise RuntimeError(f"Recipe model failed to load in {precision}")
+
+    first_token_ms = []
+    tokens_per_sec = []
+    outputs = []
+    for ingredients in SAMPLE_INGREDIENTS:
+        input_ids = model.tokenizer(model._format_prompt(ingredients), return_tensors="pt").input_ids.to(model.device)
+
+        with torch.no_grad():
+            started = time.perf_counter()
+            model.model.generate(input_ids, max_new_tokens=1, do_sample=False)
+            first_token_ms.append(1000.0 * (time.perf_counter() - started))
+
+            started = time.perf_counter()
+            output = model.model.generate(input_ids, max_new_tokens=max_new_tokens, do_sample=False)
+            elapsed = time.perf_counter() - started
+
+        new_tokens = output[0, input_ids.shape[1]:].tolist()
+        tokens_per_sec.append(len(new_tokens) / elapsed if elapsed else 0.0)
+        outputs.append(new_tokens)
+
+    return {
+        "load_seconds": load_seconds,
+        "first_token_ms": sum(first_token_ms) / len(first_token_ms),
+        "tokens_per_sec": sum(tokens_per_sec) / len(tokens_per_sec),
+        "outputs": outputs,
+    }
+
+
+def measure_vision_models(caption_model_name, detection_model_name, precision, image_paths):
+    import numpy as np
+    from models.image_captioning import ImageCaptioningModel
+    from models.object_detection import ObjectDetectionModel
+
+    captioner = ImageCaptioningModel(caption_model_name, precision=precision)
+    detector = ObjectDetectionModel(detection_model_name, precision=precision)
+
+    captions, ingredients = [], []
+    caption_ms, detection_ms = [], []
+    for path in image_paths:
+        started = time.perf_counter()
+        captions.append(captioner.generate_captions([path])[0])
+        caption_ms.append(1000.0 * (time.perf_counter() - started))
+
+        # Same seed per image so the random ingredient padding is comparable
+        np.random.seed(0)
+        started = time.perf_counter()
+        ingredients.append(detector.detect_ingredients_batch([path])[0])
+        detection_ms.append(1000.0 * (time.perf_counter() - started))
+
+    return {
+        "caption_ms": sum(caption_ms) / len(caption_ms),
+        "detection_ms": sum(detection_ms) / len(detection_ms),
+        "captions": captions,
+        "ingredients": ingredients,
+    }
+
+
+def run_worker(args):
+    """Measure a single precision mode and print the result as JSON"""
+    result = {"precision": args.worker}
+    if not args.skip_recipe:
+        result["recipe"] = measure_recipe_model(args.model, args.worker, args.max_new_tokens)
+    if args.images:
+        result["vision"] = measure_vision_models(
+            args.caption_model, args.detection_model, args.worker, find_images(args.images)
+        )
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def find_images(directory):
+    paths = []
+    for extension in ("jpg", "jpeg", "png"):
+        paths.extend(glob.glob(os.path.join(directory, f"*.{extension}")))
+    return sorted(paths)
+
+
+def token_agreement(reference, candidate):
+    """Fraction of the reference tokens reproduced before the first divergence"""
+    matched = 0
+    for a, b in zip(reference, candidate):
+        if a != b:
+            break
+        matched += 1
+    return matched / len(reference) if reference else 1.0
+
+
+def compare(reference, result):
+    """Add agreement metrics of result against the reference mode"""
+    if "recipe" in result:
+        pairs = list(zip(reference["recipe"]["outputs"], result["recipe"]["outputs"]))
+        result["recipe"]["token_agreement"] = sum(token_agreement(a, b) for a, b in pairs) / len(pairs)
+        result["recipe"]["exact_match"] = sum(a == b for a, b in pairs) / len(pairs)
+    if "vision" in result and result["vision"]["captions"]:
+        captions = list(zip(reference["vision"]["captions"], result["vision"]["captions"]))
+        result["vision"]["caption_match"] = sum(a == b for a, b in captions) / len(captions)
+        overlaps = [
+            len(set(a) & set(b)) / len(set(a) | set(b)) if set(a) | set(b) else 1.0
+            for a, b in zip(reference["vision"]["ingredients"], result["vision"]["ingredients"])
+        ]
+        result["vision"]["ingredient_jaccard"] = sum(overlaps) / len(overlaps)
+
+
+def print_report(results):
+    print("\nRecipeSnap Precision Report")
+    print("===========================")
+    print(f"{'mode':<6} {'load s':>8} {'tok/s':>8} {'1st tok ms':>11} {'peak RSS MB':>12} {'tok agree':>10} {'exact':>6}")
+    for result in results:
+        recipe = result.get("recipe", {})
+        print(
+            f"{result['precision']:<6} "
+            f"{recipe.get('load_seconds', 0):>8.1f} "
+            f"{recipe.get('tokens_per_sec', 0):>8.2f} "
+            f"{recipe.get('first_token_ms', 0):>11.1f} "
+            f"{result['peak_rss_mb']:>12.0f} "
+            f"{recipe.get('token_agreement', 1.0):>10.2%} "
+            f"{recipe.get('exact_match', 1.0):>6.0%}"
+        )
+
+    if any("vision" in result for result in results):
+        print(f"\n{'mode':<6} {'caption ms':>11} {'detect ms':>10} {'caption match':>14} {'ingredient overlap':>19}")
+        for result in results:
+            vision = result.get("vision")
+            if vision:
+                print(
+                    f"{result['precision']:<6} "
+                    f"{vision['caption_ms']:>11.1f} "
+                    f"{vision['detection_ms']:>10.1f} "
+                    f"{vision.get('caption_match', 1.0):>14.0%} "
+                    f"{vision.get('ingredient_jaccard', 1.0):>19.0%}"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare RecipeSnap inference precision modes")
+    parser.add_argument("--modes", nargs="+", default=["fp32", "bf16", "int8"],
+                        help="Precision modes to compare; the first is the reference")
+    parser.add_argument("--model", default="mistralai/Mistral-7B-Instruct-v0.2", help="Recipe model name or path")
+    parser.add_argument("--caption-model", default="nlpconnect/vit-gpt2-image-captioning")
+    parser.add_argument("--detection-model", default="facebook/detr-resnet-50")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--images", help="Directory of images to also compare the vision models on")
+    parser.add_argument("--skip-recipe", action="store_true", help="Only compare the vision models")
+    parser.add_argument("--output", help="Write the full results as JSON to this file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = []
+    for mode in args.modes:
+        print(f"Measuring {mode}...")
+        command = [sys.executable, os.path.abspath(__file__), "--worker", mode,
+                   "--model", args.model, "--max-new-tokens", str(args.max_new_tokens),
+                   "--caption-model", args.caption_model, "--detection-model", args.detection_model]
+        if args.images:
+            command += ["--images", args.images]
+        if args.skip_recipe:
+            command.append("--skip-recipe")
+
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"❌ {mode} failed:\n{completed.stderr.strip()}")
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    if not results:
+        return
+    for result in results[1:]:
+        compare(results[0], result)
+
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nFull results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Model server for RecipeSnap
+
+Hosts the captioning, detection and recipe models in their own process
+behind a Unix socket, so the web app (started with MODEL_SERVER pointing at
+the socket) holds no model weights: it restarts in seconds, and web workers
+and model threads are sized separately. The web app preprocesses images
+itself and sends pixel tensors through shared memory.
+
+Models are configured with the same environment variables as the app
+(CAPTION_MODEL, RECIPE_PRECISION, MODEL_ARTIFACTS_DIR, ...) and load in the
+background; the app waits for them. --cpus pins the server to dedicated
+cores. Several servers can split the models between them, e.g. one per
+model, each with its own cores.
+
+Usage:
+    python serve_models.py --socket /tmp/recipesnap-models.sock
+    python serve_models.py --socket /run/recipesnap/recipe.sock --models recipe --cpus 8-15
+"""
+
+import argparse
+import os
+import signal
+import sys
+
+from dotenv import load_dotenv
+
+from models.model_server import MODEL_NAMES
+
+DEFAULT_SOCKET = "/tmp/recipesnap-models.sock"
+
+
+def parse_cpus(value):
+    """CPU ids from a list like "0-3,8,10-11" """
+    cpus = set()
+    for part in value.split(","):
+        first, _, last = part.strip().partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Serve RecipeSnap's models to the web app over a Unix socket")
+    parser.add_argument("--socket", default=os.environ.get("MODEL_SERVER") or DEFAULT_SOCKET,
+                        help="Socket path; set MODEL_SERVER to the same path for the app")
+    parser.add_argument("--models", nargs="+", default=list(MODEL_NAMES), choices=MODEL_NAMES,
+                        help="Models this server hosts")
+    parser.add_argument("--cpus", help="Pin the server to these CPUs, e.g. 0-7 or 0-3,8-11")
+    parser.add_argument("--threads", type=int,
+                        help="Intra-op threads per model call (default: one per CPU the server may use)")
+    args = parser.parse_args()
+
+    if "," in args.socket or "=" in args.socket:
+        parser.error("--socket takes a single path; start one server per socket")
+
+    # Before torch starts its thread pools, which inherit the affinity
+    if args.cpus:
+        os.sched_setaffinity(0, parse_cpus(args.cpus))
+    import torch
+    torch.set_num_threads(args.threads or len(os.sched_getaffinity(0)))
+
+    from models.model_server import ModelServer, model_factories
+    from models.registry import ModelRegistry, model_config_from_env
+
+    registry = ModelRegistry()
+    factories = model_factories(model_config_from_env())
+    for name in args.models:
+        registry.register(name, factories[name])
+    registry.warm_up()
+
+    # Exit through the normal path on SIGTERM, so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Model server for {', '.join(args.models)} on {torch.get_num_threads()} threads")
+    try:
+        ModelServer(registry, args.socket).serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
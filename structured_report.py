@@ -0,0 +1,154 @@
+"""
+Structured vs free-text recipe generation report for RecipeSnap
+
+Generates recipes for the same ingredient lists with the free-text prompt
+(parsed heuristically afterwards) and with structured output (a fixed
+schema enforced while decoding, generation stopped once the recipe is
+complete), and reports per mode:
+
+- generated tokens and latency per recipe, and tokens/sec
+- how generation ended: end of sequence, schema complete, or length limit
+- how many recipes parsed into a name, ingredients and instructions
+
+Sampling settings are the ones used when serving, with a fixed seed per
+sample so both modes see the same random stream. Every mode runs in its
+own subprocess.
+
+Usage:
+    python structured_report.py --samples 3
+    python structured_report.py --model /models/mistral --max-new-tokens 512 --output structured.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmark import percentile
+from precision_report import SAMPLE_INGREDIENTS
+
+MODES = ("free", "structured")
+
+
+def measure(model_name, mode, samples, max_new_tokens):
+    import torch
+    from models.recipe_generation import RecipeGenerationModel
+
+    model = RecipeGenerationModel(model_name, structured_output=mode == "structured")
+    if not model.model_loaded:
+        raise RuntimeError(f"Recipe model {model_name} failed to load")
+
+    records = []
+    for ingredients in SAMPLE_INGREDIENTS:
+        for sample in range(samples):
+            torch.manual_seed(sample)
+            started = time.perf_counter()
+            input_ids, cache_kwargs = model._prepare_inputs(ingredients)
+            output = model._assisted_generate(input_ids, max_new_tokens=max_new_tokens, **cache_kwargs)
+            recipe = model._decode_recipe(output[0])
+            latency_ms = 1000.0 * (time.perf_counter() - started)
+
+            tokens = output.shape[1] - input_ids.shape[1]
+            limit = max_new_tokens or model.max_length - input_ids.shape[1]
+            if tokens >= limit:
+                ended = "length"
+            elif output[0, -1].item() == model.tokenizer.eos_token_id:
+                ended = "eos"
+            else:
+                ended = "schema"
+            records.append({
+                "ingredients": ingredients,
+                "tokens": tokens,
+                "latency_ms": latency_ms,
+                "ended": ended,
+                "complete": bool(recipe.get("name") and recipe["ingredients"] and recipe["instructions"]),
+                "recipe": recipe,
+            })
+
+    latencies = [record["latency_ms"] for record in records]
+    total_tokens = sum(record["tokens"] for record in records)
+    return {
+        "mode": mode,
+        "recipes": len(records),
+        "mean_tokens": total_tokens / len(records),
+        "mean_latency_ms": sum(latencies) / len(latencies),
+        "p95_latency_ms": percentile(latencies, 95),
+        "tokens_per_sec": total_tokens / (sum(latencies) / 1000.0),
+        "ended": {reason: sum(record["ended"] == reason for record in records) / len(records)
+                  for reason in ("eos", "schema", "length")},
+        "complete_rate": sum(record["complete"] for record in records) / len(records),
+        "mean_ingredients": sum(len(record["recipe"]["ingredients"]) for record in records) / len(records),
+        "mean_instructions": sum(len(record["recipe"]["instructions"]) for record in records) / len(records),
+        "samples": records,
+    }
+
+
+def print_report(results):
+    print("\nRecipeSnap Structured Output Report")
+    print("===================================")
+    print(f"{'mode':<11} {'tokens':>7} {'latency ms':>11} {'p95 ms':>9} {'tok/s':>7} "
+          f"{'eos':>5} {'schema':>7} {'length':>7} {'complete':>9} {'ingr.':>6} {'steps':>6}")
+    for result in results:
+        print(
+            f"{result['mode']:<11} "
+            f"{result['mean_tokens']:>7.0f} "
+            f"{result['mean_latency_ms']:>11.0f} "
+            f"{result['p95_latency_ms']:>9.0f} "
+            f"{result['tokens_per_sec']:>7.1f} "
+            f"{result['ended']['eos']:>5.0%} "
+            f"{result['ended']['schema']:>7.0%} "
+            f"{result['ended']['length']:>7.0%} "
+            f"{result['complete_rate']:>9.0%} "
+            f"{result['mean_ingredients']:>6.1f} "
+            f"{result['mean_instructions']:>6.1f}"
+        )
+    by_mode = {result["mode"]: result for result in results}
+    if set(by_mode) == set(MODES) and by_mode["free"]["mean_tokens"]:
+        free, structured = by_mode["free"], by_mode["structured"]
+        print(f"\nStructured vs free text: {structured['mean_tokens'] / free['mean_tokens'] - 1:+.0%} tokens, "
+              f"{structured['mean_latency_ms'] / free['mean_latency_ms'] - 1:+.0%} latency per recipe")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare structured and free-text recipe generation")
+    parser.add_argument("--model", default=os.environ.get("RECIPE_MODEL", "mistralai/Mistral-7B-Instruct-v0.2"),
+                        help="Recipe model name or path")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--samples", type=int, default=2, help="Recipes sampled per ingredient list")
+    parser.add_argument("--max-new-tokens", type=int, help="Cap on each recipe's length (default: the model's max_length)")
+    parser.add_argument("--output", help="Write the full results, recipes included, as JSON to this file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(args.model, args.worker, args.samples, args.max_new_tokens)))
+        return
+
+    results = []
+    for mode in args.modes:
+        print(f"Measuring {mode}...")
+        command = [sys.executable, os.path.abspath(__file__), "--worker", mode,
+                   "--model", args.model, "--samples", str(args.samples)]
+        if args.max_new_tokens:
+            command += ["--max-new-tokens", str(args.max_new_tokens)]
+
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"❌ {mode} failed:\n{completed.stderr.strip()}")
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    if not results:
+        sys.exit(1)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nFull results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import io
+import json
+import os
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("torch")
+
+
+@pytest.fixture(scope="module")
+def app_module(tiny_caption_model_dir, tiny_detection_model_dir, tiny_recipe_model_dir, tmp_path_factory):
+    """The app, serving the tiny test models, run from a temporary directory so uploads land there"""
+    env = {
+        "MODEL_LOADING": "eager",
+        "CAPTION_MODEL": tiny_caption_model_dir,
+        "DETECTION_MODEL": tiny_detection_model_dir,
+        "RECIPE_MODEL": tiny_recipe_model_dir,
+        "HF_HUB_OFFLINE": "1",
+    }
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        with mock.patch.dict(os.environ, env):
+            import app
+        yield app
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def jpeg(seed=0, size=(320, 240)):
+    """Bytes of a noisy JPEG photo"""
+    import numpy
+    from PIL import Image
+
+    pixels = numpy.random.RandomState(seed).randint(0, 255, (size[1], size[0], 3), dtype="uint8")
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def sse_events(response):
+    """(event, data) pairs of a Server-Sent Events response"""
+    events = []
+    for frame in response.get_data(as_text=True).split("\n\n"):
+        if frame:
+            event, data = frame.split("\n")
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_model_settings_come_from_the_shared_environment_helper(app_module, tiny_recipe_model_dir):
+    config = app_module.app.config
+
+    assert config["RECIPE_MODEL"] == tiny_recipe_model_dir
+    assert config["RECIPE_PRECISION"] == "auto"
+    assert config["RECIPE_DRAFT_LOOKAHEAD"] == 5
+    assert config["RECIPE_OUTPUT"] == "free"
+
+
+def test_recipe_stream_ends_with_the_whole_recipe(client):
+    response = client.post("/api/recipes/stream", json={"ingredients": ["egg", "rice"]})
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = sse_events(response)
+    assert events[0][0] == "token"
+    event, done = events[-1]
+    assert event == "done"
+    assert not done["fallback"]
+    assert done["recipe"]["instructions"] == [value for event, value in events if event == "instruction"]
+
+
+def test_recipe_stream_over_get_for_event_source(client):
+    events = sse_events(client.get("/api/recipes/stream?ingredients=egg,%20rice&mode=retrieve"))
+
+    assert events[0][0] == "name"
+    assert events[-1][0] == "done"
+    assert client.get("/api/recipes/stream?ingredients=").status_code == 400
+    assert client.post("/api/recipes/stream", json={}).status_code == 400
+
+
+def test_recipes_are_served_from_cache_once_every_variant_exists(client, app_module):
+    variants = app_module.app.config["RECIPE_CACHE_VARIANTS"]
+    generated = [client.post("/api/recipes", json={"ingredients": ["leek", "bean"]}).json["recipes"]
+                 for _ in range(variants)]
+    hits = app_module.recipe_cache.stats()["hits"]
+
+    cached = client.post("/api/recipes", json={"ingredients": ["Bean", "leek", "leek"]}).json["recipes"]
+
+    assert cached in generated
+    assert app_module.recipe_cache.stats()["hits"] == hits + 1
+
+
+def test_health_and_readiness(client):
+    assert client.get("/healthz").json == {"status": "ok"}
+
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json["ready"]
+    assert set(response.json["models"]) >= {"captioning", "detection", "recipe"}
+
+
+def test_several_candidates_per_request(client, app_module):
+    response = client.post("/api/recipes", json={"ingredients": ["egg"], "num_candidates": 100})
+
+    assert len(response.json["recipes"]) == app_module.app.config["RECIPE_MAX_CANDIDATES"]
+    assert client.post("/api/recipes", json={"ingredients": ["egg"], "num_candidates": 0}).status_code == 400
+    assert client.post("/api/recipes", json={"ingredients": ["egg"], "num_candidates": "x"}).status_code == 400
+
+
+def test_batch_endpoint_answers_every_list(client):
+    response = client.post("/api/recipes/batch", json={"ingredient_lists": [["egg"], ["rice", "beans"]]})
+
+    assert [result["ingredients"] for result in response.json["results"]] == [["egg"], ["rice", "beans"]]
+    assert all(len(result["recipes"]) == 1 for result in response.json["results"])
+    assert client.post("/api/recipes/batch", json={"ingredient_lists": ["egg"]}).status_code == 400
+
+
+def test_job_runs_the_whole_pipeline(client, app_module):
+    response = client.post("/api/jobs", data={"image": (io.BytesIO(jpeg()), "photo.jpg"), "mode": "retrieve"},
+                           content_type="multipart/form-data")
+
+    assert response.status_code == 202
+    job = client.get(f"{response.json['status_url']}?wait=30").json
+    assert job["status"] == "succeeded"
+    assert set(job["stages"]) == {"caption", "detect", "recipe"}
+    assert job["result"]["caption"]
+    assert job["result"]["recipes"]
+    assert app_module.upload_store.stats()["pinned"] == 0
+
+
+def test_job_requests_are_validated(client):
+    assert client.post("/api/jobs", json={}).status_code == 400
+    assert client.post("/api/jobs", json={"ingredients": "egg", "mode": "bake"}).status_code == 400
+    assert client.get("/api/jobs/unknown").status_code == 404
+
+
+def test_full_queue_answers_429(client, app_module, monkeypatch):
+    from models.jobs import QueueFull
+
+    def full():
+        raise QueueFull(retry_after=7)
+    monkeypatch.setattr(app_module.job_queue, "check_capacity", full)
+
+    response = client.post("/api/jobs", json={"ingredients": ["egg"]})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "7"
+
+
+def test_retrieve_mode_answers_from_the_recipe_index(client, app_module):
+    response = client.post("/api/recipes", json={"ingredients": ["apple", "cinnamon"], "mode": "retrieve"})
+
+    assert response.json["recipes"] == app_module.builtin_recipe_index.recipes_for(["apple", "cinnamon"])
+    assert client.post("/api/recipes", json={"ingredients": ["apple"], "mode": "bake"}).status_code == 400
+
+
+def test_metrics_endpoint_and_server_timing(client, app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, "SERVER_TIMING", True)
+
+    response = client.post("/api/recipes", json={"ingredients": ["egg"], "mode": "retrieve"})
+
+    assert "total;dur=" in response.headers["Server-Timing"]
+    scraped = client.get("/metrics")
+    assert scraped.mimetype == "text/plain"
+    assert "recipesnap_stage_seconds_bucket" in scraped.get_data(as_text=True)
+
+
+def test_fast_tier_answers_with_retrieved_recipes(client, app_module):
+    response = client.post("/api/recipes", json={"ingredients": ["apple", "cinnamon"]}, headers={"X-Quality": "fast"})
+
+    assert response.headers["X-Quality-Degradations"] == "recipes_retrieved"
+    assert response.json["recipes"] == app_module.builtin_recipe_index.recipes_for(["apple", "cinnamon"])
+    assert "X-Quality-Degradations" not in client.post("/api/recipes", json={"ingredients": ["egg"]}).headers
+    assert client.post("/api/recipes", json={"ingredients": ["egg"]}, headers={"X-Quality": "best"}).status_code == 400
+    assert client.post("/api/recipes?deadline_ms=-5", json={"ingredients": ["egg"]}).status_code == 400
+
+
+def test_near_duplicate_images_reuse_vision_results(app_module, monkeypatch):
+    from PIL import Image
+
+    from models.near_duplicates import NearDuplicateIndex
+
+    calls = []
+    monkeypatch.setattr(app_module, "near_duplicate_index", NearDuplicateIndex())
+    monkeypatch.setattr(app_module, "caption_image", lambda image, num_beams=None: calls.append("caption") or "soup")
+    monkeypatch.setattr(app_module, "detect_image_ingredients",
+                        lambda image, shortest_edge=None: calls.append("detect") or ["leek"])
+    original = Image.open(io.BytesIO(jpeg(size=(8, 6)))).resize((640, 480), Image.BICUBIC)
+    photos = []
+    for image in (original, original.resize((480, 360))):
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG")
+        photos.append(buffer.getvalue())
+
+    assert app_module.analyze_image(photos[0]) == ("soup", ["leek"])
+    assert app_module.analyze_image(photos[1]) == ("soup", ["leek"])
+
+    assert calls == ["caption", "detect"]
+    assert app_module.near_duplicate_index.stats()["hits"] == 1
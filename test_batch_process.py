@@ -0,0 +1,184 @@
+import io
+import json
+import tarfile
+import zipfile
+from argparse import Namespace
+
+import pytest
+
+from batch_process import Pipeline, Throughput, iter_sources, load_checkpoint, make_recipes_for
+from models.parallel import VisionExecutor
+
+
+def jpeg(color=(200, 40, 40), size=(64, 48)):
+    """Bytes of a single-colour JPEG"""
+    Image = pytest.importorskip("PIL.Image")
+
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class FakeVision:
+    """Captioner and detector in one: captions and ingredients name the image's width"""
+
+    min_input_edge = 48
+
+    def __init__(self, fail_batches=False):
+        self.fail_batches = fail_batches
+        self.batch_sizes = []
+
+    def generate_captions(self, images):
+        if self.fail_batches:
+            raise RuntimeError("out of memory")
+        self.batch_sizes.append(len(images))
+        return [self.generate_caption(image) for image in images]
+
+    def generate_caption(self, image):
+        return f"a photo {image.width} wide"
+
+    def detect_ingredients_batch(self, images):
+        return [self.detect_ingredients(image) for image in images]
+
+    def detect_ingredients(self, image):
+        return [f"item{image.width}"]
+
+
+def run_pipeline(sources, done=(), vision=None, vision_batch=2, recipe_batch=2, tmp_path=None):
+    vision = vision or FakeVision()
+    recipe_calls = []
+
+    def recipes_for(ingredient_lists):
+        recipe_calls.append(len(ingredient_lists))
+        return [[{"name": " and ".join(ingredients)}] for ingredients in ingredient_lists]
+
+    throughput = Throughput()
+    pipeline = Pipeline(vision, vision, recipes_for, throughput, decode_workers=2, vision_batch=vision_batch,
+                        recipe_batch=recipe_batch, vision_executor=VisionExecutor())
+    path = tmp_path / "results.jsonl"
+    with open(path, "a") as output:
+        failure = pipeline.run(iter(sources), set(done), output)
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    return records, throughput.summary(), recipe_calls, failure
+
+
+def test_directories_are_walked_in_a_stable_order(tmp_path):
+    (tmp_path / "b").mkdir()
+    (tmp_path / "b" / "two.JPG").write_bytes(b"2")
+    (tmp_path / "one.png").write_bytes(b"1")
+    (tmp_path / "notes.txt").write_bytes(b"x")
+
+    assert [(source, load()) for source, load in iter_sources(str(tmp_path))] == [
+        ("one.png", b"1"), ("b/two.JPG", b"2"),
+    ]
+
+
+def test_zip_and_tar_members_are_sources(tmp_path):
+    zip_path = tmp_path / "photos.zip"
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        archive.writestr("dinner/soup.jpg", b"soup")
+        archive.writestr("readme.md", b"x")
+    tar_path = tmp_path / "photos.tar.gz"
+    with tarfile.open(tar_path, "w:gz") as archive:
+        info = tarfile.TarInfo("salad.jpeg")
+        info.size = 5
+        archive.addfile(info, io.BytesIO(b"salad"))
+
+    assert [(source, load()) for source, load in iter_sources(str(zip_path))] == [("dinner/soup.jpg", b"soup")]
+    assert [(source, load()) for source, load in iter_sources(str(tar_path))] == [("salad.jpeg", b"salad")]
+    (tmp_path / "photo.jpg").write_bytes(b"not an archive")
+    with pytest.raises(ValueError):
+        list(iter_sources(str(tmp_path / "photo.jpg")))
+
+
+def test_checkpoint_keeps_the_last_record_per_source_and_cuts_a_partial_line(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text(
+        json.dumps({"source": "a.jpg", "caption": "soup"}) + "\n"
+        + json.dumps({"source": "b.jpg", "error": "decode failed"}) + "\n"
+        + json.dumps({"source": "c.jpg", "caption": "cake"}) + "\n"
+        + json.dumps({"source": "c.jpg", "error": "decode failed"}) + "\n"
+        + json.dumps({"source": "b.jpg", "caption": "salad"}) + "\n"
+        + '{"source": "d.jpg", "capt'
+    )
+
+    assert load_checkpoint(str(path)) == {"a.jpg", "b.jpg"}
+    assert path.read_text().endswith("\n")
+    assert load_checkpoint(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_pipeline_writes_a_record_per_image(tmp_path):
+    photos = {width: jpeg(size=(width, 48)) for width in (40, 50, 60)}
+    sources = [(f"{width}.jpg", lambda width=width: photos[width]) for width in photos]
+    sources.append(("broken.jpg", lambda: b"not a jpeg"))
+
+    records, summary, recipe_calls, failure = run_pipeline(sources, tmp_path=tmp_path)
+
+    assert failure is None
+    by_source = {record["source"]: record for record in records}
+    assert set(by_source) == {"40.jpg", "50.jpg", "60.jpg", "broken.jpg"}
+    assert by_source["50.jpg"]["caption"] == "a photo 50 wide"
+    assert by_source["50.jpg"]["ingredients"] == ["item50"]
+    assert by_source["50.jpg"]["recipes"] == [{"name": "item50"}]
+    assert len(by_source["50.jpg"]["image_hash"]) > 0
+    assert by_source["broken.jpg"]["error"].startswith("decode failed")
+    assert summary["images"] == 3
+    assert summary["errors"] == 1
+    assert sum(recipe_calls) == 3
+    assert max(recipe_calls) <= 2
+
+
+def test_pipeline_skips_done_sources_and_reports_read_failures(tmp_path):
+    photo = jpeg()
+
+    def sources():
+        yield "done.jpg", lambda: photo
+        yield "new.jpg", lambda: photo
+        raise OSError("truncated archive")
+
+    records, summary, _, failure = run_pipeline(sources(), done={"done.jpg"}, tmp_path=tmp_path)
+
+    assert [record["source"] for record in records] == ["new.jpg"]
+    assert summary["skipped"] == 1
+    assert isinstance(failure, OSError)
+
+
+def test_failed_vision_batch_falls_back_to_single_images(tmp_path):
+    photo = jpeg()
+    sources = [(f"{index}.jpg", lambda: photo) for index in range(3)]
+
+    records, summary, _, _ = run_pipeline(sources, vision=FakeVision(fail_batches=True), tmp_path=tmp_path)
+
+    assert summary["images"] == 3
+    assert all(record["caption"] == "a photo 64 wide" for record in records)
+
+
+def test_retrieve_recipe_mode_answers_from_the_builtin_recipes():
+    pytest.importorskip("numpy")
+    recipes_for, index = make_recipes_for(Namespace(recipe_mode="retrieve", corpus=None, candidates=1))
+    assert recipes_for([["apple", "cinnamon"]]) == [index.recipes_for(["apple", "cinnamon"], 1)]
+
+
+def test_none_recipe_mode_skips_recipes():
+    recipes_for, model = make_recipes_for(Namespace(recipe_mode="none"))
+    assert model is None
+    assert recipes_for([["egg"], ["rice"]]) == [[], []]
+
+
+def test_generate_mode_generates_each_ingredient_set_once(tiny_recipe_model_dir, monkeypatch):
+    from models.recipe_generation import RecipeGenerationModel
+
+    generated = []
+
+    def recording_batch(self, ingredient_lists, num_candidates=1, batch_size=None):
+        generated.append(ingredient_lists)
+        return [[{"name": " and ".join(ingredients)}] for ingredients in ingredient_lists]
+    monkeypatch.setattr(RecipeGenerationModel, "generate_recipes_batch", recording_batch)
+    args = Namespace(recipe_mode="generate", recipe_model=tiny_recipe_model_dir, recipe_precision="auto",
+                     recipe_output="free", candidates=1, recipe_batch=8)
+    recipes_for, _ = make_recipes_for(args)
+
+    results = recipes_for([["egg", "rice"], ["leek"], ["Rice", "egg"]])
+
+    assert generated == [[["egg", "rice"], ["leek"]]]
+    assert results == [[{"name": "egg and rice"}], [{"name": "leek"}], [{"name": "egg and rice"}]]
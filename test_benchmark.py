@@ -0,0 +1,66 @@
+from argparse import Namespace
+
+import pytest
+
+from benchmark import compare_to_baseline, ingredient_combo, metric, model_scenario, percentile
+
+SETTINGS = {"requests": 20, "concurrency": 2, "recipe_max_length": 64, "batch_lists": 4, "threads": None}
+
+
+def run(latency_p95, throughput, errors=0):
+    return {"latency_ms": {"p95": latency_p95}, "throughput_rps": throughput, "errors": errors}
+
+
+def test_ingredient_combos_differ_per_request():
+    combos = [tuple(ingredient_combo(i)) for i in range(220)]
+
+    assert len(set(combos)) == 220
+    assert ingredient_combo(220) == ingredient_combo(0)
+
+
+def test_metric_reads_nested_results():
+    assert metric(run(12.0, 3.0), ("latency_ms", "p95")) == 12.0
+    assert metric(run(12.0, 3.0), ("tokens_per_sec",)) is None
+
+
+def test_percentile():
+    pytest.importorskip("numpy")
+    assert percentile([1, 2, 3, 4, 5], 50) == 3.0
+    assert percentile([], 99) == 0.0
+
+
+def test_regressions_beyond_the_tolerance_are_reported():
+    baseline = {"settings": SETTINGS, "scenarios": {"caption": run(100.0, 10.0), "recipe": run(100.0, 10.0)}}
+    results = {"caption": run(112.0, 9.5), "recipe": run(130.0, 7.0), "detection": run(1.0, 1.0)}
+
+    regressions = compare_to_baseline(results, baseline, 0.15, SETTINGS)
+
+    assert sorted((name, label) for name, label, *_ in regressions) == [
+        ("recipe", "latency_ms.p95"), ("recipe", "throughput_rps")
+    ]
+
+
+def test_failed_and_missing_scenarios_are_regressions():
+    baseline = {"settings": SETTINGS, "scenarios": {name: run(100.0, 10.0) for name in ("caption", "recipe", "detection")}}
+
+    regressions = compare_to_baseline({"caption": run(100.0, 10.0)}, baseline, 0.15, SETTINGS, failed=["recipe"])
+
+    assert sorted(regressions) == [("detection", "missing", None, None, None), ("recipe", "failed", None, None, None)]
+
+
+def test_any_new_errors_are_a_regression():
+    baseline = {"settings": SETTINGS, "scenarios": {"route_recipes": run(100.0, 10.0), "recipe": run(100.0, 10.0, 20)}}
+    # Failing fast looks like a speedup; only the error count gives it away
+    results = {"route_recipes": run(5.0, 200.0, errors=1), "recipe": run(100.0, 10.0, errors=21)}
+
+    regressions = compare_to_baseline(results, baseline, 0.15, SETTINGS)
+
+    assert [(name, label) for name, label, *_ in regressions] == [("route_recipes", "errors")]
+
+
+@pytest.mark.parametrize("scenario", ["caption", "detection", "recipe", "recipe_batch"])
+def test_model_scenarios_run_on_the_tiny_models(tiny_model_dirs, scenario):
+    call, _ = model_scenario(scenario, tiny_model_dirs, Namespace(recipe_max_length=420, batch_lists=2))
+
+    # False would mean the model fell back, and the scenario would time the fallback path
+    assert call(0)
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+
+import compile_artifacts  # noqa: E402
+
+
+def test_up_to_date_artifacts_are_not_recompiled(tmp_path, tiny_recipe_model_dir, capsys):
+    target = {"kind": "recipe", "model_name": tiny_recipe_model_dir, "precision": "fp32"}
+    artifact = compile_artifacts.compile_target(target, str(tmp_path), force=False)
+    created = os.path.getmtime(os.path.join(artifact.path, "manifest.json"))
+
+    again = compile_artifacts.compile_target(target, str(tmp_path), force=False)
+
+    assert again.path == artifact.path
+    assert os.path.getmtime(os.path.join(again.path, "manifest.json")) == created
+    assert "is up to date" in capsys.readouterr().out
+    assert compile_artifacts.artifact_kind("draft") == "recipe"
+
+
+def test_verify_fails_for_missing_or_corrupted_artifacts(tmp_path, tiny_recipe_model_dir):
+    target = {"kind": "recipe", "model_name": tiny_recipe_model_dir, "precision": "fp32"}
+    with pytest.raises(SystemExit):
+        compile_artifacts.verify([target], str(tmp_path))
+
+    artifact = compile_artifacts.compile_target(target, str(tmp_path), force=False)
+    compile_artifacts.verify([target], str(tmp_path))
+    with open(os.path.join(artifact.path, "tokenizer.json"), "r+b") as f:
+        first = f.read(1)
+        f.seek(0)
+        f.write(b" " if first != b" " else b"\n")
+    with pytest.raises(SystemExit):
+        compile_artifacts.verify([target], str(tmp_path))
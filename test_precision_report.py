@@ -0,0 +1,25 @@
+from precision_report import compare, token_agreement
+
+
+def test_token_agreement_counts_tokens_before_the_first_divergence():
+    assert token_agreement([1, 2, 3, 4], [1, 2, 9, 4]) == 0.5
+    assert token_agreement([1, 2], [1, 2, 3]) == 1.0
+    assert token_agreement([], [1]) == 1.0
+
+
+def test_compare_against_the_reference_mode():
+    reference = {
+        "recipe": {"outputs": [[1, 2], [3, 4]]},
+        "vision": {"captions": ["a bowl", "a plate"], "ingredients": [["apple", "pear"], []]},
+    }
+    result = {
+        "recipe": {"outputs": [[1, 2], [3, 5]]},
+        "vision": {"captions": ["a bowl", "a cup"], "ingredients": [["apple"], []]},
+    }
+
+    compare(reference, result)
+
+    assert result["recipe"]["exact_match"] == 0.5
+    assert result["recipe"]["token_agreement"] == 0.75
+    assert result["vision"]["caption_match"] == 0.5
+    assert result["vision"]["ingredient_jaccard"] == 0.75